@@ -0,0 +1,281 @@
+import os
+import logging
+import datetime
+import numpy as np
+from .rtb_reader import create_reader
+from .batch_decoder import BatchDecoder, EnsembleBatch, DEFAULT_BATCH_SIZE, to_datetime, file_shape
+from .ensemble_index import EnsembleIndex
+from .netcdf_writer import NetcdfWriter
+from .export_profile import ExportProfile
+from .memory_budget import MemoryBudget
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from .job_control import JobControl, NULL_JOB_CONTROL
+from .analyze_stats import AnalyzeStats
+from .progress import ProgressReporter
+
+
+# Status of each file in the aggregated export
+#   exported   Records of the file were written
+#   duplicate  All the records are at or before the records already written
+#   skipped    The file is from a different instrument or has a different number of bins or beams
+#   empty      The file has no ensembles
+FILE_STATUS_EXPORTED = "exported"
+FILE_STATUS_DUPLICATE = "duplicate"
+FILE_STATUS_SKIPPED = "skipped"
+FILE_STATUS_EMPTY = "empty"
+
+
+def sort_files(file_results: list) -> list:
+    """
+    Sort the files by the first ensemble time.  Files without a time are
+    put at the end.  Files with the same first time are sorted by the last
+    time, so the file with the most data is last and is not dropped as a
+    duplicate.
+    :param file_results: Analyze results of each file.
+    :type file_results: list
+    :return: Analyze results sorted by time.
+    :rtype: list
+    """
+    def sort_key(file_result):
+        first_datetime = file_result.get("FirstEnsDateTime")
+        last_datetime = file_result.get("LastEnsDateTime") or first_datetime
+        if first_datetime is None:
+            return 1, datetime.datetime.min, datetime.datetime.min, file_result["FilePath"]
+        return 0, first_datetime, last_datetime, file_result["FilePath"]
+
+    return sorted(file_results, key=sort_key)
+
+
+def _record_count(file_result: dict) -> int:
+    """
+    Get the number of records in the file from the analyze results.
+    :param file_result: Analyze results of the file.
+    :type file_result: dict
+    :return: Number of records.
+    :rtype: int
+    """
+    return file_result.get("EnsPairCount", 0) or file_result.get("EnsCount", 0)
+
+
+class AggregateExporter:
+    """
+    Export many RTB files into a single netCDF file with one time dimension.
+    This is used for a deployment split across many files.
+
+    The files are sorted using the first and last ensemble time from the
+    analyze results.  The records are written in time order.  Any record at
+    or before the last time written is dropped, so files that overlap, such
+    as the same data downloaded twice, are only written once.  A file that
+    ends before the last time written is not read at all.  A file that
+    overlaps uses the ensemble index, if it exists, to start reading at the
+    first new record.  Records without a valid time are kept with the
+    records around them.
+
+    All the files must be from the same instrument and subsystem with the
+    same number of bins and beams as the first file.  Other files are skipped.
+
+    The files are read one after another in batches and written through the
+    write buffer, so the memory used does not depend on the number or size
+    of the files.  If the profile has a memory budget, the buffers are sized
+    to fit in the budget.  The job control is checked before each batch is
+    written, a cancelled export removes the partial netCDF file.
+    """
+
+    def __init__(self, file_results: list, output_path: str, ensemble_progress_callback=None,
+                 profile: ExportProfile = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 instrumentation: Instrumentation = NULL_INSTRUMENTATION, job_control: JobControl = NULL_JOB_CONTROL):
+        """
+        Initialize the exporter.
+        :param file_results: Analyze results of each file.  FilePath, FirstEnsDateTime and LastEnsDateTime are used.
+        :type file_results: list
+        :param output_path: netCDF file path.
+        :type output_path: str
+        :param ensemble_progress_callback: Called with the number of records processed so far.  The calls are rate limited.
+        :type ensemble_progress_callback: function(ens_exported)
+        :param profile: Chunk shape, compression and write buffer of the netCDF file.  If None, the default profile.
+        :type profile: ExportProfile
+        :param batch_size: Number of ensembles to decode and write at a time.
+        :type batch_size: int
+        :param instrumentation: Records the time of each stage and the counters.
+        :type instrumentation: Instrumentation
+        :param job_control: Cancel or pause the export.
+        :type job_control: JobControl
+        """
+        self.file_results = file_results
+        self.output_path = output_path
+        self.progress = ProgressReporter(ensemble_progress_callback)
+        self.profile = profile
+        self.batch_size = batch_size
+        self.instrumentation = instrumentation
+        self.job_control = job_control
+        self.stats = AnalyzeStats()
+        self.memory_budget = None
+
+        # Last time written
+        self.watermark = None
+
+        # Instrument, subsystem, bins and beams of the first file written
+        self.shape = None
+
+    def export(self) -> dict:
+        """
+        Export all the files.  If the export fails, the partial netCDF file is removed.
+        :return: Analyze results of the records written.  Files gives the status of each file.
+        :rtype: dict
+        """
+        logging.debug("Starting Aggregate Export netCDF: " + str(len(self.file_results)) + " files to " +
+                      self.output_path)
+        self.memory_budget = MemoryBudget.from_profile(self.profile)
+        writer = NetcdfWriter(self.output_path, self.profile, memory_budget=self.memory_budget,
+                              instrumentation=self.instrumentation)
+        file_summaries = []
+
+        try:
+            for file_result in sort_files(self.file_results):
+                summary = {"FilePath": file_result["FilePath"], "Status": FILE_STATUS_EXPORTED,
+                           "Records": 0, "Dropped": 0, "Reason": None}
+                file_summaries.append(summary)
+                self._export_file(writer, file_result, summary)
+            self.progress.finish()
+        except Exception:
+            writer.abort()
+            if os.path.exists(self.output_path):
+                os.remove(self.output_path)
+            raise
+
+        result = self.stats.result(self.output_path)
+        writer.close(result)
+        result["Files"] = file_summaries
+
+        logging.debug("Aggregate Export netCDF Complete: " + self.output_path + " " + str(result["EnsCount"]) +
+                      " ensembles")
+        return result
+
+    def _export_file(self, writer: NetcdfWriter, file_result: dict, summary: dict):
+        """
+        Write the records of the file that are after the last time written.
+        :param writer: netCDF writer.
+        :type writer: NetcdfWriter
+        :param file_result: Analyze results of the file.
+        :type file_result: dict
+        :param summary: Summary of the file to update.
+        :type summary: dict
+        :return:
+        :rtype:
+        """
+        file_path = file_result["FilePath"]
+
+        # The whole file is before the last time written
+        last_datetime = file_result.get("LastEnsDateTime")
+        if self.watermark is not None and last_datetime is not None and \
+                np.datetime64(last_datetime, "us") <= self.watermark:
+            summary["Status"] = FILE_STATUS_DUPLICATE
+            summary["Dropped"] = _record_count(file_result)
+            self.progress.add(summary["Dropped"])
+            logging.debug("Skipping duplicate file " + file_path)
+            return
+
+        num_bins, num_beams = file_shape(file_path)
+        if num_bins is None:
+            summary["Status"] = FILE_STATUS_EMPTY
+            return
+
+        if self.shape is not None and (num_bins, num_beams) != self.shape[:2]:
+            self._skip(summary, file_result, "has " + str(num_bins) + " bins and " + str(num_beams) +
+                       " beams, the first file has " + str(self.shape[0]) + " bins and " + str(self.shape[1]) +
+                       " beams")
+            return
+        decoder = BatchDecoder(self.batch_size, num_bins, num_beams, self.memory_budget, self.instrumentation)
+
+        # Start at the first record after the last time written
+        start_offset = 0
+        if self.watermark is not None:
+            index = EnsembleIndex.load_for_file(file_path)
+            if index is not None:
+                start_offset = index.time_offsets(to_datetime(self.watermark))[0]
+
+                # Records before the start are at or before the last time written
+                record_offsets = np.asarray(index.offsets)[np.asarray(index.record_starts(), dtype=np.intp)]
+                summary["Dropped"] = int((record_offsets < start_offset).sum())
+                self.progress.add(summary["Dropped"])
+
+        reader = create_reader(file_path, memory_budget=self.memory_budget, instrumentation=self.instrumentation)
+        for batch in decoder.batches(reader.ensembles(start_offset)):
+            instrument = (batch.serial_number, batch.subsystem_code, batch.subsystem_config)
+            if self.shape is None:
+                self.shape = (batch.num_bins, batch.num_beams) + instrument
+            elif instrument != self.shape[2:]:
+                self._skip(summary, file_result, "is from instrument " + " ".join(str(value) for value in instrument) +
+                           ", the first file is from " + " ".join(str(value) for value in self.shape[2:]))
+                return
+
+            self.job_control.check()
+            self._write(writer, batch, summary)
+
+        if summary["Records"] == 0:
+            summary["Status"] = FILE_STATUS_DUPLICATE if summary["Dropped"] > 0 else FILE_STATUS_EMPTY
+
+    def _skip(self, summary: dict, file_result: dict, reason: str):
+        """
+        Skip the file because it can not be added to the netCDF file.
+        :param summary: Summary of the file to update.
+        :type summary: dict
+        :param file_result: Analyze results of the file.
+        :type file_result: dict
+        :param reason: Reason the file is skipped.
+        :type reason: str
+        :return:
+        :rtype:
+        """
+        logging.warning("Skipping " + file_result["FilePath"] + ", the file " + reason)
+        summary["Status"] = FILE_STATUS_SKIPPED
+        summary["Reason"] = "The file " + reason
+        self.progress.add(max(0, _record_count(file_result) - summary["Records"] - summary["Dropped"]))
+
+    def _write(self, writer: NetcdfWriter, batch: EnsembleBatch, summary: dict):
+        """
+        Write the records of the batch that are after the last time written.
+        :param writer: netCDF writer.
+        :type writer: NetcdfWriter
+        :param batch: Batch of decoded ensembles.
+        :type batch: EnsembleBatch
+        :param summary: Summary of the file to update.
+        :type summary: dict
+        :return:
+        :rtype:
+        """
+        count = batch.count
+        datetimes = batch.datetimes[:count]
+        valid = ~np.isnat(datetimes)
+
+        # Drop the records at or before the last time written
+        if self.watermark is not None:
+            keep = ~valid | (datetimes > self.watermark)
+        else:
+            keep = np.ones(count, dtype=bool)
+
+        # Drop the records that go back in time within the batch
+        valid_kept = np.flatnonzero(valid & keep)
+        if len(valid_kept) > 1:
+            running_max = np.maximum.accumulate(datetimes[valid_kept])
+            backwards = np.zeros(len(valid_kept), dtype=bool)
+            backwards[1:] = datetimes[valid_kept][1:] <= running_max[:-1]
+            keep[valid_kept[backwards]] = False
+
+        kept = int(keep.sum())
+        summary["Dropped"] += count - kept
+        if kept < count:
+            batch = batch.select(keep)
+
+        if batch.count > 0:
+            writer.write_batch(batch)
+            self.stats.add_batch(batch.count, batch.pair_count(), *batch.time_summary())
+            summary["Records"] += batch.count
+
+            kept_datetimes = batch.datetimes[:batch.count]
+            kept_datetimes = kept_datetimes[~np.isnat(kept_datetimes)]
+            if len(kept_datetimes) > 0:
+                self.watermark = kept_datetimes.max()
+
+        if self.progress.enabled:
+            self.progress.add(count)
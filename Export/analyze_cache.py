@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import datetime
+import logging
+from contextlib import closing
+
+
+# Default location of the cache
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".exportr", "analyze_cache.db")
+
+# Maximum number of files to keep in the cache
+DEFAULT_MAX_ENTRIES = 10000
+
+# Number of bytes at the start and end of the file used in the fingerprint
+FINGERPRINT_BYTES = 64 * 1024
+
+# Time in seconds to wait for another process using the cache
+CACHE_TIMEOUT = 10.0
+
+
+def file_fingerprint(file_path: str) -> tuple:
+    """
+    Create a fingerprint of the file.  The fingerprint is the file size, the
+    modified time and a hash of the start and end of the file.  The hash is
+    used to find files that have changed without changing the size or modified time.
+    :param file_path: File path.
+    :type file_path: str
+    :return: File size, modified time in nanoseconds and content hash.
+    :rtype: tuple
+    """
+    stat = os.stat(file_path)
+    content_hash = hashlib.blake2b(digest_size=16)
+
+    with open(file_path, "rb") as file:
+        content_hash.update(file.read(FINGERPRINT_BYTES))
+        if stat.st_size > FINGERPRINT_BYTES:
+            file.seek(max(FINGERPRINT_BYTES, stat.st_size - FINGERPRINT_BYTES))
+            content_hash.update(file.read(FINGERPRINT_BYTES))
+
+    return stat.st_size, stat.st_mtime_ns, content_hash.hexdigest()
+
+
+def head_hash(file_path: str, size: int) -> str:
+    """
+    Hash the start of the file.  Only the bytes before size are used, so
+    the hash does not change when more data is added to the end of the file.
+    :param file_path: File path.
+    :type file_path: str
+    :param size: Number of bytes of the file that must not change.
+    :type size: int
+    :return: Content hash.
+    :rtype: str
+    """
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as file:
+        content_hash.update(file.read(min(size, FINGERPRINT_BYTES)))
+    return content_hash.hexdigest()
+
+
+def _encode_value(value):
+    """
+    Encode the values in the analyze results that JSON does not support.
+    :param value: Value to encode.
+    :return: Value JSON can encode.
+    """
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if hasattr(value, "item"):
+        # Numpy values
+        return value.item()
+    return str(value)
+
+
+def _decode_value(obj: dict):
+    """
+    Decode the values encoded with _encode_value.
+    :param obj: JSON object.
+    :type obj: dict
+    :return: Decoded value.
+    """
+    if "__datetime__" in obj:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class AnalyzeCache:
+    """
+    Store the analyze results on disk so unchanged files do not need to be analyzed again.
+    The results are keyed by the file path and checked against the file fingerprint.
+    The least recently used results are removed when the cache is full.
+    """
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Initialize the cache.  The cache file is created if it does not exist.
+        :param cache_path: File path of the cache database.
+        :type cache_path: str
+        :param max_entries: Maximum number of files to keep in the cache.
+        :type max_entries: int
+        """
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS analyze_results ("
+                         "path TEXT PRIMARY KEY, "
+                         "size INTEGER, "
+                         "mtime_ns INTEGER, "
+                         "content_hash TEXT, "
+                         "result TEXT, "
+                         "last_used REAL)")
+
+    def _connect(self):
+        """
+        Connect to the cache database.  A new connection is used for each
+        call so the cache can be used from the analyze threads.
+        :return: Database connection.
+        :rtype: sqlite3.Connection
+        """
+        return sqlite3.connect(self.cache_path, timeout=CACHE_TIMEOUT)
+
+    def get(self, file_path: str, fingerprint: tuple = None) -> dict:
+        """
+        Get the analyze results for the file.
+        :param file_path: File path.
+        :type file_path: str
+        :param fingerprint: File fingerprint.  If None, the fingerprint is created.
+        :type fingerprint: tuple
+        :return: Analyze results or None if the file is not in the cache or has changed.
+        :rtype: dict
+        """
+        path = os.path.abspath(file_path)
+        if fingerprint is None:
+            fingerprint = file_fingerprint(file_path)
+
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute("SELECT size, mtime_ns, content_hash, result FROM analyze_results WHERE path = ?",
+                                   (path,)).fetchone()
+                if row is None:
+                    return None
+
+                if tuple(row[:3]) != tuple(fingerprint):
+                    # The file has changed
+                    conn.execute("DELETE FROM analyze_results WHERE path = ?", (path,))
+                    return None
+
+                conn.execute("UPDATE analyze_results SET last_used = ? WHERE path = ?", (time.time(), path))
+                result = json.loads(row[3], object_hook=_decode_value)
+        except sqlite3.Error as ex:
+            logging.warning("Error reading the analyze cache: " + str(ex))
+            return None
+
+        # Use the file path given
+        result["FilePath"] = file_path
+        return result
+
+    def put(self, file_path: str, result: dict, fingerprint: tuple = None):
+        """
+        Store the analyze results for the file.  If the cache is full,
+        the least recently used results are removed.
+        :param file_path: File path.
+        :type file_path: str
+        :param result: Analyze results.
+        :type result: dict
+        :param fingerprint: File fingerprint when the file was analyzed.  If None, the fingerprint is created.
+        :type fingerprint: tuple
+        :return:
+        :rtype:
+        """
+        path = os.path.abspath(file_path)
+        if fingerprint is None:
+            fingerprint = file_fingerprint(file_path)
+        size, mtime_ns, content_hash = fingerprint
+
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO analyze_results VALUES (?, ?, ?, ?, ?, ?)",
+                             (path, size, mtime_ns, content_hash, json.dumps(result, default=_encode_value), time.time()))
+
+                # Remove the least recently used results
+                conn.execute("DELETE FROM analyze_results WHERE path IN "
+                             "(SELECT path FROM analyze_results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                             (self.max_entries,))
+        except sqlite3.Error as ex:
+            logging.warning("Error writing the analyze cache: " + str(ex))
+
+    def clear(self):
+        """
+        Remove all the results from the cache.
+        :return:
+        :rtype:
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM analyze_results")
@@ -0,0 +1,210 @@
+import os
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from . import file_export
+from .analyze_cache import AnalyzeCache
+from .export_pool import default_worker_count, PROGRESS_POLL_TIMEOUT
+from .progress import ProgressReporter, drain_progress
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION
+
+
+def analyze_file_summary(file_path: str, file_progress_handler, analyze_options: dict) -> dict:
+    """
+    Analyze a file and create the summary of the analyze.  Any error is
+    logged and given in the summary.
+
+    The analyze options are cache_path, the analyze cache to use or None to
+    not use a cache, incremental to only read the data added since the file
+    was last exported and instrument to give the time of each stage and the
+    counters in Instrumentation.
+    :param file_path: File path to analyze.
+    :type file_path: str
+    :param file_progress_handler: Optional handler for the file progress event.
+    :type file_progress_handler: function(sender, bytes_read, total_size, file_name)
+    :param analyze_options: cache_path, incremental and instrument.
+    :type analyze_options: dict
+    :return: Summary of the analyze.  The analyze results are in Result.
+    :rtype: dict
+    """
+    summary = {"FilePath": file_path, "Status": "ok", "Error": None}
+
+    instrument = analyze_options.get("instrument", False)
+    instrumentation = Instrumentation() if instrument else NULL_INSTRUMENTATION
+
+    start_time = time.perf_counter()
+    try:
+        cache = None
+        if analyze_options.get("cache_path"):
+            cache = AnalyzeCache(analyze_options["cache_path"])
+        summary["Result"] = file_export.analyze_file(file_path, file_progress_handler, cache=cache,
+                                                     incremental=analyze_options.get("incremental", False),
+                                                     instrumentation=instrumentation)
+    except Exception as ex:
+        logging.exception("Error analyzing file " + file_path)
+        summary["Status"] = "failed"
+        summary["Error"] = str(ex)
+    summary["AnalyzeSeconds"] = time.perf_counter() - start_time
+
+    if instrument:
+        summary["Instrumentation"] = instrumentation.result()
+
+    return summary
+
+
+def _analyze_file_worker(file_index: int, file_path: str, progress_queue, analyze_options: dict) -> dict:
+    """
+    Analyze a file within a worker process.  The bytes read from the file
+    are sent to the main process through the progress queue.  The progress
+    is rate limited, so the queue is not flooded.
+    :param file_index: Index of the file in the list of files to analyze.
+    :type file_index: int
+    :param file_path: File path to analyze.
+    :type file_path: str
+    :param progress_queue: Queue to send the progress to the main process.
+    :type progress_queue: multiprocessing.Queue
+    :param analyze_options: Options passed to analyze_file_summary().
+    :type analyze_options: dict
+    :return: Summary of the analyze.  The analyze results are in Result.
+    :rtype: dict
+    """
+    # Only send the progress if someone is listening
+    file_progress_handler = None
+    progress = None
+    if progress_queue is not None:
+        try:
+            file_size = os.path.getsize(file_path)
+        except OSError:
+            file_size = 0
+
+        def send_progress(bytes_read):
+            progress_queue.put((file_index, bytes_read))
+        progress = ProgressReporter(send_progress, file_size)
+
+        def file_progress_handler(sender, bytes_read, total_size, file_name):
+            progress.add(bytes_read)
+
+    summary = analyze_file_summary(file_path, file_progress_handler, analyze_options)
+    if progress is not None:
+        progress.finish()
+    return summary
+
+
+class AnalyzePool:
+    """
+    Analyze multiple files at the same time using a pool of processes.
+    Reading and decoding the files is CPU bound, so each file is analyzed
+    in its own process.  The progress of each file and the results are
+    passed back to the main process through the callbacks as each file
+    is complete, and the results are given in the order of the files.
+
+    The analyze can be cancelled from another thread.  The files not
+    started are skipped, the files already being analyzed are finished.
+    """
+
+    def __init__(self, workers: int = None, analyze_options: dict = None):
+        """
+        Initialize the pool.
+        :param workers: Number of worker processes.  If None, the number of CPU cores is used.
+        :type workers: int
+        :param analyze_options: Options passed to analyze_file_summary() for each file, such as
+                                cache_path, incremental and instrument.
+        :type analyze_options: dict
+        """
+        if workers is None or workers <= 0:
+            workers = default_worker_count()
+        self.workers = workers
+        self.analyze_options = analyze_options if analyze_options else {}
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """
+        Stop the analyze.  The files not started are given the cancelled status.
+        :return:
+        :rtype:
+        """
+        self.cancel_event.set()
+
+    def analyze(self, file_paths: list, file_progress_callback=None, file_complete_callback=None) -> list:
+        """
+        Analyze all the files.  This will block until all the files are analyzed or the analyze is cancelled.
+        The callbacks are called from the thread calling this method.  They are not called after the
+        analyze is cancelled.
+        :param file_paths: Files to analyze.
+        :type file_paths: list
+        :param file_progress_callback: Called with the file index and the bytes read from the file so far.
+                                       This is called at most once per file for each poll of the workers.
+        :type file_progress_callback: function(file_index, bytes_read)
+        :param file_complete_callback: Called with the file index and the analyze summary when a file is complete.
+                                       The files complete in any order.
+        :type file_complete_callback: function(file_index, summary)
+        :return: List of analyze summaries in the same order as the files.
+        :rtype: list
+        """
+        summaries = [{"FilePath": file_path, "Status": "cancelled", "Error": None} for file_path in file_paths]
+        if not file_paths:
+            return summaries
+
+        with multiprocessing.Manager() as manager:
+            # Only pass the progress if someone is listening
+            progress_queue = manager.Queue() if file_progress_callback else None
+
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(file_paths))) as executor:
+                # Start all the files, the executor will limit the number running at once
+                futures = {}
+                for file_index, file_path in enumerate(file_paths):
+                    future = executor.submit(_analyze_file_worker, file_index, file_path, progress_queue,
+                                             self.analyze_options)
+                    futures[future] = file_index
+
+                pending = set(futures.keys())
+                while pending:
+                    if self.cancel_event.is_set():
+                        # The files being analyzed are finished before the workers stop
+                        for future in pending:
+                            future.cancel()
+                        wait(pending)
+                        for future in pending:
+                            if not future.cancelled() and future.exception() is None:
+                                summaries[futures[future]] = future.result()
+                        break
+
+                    # Pass on the progress from the workers
+                    self._dispatch_progress(progress_queue, file_progress_callback)
+
+                    done, pending = wait(pending, timeout=PROGRESS_POLL_TIMEOUT, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file_index = futures[future]
+                        try:
+                            summary = future.result()
+                        except Exception as ex:
+                            # The worker process failed
+                            logging.error("Error analyzing file " + str(file_paths[file_index]))
+                            summary = {"FilePath": file_paths[file_index], "Status": "failed", "Error": str(ex)}
+                        summaries[file_index] = summary
+
+                        # Send the last progress for the file before it is complete
+                        self._dispatch_progress(progress_queue, file_progress_callback)
+                        if file_complete_callback and not self.cancel_event.is_set():
+                            file_complete_callback(file_index, summary)
+
+        return summaries
+
+    def _dispatch_progress(self, progress_queue, file_progress_callback):
+        """
+        Pass the progress in the queue to the callback.  The counts are
+        cumulative, so only the latest count for each file is passed on.
+        :param progress_queue: Queue with the progress from the workers.
+        :type progress_queue: multiprocessing.Queue
+        :param file_progress_callback: Callback to receive the progress.
+        :type file_progress_callback: function(file_index, bytes_read)
+        :return:
+        :rtype:
+        """
+        latest = drain_progress(progress_queue)
+        if self.cancel_event.is_set():
+            return
+        for file_index, bytes_read in latest.items():
+            file_progress_callback(file_index, bytes_read)
@@ -0,0 +1,95 @@
+import os
+import datetime
+
+
+class AnalyzeStats:
+    """
+    Collect the analyze results while the ensembles are read.
+    This gives the same results as analyzing the file, so the
+    file does not need to be read again to get the results.
+    """
+
+    def __init__(self):
+        # Number of ensembles read
+        self.ens_count = 0
+
+        # Number of 4 beam and vertical beam ensembles paired together
+        self.ens_pair_count = 0
+
+        # First and last date and time
+        self.first_datetime = None
+        self.last_datetime = None
+
+        # Time between ensembles in seconds
+        self.ens_delta_time = 0.0
+
+    def resume(self, result: dict):
+        """
+        Continue from the analyze results of the start of the file.
+        The records added after this are added to the results.
+        :param result: Analyze results of the start of the file.
+        :type result: dict
+        :return:
+        :rtype:
+        """
+        self.ens_count = result.get("EnsCount", 0)
+        self.ens_pair_count = result.get("EnsPairCount", 0)
+        self.ens_delta_time = result.get("EnsembleDeltaTime", 0.0)
+        self.first_datetime = result.get("FirstEnsDateTime")
+        self.last_datetime = result.get("LastEnsDateTime")
+
+    def add_batch(self, record_count: int, pair_count: int, first_datetime: datetime.datetime,
+                  second_datetime: datetime.datetime, last_datetime: datetime.datetime):
+        """
+        Add a batch of exported records.  Only the first two and last valid
+        times in the batch are needed to give the same results as adding
+        each record.
+        :param record_count: Number of records in the batch.
+        :type record_count: int
+        :param pair_count: Number of records that are paired ensembles.
+        :type pair_count: int
+        :param first_datetime: First valid date and time in the batch.  None if no valid time.
+        :type first_datetime: datetime.datetime
+        :param second_datetime: Second valid date and time in the batch.  None if less than 2 valid times.
+        :type second_datetime: datetime.datetime
+        :param last_datetime: Last valid date and time in the batch.
+        :type last_datetime: datetime.datetime
+        :return:
+        :rtype:
+        """
+        self.ens_count += record_count + pair_count
+        self.ens_pair_count += pair_count
+
+        if first_datetime is None:
+            return
+
+        if self.first_datetime is None:
+            self.first_datetime = first_datetime
+            if second_datetime is not None:
+                self.ens_delta_time = (second_datetime - first_datetime).total_seconds()
+        elif self.ens_delta_time <= 0 and self.last_datetime is not None:
+            # Use the time between the first ensembles
+            self.ens_delta_time = (first_datetime - self.last_datetime).total_seconds()
+        self.last_datetime = last_datetime
+
+    def result(self, file_path: str) -> dict:
+        """
+        Get the analyze results.
+        :param file_path: File path analyzed.
+        :type file_path: str
+        :return: Dictionary containing the results.
+        :rtype: dict
+        """
+        desc = os.path.basename(file_path) + " - " + str(self.ens_count) + " ensembles"
+        if self.first_datetime is not None:
+            desc += " - " + str(self.first_datetime) + " to " + str(self.last_datetime)
+
+        return {
+            "FilePath": file_path,
+            "CompleteFileDesc": desc,
+            "EnsCount": self.ens_count,
+            "EnsPairCount": self.ens_pair_count,
+            "EnsembleDeltaTime": self.ens_delta_time,
+            "FirstEnsDateTime": self.first_datetime,
+            "LastEnsDateTime": self.last_datetime,
+        }
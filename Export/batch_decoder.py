@@ -0,0 +1,706 @@
+import logging
+import datetime
+import itertools
+import numpy as np
+from .rtb_reader import HEADER_SIZE, create_reader
+from .memory_budget import MemoryBudget, MIN_BATCH_SIZE
+from .ensemble_index import EnsembleIndex
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION, STAGE_DECODE, COUNTER_BATCHES
+from .rtb_decoder import find_datasets, value_dtype, decode_ensemble_header, pair_vertical_beam, DATASET_HEADER_STRUCT, \
+    BIN_BEAM_DATASETS, ENSEMBLE_DATA_ID, ANCILLARY_DATA_ID, ANCILLARY_FIELDS, \
+    ENS_DATA_ENS_NUM, ENS_DATA_NUM_BINS, ENS_DATA_NUM_BEAMS, ENS_DATA_YEAR, ENS_DATA_FIRMWARE, ENS_DATA_SUBSYSTEM_CONFIG
+
+
+# Number of ensembles to decode at a time
+DEFAULT_BATCH_SIZE = 500
+
+# Number of records at the start of the file used to find the number of bins and beams
+SHAPE_RECORDS = DEFAULT_BATCH_SIZE
+
+# Bytes at the start of the payload used to identify the layout of an ensemble.
+# This is the first data set header and name.
+LAYOUT_KEY_SIZE = DATASET_HEADER_STRUCT.size + 8
+
+# Microseconds in a second
+US_PER_SECOND = 1000000
+
+
+def ensemble_datetimes(ens_data: np.ndarray) -> np.ndarray:
+    """
+    Convert the date and time values in the ensemble data sets to datetime64.
+    :param ens_data: Ensemble data set values of shape (ensemble, value).
+    :type ens_data: np.ndarray
+    :return: Date and time of each ensemble.  NaT if the date and time is not valid.
+    :rtype: np.ndarray of datetime64[us]
+    """
+    year, month, day, hour, minute, second, hsec = \
+        (ens_data[:, ENS_DATA_YEAR + value].astype(np.int64) for value in range(7))
+
+    valid = (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & \
+            (hour >= 0) & (hour < 24) & (minute >= 0) & (minute < 60) & (second >= 0) & (second < 60) & \
+            (hsec >= 0) & (hsec < 100)
+
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype("datetime64[M]")
+    usec = ((((day - 1) * 24 + hour) * 60 + minute) * 60 + second) * US_PER_SECOND + hsec * 10000
+    times = months.astype("datetime64[us]") + np.where(valid, usec, 0).astype("timedelta64[us]")
+    times[~valid] = np.datetime64("NaT")
+    return times
+
+
+def to_datetime(value: np.datetime64) -> datetime.datetime:
+    """
+    Convert the datetime64 to a datetime.
+    :param value: Date and time.
+    :type value: np.datetime64
+    :return: Date and time or None if NaT.
+    :rtype: datetime.datetime
+    """
+    if np.isnat(value):
+        return None
+    return value.astype("datetime64[us]").item()
+
+
+class EnsembleLayout:
+    """
+    Layout of the data sets in an ensemble.  Ensembles from the same subsystem
+    configuration have the same data sets at the same offsets, so a structured
+    numpy data type can decode many ensembles at once.
+    """
+
+    def __init__(self, ens_bytes):
+        """
+        Create the layout from an ensemble.
+        :param ens_bytes: Complete ensemble including the header and checksum.
+        :type ens_bytes: bytes
+        """
+        header = decode_ensemble_header(ens_bytes)
+        self.num_bins = header.num_bins
+        self.num_beams = header.num_beams
+        self.serial_number = header.serial_number
+        self.subsystem_code = header.subsystem_code
+        self.subsystem_config = header.subsystem_config
+        self.length = len(ens_bytes)
+
+        # Bin and beam data sets: (field name, variable name, number of bins, number of beams)
+        self.bin_beam = []
+        self.ens_data_size = 0
+        self.ens_data_offset = 0
+        self.ancillary_size = 0
+
+        names, formats, offsets = [], [], []
+        for name, value_type, num_elements, element_multiplier, data_offset, data_size in find_datasets(ens_bytes):
+            if name in BIN_BEAM_DATASETS:
+                # The data is stored beam by beam
+                self.bin_beam.append((name, BIN_BEAM_DATASETS[name], num_elements, element_multiplier))
+                shape = (element_multiplier, num_elements)
+            elif name == ENSEMBLE_DATA_ID and num_elements > ENS_DATA_SUBSYSTEM_CONFIG:
+                self.ens_data_size = num_elements
+                self.ens_data_offset = data_offset
+                shape = (num_elements,)
+            elif name == ANCILLARY_DATA_ID:
+                self.ancillary_size = num_elements
+                shape = (num_elements,)
+            else:
+                continue
+
+            names.append(name)
+            formats.append((value_dtype(value_type), shape))
+            offsets.append(data_offset)
+
+        # Structured data type of the complete ensemble
+        self.dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": self.length})
+
+    def subsystem(self, ens_bytes) -> tuple:
+        """
+        Get the subsystem of the ensemble.  Subsystems with the same number of
+        bins and beams have the same layout, so the subsystem is read from each
+        ensemble instead of the ensemble used to create the layout.
+        :param ens_bytes: Complete ensemble with this layout.
+        :type ens_bytes: bytes
+        :return: Subsystem code and subsystem configuration index.
+        :rtype: tuple
+        """
+        if not self.ens_data_size:
+            return self.subsystem_code, self.subsystem_config
+        return (chr(ens_bytes[self.ens_data_offset + ENS_DATA_FIRMWARE * 4 + 3]),
+                ens_bytes[self.ens_data_offset + ENS_DATA_SUBSYSTEM_CONFIG * 4 + 3])
+
+    @staticmethod
+    def key(ens_bytes) -> tuple:
+        """
+        Get the key to identify the layout of the ensemble.  This is the length of
+        the ensemble and the first data set header.
+        :param ens_bytes: Complete ensemble including the header and checksum.
+        :type ens_bytes: bytes
+        :return: Layout key.
+        :rtype: tuple
+        """
+        return len(ens_bytes), bytes(ens_bytes[HEADER_SIZE:HEADER_SIZE + LAYOUT_KEY_SIZE])
+
+
+class EnsembleBatch:
+    """
+    Batch of decoded ensembles stored in columns.  The bin and beam data
+    is stored as arrays of shape (ensemble, bin, beam).  The arrays may be
+    reused by the decoder for the next batch, so the batch must be written
+    before the next batch is decoded.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.num_bins = 0
+        self.num_beams = 0
+        self.serial_number = ""
+        self.subsystem_code = ""
+        self.subsystem_config = 0
+
+        # Column for each ensemble
+        self.ens_num = None
+        self.datetimes = None
+        self.is_pair = None
+
+        # Byte offset in the file of the start of the record and the end of its last ensemble
+        self.offsets = None
+        self.end_offsets = None
+
+        # Variable name and array of shape (ensemble, bin, beam)
+        self.bin_beam = {}
+
+        # Ancillary values of shape (ensemble, ANCILLARY_FIELDS)
+        self.ancillary = None
+
+        # Number of records and paired records averaged into each ensemble.  None if not averaged.
+        self.record_counts = None
+        self.pair_counts = None
+
+    def first_datetime(self) -> datetime.datetime:
+        """
+        Get the first valid date and time in the batch.
+        :return: First date and time or None if no ensemble has a valid time.
+        :rtype: datetime.datetime
+        """
+        datetimes = self.datetimes[:self.count]
+        valid = datetimes[~np.isnat(datetimes)]
+        return to_datetime(valid[0]) if len(valid) > 0 else None
+
+    def pair_count(self) -> int:
+        """
+        Get the number of records in the batch that are paired ensembles.
+        :return: Number of paired records.
+        :rtype: int
+        """
+        return int(self.is_pair[:self.count].sum())
+
+    def source_counts(self) -> tuple:
+        """
+        Get the number of records and paired records in the file that are in
+        the batch.  An averaged ensemble counts the records averaged into it.
+        :return: Number of records and number of paired records.
+        :rtype: tuple
+        """
+        if self.record_counts is None:
+            return self.count, self.pair_count()
+        return int(self.record_counts[:self.count].sum()), int(self.pair_counts[:self.count].sum())
+
+    def time_summary(self) -> tuple:
+        """
+        Get the first, second and last valid date and time in the batch.
+        These are all that is needed to collect the analyze results.
+        :return: First, second and last date and time.  None if there are not enough valid times.
+        :rtype: tuple
+        """
+        datetimes = self.datetimes[:self.count]
+        valid = datetimes[~np.isnat(datetimes)]
+        return (to_datetime(valid[0]) if len(valid) > 0 else None,
+                to_datetime(valid[1]) if len(valid) > 1 else None,
+                to_datetime(valid[-1]) if len(valid) > 0 else None)
+
+    def select(self, mask: np.ndarray):
+        """
+        Create a batch with only the ensembles selected.  The columns are
+        copied, so the batch is kept when the decoder reuses its arrays.
+        :param mask: TRUE for each ensemble in the batch to keep.
+        :type mask: np.ndarray
+        :return: Batch of the selected ensembles.
+        :rtype: EnsembleBatch
+        """
+        count = self.count
+        batch = EnsembleBatch()
+        batch.count = int(mask.sum())
+        batch.num_bins = self.num_bins
+        batch.num_beams = self.num_beams
+        batch.serial_number = self.serial_number
+        batch.subsystem_code = self.subsystem_code
+        batch.subsystem_config = self.subsystem_config
+
+        batch.ens_num = self.ens_num[:count][mask]
+        batch.datetimes = self.datetimes[:count][mask]
+        batch.is_pair = self.is_pair[:count][mask]
+        batch.offsets = self.offsets[:count][mask]
+        batch.end_offsets = self.end_offsets[:count][mask]
+        batch.ancillary = self.ancillary[:count][mask]
+        for var_name, values in self.bin_beam.items():
+            batch.bin_beam[var_name] = values[:count][mask]
+        return batch
+
+
+class RawEnsemble:
+    """
+    Ensemble that has not been decoded.  The number of beams is
+    taken from the layout so the ensembles can be paired.
+    """
+
+    __slots__ = ("offset", "data", "num_beams")
+
+    def __init__(self, offset: int, data, num_beams: int):
+        self.offset = offset
+        self.data = data
+        self.num_beams = num_beams
+
+
+def record(ens: RawEnsemble, vert_ens: RawEnsemble = None) -> tuple:
+    """
+    Create the record decoded by the batch decoder.
+    :param ens: Ensemble.
+    :type ens: RawEnsemble
+    :param vert_ens: Vertical beam ensemble paired with the ensemble.  None if not paired.
+    :type vert_ens: RawEnsemble
+    :return: Offset, ensemble bytes, vertical offset and vertical ensemble bytes.
+    :rtype: tuple
+    """
+    if vert_ens is not None:
+        return ens.offset, ens.data, vert_ens.offset, vert_ens.data
+    return ens.offset, ens.data, None, None
+
+
+class BatchDecoder:
+    """
+    Decode many ensembles at once into preallocated numpy arrays.  The ensembles
+    with the same layout are decoded with a single np.frombuffer using a structured
+    data type, so there is no Python work for each value.
+
+    A 4 beam ensemble paired with a vertical beam is stored as 5 beams with the
+    vertical beam last.  The number of bins and beams is set by the largest
+    record in the first batch unless it is given, because a file can start on a
+    vertical beam ensemble or be missing a vertical beam.  Use file_shape() to
+    give the shape of the whole file.  A record with more bins or beams than
+    the batch raises a ValueError instead of losing the values.
+
+    With a memory budget, the batch size is lowered so the batch arrays fit in
+    the budget.  The size of a decoded ensemble is only known from the first records.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, num_bins: int = None, num_beams: int = None,
+                 memory_budget: MemoryBudget = None, instrumentation: Instrumentation = NULL_INSTRUMENTATION):
+        """
+        Initialize the decoder.
+        :param batch_size: Maximum number of ensembles in a batch.
+        :type batch_size: int
+        :param num_bins: Number of bins to store.  If None, the most bins in a record of the first batch.
+        :type num_bins: int
+        :param num_beams: Number of beams to store.  If None, the most beams in a record of the first batch.
+        :type num_beams: int
+        :param memory_budget: Memory budget of the export.  If None, the memory is not limited.
+        :type memory_budget: MemoryBudget
+        :param instrumentation: Records the decode time and the number of batches.
+        :type instrumentation: Instrumentation
+        """
+        self.batch_size = batch_size
+        self.num_bins = num_bins
+        self.num_beams = num_beams
+        self.memory_budget = memory_budget
+        self.instrumentation = instrumentation
+        self.layouts = {}
+        self.batch = None
+
+        # Records waiting to be decoded
+        self.records = []
+
+        # Byte offset of the 4 beam ensemble held at the end of paired ensembles.  None if not held.
+        self.held_offset = None
+
+    def layout(self, ens_bytes) -> EnsembleLayout:
+        """
+        Get the layout of the ensemble.  The layouts are cached, so this is
+        only decoded for the first ensemble of each layout.
+        :param ens_bytes: Complete ensemble including the header and checksum.
+        :type ens_bytes: bytes
+        :return: Layout of the ensemble.
+        :rtype: EnsembleLayout
+        """
+        key = EnsembleLayout.key(ens_bytes)
+        layout = self.layouts.get(key)
+        if layout is None:
+            layout = EnsembleLayout(ens_bytes)
+            self.layouts[key] = layout
+        return layout
+
+    def batches(self, ensembles, hold_unpaired: bool = False):
+        """
+        Pair the vertical beam ensembles and decode the ensembles in batches.
+        Each batch is only valid until the next batch is decoded.
+        :param ensembles: Offset and bytes of each ensemble in the order they were read.
+        :type ensembles: iterable of (int, bytes)
+        :param hold_unpaired: Do not decode a 4 beam ensemble at the end of paired ensembles.  See ensemble_records().
+        :type hold_unpaired: bool
+        :return: Decoded batches.
+        :rtype: EnsembleBatch
+        """
+        return self.record_batches(self.ensemble_records(ensembles, hold_unpaired))
+
+    def ensemble_records(self, ensembles, hold_unpaired: bool = False):
+        """
+        Pair the vertical beam ensembles into records.
+
+        If hold unpaired is used and the ensembles are paired, a 4 beam ensemble
+        at the end is not given.  The file may end before its vertical beam was
+        recorded, so the offset of the ensemble is kept in held_offset.  A file
+        appended to later reads the ensemble again with its vertical beam.
+        :param ensembles: Offset and bytes of each ensemble in the order they were read.
+        :type ensembles: iterable of (int, bytes)
+        :param hold_unpaired: Hold a 4 beam ensemble at the end of paired ensembles.
+        :type hold_unpaired: bool
+        :return: Records from record().
+        :rtype: iterable of tuple
+        """
+        raw_ensembles = (RawEnsemble(offset, ens_bytes, self.layout(ens_bytes).num_beams)
+                         for offset, ens_bytes in ensembles)
+        self.held_offset = None
+        if not hold_unpaired:
+            for ens, vert_ens in pair_vertical_beam(raw_ensembles):
+                yield record(ens, vert_ens)
+            return
+
+        # The vertical beam is stored as the 5th beam of paired ensembles
+        paired = self.num_beams == 5
+        last = None
+        for ens, vert_ens in pair_vertical_beam(raw_ensembles):
+            if last is not None:
+                yield record(*last)
+            paired = paired or vert_ens is not None
+            last = (ens, vert_ens)
+
+        if last is not None:
+            ens, vert_ens = last
+            if paired and vert_ens is None and ens.num_beams == 4:
+                self.held_offset = ens.offset
+            else:
+                yield record(ens, vert_ens)
+
+    def record_batches(self, records):
+        """
+        Decode the records in batches.  Each batch is only valid until the next batch is decoded.
+        :param records: Records from record() in the order they were read.
+        :type records: iterable of tuple
+        :return: Decoded batches.
+        :rtype: EnsembleBatch
+        """
+        for ens_record in records:
+            batch = self.add(ens_record)
+            if batch is not None:
+                yield batch
+
+        batch = self.finish()
+        if batch is not None:
+            yield batch
+
+    def paired_records(self, ensembles: list):
+        """
+        Pair the vertical beam ensembles of a single record read by itself, such
+        as a record read using the ensemble index.  The ensembles are only paired
+        within the record.
+        :param ensembles: Offset and bytes of each ensemble in the record.
+        :type ensembles: list
+        :return: Records from record().
+        :rtype: list
+        """
+        raw_ensembles = [RawEnsemble(offset, ens_bytes, self.layout(ens_bytes).num_beams)
+                         for offset, ens_bytes in ensembles]
+        return [record(ens, vert_ens) for ens, vert_ens in pair_vertical_beam(raw_ensembles)]
+
+    def record_shape(self, ens_record: tuple) -> tuple:
+        """
+        Get the number of bins and beams needed to store the record.
+        :param ens_record: Record from record().
+        :type ens_record: tuple
+        :return: Number of bins and beams.
+        :rtype: tuple
+        """
+        offset, ens_bytes, vert_offset, vert_bytes = ens_record
+        layout = self.layout(ens_bytes)
+        if vert_bytes is None:
+            return layout.num_bins, layout.num_beams
+        vert_layout = self.layout(vert_bytes)
+        return max(layout.num_bins, vert_layout.num_bins), layout.num_beams + vert_layout.num_beams
+
+    def records_shape(self, records) -> tuple:
+        """
+        Get the number of bins and beams needed to store all the records.
+        :param records: Records from record().
+        :type records: iterable of tuple
+        :return: Most bins and beams in a record.  None, None if there are no records.
+        :rtype: tuple
+        """
+        num_bins = None
+        num_beams = None
+        for ens_record in records:
+            bins, beams = self.record_shape(ens_record)
+            num_bins = bins if num_bins is None else max(num_bins, bins)
+            num_beams = beams if num_beams is None else max(num_beams, beams)
+        return num_bins, num_beams
+
+    def add(self, ens_record: tuple) -> EnsembleBatch:
+        """
+        Add a record to decode.  The records are decoded when there is a batch
+        of them.  This is used when the ensembles are already paired, such as
+        when the records of each subsystem are decoded separately.
+        :param ens_record: Record from record().
+        :type ens_record: tuple
+        :return: Decoded batch if the batch is full, otherwise None.  The batch is only valid until the next batch.
+        :rtype: EnsembleBatch
+        """
+        records = self.records
+        records.append(ens_record)
+
+        # The batch size in the memory budget is set by the first records
+        if self.batch is None and self.memory_budget is not None and \
+                len(records) >= min(MIN_BATCH_SIZE, self.batch_size):
+            self._create_batch(records)
+
+        if len(records) >= self.batch_size:
+            self.records = []
+            return self._decode_timed(records)
+        return None
+
+    def finish(self) -> EnsembleBatch:
+        """
+        Decode the records that do not fill a batch.
+        :return: Decoded batch or None if no records are waiting.
+        :rtype: EnsembleBatch
+        """
+        records = self.records
+        if not records:
+            return None
+        self.records = []
+        return self._decode_timed(records)
+
+    def _decode_timed(self, records: list) -> EnsembleBatch:
+        """
+        Decode the records and add the time to the instrumentation.
+        :param records: List of (offset, ensemble bytes, vertical offset, vertical ensemble bytes).
+        :type records: list
+        :return: Decoded batch.
+        :rtype: EnsembleBatch
+        """
+        if not self.instrumentation.enabled:
+            return self.decode(records)
+
+        with self.instrumentation.stage(STAGE_DECODE):
+            batch = self.decode(records)
+        self.instrumentation.count(COUNTER_BATCHES)
+        return batch
+
+    def decode(self, records: list) -> EnsembleBatch:
+        """
+        Decode the records.
+        :param records: List of (offset, ensemble bytes, vertical offset, vertical ensemble bytes).
+                        The vertical offset and bytes are None if the ensemble is not paired.
+        :type records: list
+        :return: Decoded batch.
+        :rtype: EnsembleBatch
+        """
+        if self.batch is None:
+            self._create_batch(records)
+
+        batch = self.batch
+        count = len(records)
+        if count > self.batch_size:
+            raise ValueError("Batch of " + str(count) + " is larger than " + str(self.batch_size))
+        batch.count = count
+
+        # Reset the reused arrays
+        for values in batch.bin_beam.values():
+            values[:count] = np.nan if values.dtype.kind == "f" else 0
+        batch.ancillary[:count] = np.nan
+        batch.ens_num[:count] = 0
+        batch.datetimes[:count] = np.datetime64("NaT")
+        batch.is_pair[:count] = False
+
+        # Group the ensembles with the same layout.  The vertical beam is stored after the 4 beams.
+        groups = {}
+        for row, (offset, ens_bytes, vert_offset, vert_bytes) in enumerate(records):
+            layout = self.layout(ens_bytes)
+            groups.setdefault((layout, 0), []).append((row, offset, ens_bytes))
+            batch.offsets[row] = offset
+            if vert_bytes is not None:
+                batch.is_pair[row] = True
+                batch.end_offsets[row] = vert_offset + len(vert_bytes)
+                groups.setdefault((self.layout(vert_bytes), layout.num_beams), []).append((row, vert_offset, vert_bytes))
+            else:
+                batch.end_offsets[row] = offset + len(ens_bytes)
+
+        for (layout, beam_offset), group in groups.items():
+            self._decode_group(batch, layout, beam_offset, group)
+
+        return batch
+
+    def _create_batch(self, records: list):
+        """
+        Create the batch arrays using the largest of the first records to set the
+        number of bins and beams if not given.  The instrument is taken from the
+        first record with the most beams, so not from a vertical beam ensemble.
+        :param records: First records.
+        :type records: list
+        :return:
+        :rtype:
+        """
+        shapes = [self.record_shape(ens_record) for ens_record in records]
+        most_beams = max(beams for bins, beams in shapes)
+        ens_bytes = next(ens_record[1] for ens_record, (bins, beams) in zip(records, shapes) if beams == most_beams)
+        layout = self.layout(ens_bytes)
+
+        batch = EnsembleBatch()
+        batch.num_bins = self.num_bins if self.num_bins else max(bins for bins, beams in shapes)
+        batch.num_beams = self.num_beams if self.num_beams else most_beams
+        batch.serial_number = layout.serial_number
+        batch.subsystem_code, batch.subsystem_config = layout.subsystem(ens_bytes)
+
+        # Data sets of all the records, in case the first ensemble is missing some
+        datasets = {}
+        for offset, ens_bytes, vert_offset, vert_bytes in records:
+            for data_bytes in (ens_bytes, vert_bytes):
+                if data_bytes is not None:
+                    record_layout = self.layout(data_bytes)
+                    for name, var_name, num_bins, num_beams in record_layout.bin_beam:
+                        datasets.setdefault(var_name, record_layout.dtype[name].base)
+
+        if self.memory_budget is not None:
+            # Bytes of a decoded ensemble
+            ensemble_bytes = (np.dtype(np.int32).itemsize + np.dtype("datetime64[us]").itemsize +
+                              np.dtype(bool).itemsize + 2 * np.dtype(np.int64).itemsize +
+                              len(ANCILLARY_FIELDS) * np.dtype(np.float32).itemsize)
+            for dtype in datasets.values():
+                ensemble_bytes += batch.num_bins * batch.num_beams * dtype.itemsize
+            self.batch_size = self.memory_budget.batch_size(ensemble_bytes, self.batch_size)
+
+        size = self.batch_size
+        batch.ens_num = np.zeros(size, dtype=np.int32)
+        batch.datetimes = np.empty(size, dtype="datetime64[us]")
+        batch.is_pair = np.zeros(size, dtype=bool)
+        batch.offsets = np.zeros(size, dtype=np.int64)
+        batch.end_offsets = np.zeros(size, dtype=np.int64)
+        batch.ancillary = np.empty((size, len(ANCILLARY_FIELDS)), dtype=np.float32)
+        for var_name, dtype in datasets.items():
+            batch.bin_beam[var_name] = np.empty((size, batch.num_bins, batch.num_beams), dtype=dtype)
+        self.batch = batch
+
+    def _decode_group(self, batch: EnsembleBatch, layout: EnsembleLayout, beam_offset: int, group: list):
+        """
+        Decode all the ensembles with the same layout into the batch.
+        :param batch: Batch to store the values.
+        :type batch: EnsembleBatch
+        :param layout: Layout of the ensembles.
+        :type layout: EnsembleLayout
+        :param beam_offset: First beam in the batch to store the beams.  The vertical beam is stored after the 4 beams.
+        :type beam_offset: int
+        :param group: List of (row, offset, ensemble bytes).
+        :type group: list
+        :return:
+        :rtype:
+        """
+        rows = np.fromiter((row for row, offset, ens_bytes in group), dtype=np.intp, count=len(group))
+        raw = self._group_array(layout, group)
+
+        # Verify the ensembles match the layout
+        if layout.ens_data_size:
+            ens_data = raw[ENSEMBLE_DATA_ID]
+            good = (ens_data[:, ENS_DATA_NUM_BINS] == layout.num_bins) & \
+                   (ens_data[:, ENS_DATA_NUM_BEAMS] == layout.num_beams)
+            if not good.all():
+                logging.debug("Ensembles do not match the layout, decoding separately")
+                for index in np.flatnonzero(~good):
+                    row, offset, ens_bytes = group[index]
+                    self._decode_group(batch, EnsembleLayout(ens_bytes), beam_offset, [group[index]])
+                rows = rows[good]
+                raw = raw[good]
+
+        for name, var_name, num_bins, num_beams in layout.bin_beam:
+            values = batch.bin_beam.get(var_name)
+            if values is None or len(rows) == 0:
+                continue
+            if num_bins > batch.num_bins or beam_offset + num_beams > batch.num_beams:
+                raise ValueError("Ensemble at byte " + str(group[0][1]) + " has " + str(num_bins) + " bins and " +
+                                 str(beam_offset + num_beams) + " beams, the export has " + str(batch.num_bins) +
+                                 " bins and " + str(batch.num_beams) + " beams")
+
+            # Transpose from (ensemble, beam, bin) to (ensemble, bin, beam)
+            values[rows, :num_bins, beam_offset:beam_offset + num_beams] = raw[name].transpose(0, 2, 1)
+
+        # The ensemble data and ancillary data are taken from the 4 beam ensemble
+        if beam_offset > 0:
+            return
+
+        if layout.ens_data_size:
+            ens_data = raw[ENSEMBLE_DATA_ID]
+            batch.ens_num[rows] = ens_data[:, ENS_DATA_ENS_NUM]
+            batch.datetimes[rows] = ensemble_datetimes(ens_data)
+
+        if layout.ancillary_size:
+            fields = min(layout.ancillary_size, len(ANCILLARY_FIELDS))
+            batch.ancillary[rows, :fields] = raw[ANCILLARY_DATA_ID][:, :fields]
+
+    @staticmethod
+    def _group_array(layout: EnsembleLayout, group: list) -> np.ndarray:
+        """
+        Create the structured array for the ensembles.  If the ensembles are
+        evenly spaced in the same buffer, such as the memory mapped file, the
+        array is a view of the buffer.  Otherwise the ensembles are copied
+        into a single buffer.
+        :param layout: Layout of the ensembles.
+        :type layout: EnsembleLayout
+        :param group: List of (row, offset, ensemble bytes).
+        :type group: list
+        :return: Structured array of the ensembles.
+        :rtype: np.ndarray
+        """
+        first_bytes = group[0][2]
+        if isinstance(first_bytes, memoryview) and first_bytes.obj is not None:
+            base = first_bytes.obj
+            first_offset = group[0][1]
+            stride = group[1][1] - first_offset if len(group) > 1 else layout.length
+            evenly_spaced = stride >= layout.length and all(
+                isinstance(ens_bytes, memoryview) and ens_bytes.obj is base and offset == first_offset + index * stride
+                for index, (row, offset, ens_bytes) in enumerate(group))
+            if evenly_spaced:
+                return np.ndarray(shape=(len(group),), dtype=layout.dtype, buffer=base,
+                                  offset=first_offset, strides=(stride,))
+
+        return np.frombuffer(b"".join(ens_bytes for row, offset, ens_bytes in group), dtype=layout.dtype)
+
+
+def file_shape(file_path: str) -> tuple:
+    """
+    Get the number of bins and beams to store every record of the file.  A
+    file can start on a vertical beam ensemble or be missing a vertical beam,
+    so the shape is the largest record at the start of the file instead of
+    the first record.  If the ensemble index of the file is current, the
+    beams of every record in the file are included.
+    :param file_path: RTB file path.
+    :type file_path: str
+    :return: Number of bins and beams.  None, None if there are no ensembles.
+    :rtype: tuple
+    """
+    decoder = BatchDecoder()
+    reader = create_reader(file_path)
+    records = decoder.ensemble_records(reader.ensembles())
+    try:
+        num_bins, num_beams = decoder.records_shape(itertools.islice(records, SHAPE_RECORDS))
+    finally:
+        records.close()
+    if num_bins is None:
+        return None, None
+
+    index = EnsembleIndex.load_for_file(file_path)
+    if index is not None:
+        num_beams = max(num_beams, index.max_record_beams())
+    return num_bins, num_beams
@@ -0,0 +1,380 @@
+import os
+import datetime
+import numpy as np
+from .rtb_decoder import ANCILLARY_FIELDS
+from .batch_decoder import EnsembleBatch
+from .export_profile import ExportProfile, get_profile, DEFAULT_PROFILE_NAME
+from .memory_budget import MemoryBudget
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION, STAGE_WRITE, COUNTER_RECORDS, COUNTER_FLUSHES
+from .output_formats import FORMAT_NETCDF, FORMAT_ZARR, FORMAT_PARQUET, DEFAULT_FORMATS, format_output_path
+
+
+# Attributes for each variable
+VARIABLE_ATTRS = {
+    "beam_vel": {"long_name": "Beam Velocity", "units": "m/s"},
+    "instr_vel": {"long_name": "Instrument Velocity", "units": "m/s"},
+    "earth_vel": {"long_name": "Earth Velocity", "units": "m/s"},
+    "amp": {"long_name": "Amplitude", "units": "dB"},
+    "corr": {"long_name": "Correlation", "units": "1"},
+    "good_beam": {"long_name": "Good Beam Pings", "units": "count"},
+    "good_earth": {"long_name": "Good Earth Pings", "units": "count"},
+    "first_bin_range": {"long_name": "Range to the First Bin", "units": "m"},
+    "bin_size": {"long_name": "Bin Size", "units": "m"},
+    "first_ping_time": {"long_name": "First Ping Time", "units": "s"},
+    "last_ping_time": {"long_name": "Last Ping Time", "units": "s"},
+    "heading": {"long_name": "Heading", "units": "degree"},
+    "pitch": {"long_name": "Pitch", "units": "degree"},
+    "roll": {"long_name": "Roll", "units": "degree"},
+    "water_temp": {"long_name": "Water Temperature", "units": "degree_Celsius"},
+    "system_temp": {"long_name": "System Temperature", "units": "degree_Celsius"},
+    "salinity": {"long_name": "Salinity", "units": "ppt"},
+    "pressure": {"long_name": "Pressure", "units": "Pa"},
+    "xdcr_depth": {"long_name": "Transducer Depth", "units": "m"},
+    "speed_of_sound": {"long_name": "Speed of Sound", "units": "m/s"},
+}
+
+# Variables that use the bad velocity value
+VELOCITY_VARIABLES = ("beam_vel", "instr_vel", "earth_vel")
+
+# Units of the time variable, followed by the time reference
+TIME_UNITS_PREFIX = "seconds since "
+TIME_UNITS_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Time reference used when the first ensemble has no date and time
+DEFAULT_TIME_REF = datetime.datetime(1970, 1, 1)
+
+
+def has_ancillary(batch: EnsembleBatch) -> bool:
+    """
+    Check if the ensembles have the ancillary data set.
+    :param batch: First batch.
+    :type batch: EnsembleBatch
+    :return: TRUE if the first ensemble has ancillary data.
+    :rtype: bool
+    """
+    return not np.isnan(batch.ancillary[0]).all()
+
+
+def analyze_attrs(analyze_result: dict) -> dict:
+    """
+    Get the file attributes of the analyze results.
+    :param analyze_result: Analyze results of the ensembles written.
+    :type analyze_result: dict
+    :return: Attribute name and value.
+    :rtype: dict
+    """
+    attrs = {
+        "ens_count": analyze_result.get("EnsCount", 0),
+        "ens_pair_count": analyze_result.get("EnsPairCount", 0),
+        "ensemble_delta_time": analyze_result.get("EnsembleDeltaTime", 0.0),
+    }
+    if analyze_result.get("FirstEnsDateTime") is not None:
+        attrs["time_coverage_start"] = analyze_result["FirstEnsDateTime"].isoformat()
+    if analyze_result.get("LastEnsDateTime") is not None:
+        attrs["time_coverage_end"] = analyze_result["LastEnsDateTime"].isoformat()
+
+    # Quick look exports of some of the ensembles
+    if analyze_result.get("Decimate"):
+        attrs["decimate"] = analyze_result["Decimate"]
+    if analyze_result.get("AverageInterval"):
+        attrs["average_interval"] = analyze_result["AverageInterval"]
+    if analyze_result.get("IntervalCount") is not None:
+        attrs["interval_count"] = analyze_result["IntervalCount"]
+    return attrs
+
+
+class BatchWriter:
+    """
+    Write the decoded ensembles to an output format.  The output is created
+    when the first batch is written, because the number of bins and beams and
+    the data sets available are only known from the first ensemble.
+
+    The ensembles are held in a write buffer of a column for each variable,
+    and the buffer is written in large blocks that are a multiple of the time
+    chunk of the export profile.  Each format creates the output in _start()
+    and writes the buffer in _write_buffer().
+
+    With a memory budget, the write buffer is sized to fit in the budget.
+    """
+
+    def __init__(self, file_path: str, profile: ExportProfile = None, memory_budget: MemoryBudget = None,
+                 instrumentation: Instrumentation = NULL_INSTRUMENTATION):
+        """
+        Initialize the writer.
+        :param file_path: File path of the output to create.
+        :type file_path: str
+        :param profile: Chunk shape, compression and write buffer settings.  If None, the default profile.
+        :type profile: ExportProfile
+        :param memory_budget: Memory budget of the export.  If None, the memory is not limited.
+        :type memory_budget: MemoryBudget
+        :param instrumentation: Records the write time, the records written and the buffer writes.
+        :type instrumentation: Instrumentation
+        """
+        self.file_path = file_path
+        self.profile = profile if profile else get_profile(DEFAULT_PROFILE_NAME)
+        self.memory_budget = memory_budget
+        self.instrumentation = instrumentation
+        self.time_ref = None
+
+        # Number of ensembles written to the output
+        self.ens_index = 0
+
+        # Variable name and the ensembles waiting to be written
+        self.buffer = {}
+        self.buffer_count = 0
+
+    def write_batch(self, batch: EnsembleBatch):
+        """
+        Add the batch of ensembles to the write buffer.  When the buffer
+        is full, each variable is written to the output.
+        :param batch: Batch of decoded ensembles.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        if batch.count == 0:
+            return
+
+        if self.instrumentation.enabled:
+            with self.instrumentation.stage(STAGE_WRITE):
+                self._write_batch(batch)
+            self.instrumentation.count(COUNTER_RECORDS, batch.count)
+        else:
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: EnsembleBatch):
+        """
+        Copy the batch into the write buffer, writing the buffer each time it is full.
+        :param batch: Batch of decoded ensembles.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        if not self.buffer:
+            self._start(batch)
+
+        count = batch.count
+
+        # Time in seconds since the time reference.  Ensembles without a valid time are NaN.
+        columns = {
+            "ens_num": batch.ens_num[:count],
+            "time": (batch.datetimes[:count] - self.time_ref) / np.timedelta64(1, "s"),
+        }
+        for var_name, values in batch.bin_beam.items():
+            columns[var_name] = values[:count]
+        for field_index, field in enumerate(ANCILLARY_FIELDS):
+            columns[field] = batch.ancillary[:count, field_index]
+
+        # Copy the batch into the buffer, writing the buffer each time it is full
+        capacity = len(self.buffer["time"])
+        pos = 0
+        while pos < count:
+            size = min(count - pos, capacity - self.buffer_count)
+            for var_name, values in self.buffer.items():
+                values[self.buffer_count:self.buffer_count + size] = columns[var_name][pos:pos + size]
+            self.buffer_count += size
+            pos += size
+
+            if self.buffer_count >= capacity:
+                self.flush()
+
+    def flush(self):
+        """
+        Write the ensembles in the buffer to the output.
+        :return:
+        :rtype:
+        """
+        if not self.buffer or self.buffer_count == 0:
+            return
+
+        start = self.ens_index
+        end = start + self.buffer_count
+        self._write_buffer(start, end, {var_name: values[:self.buffer_count]
+                                        for var_name, values in self.buffer.items()})
+
+        self.ens_index = end
+        self.buffer_count = 0
+        self.instrumentation.count(COUNTER_FLUSHES)
+
+    def _start(self, batch: EnsembleBatch):
+        """
+        Create the output using the first batch and create the write buffer.
+        :param batch: First batch.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        raise NotImplementedError()
+
+    def _write_buffer(self, start: int, end: int, columns: dict):
+        """
+        Write the ensembles in the buffer to the output.
+        :param start: Index of the first ensemble in the output.
+        :type start: int
+        :param end: Index after the last ensemble.
+        :type end: int
+        :param columns: Variable name and the values of the ensembles.
+        :type columns: dict
+        :return:
+        :rtype:
+        """
+        raise NotImplementedError()
+
+    def _set_time_ref(self, batch: EnsembleBatch) -> datetime.datetime:
+        """
+        Use the first ensemble time as the time reference.
+        :param batch: First batch.
+        :type batch: EnsembleBatch
+        :return: Time reference.
+        :rtype: datetime.datetime
+        """
+        first_datetime = batch.first_datetime()
+        if first_datetime is None:
+            first_datetime = DEFAULT_TIME_REF
+        self.time_ref = np.datetime64(first_datetime, "us")
+        return first_datetime
+
+    def _create_buffer(self, batch: EnsembleBatch, has_ancillary: bool):
+        """
+        Create the write buffer for each variable written for each ensemble.
+        :param batch: First batch.
+        :type batch: EnsembleBatch
+        :param has_ancillary: TRUE if the ancillary variables are written.
+        :type has_ancillary: bool
+        :return:
+        :rtype:
+        """
+        size = self.profile.buffer_size()
+        if self.memory_budget is not None:
+            # Bytes of an ensemble in the buffer
+            ensemble_bytes = np.dtype(np.int32).itemsize + np.dtype(np.float64).itemsize
+            for values in batch.bin_beam.values():
+                ensemble_bytes += batch.num_bins * batch.num_beams * values.dtype.itemsize
+            if has_ancillary:
+                ensemble_bytes += len(ANCILLARY_FIELDS) * np.dtype(np.float32).itemsize
+
+            size = self.memory_budget.buffer_size(ensemble_bytes, self.profile.time_chunk, size)
+
+        self.buffer = {
+            "ens_num": np.zeros(size, dtype=np.int32),
+            "time": np.zeros(size, dtype=np.float64),
+        }
+        for var_name, values in batch.bin_beam.items():
+            self.buffer[var_name] = np.zeros((size, batch.num_bins, batch.num_beams), dtype=values.dtype)
+        if has_ancillary:
+            for field in ANCILLARY_FIELDS:
+                self.buffer[field] = np.zeros(size, dtype=np.float32)
+
+    def abort(self):
+        """
+        Close the output without writing the buffer.  This is used when
+        the export fails and the output will be removed.
+        :return:
+        :rtype:
+        """
+        self.buffer_count = 0
+        self.close()
+
+    def close(self, analyze_result: dict = None, resume_offset: int = None, source_hash: str = None):
+        """
+        Write the buffer and close the output.  The analyze results are only known
+        after all the ensembles are written, so they are added to the output now.
+        The resume offset is only stored by the formats that can be appended to.
+        :param analyze_result: Analyze results to store in the output.
+        :type analyze_result: dict
+        :param resume_offset: Byte offset in the RTB file after the last ensemble written.
+        :type resume_offset: int
+        :param source_hash: Hash of the start of the RTB file to check it is the same file when appending.
+        :type source_hash: str
+        :return:
+        :rtype:
+        """
+        raise NotImplementedError()
+
+    def remove(self):
+        """
+        Remove the output.  This is used when the export fails or is cancelled.
+        :return:
+        :rtype:
+        """
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+
+class MultiWriter:
+    """
+    Write each batch to many writers, so all the output formats are
+    produced from a single pass over the RTB file.  Each writer has its
+    own write buffer.
+    """
+
+    def __init__(self, writers: list):
+        """
+        Initialize the writer.
+        :param writers: Writer of each output format.
+        :type writers: list
+        """
+        self.writers = writers
+
+    def write_batch(self, batch: EnsembleBatch):
+        for writer in self.writers:
+            writer.write_batch(batch)
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
+
+    def close(self, analyze_result: dict = None, resume_offset: int = None, source_hash: str = None):
+        for writer in self.writers:
+            writer.close(analyze_result, resume_offset, source_hash)
+
+    def remove(self):
+        for writer in self.writers:
+            writer.remove()
+
+
+def create_writer(output_path: str, formats: list = None, profile: ExportProfile = None,
+                  memory_budget: MemoryBudget = None, instrumentation: Instrumentation = NULL_INSTRUMENTATION):
+    """
+    Create the writer of the output formats.  If there is more than one format,
+    the memory budget is shared by the writers.
+    :param output_path: netCDF file path.  The other formats use the same path with their extension.
+    :type output_path: str
+    :param formats: Output formats in OUTPUT_FORMATS.  If None, only netCDF.
+    :type formats: list
+    :param profile: Chunk shape, compression and write buffer settings.
+    :type profile: ExportProfile
+    :param memory_budget: Memory budget of the export.  If None, the memory is not limited.
+    :type memory_budget: MemoryBudget
+    :param instrumentation: Records the write time, the records written and the buffer writes.
+    :type instrumentation: Instrumentation
+    :return: Writer of the format, or a MultiWriter if there is more than one format.
+    :rtype: BatchWriter
+    """
+    formats = list(formats) if formats else list(DEFAULT_FORMATS)
+    if memory_budget is not None and len(formats) > 1:
+        memory_budget = memory_budget.share(len(formats))
+
+    writers = []
+    for output_format in formats:
+        file_path = format_output_path(output_path, output_format)
+        if output_format == FORMAT_NETCDF:
+            from .netcdf_writer import NetcdfWriter
+            writers.append(NetcdfWriter(output_path, profile, memory_budget=memory_budget,
+                                        instrumentation=instrumentation))
+        elif output_format == FORMAT_ZARR:
+            from .zarr_writer import ZarrWriter
+            writers.append(ZarrWriter(file_path, profile, memory_budget, instrumentation))
+        elif output_format == FORMAT_PARQUET:
+            from .parquet_writer import ParquetWriter
+            writers.append(ParquetWriter(file_path, profile, memory_budget, instrumentation))
+        else:
+            raise ValueError("Unknown output format " + output_format)
+
+    if len(writers) == 1:
+        return writers[0]
+    return MultiWriter(writers)
@@ -0,0 +1,365 @@
+import os
+import sys
+import struct
+import bisect
+import logging
+import datetime
+from array import array
+import numpy as np
+
+
+# Extension added to the RTB file path for the index file
+INDEX_EXTENSION = ".ensidx"
+
+# Identify the index file and version
+INDEX_MAGIC = b"RTBIDX01"
+
+# Index header: file size, file modified time in nanoseconds, number of ensembles
+INDEX_HEADER_STRUCT = struct.Struct("<qqq")
+
+# Time used when the ensemble has no valid date and time
+NO_TIME = float("nan")
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def datetime_to_timestamp(ens_datetime: datetime.datetime) -> float:
+    """
+    Convert the ensemble date and time to seconds since 1970.
+    The ensemble time has no time zone, so it is not converted.
+    :param ens_datetime: Ensemble date and time.
+    :type ens_datetime: datetime.datetime
+    :return: Seconds since 1970.  NaN if no date and time is given.
+    :rtype: float
+    """
+    if ens_datetime is None:
+        return NO_TIME
+    return (ens_datetime - EPOCH).total_seconds()
+
+
+def index_path(file_path: str) -> str:
+    """
+    Get the index file path for the RTB file.
+    :param file_path: RTB file path.
+    :type file_path: str
+    :return: Index file path.
+    :rtype: str
+    """
+    return file_path + INDEX_EXTENSION
+
+
+class EnsembleIndex:
+    """
+    Index of the ensembles in an RTB file.  For each ensemble the byte offset,
+    length, ensemble number, time and number of beams are stored in arrays.
+    The index is used to seek directly to an ensemble or time in the file
+    instead of reading the file from the start.
+
+    A record is an ensemble or a 4 beam ensemble paired with the vertical beam
+    ensemble that follows it.  This matches the ensembles exported to netCDF.
+    """
+
+    def __init__(self, file_size: int = 0, file_mtime_ns: int = 0):
+        """
+        Initialize the index.
+        :param file_size: Size of the RTB file when the index was created.
+        :type file_size: int
+        :param file_mtime_ns: Modified time of the RTB file when the index was created.
+        :type file_mtime_ns: int
+        """
+        self.file_size = file_size
+        self.file_mtime_ns = file_mtime_ns
+
+        self.offsets = array('q')
+        self.lengths = array('I')
+        self.ens_nums = array('I')
+        self.timestamps = array('d')
+        self.num_beams = array('B')
+
+        # Index of the ensemble starting each record
+        self._record_starts = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, offset: int, length: int, ens_num: int, ens_datetime: datetime.datetime, num_beams: int):
+        """
+        Add an ensemble to the index.
+        :param offset: Byte offset of the ensemble in the file.
+        :type offset: int
+        :param length: Length of the ensemble in bytes.
+        :type length: int
+        :param ens_num: Ensemble number.
+        :type ens_num: int
+        :param ens_datetime: Ensemble date and time.
+        :type ens_datetime: datetime.datetime
+        :param num_beams: Number of beams in the ensemble.
+        :type num_beams: int
+        :return:
+        :rtype:
+        """
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.ens_nums.append(ens_num)
+        self.timestamps.append(datetime_to_timestamp(ens_datetime))
+        self.num_beams.append(min(max(num_beams, 0), 255))
+        self._record_starts = None
+
+    def extend(self, offsets, lengths, ens_nums, timestamps, num_beams):
+        """
+        Add many ensembles to the index.  This is used to add a batch
+        of ensembles without Python work for each ensemble.
+        :param offsets: Byte offset of each ensemble in the file.
+        :type offsets: np.ndarray
+        :param lengths: Length of each ensemble in bytes.
+        :type lengths: np.ndarray
+        :param ens_nums: Ensemble number of each ensemble.
+        :type ens_nums: np.ndarray
+        :param timestamps: Seconds since 1970 of each ensemble.  NaN if the ensemble has no date and time.
+        :type timestamps: np.ndarray
+        :param num_beams: Number of beams in each ensemble.
+        :type num_beams: np.ndarray
+        :return:
+        :rtype:
+        """
+        for values, new_values in zip(self._arrays(), (offsets, lengths, ens_nums, timestamps, num_beams)):
+            values.frombytes(new_values.astype(values.typecode).tobytes())
+        self._record_starts = None
+
+    def truncate(self, end_offset: int) -> bool:
+        """
+        Remove the ensembles that end after the byte offset.  This is used to
+        continue the index when data is added to the end of the file.
+        :param end_offset: Byte offset in the file to keep the ensembles before.
+        :type end_offset: int
+        :return: TRUE if the last ensemble kept ends at the byte offset, so the index can be continued from it.
+        :rtype: bool
+        """
+        count = bisect.bisect_right(self.offsets, end_offset)
+        while count > 0 and self.offsets[count - 1] + self.lengths[count - 1] > end_offset:
+            count -= 1
+
+        for values in self._arrays():
+            del values[count:]
+        self._record_starts = None
+
+        return self.ensemble_offset(count) == end_offset
+
+    def is_current(self, file_path: str) -> bool:
+        """
+        Check if the index matches the file.  If the file has changed
+        since the index was created, the index can not be used.
+        :param file_path: RTB file path.
+        :type file_path: str
+        :return: TRUE if the index matches the file.
+        :rtype: bool
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return stat.st_size == self.file_size and stat.st_mtime_ns == self.file_mtime_ns
+
+    def save(self, path: str):
+        """
+        Save the index to a file.
+        :param path: Index file path.
+        :type path: str
+        :return:
+        :rtype:
+        """
+        with open(path, "wb") as file:
+            file.write(INDEX_MAGIC)
+            file.write(INDEX_HEADER_STRUCT.pack(self.file_size, self.file_mtime_ns, len(self)))
+            for values in self._arrays():
+                if sys.byteorder == "big":
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(file)
+
+    @staticmethod
+    def load(path: str):
+        """
+        Load the index from a file.
+        :param path: Index file path.
+        :type path: str
+        :return: Index or None if the file is not a valid index.
+        :rtype: EnsembleIndex
+        """
+        try:
+            with open(path, "rb") as file:
+                if file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return None
+                file_size, file_mtime_ns, count = INDEX_HEADER_STRUCT.unpack(file.read(INDEX_HEADER_STRUCT.size))
+
+                index = EnsembleIndex(file_size, file_mtime_ns)
+                for values in index._arrays():
+                    values.fromfile(file, count)
+                    if sys.byteorder == "big":
+                        values.byteswap()
+                return index
+        except (OSError, EOFError, struct.error) as ex:
+            logging.debug("Could not load the ensemble index " + path + ": " + str(ex))
+            return None
+
+    @staticmethod
+    def load_for_file(file_path: str):
+        """
+        Load the index for the RTB file if the index exists and matches the file.
+        :param file_path: RTB file path.
+        :type file_path: str
+        :return: Index or None if no current index exists.
+        :rtype: EnsembleIndex
+        """
+        index = EnsembleIndex.load(index_path(file_path))
+        if index is not None and index.is_current(file_path):
+            return index
+        return None
+
+    def _arrays(self) -> tuple:
+        """
+        Get all the arrays in the order they are saved.
+        :return: All the arrays.
+        :rtype: tuple
+        """
+        return self.offsets, self.lengths, self.ens_nums, self.timestamps, self.num_beams
+
+    def record_starts(self) -> np.ndarray:
+        """
+        Get the index of the ensemble that starts each record.  A vertical beam
+        ensemble following a 4 beam ensemble is part of the 4 beam record.
+        :return: Index of the first ensemble in each record.
+        :rtype: np.ndarray
+        """
+        if self._record_starts is None:
+            num_beams = np.frombuffer(self.num_beams, dtype=np.uint8)
+
+            # Vertical beam paired with the previous 4 beam ensemble
+            paired = np.zeros(len(num_beams), dtype=bool)
+            paired[1:] = (num_beams[1:] == 1) & (num_beams[:-1] == 4)
+            self._record_starts = np.flatnonzero(~paired)
+        return self._record_starts
+
+    def max_record_beams(self) -> int:
+        """
+        Get the most beams in a record of the file.  A 4 beam ensemble and its
+        vertical beam are a record of 5 beams.
+        :return: Number of beams.  0 if there are no ensembles.
+        :rtype: int
+        """
+        if len(self) == 0:
+            return 0
+        num_beams = np.frombuffer(self.num_beams, dtype=np.uint8).astype(np.int64)
+        return int(np.add.reduceat(num_beams, self.record_starts()).max())
+
+    def ensemble_offset(self, ens_index: int) -> int:
+        """
+        Get the byte offset of the ensemble.  If the index is past the
+        last ensemble, the end of the last ensemble is given.
+        :param ens_index: Index of the ensemble.
+        :type ens_index: int
+        :return: Byte offset in the file.
+        :rtype: int
+        """
+        if ens_index >= len(self):
+            if len(self) == 0:
+                return 0
+            return self.offsets[-1] + self.lengths[-1]
+        return self.offsets[ens_index]
+
+    def record_offsets(self, start_record: int, stop_record: int) -> tuple:
+        """
+        Get the byte range of the records.
+        :param start_record: First record to include.
+        :type start_record: int
+        :param stop_record: Record to stop at.  This record is not included.
+        :type stop_record: int
+        :return: Start and end byte offset.
+        :rtype: tuple
+        """
+        starts = self.record_starts()
+        start_record = max(0, start_record)
+        start_ens = starts[start_record] if start_record < len(starts) else len(self)
+        stop_ens = starts[stop_record] if 0 <= stop_record < len(starts) else len(self)
+        return self.ensemble_offset(start_ens), self.ensemble_offset(max(start_ens, stop_ens))
+
+    def record_ranges(self, start_record: int, stop_record: int, step: int = 1) -> list:
+        """
+        Get the byte range of every step record.  Each range covers the ensembles
+        of a single record, so the records can be read without reading or searching
+        the bytes between them.
+        :param start_record: First record to include.
+        :type start_record: int
+        :param stop_record: Record to stop at.  This record is not included.
+        :type stop_record: int
+        :param step: Include every step record, starting with the first record.
+        :type step: int
+        :return: Start and end byte offset of each record included.
+        :rtype: list
+        """
+        starts = self.record_starts()
+        ranges = []
+        for record in range(max(0, start_record), min(stop_record, len(starts)), max(1, step)):
+            # Last ensemble of the record
+            last_ens = (starts[record + 1] if record + 1 < len(starts) else len(self)) - 1
+            ranges.append((self.offsets[starts[record]], self.offsets[last_ens] + self.lengths[last_ens]))
+        return ranges
+
+    def time_records(self, start_time: datetime.datetime = None, end_time: datetime.datetime = None) -> tuple:
+        """
+        Get the records within the time range.  The ensembles must be in time order.
+        Ensembles without a time are included with the ensembles around them.
+        :param start_time: Include the records at or after this time.  If None, start at the first record.
+        :type start_time: datetime.datetime
+        :param end_time: Include the records at or before this time.  If None, stop at the last record.
+        :type end_time: datetime.datetime
+        :return: First record and the record to stop at.
+        :rtype: tuple
+        """
+        starts = self.record_starts()
+        record_times = _RecordTimes(self.timestamps, starts)
+
+        start_record = 0
+        if start_time is not None:
+            start_record = bisect.bisect_left(record_times, datetime_to_timestamp(start_time))
+
+        stop_record = len(starts)
+        if end_time is not None:
+            stop_record = bisect.bisect_right(record_times, datetime_to_timestamp(end_time))
+
+        return start_record, stop_record
+
+    def time_offsets(self, start_time: datetime.datetime = None, end_time: datetime.datetime = None) -> tuple:
+        """
+        Get the byte range of the records within the time range.  See time_records().
+        :param start_time: Include the records at or after this time.  If None, start at the first record.
+        :type start_time: datetime.datetime
+        :param end_time: Include the records at or before this time.  If None, stop at the last record.
+        :type end_time: datetime.datetime
+        :return: Start and end byte offset.
+        :rtype: tuple
+        """
+        return self.record_offsets(*self.time_records(start_time, end_time))
+
+
+class _RecordTimes:
+    """
+    Sequence of the time of each record used to search the records by time.
+    An ensemble without a time uses the time of the ensemble before it.
+    """
+
+    def __init__(self, timestamps: array, starts: np.ndarray):
+        self.timestamps = timestamps
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, record: int) -> float:
+        ens_index = self.starts[record]
+        while ens_index > 0 and self.timestamps[ens_index] != self.timestamps[ens_index]:
+            ens_index -= 1
+        timestamp = self.timestamps[ens_index]
+        if timestamp != timestamp:
+            return float("-inf")
+        return timestamp
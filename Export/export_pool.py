@@ -0,0 +1,234 @@
+import os
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from . import file_export
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION, DEFAULT_PROFILER, profile_call, \
+    profile_dump_path
+from .job_control import JobControl, JobCancelled, NULL_JOB_CONTROL
+from .output_formats import is_netcdf_only
+from .progress import drain_progress
+
+
+# Time in seconds to wait for progress before checking if the files are complete
+PROGRESS_POLL_TIMEOUT = 0.1
+
+
+def default_worker_count() -> int:
+    """
+    Get the default number of worker processes.  This is the number of CPU cores.
+    :return: Number of workers.
+    :rtype: int
+    """
+    return os.cpu_count() or 1
+
+
+def export_file_summary(file_result: dict, ensemble_progress_callback, export_options: dict,
+                        job_control: JobControl = NULL_JOB_CONTROL) -> dict:
+    """
+    Export a file and create the summary of the export.  Any error is
+    logged and given in the summary.
+
+    The export options instrument, profile_dir and profiler are used here
+    and not passed to file_export.export_file().  If instrument is set, the
+    time of each stage and the counters are given in Instrumentation.  If a
+    profile folder is given, the call profile of the export is written to it.
+
+    If the job is cancelled, the Status is cancelled and the partial netCDF
+    file is removed.
+    :param file_result: Analyze results for the file.
+    :type file_result: dict
+    :param ensemble_progress_callback: Optional callback with the number of ensembles exported so far.
+    :type ensemble_progress_callback: function(ens_exported)
+    :param export_options: Options passed to file_export.export_file().
+    :type export_options: dict
+    :param job_control: Cancel or pause the export.
+    :type job_control: JobControl
+    :return: Summary of the export.  The analyze results are in Result.
+    :rtype: dict
+    """
+    summary = {"FilePath": file_result.get("FilePath"), "Status": "ok", "Error": None}
+
+    export_options = dict(export_options)
+    instrument = export_options.pop("instrument", False)
+    profile_dir = export_options.pop("profile_dir", None)
+    profiler = export_options.pop("profiler", DEFAULT_PROFILER)
+    instrumentation = Instrumentation() if instrument else NULL_INSTRUMENTATION
+
+    def export():
+        return file_export.export_file(file_result, ensemble_progress_callback, instrumentation=instrumentation,
+                                       job_control=job_control, **export_options)
+
+    start_time = time.perf_counter()
+    try:
+        if profile_dir:
+            summary["Result"] = profile_call(export, profile_dump_path(profile_dir, summary["FilePath"], "export"),
+                                             profiler)
+        else:
+            summary["Result"] = export()
+    except JobCancelled:
+        logging.info("Cancelled exporting file " + str(summary["FilePath"]))
+        summary["Status"] = "cancelled"
+    except Exception as ex:
+        logging.exception("Error exporting file " + str(summary["FilePath"]))
+        summary["Status"] = "failed"
+        summary["Error"] = str(ex)
+    summary["ExportSeconds"] = time.perf_counter() - start_time
+
+    if instrument:
+        summary["Instrumentation"] = instrumentation.result()
+
+    return summary
+
+
+def _export_file_worker(file_index: int, file_result: dict, progress_queue, export_options: dict) -> dict:
+    """
+    Export a file within a worker process.  The number of ensembles exported
+    is sent to the main process through the progress queue.  The export
+    limits how often the progress is sent, so the queue is not flooded.
+    :param file_index: Index of the file in the list of files to export.
+    :type file_index: int
+    :param file_result: Analyze results for the file.
+    :type file_result: dict
+    :param progress_queue: Queue to send the progress to the main process.
+    :type progress_queue: multiprocessing.Queue
+    :param export_options: Options passed to file_export.export_file().
+    :type export_options: dict
+    :return: Summary of the export.  The analyze results are in Result.
+    :rtype: dict
+    """
+    # Only send the progress if someone is listening
+    ensemble_progress_callback = None
+    if progress_queue is not None:
+        def ensemble_progress_callback(ens_exported):
+            progress_queue.put((file_index, ens_exported))
+
+    return export_file_summary(file_result, ensemble_progress_callback, export_options)
+
+
+class ExportPool:
+    """
+    Export multiple files at the same time using a pool of processes.
+    Decoding the files is CPU bound, so each file is exported in its
+    own process.  The progress and the results are passed back to the
+    main process through the callbacks.
+
+    If the split_workers export option is more than 1, each file is split
+    across the worker processes instead.  The files are then exported one
+    at a time, so the processes are not nested.
+    """
+
+    def __init__(self, workers: int = None, export_options: dict = None):
+        """
+        Initialize the pool.
+        :param workers: Number of worker processes.  If None, the number of CPU cores is used.
+        :type workers: int
+        :param export_options: Options passed to file_export.export_file() for each file, such as
+                               single_pass, ens_range, time_range and split_workers.
+        :type export_options: dict
+        """
+        if workers is None or workers <= 0:
+            workers = default_worker_count()
+        self.workers = workers
+        self.export_options = export_options if export_options else {}
+
+    def export(self, file_results: list, ensemble_progress_callback=None, file_complete_callback=None) -> list:
+        """
+        Export all the files.  This will block until all the files are exported.
+        The callbacks are called from the thread calling this method.
+        :param file_results: List of analyze results for each file.
+        :type file_results: list
+        :param ensemble_progress_callback: Called with the file index and the number of ensembles exported in the file
+                                           so far.  This is called at most once per file for each poll of the workers.
+        :type ensemble_progress_callback: function(file_index, ens_exported)
+        :param file_complete_callback: Called with the file index and the export summary when a file is complete.
+        :type file_complete_callback: function(file_index, summary)
+        :return: List of export summaries in the same order as the file results.
+        :rtype: list
+        """
+        summaries = [None] * len(file_results)
+        if not file_results:
+            return summaries
+
+        # The subsystem groups and the formats other than netCDF are not split
+        if self.export_options.get("split_workers", 0) > 1 and not self.export_options.get("groups", False) and \
+                is_netcdf_only(self.export_options.get("formats")):
+            return self._export_split(file_results, ensemble_progress_callback, file_complete_callback)
+
+        with multiprocessing.Manager() as manager:
+            # Only pass the progress if someone is listening
+            progress_queue = manager.Queue() if ensemble_progress_callback else None
+
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(file_results))) as executor:
+                # Start all the files, the executor will limit the number running at once
+                futures = {}
+                for file_index, file_result in enumerate(file_results):
+                    future = executor.submit(_export_file_worker, file_index, file_result, progress_queue, self.export_options)
+                    futures[future] = file_index
+
+                pending = set(futures.keys())
+                while pending:
+                    # Pass on the progress from the workers
+                    self._dispatch_progress(progress_queue, ensemble_progress_callback)
+
+                    done, pending = wait(pending, timeout=PROGRESS_POLL_TIMEOUT, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file_index = futures[future]
+                        try:
+                            summary = future.result()
+                        except Exception as ex:
+                            # The worker process failed
+                            logging.error("Error exporting file " + str(file_results[file_index].get("FilePath")))
+                            summary = {"FilePath": file_results[file_index].get("FilePath"),
+                                       "Status": "failed",
+                                       "Error": str(ex)}
+                        summaries[file_index] = summary
+
+                        # Send the last progress for the file before it is complete
+                        self._dispatch_progress(progress_queue, ensemble_progress_callback)
+                        if file_complete_callback:
+                            file_complete_callback(file_index, summary)
+
+        return summaries
+
+    def _export_split(self, file_results: list, ensemble_progress_callback=None, file_complete_callback=None) -> list:
+        """
+        Export the files one at a time, each file split across the worker processes.
+        :param file_results: List of analyze results for each file.
+        :type file_results: list
+        :param ensemble_progress_callback: Called with the file index and the number of ensembles exported in the file.
+        :type ensemble_progress_callback: function(file_index, ens_exported)
+        :param file_complete_callback: Called with the file index and the export summary when a file is complete.
+        :type file_complete_callback: function(file_index, summary)
+        :return: List of export summaries in the same order as the file results.
+        :rtype: list
+        """
+        summaries = []
+        for file_index, file_result in enumerate(file_results):
+            file_progress_callback = None
+            if ensemble_progress_callback:
+                def file_progress_callback(ens_exported, file_index=file_index):
+                    ensemble_progress_callback(file_index, ens_exported)
+
+            summary = export_file_summary(file_result, file_progress_callback, self.export_options)
+            summaries.append(summary)
+            if file_complete_callback:
+                file_complete_callback(file_index, summary)
+
+        return summaries
+
+    @staticmethod
+    def _dispatch_progress(progress_queue, ensemble_progress_callback):
+        """
+        Pass the progress in the queue to the callback.  The counts are
+        cumulative, so only the latest count for each file is passed on.
+        :param progress_queue: Queue with the progress from the workers.
+        :type progress_queue: multiprocessing.Queue
+        :param ensemble_progress_callback: Callback to receive the progress.
+        :type ensemble_progress_callback: function(file_index, ens_exported)
+        :return:
+        :rtype:
+        """
+        for file_index, ens_exported in drain_progress(progress_queue).items():
+            ensemble_progress_callback(file_index, ens_exported)
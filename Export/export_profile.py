@@ -0,0 +1,137 @@
+# Default number of ensembles in a chunk along the time dimension
+DEFAULT_TIME_CHUNK = 256
+
+# Default number of ensembles held in memory before they are written to the file
+DEFAULT_WRITE_BUFFER = 1024
+
+
+class ExportProfile:
+    """
+    HDF5 storage settings used when writing the netCDF file.
+
+    The chunk shape sets how the values are grouped on disk.  A chunk is always
+    read and decompressed as a whole, so the chunk shape should match how the file
+    will be read.  Reading a few profiles (all the bins and beams at a time) is fastest
+    with short time chunks that contain all the bins and beams.  Reading a long time series
+    of a single bin is fastest with long time chunks that contain a single bin.
+
+    The ensembles are held in a write buffer and written to the file in large blocks.
+    The write buffer is rounded up to a multiple of the time chunk, so each chunk is
+    written and compressed once.
+
+    A memory budget limits the resident memory of the export process.  The write
+    buffer, decoded batch and chunk cache are made smaller to fit in the budget.
+    See MemoryBudget.
+    """
+
+    def __init__(self, time_chunk: int = DEFAULT_TIME_CHUNK, bin_chunk: int = None, beam_chunk: int = None,
+                 complevel: int = 4, shuffle: bool = True, write_buffer: int = DEFAULT_WRITE_BUFFER,
+                 memory_budget: float = None):
+        """
+        Initialize the profile.
+        :param time_chunk: Number of ensembles in a chunk.
+        :type time_chunk: int
+        :param bin_chunk: Number of bins in a chunk.  If None, all the bins.
+        :type bin_chunk: int
+        :param beam_chunk: Number of beams in a chunk.  If None, all the beams.
+        :type beam_chunk: int
+        :param complevel: zlib compression level 1 to 9.  0 to not compress.
+        :type complevel: int
+        :param shuffle: Use the HDF5 shuffle filter before compressing.
+        :type shuffle: bool
+        :param write_buffer: Number of ensembles to hold in memory before writing to the file.
+        :type write_buffer: int
+        :param memory_budget: Resident memory budget of the export process in megabytes.  If None, not limited.
+        :type memory_budget: float
+        """
+        if time_chunk < 1:
+            raise ValueError("Time chunk must be at least 1")
+        if not 0 <= complevel <= 9:
+            raise ValueError("Compression level must be 0 to 9")
+        if memory_budget is not None and memory_budget <= 0:
+            raise ValueError("Memory budget must be more than 0 MB")
+
+        self.time_chunk = time_chunk
+        self.bin_chunk = bin_chunk
+        self.beam_chunk = beam_chunk
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.write_buffer = max(write_buffer, 1)
+        self.memory_budget = memory_budget
+
+    def with_memory_budget(self, memory_budget: float):
+        """
+        Create a copy of the profile with a memory budget.
+        :param memory_budget: Resident memory budget of the export process in megabytes.
+        :type memory_budget: float
+        :return: Export profile with the memory budget.
+        :rtype: ExportProfile
+        """
+        return ExportProfile(time_chunk=self.time_chunk, bin_chunk=self.bin_chunk, beam_chunk=self.beam_chunk,
+                             complevel=self.complevel, shuffle=self.shuffle, write_buffer=self.write_buffer,
+                             memory_budget=memory_budget)
+
+    def buffer_size(self) -> int:
+        """
+        Get the number of ensembles in the write buffer.  This is
+        rounded up to a multiple of the time chunk.
+        :return: Number of ensembles in the write buffer.
+        :rtype: int
+        """
+        chunks = -(-self.write_buffer // self.time_chunk)
+        return chunks * self.time_chunk
+
+    def variable_options(self, num_bins: int = None, num_beams: int = None) -> dict:
+        """
+        Get the options to create a netCDF variable with the time dimension.
+        :param num_bins: Number of bins if the variable has the bin and beam dimensions.
+        :type num_bins: int
+        :param num_beams: Number of beams if the variable has the bin and beam dimensions.
+        :type num_beams: int
+        :return: Keyword arguments for netCDF4.Dataset.createVariable().
+        :rtype: dict
+        """
+        if num_bins is None:
+            chunk_sizes = [self.time_chunk]
+        else:
+            chunk_sizes = [self.time_chunk,
+                           min(self.bin_chunk, num_bins) if self.bin_chunk else num_bins,
+                           min(self.beam_chunk, num_beams) if self.beam_chunk else num_beams]
+
+        return {
+            "zlib": self.complevel > 0,
+            "complevel": max(self.complevel, 1),
+            "shuffle": self.shuffle and self.complevel > 0,
+            "chunksizes": chunk_sizes,
+        }
+
+
+# Profiles that can be selected by name
+EXPORT_PROFILES = {
+    # Balanced size and speed.  Good for reading profiles (time slices).
+    "default": ExportProfile(),
+
+    # No compression.  Fastest to write, largest file.
+    "fast": ExportProfile(time_chunk=512, complevel=0, shuffle=False),
+
+    # Highest compression.  Smallest file, slowest to write.
+    "archive": ExportProfile(time_chunk=512, complevel=9),
+
+    # Long time chunks of a single bin.  Good for reading the time series of a bin.
+    "timeseries": ExportProfile(time_chunk=2048, bin_chunk=1, write_buffer=2048),
+}
+
+DEFAULT_PROFILE_NAME = "default"
+
+
+def get_profile(name: str) -> ExportProfile:
+    """
+    Get the export profile by name.
+    :param name: Name of the profile in EXPORT_PROFILES.
+    :type name: str
+    :return: Export profile.
+    :rtype: ExportProfile
+    """
+    if name not in EXPORT_PROFILES:
+        raise ValueError("Unknown export profile " + name + ".  Use one of " + ", ".join(EXPORT_PROFILES))
+    return EXPORT_PROFILES[name]
@@ -0,0 +1,532 @@
+import glob
+import logging
+import os
+from .export_profile import ExportProfile
+from .progress import ProgressReporter
+from .analyze_cache import AnalyzeCache, file_fingerprint
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION, STAGE_RTI_NETCDF, COUNTER_CACHE_HITS
+from .job_control import JobControl, JobCancelled, NULL_JOB_CONTROL
+from .output_formats import is_netcdf_only
+
+# The analyze and export modules import numpy, netCDF4 and rti_python, which are slow
+# to import.  They are imported when a file is analyzed or exported, so the user
+# interface and command line start without them.
+
+
+# File extensions of the RTB binary files
+RTB_FILE_EXTENSIONS = (".ens", ".bin")
+
+
+def find_files(paths: list, recursive: bool = False) -> list:
+    """
+    Find all the RTB files given a list of files, directories or glob patterns.
+    A directory will be searched for all the files with an RTB file extension.
+    The order of the paths is kept and any duplicate files are removed.
+    :param paths: List of file paths, directories or glob patterns.
+    :type paths: list
+    :param recursive: Search the directories and glob patterns recursively.
+    :type recursive: bool
+    :return: List of file paths found.
+    :rtype: list
+    """
+    found_files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            # Search the directory for all the RTB files
+            for ext in RTB_FILE_EXTENSIONS:
+                if recursive:
+                    pattern = os.path.join(path, "**", "*" + ext)
+                else:
+                    pattern = os.path.join(path, "*" + ext)
+                found_files.extend(sorted(glob.glob(pattern, recursive=recursive)))
+        elif os.path.isfile(path):
+            found_files.append(path)
+        else:
+            # Treat the path as a glob pattern
+            found_files.extend(sorted(glob.glob(path, recursive=recursive)))
+
+    # Remove any duplicates but keep the order
+    unique_files = []
+    seen = set()
+    for file_path in found_files:
+        abs_path = os.path.abspath(file_path)
+        if abs_path not in seen and os.path.isfile(abs_path):
+            seen.add(abs_path)
+            unique_files.append(abs_path)
+
+    return unique_files
+
+
+def analyze_file(file_path: str, file_progress_handler=None, cache: AnalyzeCache = None,
+                 incremental: bool = False, instrumentation: Instrumentation = NULL_INSTRUMENTATION) -> dict:
+    """
+    Analyze the file.  This will check for the number of ensembles
+    and the start and stop date and time.  It will also get the
+    delta time between ensembles.
+
+    An index of the byte offset of each ensemble is saved next
+    to the file, so the export can seek to an ensemble or time.
+
+    If a cache is given and the file has not changed since it was
+    last analyzed, the results are taken from the cache.
+
+    If incremental is used and the file was exported before, only the data
+    after the last ensemble exported is read.  The results are for the whole
+    file and NewEnsCount and NewEnsPairCount give the ensembles not exported.
+    :param file_path: File path to analyze.
+    :type file_path: str
+    :param file_progress_handler: Optional handler for the file progress event.
+    :type file_progress_handler: function(sender, bytes_read, total_size, file_name)
+    :param cache: Optional cache of the analyze results.
+    :type cache: AnalyzeCache
+    :param incremental: Only read the data added since the file was last exported.
+    :type incremental: bool
+    :param instrumentation: Records the time of each stage and the counters.
+    :type instrumentation: Instrumentation
+    :return: Dictionary containing the results.
+    :rtype: dict
+    """
+    from .rtb_analyze import RtbAnalyzer
+
+    file_progress_callback = None
+    if file_progress_handler:
+        def file_progress_callback(bytes_read, total_size, file_name):
+            file_progress_handler(None, bytes_read, total_size, file_name)
+
+    # Continue from the resume offset stored in the netCDF file
+    if incremental:
+        from .stream_export import find_resume_state
+        resume = find_resume_state(file_path)
+        if resume is not None:
+            logging.debug("Analyze " + file_path + " from byte " + str(resume["ResumeOffset"]))
+            analyzer = RtbAnalyzer(file_path, file_progress_callback=file_progress_callback,
+                                   start_offset=resume["ResumeOffset"], previous_result=resume["Result"],
+                                   instrumentation=instrumentation)
+            return analyzer.analyze()
+
+    # Check the cache for the results
+    # Get the fingerprint before analyzing in case the file changes while analyzing
+    fingerprint = None
+    if cache:
+        fingerprint = file_fingerprint(file_path)
+        result = cache.get(file_path, fingerprint)
+        if result is not None:
+            logging.debug("Analyze results from cache: " + file_path)
+            instrumentation.count(COUNTER_CACHE_HITS)
+            return result
+
+    # Analyze the file and save the ensemble index next to the file
+    analyzer = RtbAnalyzer(file_path, file_progress_callback=file_progress_callback, instrumentation=instrumentation)
+    result = analyzer.analyze()
+
+    if cache:
+        cache.put(file_path, result, fingerprint)
+
+    return result
+
+
+def get_total_ensembles(file_result: dict) -> int:
+    """
+    Get the number of ensembles to export from the analyze results.
+    Use the ensemble pair count if the ensembles are paired, otherwise
+    use the ensemble count.  If the file was analyzed incrementally,
+    only the new ensembles are exported.
+    :param file_result: Analyze results for the file.
+    :type file_result: dict
+    :return: Number of ensembles to export.
+    :rtype: int
+    """
+    if 'NewEnsCount' in file_result:
+        total_ensembles = file_result.get('NewEnsPairCount', 0)
+        if total_ensembles <= 0:
+            total_ensembles = file_result['NewEnsCount']
+        return total_ensembles
+
+    total_ensembles = file_result.get('EnsPairCount', 0)
+    if total_ensembles <= 0:
+        total_ensembles = file_result.get('EnsCount', 0)
+
+    return total_ensembles
+
+
+def export_file(file_result: dict, ensemble_progress_callback=None, single_pass: bool = False,
+                ens_range: list = None, time_range: list = None, profile: ExportProfile = None,
+                split_workers: int = 0, incremental: bool = False,
+                instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+                job_control: JobControl = NULL_JOB_CONTROL, groups: bool = False, formats: list = None,
+                decimate: int = 1, average_interval: float = None) -> dict:
+    """
+    Export the file to netCDF using the results from analyzing the file.
+
+    If single pass is used, the file does not need to be analyzed first.  The
+    file result only needs the FilePath.  The file is read once and the analyze
+    results are collected while the ensembles are exported.
+
+    If an ensemble range or time range is given, the ensemble index is used to
+    seek to the first ensemble in the range, so only the range is read.
+
+    The export profile sets the chunk shape and compression of the netCDF file.
+    It is only used by the single pass and range export, so giving a profile
+    will use the single pass export.
+
+    If split workers is more than 1, a large file is split at the ensembles
+    and each part is decoded in its own process.  This is a single pass export.
+    The decoded parts are memory mapped, so a file is not split if the profile
+    has a memory budget.
+
+    If incremental is used and the netCDF file was exported from this file before,
+    only the ensembles added to the file since are appended to the netCDF file.
+    Otherwise the whole file is exported.  This is a single pass export.  A range
+    export always creates a new file.
+
+    The job control can cancel or pause the export between batches, or between
+    ensembles for the rti_python export.  A cancelled export raises JobCancelled
+    after removing the partial netCDF file.  A cancelled append keeps the
+    ensembles appended so far.
+
+    If groups is used, each subsystem configuration is written to its own
+    netCDF group, so the subsystems of a 7 beam or 8 beam system are not
+    merged.  This is a single pass export that always creates a new file and
+    the file is not split.
+
+    If formats other than netCDF are given, such as Zarr or Parquet, all the
+    formats are written from a single pass over the file.  These files can not
+    be appended to and the file is not split.  The groups are only written to
+    netCDF.
+
+    For a quick look at the file, decimate only exports every Nth ensemble and
+    the average interval averages the ensembles into fixed time intervals.  The
+    ensemble index is used to read only the ensembles decimated.  These are
+    single pass exports that always create a new file and the file is not split.
+    They can not be used with groups.
+    :param file_result: Analyze results for the file.
+    :type file_result: dict
+    :param ensemble_progress_callback: Optional callback with the number of ensembles exported so far.
+                                       The calls are rate limited.
+    :type ensemble_progress_callback: function(ens_exported)
+    :param single_pass: Analyze and export the file in a single pass.
+    :type single_pass: bool
+    :param ens_range: First ensemble and the ensemble to stop at, [start, stop].
+    :type ens_range: list
+    :param time_range: Start and end date and time, [start, end].  None for either to not limit it.
+    :type time_range: list
+    :param profile: Chunk shape, compression and write buffer of the netCDF file.
+    :type profile: ExportProfile
+    :param split_workers: Number of processes to split a large file across.  0 or 1 to not split the file.
+    :type split_workers: int
+    :param incremental: Append the ensembles added since the last export to the netCDF file.
+    :type incremental: bool
+    :param instrumentation: Records the time of each stage and the counters.
+    :type instrumentation: Instrumentation
+    :param job_control: Cancel or pause the export.
+    :type job_control: JobControl
+    :param groups: Write each subsystem configuration to its own netCDF group.
+    :type groups: bool
+    :param formats: Output formats in OUTPUT_FORMATS.  If None, only netCDF.
+    :type formats: list
+    :param decimate: Only export every decimate ensemble.  1 to export all the ensembles.
+    :type decimate: int
+    :param average_interval: Average the ensembles into intervals of this many seconds.  None to not average.
+    :type average_interval: float
+    :return: Analyze results for the file.  Groups gives the analyze results of each group.
+    :rtype: dict
+    """
+    from .stream_export import find_resume_state
+
+    if ens_range is not None or time_range is not None or (decimate and decimate > 1):
+        return export_file_range(file_result["FilePath"], ens_range, time_range,
+                                 ensemble_progress_callback=ensemble_progress_callback,
+                                 profile=profile, instrumentation=instrumentation, job_control=job_control,
+                                 groups=groups, formats=formats, decimate=decimate,
+                                 average_interval=average_interval)
+
+    # The whole file is averaged in a single pass, so the index is not needed
+    if average_interval:
+        if groups:
+            raise ValueError("The subsystem groups can not be averaged")
+        return analyze_export_file(file_result["FilePath"], ensemble_progress_callback=ensemble_progress_callback,
+                                   profile=profile, instrumentation=instrumentation, job_control=job_control,
+                                   formats=formats, average_interval=average_interval)
+
+    # The groups are written in a single pass and can not be appended to or split
+    if groups:
+        return analyze_export_file(file_result["FilePath"], ensemble_progress_callback=ensemble_progress_callback,
+                                   profile=profile, instrumentation=instrumentation, job_control=job_control,
+                                   groups=True)
+
+    # Only the netCDF file can be appended to or split
+    netcdf_only = is_netcdf_only(formats)
+
+    # Only the new ensembles are read, so they are appended in a single process
+    if incremental and netcdf_only and find_resume_state(file_result["FilePath"]) is not None:
+        return analyze_export_file(file_result["FilePath"], ensemble_progress_callback=ensemble_progress_callback,
+                                   profile=profile, append=True, instrumentation=instrumentation,
+                                   job_control=job_control)
+
+    if split_workers and split_workers > 1 and netcdf_only and not (profile and profile.memory_budget):
+        from .parallel_export import ParallelExporter
+        exporter = ParallelExporter(file_result["FilePath"], workers=split_workers,
+                                    ensemble_progress_callback=ensemble_progress_callback,
+                                    profile=profile, instrumentation=instrumentation, job_control=job_control)
+        return exporter.export()
+
+    # The resume state is only stored by the single pass export
+    if single_pass or profile is not None or incremental or not netcdf_only:
+        return analyze_export_file(file_result["FilePath"], ensemble_progress_callback=ensemble_progress_callback,
+                                   profile=profile, instrumentation=instrumentation, job_control=job_control,
+                                   formats=formats)
+
+    logging.debug("Starting Export netCDF: " + file_result["FilePath"])
+    from rti_python.Writer.rti_netcdf import RtiNetcdf
+    net_cdf = RtiNetcdf()
+
+    # File Path
+    file_path = file_result["FilePath"]
+
+    # Ensure a value is given for the number of ensembles
+    total_ensembles = get_total_ensembles(file_result)
+
+    # The event is sent for each ensemble, so limit the progress reported.
+    # The job is also cancelled or paused within the event.
+    progress = ProgressReporter(ensemble_progress_callback, total_ensembles)
+    if progress.enabled or job_control.enabled:
+        def ensemble_progress_handler(sender, ens):
+            job_control.check()
+            if progress.enabled:
+                progress.add()
+        net_cdf.ensemble_progress_event += ensemble_progress_handler
+
+    logging.debug("Exporting " + str(total_ensembles) + " to netCDF")
+
+    # Start and stop ensemble
+    ens_to_process = [0, total_ensembles]
+
+    # Time between ensembles
+    ens_delta = file_result['EnsembleDeltaTime']
+
+    # Start exporting the data
+    try:
+        with instrumentation.stage(STAGE_RTI_NETCDF):
+            net_cdf.export(file_path, ens_to_process, ens_delta)
+    except JobCancelled:
+        # rti_python writes the netCDF file next to the RTB file
+        nc_file_path = os.path.splitext(file_path)[0] + ".nc"
+        if os.path.exists(nc_file_path):
+            os.remove(nc_file_path)
+        logging.debug("Exporting netCDF Cancelled: " + file_path)
+        raise
+    progress.finish()
+
+    logging.debug("Exporting netCDF Complete: " + file_result["FilePath"])
+
+    return file_result
+
+
+def export_file_range(file_path: str, ens_range: list = None, time_range: list = None, output_path: str = None,
+                      ensemble_progress_callback=None, profile: ExportProfile = None,
+                      instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+                      job_control: JobControl = NULL_JOB_CONTROL, groups: bool = False,
+                      formats: list = None, decimate: int = 1, average_interval: float = None) -> dict:
+    """
+    Export a range of the file.  The ensemble index is used to find the byte
+    offset of the range, so only the ensembles in the range are read.  If the
+    index does not exist or the file has changed, the file is analyzed first
+    to create the index.
+
+    If decimate is more than 1, the index gives the byte range of every Nth
+    record, so the ensembles skipped are not read or decoded.  If an average
+    interval is given, the ensembles in the range are averaged into fixed time
+    intervals.  Neither can be used with groups.
+    :param file_path: File path to export.
+    :type file_path: str
+    :param ens_range: First ensemble and the ensemble to stop at, [start, stop].
+    :type ens_range: list
+    :param time_range: Start and end date and time, [start, end].  None for either to not limit it.
+    :type time_range: list
+    :param output_path: netCDF file path.  If None, the file path with the .nc extension.
+    :type output_path: str
+    :param ensemble_progress_callback: Optional callback with the number of ensembles exported so far.
+    :type ensemble_progress_callback: function(ens_exported)
+    :param profile: Chunk shape, compression and write buffer of the netCDF file.
+    :type profile: ExportProfile
+    :param instrumentation: Records the time of each stage and the counters.
+    :type instrumentation: Instrumentation
+    :param job_control: Cancel or pause the export.
+    :type job_control: JobControl
+    :param groups: Write each subsystem configuration to its own netCDF group.
+    :type groups: bool
+    :param formats: Output formats in OUTPUT_FORMATS.  If None, only netCDF.  Not used with groups.
+    :type formats: list
+    :param decimate: Only export every decimate ensemble in the range.  1 to export all the ensembles.
+    :type decimate: int
+    :param average_interval: Average the ensembles into intervals of this many seconds.  None to not average.
+    :type average_interval: float
+    :return: Analyze results for the range exported.
+    :rtype: dict
+    """
+    from .rtb_analyze import load_or_create_index
+
+    decimate = decimate or 1
+    if groups and (decimate > 1 or average_interval):
+        raise ValueError("The subsystem groups can not be decimated or averaged")
+
+    index = load_or_create_index(file_path)
+
+    start_offset, end_offset = 0, index.ensemble_offset(len(index))
+    if ens_range is not None:
+        start_offset, end_offset = index.record_offsets(ens_range[0], ens_range[1])
+    if time_range is not None:
+        time_start_offset, time_end_offset = index.time_offsets(time_range[0], time_range[1])
+        start_offset = max(start_offset, time_start_offset)
+        end_offset = min(end_offset, time_end_offset)
+
+    logging.debug("Exporting " + file_path + " bytes " + str(start_offset) + " to " + str(end_offset))
+
+    # Byte range of each record decimated, so only these records are read
+    record_ranges = None
+    if decimate > 1:
+        start_record, stop_record = 0, len(index.record_starts())
+        if ens_range is not None:
+            start_record = max(start_record, ens_range[0])
+            if ens_range[1] >= 0:
+                stop_record = min(stop_record, ens_range[1])
+        if time_range is not None:
+            time_start_record, time_stop_record = index.time_records(time_range[0], time_range[1])
+            start_record = max(start_record, time_start_record)
+            stop_record = min(stop_record, time_stop_record)
+        record_ranges = index.record_ranges(start_record, stop_record, decimate)
+        logging.debug("Exporting every " + str(decimate) + " records, " + str(len(record_ranges)) + " records")
+
+    if groups:
+        from .group_export import GroupExporter
+        exporter = GroupExporter(file_path, output_path,
+                                 ensemble_progress_callback=ensemble_progress_callback,
+                                 start_offset=start_offset,
+                                 end_offset=max(start_offset, end_offset),
+                                 profile=profile,
+                                 instrumentation=instrumentation,
+                                 job_control=job_control)
+        return exporter.export()
+
+    from .stream_export import StreamExporter
+    exporter = StreamExporter(file_path, output_path,
+                              ensemble_progress_callback=ensemble_progress_callback,
+                              start_offset=start_offset,
+                              end_offset=max(start_offset, end_offset),
+                              profile=profile,
+                              instrumentation=instrumentation,
+                              job_control=job_control,
+                              formats=formats,
+                              record_ranges=record_ranges,
+                              decimate=decimate,
+                              average_interval=average_interval)
+    return exporter.export()
+
+
+def analyze_export_file(file_path: str, output_path: str = None,
+                        file_progress_handler=None, ensemble_progress_callback=None,
+                        profile: ExportProfile = None, append: bool = False,
+                        instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+                        job_control: JobControl = NULL_JOB_CONTROL, groups: bool = False,
+                        formats: list = None, average_interval: float = None) -> dict:
+    """
+    Analyze and export the file in a single pass.  Each ensemble is decoded once
+    and the analyze results are collected while the netCDF file is written.
+    With groups, each subsystem configuration is written to its own netCDF
+    group and append is not used.  The same ensembles can be written to more
+    than one output format, such as netCDF and Zarr.
+    :param file_path: File path to export.
+    :type file_path: str
+    :param output_path: netCDF file path.  If None, the file path with the .nc extension.
+    :type output_path: str
+    :param file_progress_handler: Optional handler for the file progress event.
+    :type file_progress_handler: function(sender, bytes_read, total_size, file_name)
+    :param ensemble_progress_callback: Optional callback with the number of ensembles exported so far.
+    :type ensemble_progress_callback: function(ens_exported)
+    :param profile: Chunk shape, compression and write buffer of the netCDF file.
+    :type profile: ExportProfile
+    :param append: Append the ensembles added since the last export to the netCDF file.
+    :type append: bool
+    :param instrumentation: Records the time of each stage and the counters.
+    :type instrumentation: Instrumentation
+    :param job_control: Cancel or pause the export.
+    :type job_control: JobControl
+    :param groups: Write each subsystem configuration to its own netCDF group.
+    :type groups: bool
+    :param formats: Output formats in OUTPUT_FORMATS.  If None, only netCDF.  Not used with groups.
+    :type formats: list
+    :param average_interval: Average the ensembles into intervals of this many seconds.  Not used with groups.
+    :type average_interval: float
+    :return: Analyze results for the file.
+    :rtype: dict
+    """
+    file_progress_callback = None
+    if file_progress_handler:
+        def file_progress_callback(bytes_read, total_size, file_name):
+            file_progress_handler(None, bytes_read, total_size, file_name)
+
+    if groups:
+        from .group_export import GroupExporter
+        exporter = GroupExporter(file_path, output_path,
+                                 file_progress_callback=file_progress_callback,
+                                 ensemble_progress_callback=ensemble_progress_callback,
+                                 profile=profile,
+                                 instrumentation=instrumentation,
+                                 job_control=job_control)
+        return exporter.export()
+
+    from .stream_export import StreamExporter
+
+    exporter = StreamExporter(file_path, output_path,
+                              file_progress_callback=file_progress_callback,
+                              ensemble_progress_callback=ensemble_progress_callback,
+                              profile=profile,
+                              append=append,
+                              instrumentation=instrumentation,
+                              job_control=job_control,
+                              formats=formats,
+                              average_interval=average_interval)
+    return exporter.export()
+
+
+def export_aggregate(file_results: list, output_path: str, ensemble_progress_callback=None,
+                     profile: ExportProfile = None, cache: AnalyzeCache = None,
+                     instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+                     job_control: JobControl = NULL_JOB_CONTROL) -> dict:
+    """
+    Export all the files into a single netCDF file in time order.  Files that
+    overlap are only written once.  Any file without the analyze results is
+    analyzed first to get the time range of the file.
+    :param file_results: Analyze results for each file.  Only the FilePath is needed.
+    :type file_results: list
+    :param output_path: netCDF file path.
+    :type output_path: str
+    :param ensemble_progress_callback: Optional callback with the number of ensembles processed so far.
+    :type ensemble_progress_callback: function(ens_exported)
+    :param profile: Chunk shape, compression and write buffer of the netCDF file.
+    :type profile: ExportProfile
+    :param cache: Optional cache of the analyze results.
+    :type cache: AnalyzeCache
+    :param instrumentation: Records the time of each stage and the counters.
+    :type instrumentation: Instrumentation
+    :param job_control: Cancel or pause the export.
+    :type job_control: JobControl
+    :return: Analyze results of the records written.  Files gives the status of each file.
+    :rtype: dict
+    """
+    from .aggregate_export import AggregateExporter
+
+    analyzed_results = []
+    for file_result in file_results:
+        if "FirstEnsDateTime" not in file_result:
+            job_control.check()
+            file_result = analyze_file(file_result["FilePath"], cache=cache, instrumentation=instrumentation)
+        analyzed_results.append(file_result)
+
+    exporter = AggregateExporter(analyzed_results, output_path,
+                                 ensemble_progress_callback=ensemble_progress_callback,
+                                 profile=profile,
+                                 instrumentation=instrumentation,
+                                 job_control=job_control)
+    return exporter.export()
@@ -0,0 +1,280 @@
+import os
+import logging
+import netCDF4
+from .rtb_reader import create_reader
+from .rtb_decoder import pair_vertical_beam
+from .batch_decoder import BatchDecoder, EnsembleBatch, EnsembleLayout, RawEnsemble, record, DEFAULT_BATCH_SIZE
+from .netcdf_writer import NetcdfWriter
+from .stream_export import default_output_path
+from .export_profile import ExportProfile
+from .memory_budget import MemoryBudget
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from .job_control import JobControl, JobCancelled, NULL_JOB_CONTROL
+from .progress import ProgressReporter
+from .analyze_stats import AnalyzeStats
+
+
+# The groups are only known when they are found in the file, so the memory
+# budget is split between this many groups.  A 7 beam or 8 beam system has
+# 2 subsystems.  More groups can go over the budget.
+BUDGET_GROUPS = 2
+
+# Start of the name of each subsystem group, followed by the subsystem code and configuration
+GROUP_NAME_PREFIX = "subsystem_"
+
+
+def group_name(subsystem_code: str, subsystem_config: int) -> str:
+    """
+    Get the netCDF group name of the subsystem configuration.
+    A subsystem code that is not a letter or digit is given in hex.
+    :param subsystem_code: Subsystem code.
+    :type subsystem_code: str
+    :param subsystem_config: Subsystem configuration index.
+    :type subsystem_config: int
+    :return: Group name.
+    :rtype: str
+    """
+    if not subsystem_code.isalnum() or not subsystem_code.isascii():
+        subsystem_code = "0x" + format(ord(subsystem_code), "02x")
+    return GROUP_NAME_PREFIX + subsystem_code + "_" + str(subsystem_config)
+
+
+class _SubsystemGroup:
+    """
+    Decoder, writer and analyze results of a subsystem group.
+    """
+
+    def __init__(self, name: str, decoder: BatchDecoder, writer: NetcdfWriter):
+        self.name = name
+        self.decoder = decoder
+        self.writer = writer
+        self.stats = AnalyzeStats()
+
+
+class GroupExporter:
+    """
+    Export the RTB file to netCDF in a single pass with each subsystem
+    configuration in its own netCDF group.  This is used for 7 beam and 8 beam
+    systems, where the ensembles of the subsystems are interleaved in the file.
+    Each group has its own dimensions, so the subsystems can have a different
+    number of bins and beams and are not merged together.
+
+    The ensembles are read once.  A 4 beam ensemble followed by a vertical beam
+    ensemble is merged into a 5 beam ensemble and goes to the group of the
+    4 beam ensemble.  Each record is routed by its subsystem to the decoder of
+    its group, and each decoded batch is written to the group.
+
+    The job control is checked before each batch is written.  If the export
+    fails or is cancelled, the partial netCDF file is removed.  The groups can
+    not be appended to.
+    """
+
+    def __init__(self, file_path: str, output_path: str = None,
+                 file_progress_callback=None, ensemble_progress_callback=None,
+                 start_offset: int = 0, end_offset: int = None, use_mmap: bool = True,
+                 batch_size: int = DEFAULT_BATCH_SIZE, profile: ExportProfile = None,
+                 instrumentation: Instrumentation = NULL_INSTRUMENTATION, job_control: JobControl = NULL_JOB_CONTROL):
+        """
+        Initialize the exporter.
+        :param file_path: RTB file path to export.
+        :type file_path: str
+        :param output_path: netCDF file path.  If None, the RTB file path with the .nc extension.
+        :type output_path: str
+        :param file_progress_callback: Called with the bytes read for each chunk, the total size and file name.
+        :type file_progress_callback: function(bytes_read, total_size, file_name)
+        :param ensemble_progress_callback: Called with the number of ensembles exported so far.  The calls are rate limited.
+        :type ensemble_progress_callback: function(ens_exported)
+        :param start_offset: Byte offset in the file of the first ensemble to export.
+        :type start_offset: int
+        :param end_offset: Byte offset in the file to stop exporting.  If None, export to the end of the file.
+        :type end_offset: int
+        :param use_mmap: Read the file using a memory mapped file.
+        :type use_mmap: bool
+        :param batch_size: Number of ensembles of a group to decode and write at a time.
+        :type batch_size: int
+        :param profile: Chunk shape, compression and write buffer of the netCDF file.  If None, the default profile.
+        :type profile: ExportProfile
+        :param instrumentation: Records the time of each stage and the counters.
+        :type instrumentation: Instrumentation
+        :param job_control: Cancel or pause the export.
+        :type job_control: JobControl
+        """
+        self.file_path = file_path
+        self.output_path = output_path if output_path else default_output_path(file_path)
+        self.file_progress_callback = file_progress_callback
+        self.progress = ProgressReporter(ensemble_progress_callback)
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.use_mmap = use_mmap
+        self.batch_size = batch_size
+        self.profile = profile
+        self.instrumentation = instrumentation
+        self.job_control = job_control
+
+        # Layout of the ensembles read, used to pair the ensembles and find their subsystem
+        self.layouts = {}
+
+        # Subsystem code and configuration and the group
+        self.groups = {}
+
+        # Serial number of the first ensemble, stored in the file attributes
+        self.serial_number = None
+
+    def export(self) -> dict:
+        """
+        Export the file.  If the export fails, the partial netCDF file is removed.
+        :return: Analyze results of the file with the analyze results of each group in Groups.
+        :rtype: dict
+        """
+        logging.debug("Starting Subsystem Group Export netCDF: " + self.file_path)
+        memory_budget = MemoryBudget.from_profile(self.profile)
+        reader = create_reader(self.file_path, self.file_progress_callback, self.use_mmap, memory_budget,
+                               self.instrumentation)
+        group_budget = memory_budget.share(BUDGET_GROUPS) if memory_budget is not None else None
+
+        dataset = netCDF4.Dataset(self.output_path, "w", format="NETCDF4")
+        dataset.Conventions = "CF-1.6"
+        dataset.history = "Created by Rowe Technologies Inc. ExportR"
+
+        try:
+            raw_ensembles = (RawEnsemble(offset, ens_bytes, self._layout(ens_bytes).num_beams)
+                             for offset, ens_bytes in reader.ensembles(self.start_offset, self.end_offset))
+
+            for ens, vert_ens in pair_vertical_beam(raw_ensembles):
+                group = self._group(dataset, ens.data, group_budget)
+                batch = group.decoder.add(record(ens, vert_ens))
+                if batch is not None:
+                    self.job_control.check()
+                    self._write(group, batch)
+
+            # Write the records left in each group
+            for group in self.groups.values():
+                batch = group.decoder.finish()
+                if batch is not None:
+                    self.job_control.check()
+                    self._write(group, batch)
+            self.progress.finish()
+
+            result = self._close(dataset)
+        except Exception as ex:
+            for group in self.groups.values():
+                group.writer.abort()
+            if dataset.isopen():
+                dataset.close()
+            if os.path.exists(self.output_path):
+                os.remove(self.output_path)
+            if isinstance(ex, JobCancelled):
+                logging.debug("Subsystem Group Export netCDF Cancelled: " + self.file_path)
+            raise
+
+        logging.debug("Subsystem Group Export netCDF Complete: " + self.file_path + " Groups: " +
+                      ", ".join(self.groups[key].name for key in sorted(self.groups)) +
+                      " Bad Checksums: " + str(reader.bad_checksums) + " Bad Bytes: " + str(reader.bad_bytes))
+        return result
+
+    def _layout(self, ens_bytes) -> EnsembleLayout:
+        """
+        Get the layout of the ensemble, creating it the first time it is seen.
+        :param ens_bytes: Complete ensemble.
+        :type ens_bytes: bytes
+        :return: Layout of the ensemble.
+        :rtype: EnsembleLayout
+        """
+        key = EnsembleLayout.key(ens_bytes)
+        layout = self.layouts.get(key)
+        if layout is None:
+            layout = EnsembleLayout(ens_bytes)
+            self.layouts[key] = layout
+        return layout
+
+    def _group(self, dataset: netCDF4.Dataset, ens_bytes, memory_budget: MemoryBudget) -> _SubsystemGroup:
+        """
+        Get the group of the ensemble subsystem, creating it the first time the subsystem is seen.
+        :param dataset: netCDF file to create the group in.
+        :type dataset: netCDF4.Dataset
+        :param ens_bytes: Complete ensemble.
+        :type ens_bytes: bytes
+        :param memory_budget: Memory budget of each group.  None if the memory is not limited.
+        :type memory_budget: MemoryBudget
+        :return: Group of the subsystem.
+        :rtype: _SubsystemGroup
+        """
+        layout = self._layout(ens_bytes)
+        subsystem = layout.subsystem(ens_bytes)
+        group = self.groups.get(subsystem)
+        if group is None:
+            name = group_name(*subsystem)
+            if self.serial_number is None:
+                self.serial_number = layout.serial_number
+            if memory_budget is not None and len(self.groups) >= BUDGET_GROUPS:
+                logging.warning(self.file_path + " has more than " + str(BUDGET_GROUPS) +
+                                " subsystems, the export can go over the memory budget")
+
+            decoder = BatchDecoder(self.batch_size, memory_budget=memory_budget, instrumentation=self.instrumentation)
+            writer = NetcdfWriter(self.output_path, self.profile, memory_budget=memory_budget,
+                                  instrumentation=self.instrumentation, parent=dataset, group_name=name)
+            group = _SubsystemGroup(name, decoder, writer)
+            self.groups[subsystem] = group
+        return group
+
+    def _close(self, dataset: netCDF4.Dataset) -> dict:
+        """
+        Close each group with its analyze results and close the netCDF file.
+        The analyze results of the file are the total of the groups.
+        :param dataset: netCDF file.
+        :type dataset: netCDF4.Dataset
+        :return: Analyze results of the file with the analyze results of each group in Groups.
+        :rtype: dict
+        """
+        total = AnalyzeStats()
+        group_results = {}
+        for key in sorted(self.groups):
+            group = self.groups[key]
+            result = group.stats.result(self.file_path)
+            group.writer.close(result)
+            group_results[group.name] = result
+
+            total.ens_count += group.stats.ens_count
+            total.ens_pair_count += group.stats.ens_pair_count
+            if group.stats.first_datetime is not None:
+                if total.first_datetime is None:
+                    # The time between ensembles is of a single subsystem
+                    total.ens_delta_time = group.stats.ens_delta_time
+                    total.first_datetime = group.stats.first_datetime
+                    total.last_datetime = group.stats.last_datetime
+                else:
+                    total.first_datetime = min(total.first_datetime, group.stats.first_datetime)
+                    total.last_datetime = max(total.last_datetime, group.stats.last_datetime)
+
+        result = total.result(self.file_path)
+        if self.serial_number is not None:
+            dataset.serial_number = self.serial_number
+        dataset.subsystem_groups = ", ".join(group_results)
+        dataset.ens_count = result["EnsCount"]
+        dataset.ens_pair_count = result["EnsPairCount"]
+        if result["FirstEnsDateTime"] is not None:
+            dataset.time_coverage_start = result["FirstEnsDateTime"].isoformat()
+        if result["LastEnsDateTime"] is not None:
+            dataset.time_coverage_end = result["LastEnsDateTime"].isoformat()
+        dataset.close()
+
+        result["Groups"] = group_results
+        return result
+
+    def _write(self, group: _SubsystemGroup, batch: EnsembleBatch):
+        """
+        Write the batch to the group and add it to the analyze results of the group.
+        :param group: Group of the batch subsystem.
+        :type group: _SubsystemGroup
+        :param batch: Batch of decoded ensembles.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        group.writer.write_batch(batch)
+
+        # Only the first two and last valid times are needed for the analyze results
+        group.stats.add_batch(batch.count, batch.pair_count(), *batch.time_summary())
+
+        if self.progress.enabled:
+            self.progress.add(batch.count)
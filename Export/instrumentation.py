@@ -0,0 +1,301 @@
+import os
+import json
+import time
+import logging
+
+
+# Stages timed in the analyze and export
+#   read           Reading the file in chunks.  A memory mapped file is read within the header search.
+#   header_search  Searching for the next ensemble header and checking it
+#   checksum       Verifying the checksum of each ensemble
+#   decode         Decoding the ensembles
+#   write          Copying the ensembles to the write buffer and writing the netCDF file
+#   rti_netcdf     RtiNetcdf.export of rti_python.  The stages within it are not separated.
+STAGE_READ = "read"
+STAGE_HEADER_SEARCH = "header_search"
+STAGE_CHECKSUM = "checksum"
+STAGE_DECODE = "decode"
+STAGE_WRITE = "write"
+STAGE_RTI_NETCDF = "rti_netcdf"
+
+# Counters
+#   bytes_read     Bytes of the file scanned for ensembles
+#   ensembles      Ensembles found with a good checksum
+#   records        Records written, a 4 beam ensemble paired with a vertical beam is one record
+#   batches        Batches decoded
+#   flushes        Writes of the write buffer to the netCDF file
+#   bad_checksums  Ensembles with a bad checksum
+#   bad_bytes      Bytes skipped because they are not part of a good ensemble
+#   cache_hits     Files whose analyze results were taken from the cache
+COUNTER_BYTES_READ = "bytes_read"
+COUNTER_ENSEMBLES = "ensembles"
+COUNTER_RECORDS = "records"
+COUNTER_BATCHES = "batches"
+COUNTER_FLUSHES = "flushes"
+COUNTER_BAD_CHECKSUMS = "bad_checksums"
+COUNTER_BAD_BYTES = "bad_bytes"
+COUNTER_CACHE_HITS = "cache_hits"
+
+# Profilers that can dump the call profile
+#   cprofile     Python cProfile, written as a .prof file for pstats or snakeviz
+#   pyinstrument Sampling profiler, written as a .html file.  pyinstrument must be installed.
+PROFILERS = ("cprofile", "pyinstrument")
+DEFAULT_PROFILER = "cprofile"
+
+# Default location of the instrumentation written by the user interface
+DEFAULT_INSTRUMENTATION_PATH = os.path.join(os.path.expanduser("~"), ".exportr", "instrumentation.json")
+
+
+class _StageTimer:
+    """
+    Context manager adding the time spent in the block to a stage.
+    """
+
+    def __init__(self, instrumentation, stage: str):
+        self.instrumentation = instrumentation
+        self.stage = stage
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.add_time(self.stage, time.perf_counter() - self.start_time)
+        return False
+
+
+class _NullStageTimer:
+    """
+    Context manager that does nothing, used when the instrumentation is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Instrumentation:
+    """
+    Record the cumulative time of each stage of the analyze and export and
+    count the bytes, ensembles and bad data.
+
+    The hot loops check enabled once and only read the clock when it is set,
+    so NULL_INSTRUMENTATION costs close to nothing.  Stages that run for each
+    ensemble are timed with add_time(), stages that run for each batch or file
+    can use the stage() context manager.
+    """
+
+    # The stages and counters are recorded
+    enabled = True
+
+    def __init__(self):
+        # Stage name and [seconds, calls]
+        self.stages = {}
+
+        # Counter name and value
+        self.counters = {}
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1):
+        """
+        Add the time spent in the stage.
+        :param stage: Stage name.
+        :type stage: str
+        :param seconds: Time in seconds.
+        :type seconds: float
+        :param calls: Number of times the stage was run.
+        :type calls: int
+        :return:
+        :rtype:
+        """
+        totals = self.stages.get(stage)
+        if totals is None:
+            self.stages[stage] = [seconds, calls]
+        else:
+            totals[0] += seconds
+            totals[1] += calls
+
+    def stage(self, stage: str):
+        """
+        Time the block as the stage.
+        :param stage: Stage name.
+        :type stage: str
+        :return: Context manager timing the block.
+        :rtype: _StageTimer
+        """
+        return _StageTimer(self, stage)
+
+    def count(self, counter: str, value: int = 1):
+        """
+        Add to the counter.
+        :param counter: Counter name.
+        :type counter: str
+        :param value: Value to add.
+        :type value: int
+        :return:
+        :rtype:
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def merge(self, result: dict):
+        """
+        Add the stages and counters from the result of another instrumentation,
+        such as an export run in another process.
+        :param result: Result from Instrumentation.result().
+        :type result: dict
+        :return:
+        :rtype:
+        """
+        if not result:
+            return
+        for stage, totals in result.get("Stages", {}).items():
+            self.add_time(stage, totals["Seconds"], totals["Calls"])
+        for counter, value in result.get("Counters", {}).items():
+            self.count(counter, value)
+
+    def result(self) -> dict:
+        """
+        Get the stages and counters to write as JSON.
+        :return: Seconds and calls of each stage and the counters.
+        :rtype: dict
+        """
+        return {
+            "Stages": {stage: {"Seconds": totals[0], "Calls": totals[1]}
+                       for stage, totals in sorted(self.stages.items())},
+            "Counters": dict(sorted(self.counters.items())),
+        }
+
+
+class NullInstrumentation(Instrumentation):
+    """
+    Instrumentation that records nothing.  This is used when the
+    instrumentation is disabled.
+    """
+
+    enabled = False
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1):
+        pass
+
+    def stage(self, stage: str):
+        return NULL_STAGE_TIMER
+
+    def count(self, counter: str, value: int = 1):
+        pass
+
+    def merge(self, result: dict):
+        pass
+
+
+NULL_STAGE_TIMER = _NullStageTimer()
+
+# Shared instrumentation used when it is disabled
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+def merge_results(results: list) -> dict:
+    """
+    Add up the instrumentation results of many files.
+    :param results: Results from Instrumentation.result().  None values are skipped.
+    :type results: list
+    :return: Total of the stages and counters.
+    :rtype: dict
+    """
+    total = Instrumentation()
+    for result in results:
+        total.merge(result)
+    return total.result()
+
+
+def write_results(file_results: list, json_path: str = DEFAULT_INSTRUMENTATION_PATH):
+    """
+    Write the instrumentation of each file and the total to a JSON file.
+    :param file_results: FilePath with the AnalyzeInstrumentation and ExportInstrumentation of each file.
+    :type file_results: list
+    :param json_path: File path to write the JSON.
+    :type json_path: str
+    :return:
+    :rtype:
+    """
+    results = []
+    for file_result in file_results:
+        results.append(file_result.get("AnalyzeInstrumentation"))
+        results.append(file_result.get("ExportInstrumentation"))
+
+    directory = os.path.dirname(json_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(json_path, "w") as json_file:
+        json.dump({"Files": file_results, "Instrumentation": merge_results(results)}, json_file, indent=2)
+
+
+def check_profiler(profiler: str):
+    """
+    Check the profiler can be used.
+    :param profiler: Profiler name in PROFILERS.
+    :type profiler: str
+    :return:
+    :rtype:
+    """
+    if profiler not in PROFILERS:
+        raise ValueError("Unknown profiler " + profiler + ".  Use one of " + ", ".join(PROFILERS))
+    if profiler == "pyinstrument":
+        try:
+            import pyinstrument
+        except ImportError:
+            raise ValueError("pyinstrument is not installed.  Install it with pip install pyinstrument")
+
+
+def profile_dump_path(profile_dir: str, file_path: str, stage: str) -> str:
+    """
+    Get the file path of the profile of a file without the extension.
+    :param profile_dir: Folder to write the profiles.
+    :type profile_dir: str
+    :param file_path: RTB file path.
+    :type file_path: str
+    :param stage: analyze or export.
+    :type stage: str
+    :return: Profile file path without the extension.
+    :rtype: str
+    """
+    return os.path.join(profile_dir, os.path.basename(file_path) + "." + stage)
+
+
+def profile_call(function, dump_path: str, profiler: str = DEFAULT_PROFILER):
+    """
+    Call the function with the profiler running and dump the profile.
+    The profile is written even if the function fails.
+    :param function: Function to call with no arguments.
+    :type function: function()
+    :param dump_path: File path of the profile without the extension.  .prof is added for cProfile
+                      and .html for pyinstrument.
+    :type dump_path: str
+    :param profiler: Profiler name in PROFILERS.
+    :type profiler: str
+    :return: Value returned by the function.
+    """
+    directory = os.path.dirname(dump_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if profiler == "pyinstrument":
+        import pyinstrument
+        sampler = pyinstrument.Profiler()
+        sampler.start()
+        try:
+            return function()
+        finally:
+            sampler.stop()
+            with open(dump_path + ".html", "w") as html_file:
+                html_file.write(sampler.output_html())
+            logging.debug("Wrote the profile " + dump_path + ".html")
+
+    import cProfile
+    call_profile = cProfile.Profile()
+    try:
+        return call_profile.runcall(function)
+    finally:
+        call_profile.dump_stats(dump_path + ".prof")
+        logging.debug("Wrote the profile " + dump_path + ".prof")
@@ -0,0 +1,135 @@
+import time
+
+
+# Minimum time in seconds between checks of the cancel and pause flags.
+# The flags may be in another process, so each check can be a round trip.
+DEFAULT_CHECK_INTERVAL = 0.1
+
+# Time in seconds to wait for the job to be resumed before checking if it is cancelled
+PAUSE_POLL_TIMEOUT = 0.5
+
+
+class JobCancelled(Exception):
+    """
+    Raised within the export when the job is cancelled.  The export
+    removes the partial netCDF file before passing it on.
+    """
+    pass
+
+
+class JobControl:
+    """
+    Cooperative cancel and pause of a running export.  The export loops call
+    check() between batches.  If the job is cancelled, check() raises
+    JobCancelled.  If the job is paused, check() blocks until the job is
+    resumed or cancelled.
+
+    The flags are events, such as multiprocessing.Manager().Event(), so the
+    job can be controlled from another process.  The flags are only read at
+    most every check interval, so check() can be called for every batch.
+    """
+
+    # The flags are checked
+    enabled = True
+
+    def __init__(self, cancel_event, run_event, check_interval: float = DEFAULT_CHECK_INTERVAL):
+        """
+        Initialize the control.
+        :param cancel_event: Set to cancel the job.
+        :type cancel_event: threading.Event
+        :param run_event: Cleared to pause the job and set to resume it.
+        :type run_event: threading.Event
+        :param check_interval: Minimum time in seconds between checks of the flags.
+        :type check_interval: float
+        """
+        self.cancel_event = cancel_event
+        self.run_event = run_event
+        self.check_interval = check_interval
+        self.last_check_time = 0.0
+
+    def check(self):
+        """
+        Raise JobCancelled if the job is cancelled and wait while the job is paused.
+        :return:
+        :rtype:
+        """
+        now = time.monotonic()
+        if now - self.last_check_time < self.check_interval:
+            return
+        self.last_check_time = now
+
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+        # Paused, wait to be resumed
+        while not self.run_event.is_set():
+            self.run_event.wait(PAUSE_POLL_TIMEOUT)
+            if self.cancel_event.is_set():
+                raise JobCancelled()
+
+    def cancel(self):
+        """
+        Cancel the job.  The export stops at the next check.
+        :return:
+        :rtype:
+        """
+        self.cancel_event.set()
+
+        # Wake a paused job so it sees the cancel
+        self.run_event.set()
+
+    def pause(self):
+        """
+        Pause the job at the next check.
+        :return:
+        :rtype:
+        """
+        self.run_event.clear()
+
+    def resume(self):
+        """
+        Resume a paused job.
+        :return:
+        :rtype:
+        """
+        self.run_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Check if the job is cancelled.
+        :return: TRUE if the job is cancelled.
+        :rtype: bool
+        """
+        return self.cancel_event.is_set()
+
+
+class NullJobControl(JobControl):
+    """
+    Control of an export that can not be cancelled or paused.
+    """
+
+    enabled = False
+
+    def __init__(self):
+        pass
+
+    def check(self):
+        pass
+
+    def cancel(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    @property
+    def cancelled(self) -> bool:
+        return False
+
+
+# Shared control used when the export can not be cancelled
+NULL_JOB_CONTROL = NullJobControl()
@@ -0,0 +1,589 @@
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import file_export
+from .export_pool import export_file_summary, default_worker_count
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from .job_control import JobControl, JobCancelled
+from .output_formats import is_netcdf_only
+from .progress import drain_progress
+
+
+# State of each export job
+#   queued     Waiting for a worker
+#   running    Exporting in a worker
+#   paused     A queued job is not started, a running job waits at the next batch and keeps its worker
+#   cancelled  Cancelled before or while exporting, the partial netCDF file is removed
+#   completed  Exported
+#   failed     The export failed, the error is in the summary
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_PAUSED = "paused"
+JOB_CANCELLED = "cancelled"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# States of a job that will not change again
+JOB_FINAL_STATES = (JOB_CANCELLED, JOB_COMPLETED, JOB_FAILED)
+
+# Priority of a job.  Queued jobs with a higher priority are started first,
+# jobs with the same priority are started in the order they were submitted.
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+# Time in seconds to wait for a job to complete before checking the progress and the queue
+QUEUE_POLL_TIMEOUT = 0.1
+
+
+def _aggregate_summary(file_results: list, output_path: str, ensemble_progress_callback, export_options: dict,
+                       job_control: JobControl) -> dict:
+    """
+    Export all the files into a single netCDF file and create the summary of the export.
+    :param file_results: Analyze results of each file.
+    :type file_results: list
+    :param output_path: netCDF file path.
+    :type output_path: str
+    :param ensemble_progress_callback: Optional callback with the number of records processed so far.
+    :type ensemble_progress_callback: function(ens_exported)
+    :param export_options: The profile and instrument options are used.
+    :type export_options: dict
+    :param job_control: Cancel or pause the export.
+    :type job_control: JobControl
+    :return: Summary of the export.  The status of each file is in Files.
+    :rtype: dict
+    """
+    summary = {"FilePath": output_path, "Status": "ok", "Error": None, "Files": []}
+    instrument = export_options.get("instrument", False)
+    instrumentation = Instrumentation() if instrument else NULL_INSTRUMENTATION
+
+    start_time = time.perf_counter()
+    try:
+        result = file_export.export_aggregate(file_results, output_path,
+                                              ensemble_progress_callback=ensemble_progress_callback,
+                                              profile=export_options.get("profile"),
+                                              instrumentation=instrumentation,
+                                              job_control=job_control)
+        summary["Files"] = result.pop("Files")
+        summary["Result"] = result
+    except JobCancelled:
+        logging.info("Cancelled combining the files into " + output_path)
+        summary["Status"] = "cancelled"
+    except Exception as ex:
+        logging.exception("Error combining the files into " + output_path)
+        summary["Status"] = "failed"
+        summary["Error"] = str(ex)
+    summary["ExportSeconds"] = time.perf_counter() - start_time
+
+    if instrument:
+        summary["Instrumentation"] = instrumentation.result()
+
+    return summary
+
+
+def _run_job(job_id: int, file_results: list, output_path: str, export_options: dict, job_control: JobControl,
+             progress_queue) -> dict:
+    """
+    Export the job within a worker.  The number of ensembles exported is
+    sent to the queue through the progress queue.
+    :param job_id: ID of the job.
+    :type job_id: int
+    :param file_results: Analyze results of the file, or of each file to combine.
+    :type file_results: list
+    :param output_path: netCDF file to combine the files into.  None to export a single file.
+    :type output_path: str
+    :param export_options: Options passed to file_export.export_file().
+    :type export_options: dict
+    :param job_control: Cancel or pause the export.  The flags are shared with the queue.
+    :type job_control: JobControl
+    :param progress_queue: Queue to send the progress to the job queue.
+    :type progress_queue: multiprocessing.Queue
+    :return: Summary of the export.
+    :rtype: dict
+    """
+    def ensemble_progress_callback(ens_exported):
+        progress_queue.put((job_id, ens_exported))
+
+    if output_path is None:
+        return export_file_summary(file_results[0], ensemble_progress_callback, export_options, job_control)
+    return _aggregate_summary(file_results, output_path, ensemble_progress_callback, export_options, job_control)
+
+
+class ExportJob:
+    """
+    A file, or files to combine, waiting in the job queue or exporting.
+    The job is updated by the queue, read it from the callbacks.
+    """
+
+    def __init__(self, job_id: int, file_results: list, export_options: dict, priority: int, sequence: int,
+                 output_path: str = None):
+        """
+        Initialize the job.
+        :param job_id: ID of the job.
+        :type job_id: int
+        :param file_results: Analyze results of the file, or of each file to combine.
+        :type file_results: list
+        :param export_options: Options passed to file_export.export_file().
+        :type export_options: dict
+        :param priority: PRIORITY_LOW, PRIORITY_NORMAL or PRIORITY_HIGH.
+        :type priority: int
+        :param sequence: Order the job was submitted.
+        :type sequence: int
+        :param output_path: netCDF file to combine the files into.  None to export a single file.
+        :type output_path: str
+        """
+        self.job_id = job_id
+        self.file_results = file_results
+        self.export_options = export_options
+        self.priority = priority
+        self.sequence = sequence
+        self.output_path = output_path
+        self.state = JOB_QUEUED
+
+        # Ensembles exported so far and the total to export
+        self.ens_exported = 0
+        self.total_ensembles = sum(file_export.get_total_ensembles(file_result) for file_result in file_results)
+
+        # Only every Nth ensemble is exported when decimating
+        decimate = export_options.get("decimate") or 1
+        if decimate > 1:
+            self.total_ensembles = -(-self.total_ensembles // decimate)
+
+        # Summary of the export when the job is complete
+        self.summary = None
+
+        # Set when the job is started
+        self.control = None
+        self.future = None
+
+    @property
+    def file_paths(self) -> list:
+        """
+        Get the RTB files exported by the job.
+        :return: File path of each file.
+        :rtype: list
+        """
+        return [file_result["FilePath"] for file_result in self.file_results]
+
+    @property
+    def name(self) -> str:
+        """
+        Get the name to show for the job.
+        :return: netCDF file path when combining the files, otherwise the RTB file path.
+        :rtype: str
+        """
+        return self.output_path if self.output_path else self.file_results[0]["FilePath"]
+
+    @property
+    def is_split(self) -> bool:
+        """
+        Check if the file is split across the worker processes.
+        :return: TRUE if the job uses all the workers.
+        :rtype: bool
+        """
+        return self.output_path is None and self.export_options.get("split_workers", 0) > 1 and \
+            not self.export_options.get("groups", False) and is_netcdf_only(self.export_options.get("formats"))
+
+    @property
+    def is_final(self) -> bool:
+        """
+        Check if the job is complete, failed or cancelled.
+        :return: TRUE if the state will not change again.
+        :rtype: bool
+        """
+        return self.state in JOB_FINAL_STATES
+
+
+class JobQueue:
+    """
+    Queue of export jobs run by a bounded number of worker processes.
+    Each job exports a file, or combines many files into one netCDF file.
+    Jobs can be submitted at any time.  The queued jobs with the highest
+    priority are started first.
+
+    A job can be cancelled or paused while it is queued or running.  The
+    export checks the job between batches, so a running job stops within
+    a batch.  A cancelled job removes its partial netCDF file.  A paused job
+    that is running keeps its worker, cancel it to make room for another job.
+
+    A job that splits the file across the worker processes runs in a thread
+    and uses all the workers, so the processes are not nested.
+
+    The jobs are started and watched by a dispatcher thread.  The callbacks
+    are called from the dispatcher thread, or from the thread changing the
+    job for cancel, pause and resume.
+    """
+
+    def __init__(self, workers: int = None, job_state_callback=None, job_progress_callback=None):
+        """
+        Initialize the queue.
+        :param workers: Number of jobs to run at once.  If None, the number of CPU cores is used.
+        :type workers: int
+        :param job_state_callback: Called with the job when the state of the job changes.
+        :type job_state_callback: function(job)
+        :param job_progress_callback: Called with the job when the ensembles exported changes.
+                                      This is called at most once per job for each poll of the workers.
+        :type job_progress_callback: function(job)
+        """
+        if workers is None or workers <= 0:
+            workers = default_worker_count()
+        self.workers = workers
+        self.job_state_callback = job_state_callback
+        self.job_progress_callback = job_progress_callback
+
+        self.jobs = {}
+        self.next_job_id = 1
+        self.lock = threading.RLock()
+
+        # Set when the queue should be checked before the poll timeout
+        self.wake_event = threading.Event()
+
+        # Created when the first job is submitted
+        self.manager = None
+        self.progress_queue = None
+        self.process_executor = None
+        self.thread_executor = None
+        self.dispatcher = None
+
+    def submit(self, file_result: dict, export_options: dict = None, priority: int = PRIORITY_NORMAL) -> ExportJob:
+        """
+        Add a file to export.
+        :param file_result: Analyze results of the file.
+        :type file_result: dict
+        :param export_options: Options passed to export_pool.export_file_summary().
+        :type export_options: dict
+        :param priority: PRIORITY_LOW, PRIORITY_NORMAL or PRIORITY_HIGH.
+        :type priority: int
+        :return: Job added to the queue.
+        :rtype: ExportJob
+        """
+        return self._submit([file_result], export_options, priority)
+
+    def submit_aggregate(self, file_results: list, output_path: str, export_options: dict = None,
+                         priority: int = PRIORITY_NORMAL) -> ExportJob:
+        """
+        Add files to combine into a single netCDF file.
+        :param file_results: Analyze results of each file.
+        :type file_results: list
+        :param output_path: netCDF file path.
+        :type output_path: str
+        :param export_options: The profile and instrument options are used.
+        :type export_options: dict
+        :param priority: PRIORITY_LOW, PRIORITY_NORMAL or PRIORITY_HIGH.
+        :type priority: int
+        :return: Job added to the queue.
+        :rtype: ExportJob
+        """
+        return self._submit(list(file_results), export_options, priority, output_path)
+
+    def _submit(self, file_results: list, export_options: dict, priority: int, output_path: str = None) -> ExportJob:
+        """
+        Add the job and start the dispatcher if it is not running.
+        :param file_results: Analyze results of the file, or of each file to combine.
+        :type file_results: list
+        :param export_options: Options passed to export_pool.export_file_summary().
+        :type export_options: dict
+        :param priority: PRIORITY_LOW, PRIORITY_NORMAL or PRIORITY_HIGH.
+        :type priority: int
+        :param output_path: netCDF file to combine the files into.  None to export a single file.
+        :type output_path: str
+        :return: Job added to the queue.
+        :rtype: ExportJob
+        """
+        with self.lock:
+            if self.manager is None:
+                self.manager = multiprocessing.Manager()
+                self.progress_queue = self.manager.Queue()
+                self.process_executor = ProcessPoolExecutor(max_workers=self.workers)
+                self.thread_executor = ThreadPoolExecutor(max_workers=1)
+
+            job = ExportJob(self.next_job_id, file_results, dict(export_options) if export_options else {},
+                            priority, self.next_job_id, output_path)
+            self.next_job_id += 1
+            self.jobs[job.job_id] = job
+            logging.debug("Queued export job " + str(job.job_id) + ": " + job.name)
+
+            if self.dispatcher is None:
+                self.dispatcher = threading.Thread(target=self._dispatch, name="ExportJobQueue", daemon=True)
+                self.dispatcher.start()
+            self.wake_event.set()
+
+        self._notify_state(job)
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Cancel the job.  A queued job is cancelled now.  A running job is
+        cancelled at the next batch and the partial netCDF file is removed.
+        :param job_id: ID of the job.
+        :type job_id: int
+        :return: TRUE if the job was not already complete.
+        :rtype: bool
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.is_final:
+                return False
+
+            if job.future is None:
+                job.state = JOB_CANCELLED
+                job.summary = {"FilePath": job.name, "Status": "cancelled", "Error": None}
+                logging.debug("Cancelled queued export job " + str(job_id))
+            else:
+                job.control.cancel()
+                logging.debug("Cancelling export job " + str(job_id))
+            self.wake_event.set()
+
+        if job.state == JOB_CANCELLED:
+            self._notify_state(job)
+        return True
+
+    def pause(self, job_id: int) -> bool:
+        """
+        Pause the job.  A queued job is not started until it is resumed.
+        A running job waits at the next batch.
+        :param job_id: ID of the job.
+        :type job_id: int
+        :return: TRUE if the job was paused.
+        :rtype: bool
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in (JOB_QUEUED, JOB_RUNNING):
+                return False
+            if job.control is not None:
+                job.control.pause()
+            job.state = JOB_PAUSED
+
+        self._notify_state(job)
+        return True
+
+    def resume(self, job_id: int) -> bool:
+        """
+        Resume a paused job.
+        :param job_id: ID of the job.
+        :type job_id: int
+        :return: TRUE if the job was resumed.
+        :rtype: bool
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state != JOB_PAUSED:
+                return False
+            if job.control is not None:
+                job.control.resume()
+                job.state = JOB_RUNNING
+            else:
+                job.state = JOB_QUEUED
+            self.wake_event.set()
+
+        self._notify_state(job)
+        return True
+
+    def set_priority(self, job_id: int, priority: int) -> bool:
+        """
+        Change the priority of a job that has not started.
+        :param job_id: ID of the job.
+        :type job_id: int
+        :param priority: PRIORITY_LOW, PRIORITY_NORMAL or PRIORITY_HIGH.
+        :type priority: int
+        :return: TRUE if the priority was changed.
+        :rtype: bool
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.future is not None or job.is_final:
+                return False
+            job.priority = priority
+            self.wake_event.set()
+
+        self._notify_state(job)
+        return True
+
+    def cancel_all(self):
+        """
+        Cancel all the jobs that are not complete.
+        :return:
+        :rtype:
+        """
+        with self.lock:
+            job_ids = list(self.jobs.keys())
+        for job_id in job_ids:
+            self.cancel(job_id)
+
+    def active(self) -> bool:
+        """
+        Check if any job is queued, running or paused.
+        :return: TRUE if a job is not complete.
+        :rtype: bool
+        """
+        with self.lock:
+            return any(not job.is_final for job in self.jobs.values())
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait for all the jobs to complete.  A paused job that is not resumed
+        will keep this waiting until the timeout.
+        :param timeout: Time in seconds to wait.  If None, wait until the jobs are complete.
+        :type timeout: float
+        :return: TRUE if all the jobs are complete.
+        :rtype: bool
+        """
+        start_time = time.monotonic()
+        while self.active():
+            if timeout is not None and time.monotonic() - start_time >= timeout:
+                return False
+            time.sleep(QUEUE_POLL_TIMEOUT)
+        return True
+
+    def shutdown(self, cancel: bool = True):
+        """
+        Stop the queue and the worker processes.
+        :param cancel: Cancel the jobs that are not complete.  If False, wait for them to complete.
+        :type cancel: bool
+        :return:
+        :rtype:
+        """
+        if cancel:
+            self.cancel_all()
+        self.wait()
+
+        with self.lock:
+            dispatcher = self.dispatcher
+        if dispatcher is not None:
+            dispatcher.join()
+
+        with self.lock:
+            if self.manager is not None:
+                self.process_executor.shutdown()
+                self.thread_executor.shutdown()
+                self.manager.shutdown()
+                self.manager = None
+                self.progress_queue = None
+                self.process_executor = None
+                self.thread_executor = None
+
+    def _dispatch(self):
+        """
+        Start the queued jobs when a worker is free, pass on the progress and
+        complete the jobs.  The thread stops when no job is left.
+        :return:
+        :rtype:
+        """
+        while True:
+            with self.lock:
+                self._start_jobs()
+                futures = {job.future: job for job in self.jobs.values()
+                           if job.future is not None and not job.is_final}
+                if not futures and not self.active():
+                    self.dispatcher = None
+                    return
+                self.wake_event.clear()
+
+            if futures:
+                done, _ = wait(futures.keys(), timeout=QUEUE_POLL_TIMEOUT, return_when=FIRST_COMPLETED)
+            else:
+                done = set()
+                self.wake_event.wait(QUEUE_POLL_TIMEOUT)
+
+            # Send the last progress of a job before it is complete
+            self._dispatch_progress()
+
+            for future in done:
+                self._complete_job(futures[future], future)
+
+    def _start_jobs(self):
+        """
+        Start the queued jobs in priority order while there are free workers.
+        A job is only started if all the jobs before it have started, so a
+        job splitting the file is not held back by smaller jobs.
+        :return:
+        :rtype:
+        """
+        used = sum(self.workers if job.is_split else 1 for job in self.jobs.values()
+                   if job.future is not None and not job.is_final)
+
+        queued = sorted((job for job in self.jobs.values() if job.state == JOB_QUEUED),
+                        key=lambda job: (-job.priority, job.sequence))
+        for job in queued:
+            needed = self.workers if job.is_split else 1
+            if used + needed > self.workers and used > 0:
+                break
+
+            job.control = JobControl(self.manager.Event(), self.manager.Event())
+            job.control.resume()
+            if job.is_split:
+                executor = self.thread_executor
+            else:
+                executor = self.process_executor
+            job.future = executor.submit(_run_job, job.job_id, job.file_results, job.output_path,
+                                         job.export_options, job.control, self.progress_queue)
+            job.state = JOB_RUNNING
+            used += needed
+            logging.debug("Started export job " + str(job.job_id) + ": " + job.name)
+            self._notify_state(job)
+
+    def _dispatch_progress(self):
+        """
+        Pass the progress in the queue to the callback.  The counts are
+        cumulative, so only the latest count for each job is passed on.
+        The jobs are updated under the lock and the callback is called after.
+        :return:
+        :rtype:
+        """
+        latest = drain_progress(self.progress_queue)
+        updated = []
+        with self.lock:
+            for job_id, ens_exported in latest.items():
+                job = self.jobs.get(job_id)
+                if job is None or job.is_final:
+                    continue
+                job.ens_exported = ens_exported
+                updated.append(job)
+
+        if self.job_progress_callback:
+            for job in updated:
+                self.job_progress_callback(job)
+
+    def _complete_job(self, job: ExportJob, future):
+        """
+        Set the summary and the final state of the job.
+        :param job: Job that has stopped.
+        :type job: ExportJob
+        :param future: Future of the job.
+        :type future: concurrent.futures.Future
+        :return:
+        :rtype:
+        """
+        try:
+            summary = future.result()
+        except Exception as ex:
+            # The worker process failed
+            logging.error("Error exporting " + job.name + ": " + str(ex))
+            summary = {"FilePath": job.name, "Status": "failed", "Error": str(ex)}
+
+        with self.lock:
+            job.summary = summary
+            if summary["Status"] == "cancelled":
+                job.state = JOB_CANCELLED
+            elif summary["Status"] == "failed":
+                job.state = JOB_FAILED
+            else:
+                job.state = JOB_COMPLETED
+                job.ens_exported = job.total_ensembles
+        logging.debug("Export job " + str(job.job_id) + " " + job.state + ": " + job.name)
+
+        self._notify_state(job)
+
+    def _notify_state(self, job: ExportJob):
+        """
+        Pass the state of the job to the callback.
+        :param job: Job that changed.
+        :type job: ExportJob
+        :return:
+        :rtype:
+        """
+        if self.job_state_callback:
+            self.job_state_callback(job)
@@ -0,0 +1,164 @@
+import os
+import sys
+import copy
+import logging
+
+
+# Share of the available memory used to hold the decoded ensembles of a batch
+DECODE_SHARE = 0.2
+
+# Share of the available memory used by the write buffer
+WRITE_BUFFER_SHARE = 0.5
+
+# Share of the available memory used by the HDF5 chunk cache of all the variables
+CHUNK_CACHE_SHARE = 0.15
+
+# Share of the available memory used by the pages of a memory mapped file that have been read
+READ_SHARE = 0.15
+
+# Fewest ensembles in a decode batch
+MIN_BATCH_SIZE = 16
+
+# Fewest bytes used for the buffers when the process already uses most of the budget
+MIN_AVAILABLE = 8 * 1024 * 1024
+
+# Bytes in a megabyte of the budget
+BYTES_PER_MB = 1024 * 1024
+
+
+def current_rss() -> int:
+    """
+    Get the resident memory of this process.  On Linux this is the current
+    resident memory.  On other systems the peak resident memory is used.
+    :return: Resident memory in bytes.  0 if it can not be found.
+    :rtype: int
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return 0
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux gives kilobytes, macOS gives bytes
+    if sys.platform == "darwin":
+        return max_rss
+    return max_rss * 1024
+
+
+class MemoryBudget:
+    """
+    Limit the memory used by an export to a resident memory (RSS) budget.
+
+    The memory the process already uses when the export starts, such as
+    Python and the libraries, counts toward the budget.  The rest is shared
+    between the decoded batch, the write buffer, the HDF5 chunk cache and the
+    pages of a memory mapped file.  These are all a fixed size, so the memory
+    used does not grow with the size of the file.
+
+    The budget only sets an upper limit.  The batch and write buffer are never
+    larger than without a budget.  The write buffer always holds at least one
+    time chunk, so a very small budget can be exceeded.
+    """
+
+    def __init__(self, budget_mb: float):
+        """
+        Initialize the budget using the memory the process uses now.
+        :param budget_mb: Resident memory budget of the process in megabytes.
+        :type budget_mb: float
+        """
+        self.budget = int(budget_mb * BYTES_PER_MB)
+        self.baseline = current_rss()
+        self.available = self.budget - self.baseline
+
+        if self.available < MIN_AVAILABLE:
+            logging.warning("The process already uses " + str(self.baseline // BYTES_PER_MB) + " MB of the " +
+                            str(budget_mb) + " MB memory budget")
+            self.available = MIN_AVAILABLE
+
+    @staticmethod
+    def from_profile(profile):
+        """
+        Create the memory budget of the export profile.
+        :param profile: Export profile.
+        :type profile: ExportProfile
+        :return: Memory budget.  None if the profile has no memory budget.
+        :rtype: MemoryBudget
+        """
+        if profile is None or not profile.memory_budget:
+            return None
+        return MemoryBudget(profile.memory_budget)
+
+    def batch_size(self, ensemble_bytes: int, max_size: int) -> int:
+        """
+        Get the number of ensembles to decode at a time.
+        :param ensemble_bytes: Bytes of a decoded ensemble.
+        :type ensemble_bytes: int
+        :param max_size: Batch size without a budget.
+        :type max_size: int
+        :return: Number of ensembles in a batch.
+        :rtype: int
+        """
+        size = int(self.available * DECODE_SHARE) // max(ensemble_bytes, 1)
+        return max(min(size, max_size), min(MIN_BATCH_SIZE, max_size))
+
+    def buffer_size(self, ensemble_bytes: int, time_chunk: int, max_size: int) -> int:
+        """
+        Get the number of ensembles in the write buffer.  This is a multiple
+        of the time chunk, so each chunk is written once.
+        :param ensemble_bytes: Bytes of an ensemble in the write buffer.
+        :type ensemble_bytes: int
+        :param time_chunk: Number of ensembles in a chunk.
+        :type time_chunk: int
+        :param max_size: Write buffer size without a budget.
+        :type max_size: int
+        :return: Number of ensembles in the write buffer.
+        :rtype: int
+        """
+        size = int(self.available * WRITE_BUFFER_SHARE) // max(ensemble_bytes, 1)
+        size = size // time_chunk * time_chunk
+        if size < time_chunk:
+            logging.warning("A time chunk of " + str(time_chunk) + " ensembles does not fit in the memory budget")
+            size = time_chunk
+        return min(size, max_size)
+
+    def chunk_cache_size(self, num_variables: int) -> int:
+        """
+        Get the HDF5 chunk cache size of each variable.  The write buffer
+        writes whole chunks, so the chunks do not need to stay in the cache.
+        :param num_variables: Number of variables in the file.
+        :type num_variables: int
+        :return: Chunk cache size in bytes.
+        :rtype: int
+        """
+        return int(self.available * CHUNK_CACHE_SHARE) // max(num_variables, 1)
+
+    def share(self, parts: int):
+        """
+        Split the budget between writers that hold their buffers at the same
+        time, such as the subsystem groups of a file.  Each part sizes its
+        batch, write buffer and chunk cache from its share.
+        :param parts: Number of parts sharing the budget.
+        :type parts: int
+        :return: Budget of each part.
+        :rtype: MemoryBudget
+        """
+        part = copy.copy(self)
+        part.available = max(self.available // max(parts, 1), MIN_AVAILABLE)
+        return part
+
+    def read_size(self) -> int:
+        """
+        Get the bytes of a memory mapped file that can stay in memory
+        after they are read.
+        :return: Number of bytes.
+        :rtype: int
+        """
+        return int(self.available * READ_SHARE)
@@ -0,0 +1,299 @@
+import os
+import datetime
+import logging
+import numpy as np
+import netCDF4
+from .rtb_decoder import ANCILLARY_FIELDS, BAD_VELOCITY
+from .batch_decoder import EnsembleBatch
+from .batch_writer import BatchWriter, VARIABLE_ATTRS, VELOCITY_VARIABLES, TIME_UNITS_PREFIX, TIME_UNITS_FORMAT, \
+    has_ancillary, analyze_attrs
+from .export_profile import ExportProfile
+from .memory_budget import MemoryBudget
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION, STAGE_WRITE
+
+
+def read_resume_state(file_path: str) -> dict:
+    """
+    Read the resume state stored in a netCDF file when it was closed.  The
+    resume offset is the byte offset in the RTB file after the last ensemble
+    written.  The analyze results of the ensembles written are also read, so
+    they can be continued when new ensembles are appended.
+
+    If the number of ensembles in the file does not match the number when the
+    resume state was stored, such as an append that failed, the state is not used.
+    :param file_path: netCDF file path.
+    :type file_path: str
+    :return: ResumeOffset, SourceHash, NumBins, NumBeams and the analyze Result.  None if the file has no resume state.
+    :rtype: dict
+    """
+    if not os.path.exists(file_path):
+        return None
+
+    try:
+        with netCDF4.Dataset(file_path, "r") as dataset:
+            attrs = dataset.__dict__
+            if "resume_offset" not in attrs or "source_hash" not in attrs:
+                return None
+            if int(attrs.get("resume_record_count", -1)) != len(dataset.dimensions["time"]):
+                logging.debug("Resume state of " + file_path + " does not match the ensembles in the file")
+                return None
+
+            result = {
+                "EnsCount": int(attrs.get("ens_count", 0)),
+                "EnsPairCount": int(attrs.get("ens_pair_count", 0)),
+                "EnsembleDeltaTime": float(attrs.get("ensemble_delta_time", 0.0)),
+                "FirstEnsDateTime": None,
+                "LastEnsDateTime": None,
+            }
+            if "time_coverage_start" in attrs:
+                result["FirstEnsDateTime"] = datetime.datetime.fromisoformat(attrs["time_coverage_start"])
+            if "time_coverage_end" in attrs:
+                result["LastEnsDateTime"] = datetime.datetime.fromisoformat(attrs["time_coverage_end"])
+
+            return {
+                "ResumeOffset": int(attrs["resume_offset"]),
+                "SourceHash": str(attrs["source_hash"]),
+                "NumBins": len(dataset.dimensions["bin"]),
+                "NumBeams": len(dataset.dimensions["beam"]),
+                "Result": result,
+            }
+    except (OSError, KeyError, ValueError) as ex:
+        logging.debug("Could not read the resume state of " + file_path + ": " + str(ex))
+        return None
+
+
+class NetcdfWriter(BatchWriter):
+    """
+    Write the decoded ensembles to a netCDF 4 file using CF time.
+    The file is created when the first batch is written, because the
+    number of bins and beams and the data sets available are only known
+    from the ensembles.  The bin and beam dimensions are the shape of the
+    batches, which the exports set from the whole file with file_shape(),
+    so a file starting on a vertical beam ensemble still has all the beams.
+    The time dimension is unlimited, so the number of ensembles does not
+    need to be known before writing.
+
+    The ensembles are held in a write buffer and written in large blocks
+    using the chunk shape and compression of the export profile.
+
+    In append mode, the ensembles are added to the end of an existing file.
+    The chunk shape and compression of the existing file are kept.
+
+    With a memory budget, the write buffer and the HDF5 chunk cache of each
+    variable are sized to fit in the budget.  Otherwise the HDF5 chunk cache
+    of each variable can fill up to the netCDF library default.
+
+    With a parent dataset, the ensembles are written to a group of the parent
+    instead of a new file.  Each group has its own dimensions, so the groups
+    can have a different number of bins and beams.  The parent is not closed.
+    """
+
+    def __init__(self, file_path: str, profile: ExportProfile = None, append: bool = False,
+                 memory_budget: MemoryBudget = None, instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+                 parent: netCDF4.Dataset = None, group_name: str = None):
+        """
+        Initialize the writer.
+        :param file_path: File path of the netCDF file to create.
+        :type file_path: str
+        :param profile: Chunk shape, compression and write buffer settings.  If None, the default profile.
+        :type profile: ExportProfile
+        :param append: Append to the file if it exists instead of creating a new file.
+        :type append: bool
+        :param memory_budget: Memory budget of the export.  If None, the memory is not limited.
+        :type memory_budget: MemoryBudget
+        :param instrumentation: Records the write time, the records written and the buffer writes.
+        :type instrumentation: Instrumentation
+        :param parent: Open netCDF file to create the group in.  If None, the netCDF file is created.
+        :type parent: netCDF4.Dataset
+        :param group_name: Name of the group created in the parent.
+        :type group_name: str
+        """
+        super().__init__(file_path, profile, memory_budget, instrumentation)
+        self.append = append
+        self.parent = parent
+        self.group_name = group_name
+        self.dataset = None
+
+    def _start(self, batch: EnsembleBatch):
+        """
+        Create the netCDF file, or open it to append to.
+        :param batch: First batch.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        if self.append and self.parent is None and os.path.exists(self.file_path):
+            self._open(batch)
+        else:
+            self._create(batch)
+
+    def _write_buffer(self, start: int, end: int, columns: dict):
+        """
+        Write each variable to the file with a single slice assignment.
+        :param start: Index of the first ensemble in the file.
+        :type start: int
+        :param end: Index after the last ensemble.
+        :type end: int
+        :param columns: Variable name and the values of the ensembles.
+        :type columns: dict
+        :return:
+        :rtype:
+        """
+        variables = self.dataset.variables
+        for var_name, values in columns.items():
+            if var_name == "time":
+                # Ensembles without a valid time are masked
+                values = np.ma.masked_invalid(values)
+            variables[var_name][start:end] = values
+
+    def _create(self, batch: EnsembleBatch):
+        """
+        Create the netCDF file using the shape of the first batch to set the dimensions and variables.
+        :param batch: First batch.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        if self.parent is not None:
+            self.dataset = self.parent.createGroup(self.group_name)
+        else:
+            self.dataset = netCDF4.Dataset(self.file_path, "w", format="NETCDF4")
+            self.dataset.Conventions = "CF-1.6"
+            self.dataset.history = "Created by Rowe Technologies Inc. ExportR"
+
+        # Use the first ensemble time as the time reference
+        first_datetime = self._set_time_ref(batch)
+
+        self.dataset.serial_number = batch.serial_number
+        self.dataset.subsystem_code = batch.subsystem_code
+        self.dataset.subsystem_config = batch.subsystem_config
+
+        # Dimensions
+        self.dataset.createDimension("time", None)
+        self.dataset.createDimension("bin", batch.num_bins)
+        self.dataset.createDimension("beam", batch.num_beams)
+
+        # Coordinates
+        time_options = self.profile.variable_options()
+        time_var = self.dataset.createVariable("time", "f8", ("time",), **time_options)
+        time_var.units = TIME_UNITS_PREFIX + first_datetime.strftime(TIME_UNITS_FORMAT)
+        time_var.calendar = "standard"
+        time_var.standard_name = "time"
+
+        ens_num_var = self.dataset.createVariable("ens_num", "i4", ("time",), **time_options)
+        ens_num_var.long_name = "Ensemble Number"
+
+        beam_var = self.dataset.createVariable("beam", "i4", ("beam",))
+        beam_var[:] = np.arange(1, batch.num_beams + 1)
+
+        ancillary = has_ancillary(batch)
+        if ancillary:
+            bin_var = self.dataset.createVariable("bin_range", "f4", ("bin",))
+            bin_var.long_name = "Range to the Bin"
+            bin_var.units = "m"
+            bin_var[:] = batch.ancillary[0, 0] + np.arange(batch.num_bins) * batch.ancillary[0, 1]
+
+        # Bin and beam data
+        bin_beam_options = self.profile.variable_options(batch.num_bins, batch.num_beams)
+        for var_name, values in batch.bin_beam.items():
+            var = self.dataset.createVariable(var_name, values.dtype, ("time", "bin", "beam"), **bin_beam_options)
+            var.setncatts(VARIABLE_ATTRS.get(var_name, {}))
+            if var_name in VELOCITY_VARIABLES:
+                var.missing_value = np.float32(BAD_VELOCITY)
+
+        # Ancillary data
+        if ancillary:
+            for field in ANCILLARY_FIELDS:
+                var = self.dataset.createVariable(field, "f4", ("time",), **time_options)
+                var.setncatts(VARIABLE_ATTRS.get(field, {}))
+
+        self._create_buffer(batch, ancillary)
+        self._set_chunk_cache()
+
+    def _open(self, batch: EnsembleBatch):
+        """
+        Open an existing netCDF file to append the ensembles.  The ensembles
+        must have the same number of bins and beams and data sets as the file.
+        :param batch: First batch to append.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        self.dataset = netCDF4.Dataset(self.file_path, "a")
+        dimensions = self.dataset.dimensions
+        variables = self.dataset.variables
+
+        if len(dimensions["bin"]) != batch.num_bins or len(dimensions["beam"]) != batch.num_beams:
+            message = (self.file_path + " has " + str(len(dimensions["bin"])) + " bins and " +
+                       str(len(dimensions["beam"])) + " beams, the ensembles have " + str(batch.num_bins) +
+                       " bins and " + str(batch.num_beams) + " beams")
+            self.dataset.close()
+            self.dataset = None
+            raise ValueError(message)
+
+        missing = [var_name for var_name in batch.bin_beam if var_name not in variables]
+        if missing:
+            self.dataset.close()
+            self.dataset = None
+            raise ValueError(self.file_path + " does not have the data sets " + ", ".join(missing))
+
+        # Continue the time reference of the file
+        units = variables["time"].units
+        first_datetime = datetime.datetime.strptime(units[len(TIME_UNITS_PREFIX):], TIME_UNITS_FORMAT)
+        self.time_ref = np.datetime64(first_datetime, "us")
+        self.ens_index = len(dimensions["time"])
+
+        self._create_buffer(batch, ANCILLARY_FIELDS[0] in variables)
+        self._set_chunk_cache()
+
+    def _set_chunk_cache(self):
+        """
+        Limit the HDF5 chunk cache of the variables written for each ensemble
+        to the memory budget.  Without this, each variable keeps up to the
+        netCDF library default cache size (64 MB in netCDF 4.9) of written
+        chunks in memory.
+        :return:
+        :rtype:
+        """
+        if self.memory_budget is None:
+            return
+
+        cache_size = self.memory_budget.chunk_cache_size(len(self.buffer))
+        for var_name in self.buffer:
+            self.dataset.variables[var_name].set_var_chunk_cache(size=cache_size)
+
+    def close(self, analyze_result: dict = None, resume_offset: int = None, source_hash: str = None):
+        """
+        Close the file.  The analyze results are only known after all the ensembles
+        are written, so they are added to the file attributes now.
+
+        The resume offset and source hash are stored so new ensembles added to the
+        RTB file can be appended later.  See read_resume_state().
+        :param analyze_result: Analyze results to store in the file.
+        :type analyze_result: dict
+        :param resume_offset: Byte offset in the RTB file after the last ensemble written.
+        :type resume_offset: int
+        :param source_hash: Hash of the start of the RTB file to check it is the same file when appending.
+        :type source_hash: str
+        :return:
+        :rtype:
+        """
+        if self.dataset is None:
+            return
+
+        with self.instrumentation.stage(STAGE_WRITE):
+            self.flush()
+
+        if analyze_result:
+            self.dataset.setncatts(analyze_attrs(analyze_result))
+
+        if resume_offset is not None and source_hash is not None:
+            self.dataset.resume_offset = np.int64(resume_offset)
+            self.dataset.resume_record_count = np.int64(self.ens_index)
+            self.dataset.source_hash = source_hash
+
+        # The parent file is closed by its owner
+        if self.parent is None:
+            with self.instrumentation.stage(STAGE_WRITE):
+                self.dataset.close()
+        self.dataset = None
@@ -0,0 +1,71 @@
+import os
+
+
+# Output formats of the single pass export
+#   netcdf   netCDF 4 file using CF time
+#   zarr     Zarr directory store with the same variables, chunks and compression as the netCDF file.
+#            zarr 3 must be installed.
+#   parquet  Parquet file with a row for each ensemble and bin, for pandas and Dask.  pyarrow must be installed.
+FORMAT_NETCDF = "netcdf"
+FORMAT_ZARR = "zarr"
+FORMAT_PARQUET = "parquet"
+OUTPUT_FORMATS = (FORMAT_NETCDF, FORMAT_ZARR, FORMAT_PARQUET)
+DEFAULT_FORMATS = (FORMAT_NETCDF,)
+
+# File extension of each output format
+FORMAT_EXTENSIONS = {
+    FORMAT_NETCDF: ".nc",
+    FORMAT_ZARR: ".zarr",
+    FORMAT_PARQUET: ".parquet",
+}
+
+# Package needed to write each output format and how to install it
+FORMAT_PACKAGES = {
+    FORMAT_ZARR: ("zarr", "pip install zarr"),
+    FORMAT_PARQUET: ("pyarrow", "pip install pyarrow"),
+}
+
+
+def check_format(output_format: str):
+    """
+    Check the output format can be written.
+    :param output_format: Output format in OUTPUT_FORMATS.
+    :type output_format: str
+    :return:
+    :rtype:
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format " + output_format + ".  Use one of " + ", ".join(OUTPUT_FORMATS))
+    if output_format in FORMAT_PACKAGES:
+        package, install = FORMAT_PACKAGES[output_format]
+        try:
+            __import__(package)
+        except ImportError:
+            raise ValueError(package + " is not installed, it is needed for the " + output_format +
+                             " format.  Install it with " + install)
+
+
+def is_netcdf_only(formats) -> bool:
+    """
+    Check if only the netCDF file is written.  The append, split, subsystem
+    group and combine exports only write netCDF.
+    :param formats: Output formats.  None for the default formats.
+    :type formats: list
+    :return: TRUE if netCDF is the only format.
+    :rtype: bool
+    """
+    return not formats or list(formats) == [FORMAT_NETCDF]
+
+
+def format_output_path(output_path: str, output_format: str) -> str:
+    """
+    Get the output path of the format.  The extension of the netCDF
+    file path is changed to the extension of the format.
+    :param output_path: netCDF file path.
+    :type output_path: str
+    :param output_format: Output format in OUTPUT_FORMATS.
+    :type output_format: str
+    :return: Output path of the format.
+    :rtype: str
+    """
+    return os.path.splitext(output_path)[0] + FORMAT_EXTENSIONS[output_format]
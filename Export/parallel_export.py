@@ -0,0 +1,441 @@
+import os
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .rtb_reader import create_reader
+from .rtb_decoder import decode_ensemble_header
+from .batch_decoder import BatchDecoder, EnsembleBatch, DEFAULT_BATCH_SIZE, file_shape
+from .ensemble_index import EnsembleIndex
+from .netcdf_writer import NetcdfWriter
+from .export_profile import ExportProfile
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from .job_control import JobControl, JobCancelled, NULL_JOB_CONTROL
+from .analyze_stats import AnalyzeStats
+from .analyze_cache import head_hash
+from .progress import ProgressReporter, drain_progress
+from .stream_export import StreamExporter, default_output_path
+
+
+# Smallest part of the file given to a worker.  Smaller files are split into fewer parts.
+MIN_PART_SIZE = 32 * 1024 * 1024
+
+# Time in seconds to wait for progress before checking if the parts are complete
+PROGRESS_POLL_TIMEOUT = 0.1
+
+# Columns stored for each record in the part files, other than the bin and beam data
+PART_COLUMNS = ("ens_num", "datetimes", "is_pair", "offsets", "end_offsets", "ancillary")
+
+# Prefix of the bin and beam data columns in the part files
+BIN_BEAM_PREFIX = "bin_beam."
+
+
+def find_record_start(file_path: str, offset: int) -> int:
+    """
+    Find the start of the first record at or after the offset.  The file is
+    scanned for the next ensemble with a valid header and checksum.  A vertical
+    beam ensemble belongs to the 4 beam ensemble before it, so a record never
+    starts with a vertical beam ensemble.
+    :param file_path: RTB file path.
+    :type file_path: str
+    :param offset: Byte offset to start looking.
+    :type offset: int
+    :return: Byte offset of the record.  The file size if no ensemble is found.
+    :rtype: int
+    """
+    reader = create_reader(file_path)
+    ensembles = reader.ensembles(offset)
+    try:
+        skip_vertical = True
+        for ens_offset, ens_bytes in ensembles:
+            if skip_vertical and decode_ensemble_header(ens_bytes).num_beams == 1:
+                # Start at the ensemble after the vertical beam
+                skip_vertical = False
+                continue
+            return ens_offset
+    finally:
+        ensembles.close()
+
+    return os.path.getsize(file_path)
+
+
+def split_file(file_path: str, parts: int) -> list:
+    """
+    Split the file into byte ranges that start at a record.  If the ensemble
+    index exists and matches the file, the ranges start at the records in the
+    index.  Otherwise the file is scanned for the next record after each split.
+    :param file_path: RTB file path.
+    :type file_path: str
+    :param parts: Number of ranges to create.  Fewer are created for small files.
+    :type parts: int
+    :return: List of (start offset, end offset).
+    :rtype: list
+    """
+    file_size = os.path.getsize(file_path)
+    parts = max(1, min(parts, file_size // MIN_PART_SIZE))
+
+    record_offsets = None
+    index = EnsembleIndex.load_for_file(file_path)
+    if index is not None and len(index) > 0:
+        record_offsets = np.asarray(index.offsets)[index.record_starts()]
+
+    boundaries = [0]
+    for part in range(1, parts):
+        split_offset = file_size * part // parts
+        if record_offsets is not None:
+            record = int(np.searchsorted(record_offsets, split_offset))
+            start = int(record_offsets[record]) if record < len(record_offsets) else file_size
+        else:
+            start = find_record_start(file_path, split_offset)
+
+        if boundaries[-1] < start < file_size:
+            boundaries.append(start)
+    boundaries.append(file_size)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _batch_columns(batch: EnsembleBatch) -> dict:
+    """
+    Get all the columns of the batch to store in the part files.
+    :param batch: Decoded batch.
+    :type batch: EnsembleBatch
+    :return: Column name and the values of the records in the batch.
+    :rtype: dict
+    """
+    columns = {name: getattr(batch, name)[:batch.count] for name in PART_COLUMNS}
+    for var_name, values in batch.bin_beam.items():
+        columns[BIN_BEAM_PREFIX + var_name] = values[:batch.count]
+    return columns
+
+
+def _export_part(part_index: int, file_path: str, start_offset: int, end_offset: int, part_dir: str,
+                 num_bins: int, num_beams: int, batch_size: int, progress_queue, instrument: bool = False,
+                 job_control: JobControl = NULL_JOB_CONTROL, hold_unpaired: bool = False) -> dict:
+    """
+    Decode a byte range of the file within a worker process.  The decoded
+    columns are written to raw files in the part folder, so they can be
+    merged in file order.
+    :param part_index: Index of the part in the file.
+    :type part_index: int
+    :param file_path: RTB file path.
+    :type file_path: str
+    :param start_offset: Byte offset of the first record in the part.
+    :type start_offset: int
+    :param end_offset: Byte offset of the next part.
+    :type end_offset: int
+    :param part_dir: Folder to write the part files.
+    :type part_dir: str
+    :param num_bins: Number of bins to store.
+    :type num_bins: int
+    :param num_beams: Number of beams to store.
+    :type num_beams: int
+    :param batch_size: Number of ensembles to decode at a time.
+    :type batch_size: int
+    :param progress_queue: Queue to send the number of records decoded.  None if not listening.
+    :type progress_queue: multiprocessing.Queue
+    :param instrument: Record the time of each stage and the counters of the part.
+    :type instrument: bool
+    :param job_control: Cancel or pause the export.  The flags are shared with the main process.
+    :type job_control: JobControl
+    :param hold_unpaired: Do not decode a 4 beam ensemble at the end of paired ensembles.  Used for the last part.
+    :type hold_unpaired: bool
+    :return: Information of the part including the columns, number of records and end of the last ensemble.
+    :rtype: dict
+    """
+    progress_callback = None
+    if progress_queue is not None:
+        def progress_callback(ens_exported):
+            progress_queue.put((part_index, ens_exported))
+    progress = ProgressReporter(progress_callback)
+
+    info = {"Index": part_index, "StartOffset": start_offset, "EndOffset": end_offset,
+            "Count": 0, "LastEnd": start_offset, "Columns": {}}
+    instrumentation = Instrumentation() if instrument else NULL_INSTRUMENTATION
+    reader = create_reader(file_path, instrumentation=instrumentation)
+    decoder = BatchDecoder(batch_size, num_bins, num_beams, instrumentation=instrumentation)
+    files = {}
+
+    try:
+        for batch in decoder.batches(reader.ensembles(start_offset, end_offset), hold_unpaired):
+            job_control.check()
+            columns = _batch_columns(batch)
+            if not files:
+                info["SerialNumber"] = batch.serial_number
+                info["SubsystemCode"] = batch.subsystem_code
+                info["SubsystemConfig"] = int(batch.subsystem_config)
+                info["NumBins"] = batch.num_bins
+                info["NumBeams"] = batch.num_beams
+                for name, values in columns.items():
+                    info["Columns"][name] = {"Path": os.path.join(part_dir, str(part_index) + "." + name + ".bin"),
+                                             "Dtype": values.dtype.str,
+                                             "Shape": list(values.shape[1:])}
+                    files[name] = open(info["Columns"][name]["Path"], "wb")
+
+            for name, values in columns.items():
+                np.ascontiguousarray(values).tofile(files[name])
+
+            info["Count"] += batch.count
+            info["LastEnd"] = int(batch.end_offsets[batch.count - 1])
+            if progress.enabled:
+                progress.add(batch.count)
+    finally:
+        for file in files.values():
+            file.close()
+
+    # The 4 beam ensemble held is read again with its vertical beam by the next append
+    if decoder.held_offset is not None:
+        info["LastEnd"] = decoder.held_offset
+
+    progress.finish()
+    info["BadBytes"] = reader.bad_bytes
+    info["BadChecksums"] = reader.bad_checksums
+    if instrument:
+        info["Instrumentation"] = instrumentation.result()
+    return info
+
+
+def _part_columns(info: dict) -> dict:
+    """
+    Memory map the columns of the part.
+    :param info: Information of the part.
+    :type info: dict
+    :return: Column name and the values.
+    :rtype: dict
+    """
+    columns = {}
+    for name, column in info["Columns"].items():
+        shape = (info["Count"],) + tuple(column["Shape"])
+        columns[name] = np.memmap(column["Path"], dtype=np.dtype(column["Dtype"]), mode="r", shape=shape)
+    return columns
+
+
+def _part_batch(info: dict, columns: dict, start: int, stop: int) -> EnsembleBatch:
+    """
+    Create a batch from the records of the part.
+    :param info: Information of the part.
+    :type info: dict
+    :param columns: Columns of the part.
+    :type columns: dict
+    :param start: First record.
+    :type start: int
+    :param stop: Record to stop at.  This record is not included.
+    :type stop: int
+    :return: Batch of the records.
+    :rtype: EnsembleBatch
+    """
+    batch = EnsembleBatch()
+    batch.count = stop - start
+    batch.serial_number = info["SerialNumber"]
+    batch.subsystem_code = info["SubsystemCode"]
+    batch.subsystem_config = info["SubsystemConfig"]
+    batch.num_bins = info["NumBins"]
+    batch.num_beams = info["NumBeams"]
+
+    for name, values in columns.items():
+        if name.startswith(BIN_BEAM_PREFIX):
+            batch.bin_beam[name[len(BIN_BEAM_PREFIX):]] = values[start:stop]
+        else:
+            setattr(batch, name, values[start:stop])
+    return batch
+
+
+class ParallelExporter:
+    """
+    Export a single RTB file using multiple processes.  The file is split
+    into byte ranges that start at a record and each range is decoded in
+    its own process.  The decoded parts are written to raw files, then
+    merged in file order into a single netCDF file.
+
+    Each part reads every ensemble that starts within its range, completing
+    an ensemble that ends past the range.  When the parts are merged, any
+    record of a part that starts before the end of the last ensemble of the
+    previous part is a duplicate and is dropped.  All the parts use the
+    number of bins and beams of the file from file_shape(), as the single
+    process export does, so the parts can be merged.  As in the single
+    process export, a 4 beam ensemble at the end of paired ensembles is not
+    exported, so it is read again with its vertical beam when appending.
+
+    The progress counts each record half when it is decoded and half when
+    it is written to the netCDF file.
+
+    With instrumentation, the stages of all the parts are added together, so
+    the read, search, checksum and decode times are the total of the workers.
+
+    The job control is checked by each worker and by the merge.  A cancelled
+    export removes the part files and the partial netCDF file.
+    """
+
+    def __init__(self, file_path: str, output_path: str = None, workers: int = None,
+                 ensemble_progress_callback=None, profile: ExportProfile = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+                 job_control: JobControl = NULL_JOB_CONTROL):
+        """
+        Initialize the exporter.
+        :param file_path: RTB file path to export.
+        :type file_path: str
+        :param output_path: netCDF file path.  If None, the RTB file path with the .nc extension.
+        :type output_path: str
+        :param workers: Number of worker processes.  If None, the number of CPU cores.
+        :type workers: int
+        :param ensemble_progress_callback: Called with the number of ensembles exported so far.  The calls are rate limited.
+        :type ensemble_progress_callback: function(ens_exported)
+        :param profile: Chunk shape, compression and write buffer of the netCDF file.  If None, the default profile.
+        :type profile: ExportProfile
+        :param batch_size: Number of ensembles to decode and write at a time.
+        :type batch_size: int
+        :param instrumentation: Records the time of each stage and the counters.
+        :type instrumentation: Instrumentation
+        :param job_control: Cancel or pause the export.
+        :type job_control: JobControl
+        """
+        self.file_path = file_path
+        self.output_path = output_path if output_path else default_output_path(file_path)
+        self.workers = workers if workers and workers > 0 else (os.cpu_count() or 1)
+        self.progress = ProgressReporter(ensemble_progress_callback)
+        self.profile = profile
+        self.batch_size = batch_size
+        self.instrumentation = instrumentation
+        self.job_control = job_control
+
+    def export(self) -> dict:
+        """
+        Export the file.  If the export fails, the partial netCDF file is removed.
+        :return: Analyze results of the file.
+        :rtype: dict
+        """
+        ranges = split_file(self.file_path, self.workers)
+        if len(ranges) <= 1:
+            # Not worth splitting
+            return StreamExporter(self.file_path, self.output_path,
+                                  ensemble_progress_callback=self.progress.callback,
+                                  profile=self.profile, batch_size=self.batch_size,
+                                  instrumentation=self.instrumentation, job_control=self.job_control).export()
+
+        logging.debug("Parallel Export netCDF: " + self.file_path + " in " + str(len(ranges)) + " parts")
+        num_bins, num_beams = file_shape(self.file_path)
+
+        # Store the parts next to the output file, they are about the size of the RTB file
+        output_dir = os.path.dirname(os.path.abspath(self.output_path))
+        part_dir = tempfile.mkdtemp(prefix="." + os.path.basename(self.output_path) + ".parts-", dir=output_dir)
+        try:
+            infos = self._export_parts(ranges, part_dir, num_bins, num_beams)
+            result = self._merge(infos)
+            self.progress.finish()
+            return result
+        finally:
+            shutil.rmtree(part_dir, ignore_errors=True)
+
+    def _export_parts(self, ranges: list, part_dir: str, num_bins: int, num_beams: int) -> list:
+        """
+        Decode all the parts in the worker processes.
+        :param ranges: List of (start offset, end offset) of each part.
+        :type ranges: list
+        :param part_dir: Folder to write the part files.
+        :type part_dir: str
+        :param num_bins: Number of bins to store.
+        :type num_bins: int
+        :param num_beams: Number of beams to store.
+        :type num_beams: int
+        :return: Information of each part in file order.
+        :rtype: list
+        """
+        infos = [None] * len(ranges)
+
+        # The progress of all the parts is combined
+        part_progress = {}
+
+        with multiprocessing.Manager() as manager:
+            progress_queue = manager.Queue() if self.progress.enabled else None
+
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(ranges))) as executor:
+                futures = {}
+                for part_index, (start_offset, end_offset) in enumerate(ranges):
+                    future = executor.submit(_export_part, part_index, self.file_path, start_offset, end_offset,
+                                             part_dir, num_bins, num_beams, self.batch_size, progress_queue,
+                                             self.instrumentation.enabled, self.job_control,
+                                             part_index == len(ranges) - 1)
+                    futures[future] = part_index
+
+                pending = set(futures.keys())
+                try:
+                    while pending:
+                        done, pending = wait(pending, timeout=PROGRESS_POLL_TIMEOUT, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            # Raise the error of a failed part
+                            infos[futures[future]] = future.result()
+                            self.instrumentation.merge(infos[futures[future]].get("Instrumentation"))
+
+                        if progress_queue is not None:
+                            for part_index, ens_exported in drain_progress(progress_queue).items():
+                                part_progress[part_index] = max(ens_exported, part_progress.get(part_index, 0))
+                            self.progress.update(sum(part_progress.values()) // 2)
+
+                        self.job_control.check()
+                except JobCancelled:
+                    # Do not start the parts waiting for a worker
+                    for future in pending:
+                        future.cancel()
+                    raise
+
+        return infos
+
+    def _merge(self, infos: list) -> dict:
+        """
+        Merge the parts into the netCDF file in file order.  Any record that starts
+        before the end of the last ensemble in the previous part is dropped.
+        :param infos: Information of each part in file order.
+        :type infos: list
+        :return: Analyze results of the file.
+        :rtype: dict
+        """
+        writer = NetcdfWriter(self.output_path, self.profile, instrumentation=self.instrumentation)
+        stats = AnalyzeStats()
+        decoded = sum(info["Count"] for info in infos)
+        written = 0
+
+        # End of the last ensemble written
+        last_end = 0
+
+        try:
+            for info in infos:
+                if info["Count"] == 0:
+                    last_end = max(last_end, info["LastEnd"])
+                    continue
+
+                columns = _part_columns(info)
+                first = int(np.searchsorted(columns["offsets"], last_end))
+                if first > 0:
+                    logging.debug("Dropped " + str(first) + " duplicate records at the start of part " +
+                                  str(info["Index"]))
+
+                for start in range(first, info["Count"], self.batch_size):
+                    self.job_control.check()
+                    batch = _part_batch(info, columns, start, min(start + self.batch_size, info["Count"]))
+                    writer.write_batch(batch)
+                    stats.add_batch(batch.count, batch.pair_count(), *batch.time_summary())
+
+                    written += batch.count
+                    if self.progress.enabled:
+                        self.progress.update((decoded + written) // 2)
+
+                last_end = max(last_end, info["LastEnd"])
+                del columns
+        except Exception:
+            writer.abort()
+            if os.path.exists(self.output_path):
+                os.remove(self.output_path)
+            raise
+
+        result = stats.result(self.file_path)
+        if last_end > 0:
+            writer.close(result, last_end, head_hash(self.file_path, last_end))
+        else:
+            writer.close(result)
+
+        logging.debug("Parallel Export netCDF Complete: " + self.file_path +
+                      " Bad Checksums: " + str(sum(info["BadChecksums"] for info in infos)) +
+                      " Bad Bytes: " + str(sum(info["BadBytes"] for info in infos)))
+        return result
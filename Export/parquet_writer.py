@@ -0,0 +1,176 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .rtb_decoder import ANCILLARY_FIELDS
+from .batch_decoder import EnsembleBatch
+from .batch_writer import BatchWriter, has_ancillary, analyze_attrs
+from .export_profile import ExportProfile
+from .memory_budget import MemoryBudget
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION, STAGE_WRITE
+
+
+# Compression codec used when the export profile compresses.  The profile
+# compression level is used as the zstd level.
+PARQUET_COMPRESSION = "zstd"
+
+
+def beam_column(var_name: str, beam: int) -> str:
+    """
+    Get the column name of a beam of a bin and beam variable.
+    :param var_name: Variable name.
+    :type var_name: str
+    :param beam: Beam number, starting at 1.
+    :type beam: int
+    :return: Column name.
+    :rtype: str
+    """
+    return var_name + "_" + str(beam)
+
+
+class ParquetWriter(BatchWriter):
+    """
+    Write the decoded ensembles to a Parquet file in long format, with a row
+    for each ensemble and bin.  Each beam of a bin and beam variable is a
+    column, such as beam_vel_1, and the ensemble values, such as the time
+    and the ancillary data, are repeated for each bin.  This is the layout
+    pandas and Dask expect, and a column can be read without reading the rest
+    of the file.
+
+    Each write of the write buffer is a row group.  Ensembles without a
+    valid time have a null time.
+    """
+
+    def __init__(self, file_path: str, profile: ExportProfile = None, memory_budget: MemoryBudget = None,
+                 instrumentation: Instrumentation = NULL_INSTRUMENTATION):
+        """
+        Initialize the writer.
+        :param file_path: Parquet file path to create.
+        :type file_path: str
+        :param profile: Compression and write buffer settings.  If None, the default profile.
+        :type profile: ExportProfile
+        :param memory_budget: Memory budget of the export.  If None, the memory is not limited.
+        :type memory_budget: MemoryBudget
+        :param instrumentation: Records the write time, the records written and the buffer writes.
+        :type instrumentation: Instrumentation
+        """
+        super().__init__(file_path, profile, memory_budget, instrumentation)
+        self.writer = None
+        self.schema = None
+        self.num_bins = 0
+        self.num_beams = 0
+
+        # Range to each bin, repeated for each ensemble.  None if there is no ancillary data.
+        self.bin_range = None
+
+    def _start(self, batch: EnsembleBatch):
+        """
+        Create the Parquet file using the first batch to set the columns.
+        :param batch: First batch.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        self._set_time_ref(batch)
+        self.num_bins = batch.num_bins
+        self.num_beams = batch.num_beams
+
+        fields = [
+            pa.field("time", pa.timestamp("us")),
+            pa.field("ens_num", pa.int32()),
+            pa.field("bin", pa.int32()),
+        ]
+
+        ancillary = has_ancillary(batch)
+        if ancillary:
+            self.bin_range = (batch.ancillary[0, 0] + np.arange(batch.num_bins) * batch.ancillary[0, 1])
+            self.bin_range = self.bin_range.astype(np.float32)
+            fields.append(pa.field("bin_range", pa.float32()))
+
+        for var_name, values in batch.bin_beam.items():
+            value_type = pa.from_numpy_dtype(values.dtype)
+            for beam in range(1, batch.num_beams + 1):
+                fields.append(pa.field(beam_column(var_name, beam), value_type))
+
+        if ancillary:
+            for field in ANCILLARY_FIELDS:
+                fields.append(pa.field(field, pa.float32()))
+
+        self.schema = pa.schema(fields, metadata={
+            "serial_number": str(batch.serial_number),
+            "subsystem_code": str(batch.subsystem_code),
+            "subsystem_config": str(batch.subsystem_config),
+        })
+
+        if self.profile.complevel > 0:
+            self.writer = pq.ParquetWriter(self.file_path, self.schema, compression=PARQUET_COMPRESSION,
+                                           compression_level=self.profile.complevel)
+        else:
+            self.writer = pq.ParquetWriter(self.file_path, self.schema, compression="none")
+
+        self._create_buffer(batch, ancillary)
+
+    def _write_buffer(self, start: int, end: int, columns: dict):
+        """
+        Write the ensembles in the buffer as a row group, with a row for each ensemble and bin.
+        :param start: Index of the first ensemble in the file.
+        :type start: int
+        :param end: Index after the last ensemble.
+        :type end: int
+        :param columns: Variable name and the values of the ensembles.
+        :type columns: dict
+        :return:
+        :rtype:
+        """
+        count = end - start
+        num_bins = self.num_bins
+
+        # Time of each ensemble from the seconds since the time reference, null if the time is not valid
+        seconds = columns["time"]
+        invalid = np.isnan(seconds)
+        micros = np.where(invalid, 0, np.round(seconds * 1e6)).astype(np.int64)
+        times = self.time_ref + micros.astype("timedelta64[us]")
+
+        arrays = {
+            "time": pa.array(np.repeat(times, num_bins), type=pa.timestamp("us"), mask=np.repeat(invalid, num_bins)),
+            "ens_num": pa.array(np.repeat(columns["ens_num"], num_bins)),
+            "bin": pa.array(np.tile(np.arange(num_bins, dtype=np.int32), count)),
+        }
+        if self.bin_range is not None:
+            arrays["bin_range"] = pa.array(np.tile(self.bin_range, count))
+
+        # Each beam of the bin and beam data is a column
+        for var_name, values in columns.items():
+            if values.ndim == 3:
+                for beam in range(self.num_beams):
+                    arrays[beam_column(var_name, beam + 1)] = pa.array(values[:, :, beam].reshape(-1))
+            elif var_name in ANCILLARY_FIELDS:
+                arrays[var_name] = pa.array(np.repeat(values, num_bins))
+
+        table = pa.Table.from_arrays([arrays[field.name] for field in self.schema], schema=self.schema)
+        self.writer.write_table(table, row_group_size=table.num_rows)
+
+    def close(self, analyze_result: dict = None, resume_offset: int = None, source_hash: str = None):
+        """
+        Write the buffer, add the analyze results to the file metadata and close the file.
+        A Parquet file can not be appended to, so the resume offset is not used.
+        :param analyze_result: Analyze results to store in the file metadata.
+        :type analyze_result: dict
+        :param resume_offset: Not used.
+        :type resume_offset: int
+        :param source_hash: Not used.
+        :type source_hash: str
+        :return:
+        :rtype:
+        """
+        if self.writer is None:
+            return
+
+        with self.instrumentation.stage(STAGE_WRITE):
+            self.flush()
+
+            if analyze_result:
+                self.writer.add_key_value_metadata({name: str(value)
+                                                    for name, value in analyze_attrs(analyze_result).items()})
+            self.writer.close()
+
+        self.writer = None
@@ -0,0 +1,129 @@
+import time
+import queue
+
+
+# Minimum time in seconds between progress reports.  At most 10 reports a second.
+DEFAULT_MIN_INTERVAL = 0.1
+
+# Minimum fraction of the total between progress reports.  At most one report per percent.
+DEFAULT_MIN_FRACTION = 0.01
+
+
+def drain_progress(progress_queue) -> dict:
+    """
+    Get the progress sent by the worker processes since the last call.
+    The counts are cumulative, so only the latest count of each key is kept.
+    :param progress_queue: Queue of (key, count) from the workers.  None if not listening.
+    :type progress_queue: multiprocessing.Queue
+    :return: Key, such as the file index, and the latest count.
+    :rtype: dict
+    """
+    latest = {}
+    if progress_queue is None:
+        return latest
+
+    while True:
+        try:
+            key, count = progress_queue.get_nowait()
+        except queue.Empty:
+            break
+        latest[key] = max(count, latest.get(key, 0))
+    return latest
+
+
+class ProgressReporter:
+    """
+    Report the progress at a limited rate.  The work loop adds to the
+    count as often as it likes, but the callback is only called when
+    enough time has passed and the count has moved at least a percent
+    of the total.  The count is cumulative, so a skipped report is not
+    lost, the next report includes it.
+
+    Call finish() when the work is complete to report the final count.
+    """
+
+    def __init__(self, callback=None, total: int = 0,
+                 min_interval: float = DEFAULT_MIN_INTERVAL, min_fraction: float = DEFAULT_MIN_FRACTION):
+        """
+        Initialize the reporter.
+        :param callback: Called with the cumulative count.  If None, nothing is reported.
+        :type callback: function(count)
+        :param total: Total count when complete.  0 if not known, then only the time is used to limit the reports.
+        :type total: int
+        :param min_interval: Minimum time in seconds between reports.
+        :type min_interval: float
+        :param min_fraction: Minimum fraction of the total between reports.
+        :type min_fraction: float
+        """
+        self.callback = callback
+        self.total = total
+        self.min_interval = min_interval
+        self.count = 0
+        self.reported_count = 0
+        self.last_report_time = 0.0
+
+        # Count needed before checking the time for the next report
+        self.step = max(1, int(total * min_fraction)) if total > 0 else 1
+        self.next_count = self.step
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Check if anyone is listening to the progress.  The work loop
+        can skip counting the progress if not.
+        :return: TRUE if there is a callback.
+        :rtype: bool
+        """
+        return self.callback is not None
+
+    def add(self, count: int = 1):
+        """
+        Add to the count and report the progress if enough time has passed.
+        :param count: Amount to add to the count.
+        :type count: int
+        :return:
+        :rtype:
+        """
+        self.count += count
+        if self.count >= self.next_count:
+            self._report()
+
+    def update(self, count: int):
+        """
+        Set the cumulative count and report the progress if enough time has passed.
+        :param count: Cumulative count.
+        :type count: int
+        :return:
+        :rtype:
+        """
+        self.count = count
+        if self.count >= self.next_count:
+            self._report()
+
+    def finish(self):
+        """
+        Report the final count if it has not been reported.
+        :return:
+        :rtype:
+        """
+        if self.callback is not None and self.count != self.reported_count:
+            self.reported_count = self.count
+            self.callback(self.count)
+
+    def _report(self):
+        """
+        Report the count if the minimum time has passed since the last report.
+        :return:
+        :rtype:
+        """
+        if self.callback is None:
+            return
+
+        now = time.monotonic()
+        if now - self.last_report_time < self.min_interval:
+            return
+
+        self.last_report_time = now
+        self.reported_count = self.count
+        self.next_count = self.count + self.step
+        self.callback(self.count)
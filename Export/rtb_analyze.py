@@ -0,0 +1,303 @@
+import os
+import logging
+import numpy as np
+from .rtb_reader import RtbReader, HEADER_SIZE, create_reader
+from .rtb_decoder import find_datasets, value_dtype, ENSEMBLE_DATA_ID, ENS_DATA_YEAR, ENS_DATA_SUBSYSTEM_CONFIG
+from .batch_decoder import LAYOUT_KEY_SIZE, US_PER_SECOND, ensemble_datetimes, to_datetime
+from .analyze_stats import AnalyzeStats
+from .ensemble_index import EnsembleIndex, index_path
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION, STAGE_DECODE
+
+
+# Number of ensembles to decode at a time
+ANALYZE_BATCH_SIZE = 4096
+
+# Values at the start of the ensemble data set used by the analyze:
+# ensemble number, number of bins and beams, and the date and time
+HEADER_FIELD_COUNT = ENS_DATA_YEAR + 7
+
+# Header fields of an ensemble without an ensemble data set.  The year 0 gives no date and time.
+NO_HEADER_FIELDS = bytes(HEADER_FIELD_COUNT * 4)
+
+
+class HeaderLayout:
+    """
+    Location of the ensemble data set in an ensemble.  Ensembles with the same
+    layout key (see EnsembleLayout.key()) have the ensemble data set at the same
+    offset, so the header fields are sliced from the ensemble without searching
+    the data sets.  The data set header before the values is checked for each
+    ensemble, in case an ensemble has the same key but different data sets.
+    """
+
+    def __init__(self, ens_bytes):
+        """
+        Find the ensemble data set in the ensemble.
+        :param ens_bytes: Complete ensemble including the header and checksum.
+        :type ens_bytes: bytes
+        """
+        # Offset of the ensemble data set values.  None if the ensemble has no ensemble data set.
+        self.data_offset = None
+
+        # Data set header and name before the values
+        self.signature = b""
+
+        # Data type of the values
+        self.dtype = None
+
+        for name, value_type, num_elements, element_multiplier, data_offset, data_size in find_datasets(ens_bytes):
+            if name == ENSEMBLE_DATA_ID and num_elements > ENS_DATA_SUBSYSTEM_CONFIG:
+                self.data_offset = data_offset
+                self.signature = bytes(ens_bytes[max(data_offset - LAYOUT_KEY_SIZE, 0):data_offset])
+                self.dtype = value_dtype(value_type)
+                break
+
+    def matches(self, ens_bytes) -> bool:
+        """
+        Check the ensemble data set is at the offset of the layout.
+        :param ens_bytes: Complete ensemble including the header and checksum.
+        :type ens_bytes: bytes
+        :return: TRUE if the ensemble data set header matches.
+        :rtype: bool
+        """
+        return self.data_offset is None or \
+            ens_bytes[self.data_offset - len(self.signature):self.data_offset] == self.signature
+
+    def header_fields(self, ens_bytes) -> bytes:
+        """
+        Get the header fields of the ensemble as little endian 32 bit integers.
+        :param ens_bytes: Complete ensemble including the header and checksum.
+        :type ens_bytes: bytes
+        :return: HEADER_FIELD_COUNT values.
+        :rtype: bytes
+        """
+        if self.data_offset is None:
+            return NO_HEADER_FIELDS
+
+        values = ens_bytes[self.data_offset:self.data_offset + HEADER_FIELD_COUNT * self.dtype.itemsize]
+        if self.dtype.kind == "i" and self.dtype.itemsize == 4:
+            return bytes(values)
+        return np.frombuffer(values, dtype=self.dtype).astype("<i4").tobytes()
+
+
+class RtbAnalyzer:
+    """
+    Analyze the RTB file.  This will count the ensembles and find the first
+    and last date and time and the time between ensembles.  Only the header
+    fields at the start of the ensemble data set are decoded.
+
+    The ensembles are decoded in batches.  For each ensemble only the header
+    fields are sliced from the ensemble, using the location of the ensemble
+    data set found in the first ensemble of each layout.  The fields of the
+    batch are then decoded, paired and added to the index and the results
+    with numpy.  The checksum of each ensemble is still verified by the reader.
+
+    While the file is read, an index of the byte offset of each ensemble is
+    created.  The index is saved next to the file so the export can seek to
+    an ensemble or time without reading the file from the start.
+
+    If a start offset and the analyze results of the file before the start
+    offset are given, only the data added after the start offset is read.
+    The existing index is continued if it reaches the start offset.
+    """
+
+    def __init__(self, file_path: str, file_progress_callback=None, save_index: bool = True, use_mmap: bool = True,
+                 start_offset: int = 0, previous_result: dict = None,
+                 instrumentation: Instrumentation = NULL_INSTRUMENTATION):
+        """
+        Initialize the analyzer.
+        :param file_path: RTB file path to analyze.
+        :type file_path: str
+        :param file_progress_callback: Called with the bytes read for each chunk, the total size and file name.
+        :type file_progress_callback: function(bytes_read, total_size, file_name)
+        :param save_index: Save the ensemble index next to the file.
+        :type save_index: bool
+        :param use_mmap: Read the file using a memory mapped file.
+        :type use_mmap: bool
+        :param start_offset: Byte offset in the file to start reading.
+        :type start_offset: int
+        :param previous_result: Analyze results of the file before the start offset.
+        :type previous_result: dict
+        :param instrumentation: Records the time of each stage and the counters.
+        :type instrumentation: Instrumentation
+        """
+        self.file_path = file_path
+        self.file_progress_callback = file_progress_callback
+        self.save_index = save_index
+        self.use_mmap = use_mmap
+        self.start_offset = start_offset
+        self.previous_result = previous_result
+        self.instrumentation = instrumentation
+        self.index = None
+        self.stats = None
+
+        # Header layout of each layout key
+        self.layouts = {}
+
+    def analyze(self) -> dict:
+        """
+        Analyze the file and create the ensemble index.
+        :return: Analyze results of the file.
+        :rtype: dict
+        """
+        # Get the file information before reading, in case the file changes while reading
+        stat = os.stat(self.file_path)
+        self.index = self._start_index(stat)
+
+        stats = AnalyzeStats()
+        if self.previous_result:
+            stats.resume(self.previous_result)
+        self.stats = stats
+        reader = create_reader(self.file_path, self.file_progress_callback, self.use_mmap,
+                               instrumentation=self.instrumentation)
+
+        self._read_headers(reader, stat.st_size)
+
+        if self.save_index and self.index is not None:
+            try:
+                self.index.save(index_path(self.file_path))
+            except OSError as ex:
+                logging.warning("Could not save the ensemble index for " + self.file_path + ": " + str(ex))
+
+        logging.debug("Analyze Complete: " + self.file_path +
+                      " Bad Checksums: " + str(reader.bad_checksums) + " Bad Bytes: " + str(reader.bad_bytes))
+        result = stats.result(self.file_path)
+        if self.start_offset > 0:
+            # Ensembles read after the start offset
+            previous_result = self.previous_result if self.previous_result else {}
+            result["ResumeOffset"] = self.start_offset
+            result["NewEnsCount"] = stats.ens_count - previous_result.get("EnsCount", 0)
+            result["NewEnsPairCount"] = stats.ens_pair_count - previous_result.get("EnsPairCount", 0)
+        return result
+
+    def _start_index(self, stat: os.stat_result) -> EnsembleIndex:
+        """
+        Create the index to add the ensembles to.  When starting after the start of
+        the file, the existing index is continued.  If the existing index does not
+        reach the start offset, no index is created, because the ensembles before
+        the start offset are not read.
+        :param stat: File information before reading.
+        :type stat: os.stat_result
+        :return: Index or None if the index can not be created.
+        :rtype: EnsembleIndex
+        """
+        if self.start_offset <= 0:
+            return EnsembleIndex(stat.st_size, stat.st_mtime_ns)
+
+        index = EnsembleIndex.load(index_path(self.file_path))
+        if index is None or not index.truncate(self.start_offset):
+            logging.debug("No ensemble index to continue for " + self.file_path)
+            return None
+
+        index.file_size = stat.st_size
+        index.file_mtime_ns = stat.st_mtime_ns
+        return index
+
+    def _read_headers(self, reader: RtbReader, end_offset: int):
+        """
+        Read the ensembles and slice the header fields of each ensemble.
+        The fields are decoded in batches.
+        :param reader: Reader for the file.
+        :type reader: RtbReader
+        :param end_offset: Byte offset to stop reading.
+        :type end_offset: int
+        :return:
+        :rtype:
+        """
+        layouts = self.layouts
+        offsets = []
+        lengths = []
+        fields = []
+
+        for offset, ens_bytes in reader.ensembles(self.start_offset, end_offset):
+            length = len(ens_bytes)
+            key = (length, bytes(ens_bytes[HEADER_SIZE:HEADER_SIZE + LAYOUT_KEY_SIZE]))
+            layout = layouts.get(key)
+            if layout is None:
+                layout = HeaderLayout(ens_bytes)
+                layouts[key] = layout
+            elif not layout.matches(ens_bytes):
+                layout = HeaderLayout(ens_bytes)
+
+            offsets.append(offset)
+            lengths.append(length)
+            fields.append(layout.header_fields(ens_bytes))
+
+            if len(offsets) >= ANALYZE_BATCH_SIZE:
+                with self.instrumentation.stage(STAGE_DECODE):
+                    kept = self._add_batch(offsets, lengths, fields, False)
+                split = len(offsets) - kept
+                offsets, lengths, fields = offsets[split:], lengths[split:], fields[split:]
+
+        if offsets:
+            with self.instrumentation.stage(STAGE_DECODE):
+                self._add_batch(offsets, lengths, fields, True)
+
+    def _add_batch(self, offsets: list, lengths: list, fields: list, last: bool) -> int:
+        """
+        Decode the header fields of a batch of ensembles and add them to the
+        index and the results.  A 4 beam ensemble at the end of the batch is
+        kept for the next batch, because it may be paired with the vertical
+        beam ensemble that follows it.
+        :param offsets: Byte offset of each ensemble.
+        :type offsets: list
+        :param lengths: Length of each ensemble.
+        :type lengths: list
+        :param fields: Header fields of each ensemble from HeaderLayout.header_fields().
+        :type fields: list
+        :param last: TRUE if this is the last batch in the file.
+        :type last: bool
+        :return: Number of ensembles at the end of the batch kept for the next batch.
+        :rtype: int
+        """
+        values = np.frombuffer(b"".join(fields), dtype="<i4").reshape(len(fields), HEADER_FIELD_COUNT)
+        num_beams = values[:, 2]
+
+        kept = 0
+        if not last and num_beams[-1] == 4:
+            kept = 1
+            values = values[:-1]
+            num_beams = num_beams[:-1]
+        count = len(values)
+        if count == 0:
+            return kept
+
+        datetimes = ensemble_datetimes(values)
+
+        if self.index is not None:
+            timestamps = datetimes.astype(np.int64) / US_PER_SECOND
+            timestamps[np.isnat(datetimes)] = np.nan
+            self.index.extend(np.asarray(offsets[:count], dtype=np.int64),
+                              np.asarray(lengths[:count], dtype=np.int64),
+                              values[:, 0], timestamps, np.clip(num_beams, 0, 255))
+
+        # A 4 beam ensemble followed by a vertical beam ensemble is a single record
+        is_pair = np.zeros(count, dtype=bool)
+        is_pair[:-1] = (num_beams[:-1] == 4) & (num_beams[1:] == 1)
+        is_record = np.ones(count, dtype=bool)
+        is_record[1:] = ~is_pair[:-1]
+
+        record_datetimes = datetimes[is_record]
+        valid_datetimes = record_datetimes[~np.isnat(record_datetimes)]
+        pair_count = int(is_pair.sum())
+        self.stats.add_batch(count - pair_count, pair_count,
+                             to_datetime(valid_datetimes[0]) if len(valid_datetimes) > 0 else None,
+                             to_datetime(valid_datetimes[1]) if len(valid_datetimes) > 1 else None,
+                             to_datetime(valid_datetimes[-1]) if len(valid_datetimes) > 0 else None)
+        return kept
+
+
+def load_or_create_index(file_path: str) -> EnsembleIndex:
+    """
+    Load the ensemble index for the file.  If the index does not exist
+    or the file has changed, the file is analyzed to create the index.
+    :param file_path: RTB file path.
+    :type file_path: str
+    :return: Ensemble index.
+    :rtype: EnsembleIndex
+    """
+    index = EnsembleIndex.load_for_file(file_path)
+    if index is None:
+        analyzer = RtbAnalyzer(file_path)
+        analyzer.analyze()
+        index = analyzer.index
+    return index
@@ -0,0 +1,209 @@
+import struct
+import datetime
+import numpy as np
+from .rtb_reader import HEADER_SIZE, CHECKSUM_SIZE
+
+
+# Data set value types
+VALUE_TYPE_FLOAT = 10
+VALUE_TYPE_INT = 20
+VALUE_TYPE_BYTE = 50
+
+# Data set header: value type, number of elements, element multiplier, imaginary, name length
+DATASET_HEADER_STRUCT = struct.Struct("<iiiii")
+
+# Data set names
+BEAM_VELOCITY_ID = "E000001"
+INSTRUMENT_VELOCITY_ID = "E000002"
+EARTH_VELOCITY_ID = "E000003"
+AMPLITUDE_ID = "E000004"
+CORRELATION_ID = "E000005"
+GOOD_BEAM_ID = "E000006"
+GOOD_EARTH_ID = "E000007"
+ENSEMBLE_DATA_ID = "E000008"
+ANCILLARY_DATA_ID = "E000009"
+
+# Data sets with a value for each bin and beam and the variable name to store them
+BIN_BEAM_DATASETS = {
+    BEAM_VELOCITY_ID: "beam_vel",
+    INSTRUMENT_VELOCITY_ID: "instr_vel",
+    EARTH_VELOCITY_ID: "earth_vel",
+    AMPLITUDE_ID: "amp",
+    CORRELATION_ID: "corr",
+    GOOD_BEAM_ID: "good_beam",
+    GOOD_EARTH_ID: "good_earth",
+}
+
+# Values in the ancillary data set in the order they are stored
+ANCILLARY_FIELDS = ["first_bin_range", "bin_size", "first_ping_time", "last_ping_time",
+                    "heading", "pitch", "roll", "water_temp", "system_temp",
+                    "salinity", "pressure", "xdcr_depth", "speed_of_sound"]
+
+# Index of the values in the ensemble data set
+ENS_DATA_ENS_NUM = 0
+ENS_DATA_NUM_BINS = 1
+ENS_DATA_NUM_BEAMS = 2
+ENS_DATA_YEAR = 6
+ENS_DATA_SERIAL = 13
+ENS_DATA_FIRMWARE = 21
+ENS_DATA_SUBSYSTEM_CONFIG = 22
+
+# Value used by the ADCP to mark a bad velocity
+BAD_VELOCITY = 88.888
+
+
+def value_dtype(value_type: int):
+    """
+    Get the numpy data type for the data set value type.
+    :param value_type: Data set value type.
+    :type value_type: int
+    :return: Numpy data type.
+    :rtype: np.dtype
+    """
+    if value_type == VALUE_TYPE_FLOAT:
+        return np.dtype("<f4")
+    if value_type == VALUE_TYPE_BYTE:
+        return np.dtype("u1")
+    return np.dtype("<i4")
+
+
+def find_datasets(ens_bytes) -> list:
+    """
+    Find all the data sets in the ensemble.  This only reads the data set
+    headers, the data is not decoded.
+    :param ens_bytes: Complete ensemble including the header and checksum.
+    :type ens_bytes: bytes
+    :return: List of (name, value type, number of elements, element multiplier, data offset, data size).
+    :rtype: list
+    """
+    datasets = []
+    pos = HEADER_SIZE
+    end = len(ens_bytes) - CHECKSUM_SIZE
+
+    while pos + DATASET_HEADER_STRUCT.size <= end:
+        value_type, num_elements, element_multiplier, imag, name_len = DATASET_HEADER_STRUCT.unpack_from(ens_bytes, pos)
+        name_start = pos + DATASET_HEADER_STRUCT.size
+        if name_len <= 0 or name_start + name_len > end or num_elements < 0 or element_multiplier < 0:
+            break
+
+        name = bytes(ens_bytes[name_start:name_start + name_len]).rstrip(b'\0').decode("ascii", "replace")
+        data_offset = name_start + name_len
+        data_size = num_elements * element_multiplier * value_dtype(value_type).itemsize
+        if data_offset + data_size > end:
+            break
+
+        datasets.append((name, value_type, num_elements, element_multiplier, data_offset, data_size))
+        pos = data_offset + data_size
+
+    return datasets
+
+
+def decode_ensemble_datetime(ens_data) -> datetime.datetime:
+    """
+    Get the date and time from the ensemble data set values.
+    :param ens_data: Ensemble data set values.
+    :type ens_data: np.ndarray
+    :return: Date and time of the ensemble.  None if the date and time is not valid.
+    :rtype: datetime.datetime
+    """
+    year, month, day, hour, minute, second, hsec = (int(value) for value in ens_data[ENS_DATA_YEAR:ENS_DATA_YEAR + 7])
+    try:
+        return datetime.datetime(year, month, day, hour, minute, second, hsec * 10000)
+    except ValueError:
+        return None
+
+
+class DecodedEnsemble:
+    """
+    Ensemble data set values of an ensemble decoded from the RTB binary data.
+    """
+
+    def __init__(self):
+        self.ensemble_number = 0
+        self.num_bins = 0
+        self.num_beams = 0
+        self.datetime = None
+        self.serial_number = ""
+        self.subsystem_code = ""
+        self.subsystem_config = 0
+
+
+def _decode_ensemble_data(ens: DecodedEnsemble, ens_bytes, values, data_offset: int, data_size: int):
+    """
+    Decode the ensemble data set values into the ensemble.
+    :param ens: Ensemble to store the values.
+    :type ens: DecodedEnsemble
+    :param ens_bytes: Complete ensemble including the header and checksum.
+    :type ens_bytes: bytes
+    :param values: Ensemble data set values.
+    :type values: np.ndarray
+    :param data_offset: Offset of the ensemble data set values in the ensemble.
+    :type data_offset: int
+    :param data_size: Size of the ensemble data set values in bytes.
+    :type data_size: int
+    :return:
+    :rtype:
+    """
+    ens.ensemble_number = int(values[ENS_DATA_ENS_NUM])
+    ens.num_bins = int(values[ENS_DATA_NUM_BINS])
+    ens.num_beams = int(values[ENS_DATA_NUM_BEAMS])
+    ens.datetime = decode_ensemble_datetime(values)
+
+    raw = bytes(ens_bytes[data_offset:data_offset + data_size])
+    serial_start = ENS_DATA_SERIAL * 4
+    ens.serial_number = raw[serial_start:serial_start + 32].rstrip(b'\0').decode("ascii", "replace")
+    ens.subsystem_code = chr(raw[ENS_DATA_FIRMWARE * 4 + 3])
+    ens.subsystem_config = raw[ENS_DATA_SUBSYSTEM_CONFIG * 4 + 3]
+
+
+def decode_ensemble_header(ens_bytes) -> DecodedEnsemble:
+    """
+    Decode only the ensemble data set.  This gives the ensemble number,
+    number of bins and beams, date and time and subsystem without
+    decoding the bin and beam data.
+    :param ens_bytes: Complete ensemble including the header and checksum.
+    :type ens_bytes: bytes
+    :return: Ensemble with only the ensemble data set values.
+    :rtype: DecodedEnsemble
+    """
+    ens = DecodedEnsemble()
+
+    for name, value_type, num_elements, element_multiplier, data_offset, data_size in find_datasets(ens_bytes):
+        if name == ENSEMBLE_DATA_ID and num_elements > ENS_DATA_SUBSYSTEM_CONFIG:
+            values = np.frombuffer(ens_bytes, dtype=value_dtype(value_type),
+                                   count=num_elements * element_multiplier, offset=data_offset)
+            _decode_ensemble_data(ens, ens_bytes, values, data_offset, data_size)
+            break
+
+    return ens
+
+
+def pair_vertical_beam(ensembles):
+    """
+    Pair each 4 beam ensemble with the vertical beam ensemble that follows it.
+    Any other ensemble is not paired.
+    :param ensembles: Decoded ensembles in the order they were read.
+    :type ensembles: iterable of DecodedEnsemble
+    :return: Ensemble and the paired vertical beam ensemble or None if not paired.
+    :rtype: DecodedEnsemble, DecodedEnsemble
+    """
+    # Hold a 4 beam ensemble until the next ensemble is read to check for a vertical beam
+    pending_ens = None
+
+    for ens in ensembles:
+        if pending_ens is not None:
+            if ens.num_beams == 1:
+                yield pending_ens, ens
+                pending_ens = None
+                continue
+
+            yield pending_ens, None
+            pending_ens = None
+
+        if ens.num_beams == 4:
+            pending_ens = ens
+        else:
+            yield ens, None
+
+    if pending_ens is not None:
+        yield pending_ens, None
@@ -0,0 +1,521 @@
+import os
+import mmap
+import time
+import struct
+import binascii
+import logging
+from .memory_budget import MemoryBudget
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION, STAGE_READ, STAGE_HEADER_SEARCH, \
+    STAGE_CHECKSUM, COUNTER_BYTES_READ, COUNTER_ENSEMBLES, COUNTER_BAD_CHECKSUMS, COUNTER_BAD_BYTES
+
+
+# Every ensemble starts with 16 bytes of 0x80
+ENSEMBLE_HEADER = b'\x80' * 16
+
+# Header is the 16 bytes of 0x80, ensemble number, inverse ensemble number,
+# payload size and inverse payload size
+HEADER_SIZE = 32
+
+# Checksum after the payload
+CHECKSUM_SIZE = 4
+
+# Largest payload size that is considered valid
+MAX_PAYLOAD_SIZE = 2 ** 24
+
+# Number of bytes to read from the file at a time
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Header format: ensemble number, inverse ensemble number, payload size, inverse payload size
+HEADER_STRUCT = struct.Struct("<IIII")
+CHECKSUM_STRUCT = struct.Struct("<I")
+
+
+def parse_header(buffer, offset: int):
+    """
+    Parse the ensemble header at the given offset.  The offset
+    must point to the start of the 16 bytes of 0x80.
+    :param buffer: Buffer containing the header.
+    :type buffer: bytes
+    :param offset: Offset of the start of the header.
+    :type offset: int
+    :return: Ensemble number and payload size.  None, None if the header is not valid.
+    :rtype: int, int
+    """
+    ens_num, ens_num_inv, payload_size, payload_size_inv = HEADER_STRUCT.unpack_from(buffer, offset + 16)
+
+    # Verify the inverse values match
+    if ens_num ^ ens_num_inv != 0xFFFFFFFF or payload_size ^ payload_size_inv != 0xFFFFFFFF:
+        return None, None
+    if payload_size <= 0 or payload_size > MAX_PAYLOAD_SIZE:
+        return None, None
+
+    return ens_num, payload_size
+
+
+def verify_checksum(buffer, offset: int, payload_size: int) -> bool:
+    """
+    Verify the CRC-16 CCITT checksum of the ensemble payload.
+    :param buffer: Buffer containing the ensemble.
+    :type buffer: bytes
+    :param offset: Offset of the start of the ensemble header.
+    :type offset: int
+    :param payload_size: Size of the payload in bytes.
+    :type payload_size: int
+    :return: TRUE if the checksum is good.
+    :rtype: bool
+    """
+    payload_start = offset + HEADER_SIZE
+    payload_end = payload_start + payload_size
+    checksum = CHECKSUM_STRUCT.unpack_from(buffer, payload_end)[0]
+    return binascii.crc_hqx(memoryview(buffer)[payload_start:payload_end], 0) == checksum
+
+
+class RtbReader:
+    """
+    Read the ensembles from an RTB binary file.  The file is read in chunks and
+    each ensemble found is verified with the header and checksum.  Any bad data
+    between the ensembles is skipped.
+
+    With instrumentation, the time reading the file, searching for the headers
+    and verifying the checksums is recorded with the bytes, ensembles and bad data.
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, file_progress_callback=None,
+                 instrumentation: Instrumentation = NULL_INSTRUMENTATION):
+        """
+        Initialize the reader.
+        :param file_path: File path of the RTB file.
+        :type file_path: str
+        :param chunk_size: Number of bytes to read at a time.
+        :type chunk_size: int
+        :param file_progress_callback: Called with the bytes read for each chunk, the total size and file name.
+        :type file_progress_callback: function(bytes_read, total_size, file_name)
+        :param instrumentation: Records the time of each stage and the counters.
+        :type instrumentation: Instrumentation
+        """
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.file_progress_callback = file_progress_callback
+        self.instrumentation = instrumentation
+
+        # Number of bytes skipped because of bad data
+        self.bad_bytes = 0
+
+        # Number of ensembles with a bad checksum
+        self.bad_checksums = 0
+
+    def ensembles(self, start_offset: int = 0, end_offset: int = None):
+        """
+        Read the ensembles from the file.  This is a generator, each ensemble
+        found is given with its byte offset in the file.
+
+        Only the ensembles that start before the end offset are given.  An
+        ensemble that starts before the end offset but finishes after it is
+        read completely.
+        :param start_offset: Byte offset in the file to start reading.
+        :type start_offset: int
+        :param end_offset: Byte offset in the file to stop reading.  If None, read to the end of the file.
+        :type end_offset: int
+        :return: Byte offset of the ensemble and the ensemble bytes.
+        :rtype: int, bytes
+        """
+        if self.instrumentation.enabled:
+            return self._count_ensembles(start_offset, end_offset)
+        return self._read_ensembles(start_offset, end_offset)
+
+    def records(self, ranges: list):
+        """
+        Read only the byte ranges of the records, such as the records selected
+        from the ensemble index.  Each range is read with a single seek and read,
+        and the bytes between the ranges are not read or searched for headers.
+        Each range must start at an ensemble.  The ensembles in each range are
+        verified with the header and checksum.  If an ensemble does not match,
+        the rest of the range is skipped.
+        :param ranges: Start and end byte offset of each record.
+        :type ranges: list
+        :return: List of the byte offset and bytes of each ensemble in the record.
+        :rtype: list
+        """
+        total_size = os.path.getsize(self.file_path)
+        timed = self.instrumentation.enabled
+        bytes_read = 0
+        ensembles = 0
+        reported = 0
+
+        try:
+            with open(self.file_path, "rb") as file:
+                for start_offset, end_offset in ranges:
+                    if timed:
+                        read_start = time.perf_counter()
+                    file.seek(start_offset)
+                    buffer = file.read(max(0, min(end_offset, total_size) - start_offset))
+                    if timed:
+                        self.instrumentation.add_time(STAGE_READ, time.perf_counter() - read_start)
+                    bytes_read += len(buffer)
+
+                    if self.file_progress_callback and bytes_read - reported >= self.chunk_size:
+                        self.file_progress_callback(bytes_read - reported, total_size, self.file_path)
+                        reported = bytes_read
+
+                    # Ensembles of the record
+                    record = []
+                    pos = 0
+                    while pos < len(buffer):
+                        ens_size = None
+                        if buffer.startswith(ENSEMBLE_HEADER, pos) and pos + HEADER_SIZE <= len(buffer):
+                            ens_num, payload_size = parse_header(buffer, pos)
+                            if ens_num is not None:
+                                ens_size = HEADER_SIZE + payload_size + CHECKSUM_SIZE
+                        if ens_size is None or pos + ens_size > len(buffer) or \
+                                not verify_checksum(buffer, pos, payload_size):
+                            logging.debug("Ensemble not found at " + str(start_offset + pos) + " in " + self.file_path)
+                            self.bad_bytes += len(buffer) - pos
+                            break
+
+                        record.append((start_offset + pos, buffer[pos:pos + ens_size]))
+                        pos += ens_size
+
+                    ensembles += len(record)
+                    if record:
+                        yield record
+        finally:
+            # Only the bytes of the records are read
+            if self.file_progress_callback and bytes_read > reported:
+                self.file_progress_callback(bytes_read - reported, total_size, self.file_path)
+            self.instrumentation.count(COUNTER_BYTES_READ, bytes_read)
+            self.instrumentation.count(COUNTER_ENSEMBLES, ensembles)
+
+    def _count_ensembles(self, start_offset: int, end_offset: int):
+        """
+        Read the ensembles and add the bytes, ensembles and bad data read to the instrumentation.
+        :param start_offset: Byte offset in the file to start reading.
+        :type start_offset: int
+        :param end_offset: Byte offset in the file to stop reading.  If None, read to the end of the file.
+        :type end_offset: int
+        :return: Byte offset of the ensemble and the ensemble bytes.
+        :rtype: int, bytes
+        """
+        bad_bytes = self.bad_bytes
+        bad_checksums = self.bad_checksums
+        ensembles = 0
+        last_end = start_offset
+        complete = False
+
+        try:
+            for offset, ens_bytes in self._read_ensembles(start_offset, end_offset):
+                ensembles += 1
+                last_end = offset + len(ens_bytes)
+                yield offset, ens_bytes
+            complete = True
+        finally:
+            # The whole range was scanned unless the reading was stopped early
+            if complete:
+                total_size = os.path.getsize(self.file_path)
+                last_end = max(last_end, min(end_offset, total_size) if end_offset is not None else total_size)
+
+            self.instrumentation.count(COUNTER_BYTES_READ, max(0, last_end - start_offset))
+            self.instrumentation.count(COUNTER_ENSEMBLES, ensembles)
+            self.instrumentation.count(COUNTER_BAD_CHECKSUMS, self.bad_checksums - bad_checksums)
+            self.instrumentation.count(COUNTER_BAD_BYTES, self.bad_bytes - bad_bytes)
+
+    def _read_ensembles(self, start_offset: int, end_offset: int):
+        """
+        Read the ensembles from the file in chunks.  See ensembles().
+        :param start_offset: Byte offset in the file to start reading.
+        :type start_offset: int
+        :param end_offset: Byte offset in the file to stop reading.  If None, read to the end of the file.
+        :type end_offset: int
+        :return: Byte offset of the ensemble and the ensemble bytes.
+        :rtype: int, bytes
+        """
+        total_size = os.path.getsize(self.file_path)
+        if end_offset is None or end_offset > total_size:
+            end_offset = total_size
+
+        # Only read the clock if the stages are timed
+        timed = self.instrumentation.enabled
+        search_start = 0.0
+
+        with open(self.file_path, "rb") as file:
+            file.seek(start_offset)
+
+            # Offset in the file of the start of the buffer
+            buffer_offset = start_offset
+            buffer = b''
+            pos = 0
+            eof = False
+
+            while True:
+                if timed:
+                    search_start = time.perf_counter()
+
+                # Look for the next ensemble header
+                header_pos = buffer.find(ENSEMBLE_HEADER, pos)
+
+                # Stop when the next ensemble starts after the end offset
+                if header_pos >= 0 and buffer_offset + header_pos >= end_offset:
+                    break
+                if header_pos < 0 and buffer_offset + len(buffer) - len(ENSEMBLE_HEADER) >= end_offset:
+                    break
+
+                # Need more data if the header or the complete ensemble is not in the buffer
+                need_data = header_pos < 0 or header_pos + HEADER_SIZE > len(buffer)
+                if not need_data:
+                    ens_num, payload_size = parse_header(buffer, header_pos)
+                    if ens_num is None:
+                        # Not a valid header, look past this 0x80
+                        if timed:
+                            self.instrumentation.add_time(STAGE_HEADER_SEARCH, time.perf_counter() - search_start)
+                        self.bad_bytes += header_pos + 1 - pos
+                        pos = header_pos + 1
+                        continue
+
+                    ens_size = HEADER_SIZE + payload_size + CHECKSUM_SIZE
+                    if header_pos + ens_size > len(buffer):
+                        need_data = True
+
+                if timed:
+                    self.instrumentation.add_time(STAGE_HEADER_SEARCH, time.perf_counter() - search_start)
+
+                if need_data:
+                    if eof:
+                        # Any bytes left are not a complete ensemble
+                        self.bad_bytes += max(0, min(len(buffer), end_offset - buffer_offset) - pos)
+                        break
+
+                    # Keep the bytes not processed and read the next chunk
+                    # Keep enough bytes at the end to find a header split between chunks
+                    if header_pos >= 0:
+                        keep_from = header_pos
+                    else:
+                        keep_from = max(pos, len(buffer) - len(ENSEMBLE_HEADER) + 1)
+                    self.bad_bytes += keep_from - pos
+                    buffer_offset += keep_from
+
+                    if timed:
+                        read_start = time.perf_counter()
+                    chunk = file.read(self.chunk_size)
+                    if timed:
+                        self.instrumentation.add_time(STAGE_READ, time.perf_counter() - read_start)
+                    if not chunk:
+                        eof = True
+                    elif self.file_progress_callback:
+                        self.file_progress_callback(len(chunk), total_size, self.file_path)
+                    buffer = buffer[keep_from:] + chunk
+                    pos = 0
+                    continue
+
+                # Verify the checksum
+                if timed:
+                    checksum_start = time.perf_counter()
+                    good_checksum = verify_checksum(buffer, header_pos, payload_size)
+                    self.instrumentation.add_time(STAGE_CHECKSUM, time.perf_counter() - checksum_start)
+                else:
+                    good_checksum = verify_checksum(buffer, header_pos, payload_size)
+                if not good_checksum:
+                    logging.debug("Bad checksum for ensemble " + str(ens_num) + " at " + str(buffer_offset + header_pos))
+                    self.bad_checksums += 1
+                    self.bad_bytes += header_pos + 1 - pos
+                    pos = header_pos + 1
+                    continue
+
+                # Good ensemble found
+                self.bad_bytes += header_pos - pos
+                yield buffer_offset + header_pos, buffer[header_pos:header_pos + ens_size]
+                pos = header_pos + ens_size
+
+
+class MmapRtbReader(RtbReader):
+    """
+    Read the ensembles from an RTB binary file using a memory mapped file.
+    Each ensemble is given as a memoryview into the mapped file, so the
+    ensemble bytes are not copied.  The views are only valid while the
+    reader is in use, so any data that must be kept has to be copied.
+
+    If the file can not be memory mapped, the file is read in chunks.
+
+    The pages of the file that are read stay in the resident memory of the
+    process until the map is closed.  If a release size is given, the pages
+    more than the release size behind the scan are released as the file is
+    read, so the resident memory does not grow with the size of the file.
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, file_progress_callback=None,
+                 release_size: int = None, instrumentation: Instrumentation = NULL_INSTRUMENTATION):
+        """
+        Initialize the reader.
+        :param file_path: File path of the RTB file.
+        :type file_path: str
+        :param chunk_size: Number of bytes between file progress reports.
+        :type chunk_size: int
+        :param file_progress_callback: Called with the bytes read for each chunk, the total size and file name.
+        :type file_progress_callback: function(bytes_read, total_size, file_name)
+        :param release_size: Bytes of the file to keep in memory after they are read.  If None, the pages are kept.
+        :type release_size: int
+        :param instrumentation: Records the time of each stage and the counters.
+        :type instrumentation: Instrumentation
+        """
+        super().__init__(file_path, chunk_size, file_progress_callback, instrumentation)
+        self.release_size = release_size
+
+    def _read_ensembles(self, start_offset: int, end_offset: int):
+        """
+        Read the ensembles from the memory mapped file.  See ensembles().
+        :param start_offset: Byte offset in the file to start reading.
+        :type start_offset: int
+        :param end_offset: Byte offset in the file to stop reading.  If None, read to the end of the file.
+        :type end_offset: int
+        :return: Byte offset of the ensemble and a view of the ensemble bytes.
+        :rtype: int, memoryview
+        """
+        total_size = os.path.getsize(self.file_path)
+        if end_offset is None or end_offset > total_size:
+            end_offset = total_size
+        if total_size == 0 or start_offset >= end_offset:
+            return
+
+        with open(self.file_path, "rb") as file:
+            try:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError, OverflowError) as ex:
+                logging.debug("Could not memory map " + self.file_path + ", reading in chunks: " + str(ex))
+                mapped = None
+
+            if mapped is None:
+                yield from super()._read_ensembles(start_offset, end_offset)
+                return
+
+            if hasattr(mapped, "madvise"):
+                # The file is read from start to end
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+            view = memoryview(mapped)
+            try:
+                yield from self._scan(mapped, view, start_offset, end_offset, total_size)
+            finally:
+                view.release()
+                try:
+                    mapped.close()
+                except BufferError:
+                    # A view of an ensemble is still used, the map is closed when it is released
+                    logging.debug("Memory map of " + self.file_path + " still in use")
+
+    def _scan(self, mapped, view: memoryview, start_offset: int, end_offset: int, total_size: int):
+        """
+        Scan the memory mapped file for the ensembles.
+        :param mapped: Memory mapped file.
+        :type mapped: mmap.mmap
+        :param view: View of the memory mapped file.
+        :type view: memoryview
+        :param start_offset: Byte offset in the file to start reading.
+        :type start_offset: int
+        :param end_offset: Byte offset in the file to stop reading.
+        :type end_offset: int
+        :param total_size: Size of the file.
+        :type total_size: int
+        :return: Byte offset of the ensemble and a view of the ensemble bytes.
+        :rtype: int, memoryview
+        """
+        pos = start_offset
+
+        # Report the progress in the same size steps as reading the file in chunks
+        reported_pos = start_offset
+
+        # Start of the pages not released yet
+        released_pos = start_offset - start_offset % mmap.PAGESIZE
+
+        # Only read the clock if the stages are timed.  The pages of the file
+        # are read when they are first used, so the read time is in the header search.
+        timed = self.instrumentation.enabled
+        search_start = 0.0
+
+        while True:
+            if timed:
+                search_start = time.perf_counter()
+
+            # Look for the next ensemble header
+            header_pos = mapped.find(ENSEMBLE_HEADER, pos, min(end_offset + len(ENSEMBLE_HEADER) - 1, total_size))
+            if header_pos < 0 or header_pos >= end_offset:
+                self.bad_bytes += end_offset - pos if end_offset > pos else 0
+                break
+
+            if header_pos + HEADER_SIZE > total_size:
+                self.bad_bytes += end_offset - pos
+                break
+
+            ens_num, payload_size = parse_header(mapped, header_pos)
+            if timed:
+                checksum_start = time.perf_counter()
+                self.instrumentation.add_time(STAGE_HEADER_SEARCH, checksum_start - search_start)
+            if ens_num is None:
+                # Not a valid header, look past this 0x80
+                self.bad_bytes += header_pos + 1 - pos
+                pos = header_pos + 1
+                continue
+
+            ens_size = HEADER_SIZE + payload_size + CHECKSUM_SIZE
+            complete = header_pos + ens_size <= total_size
+            if complete:
+                good_checksum = verify_checksum(view, header_pos, payload_size)
+                if timed:
+                    self.instrumentation.add_time(STAGE_CHECKSUM, time.perf_counter() - checksum_start)
+            if not complete or not good_checksum:
+                if complete:
+                    logging.debug("Bad checksum for ensemble " + str(ens_num) + " at " + str(header_pos))
+                    self.bad_checksums += 1
+                self.bad_bytes += header_pos + 1 - pos
+                pos = header_pos + 1
+                continue
+
+            # Good ensemble found
+            self.bad_bytes += header_pos - pos
+            yield header_pos, view[header_pos:header_pos + ens_size]
+            pos = header_pos + ens_size
+
+            if self.file_progress_callback and pos - reported_pos >= self.chunk_size:
+                self.file_progress_callback(pos - reported_pos, total_size, self.file_path)
+                reported_pos = pos
+
+            if self.release_size and pos - released_pos >= 2 * self.release_size:
+                # Release the pages read, keeping the pages of the ensembles that may still be decoded.
+                # The pages are read again from the file if they are used.
+                release_end = pos - self.release_size
+                release_end -= release_end % mmap.PAGESIZE
+                mapped.madvise(mmap.MADV_DONTNEED, released_pos, release_end - released_pos)
+                released_pos = release_end
+
+        if self.file_progress_callback and end_offset > reported_pos:
+            self.file_progress_callback(end_offset - reported_pos, total_size, self.file_path)
+
+
+def create_reader(file_path: str, file_progress_callback=None, use_mmap: bool = True,
+                  memory_budget: MemoryBudget = None, instrumentation: Instrumentation = NULL_INSTRUMENTATION) -> RtbReader:
+    """
+    Create the reader for the RTB file.
+
+    With a memory budget, the pages of a memory mapped file are released after
+    they are read.  If the pages can not be released on this system, the file
+    is read in chunks instead.
+    :param file_path: File path of the RTB file.
+    :type file_path: str
+    :param file_progress_callback: Called with the bytes read, the total size and file name.
+    :type file_progress_callback: function(bytes_read, total_size, file_name)
+    :param use_mmap: Use a memory mapped file to not copy the ensemble bytes.
+    :type use_mmap: bool
+    :param memory_budget: Memory budget of the export.  If None, the memory is not limited.
+    :type memory_budget: MemoryBudget
+    :param instrumentation: Records the time of each stage and the counters.
+    :type instrumentation: Instrumentation
+    :return: Reader for the file.
+    :rtype: RtbReader
+    """
+    if use_mmap and memory_budget is not None:
+        if hasattr(mmap, "MADV_DONTNEED") and hasattr(mmap.mmap, "madvise"):
+            return MmapRtbReader(file_path, file_progress_callback=file_progress_callback,
+                                 release_size=max(memory_budget.read_size(), mmap.PAGESIZE),
+                                 instrumentation=instrumentation)
+        use_mmap = False
+
+    if use_mmap:
+        return MmapRtbReader(file_path, file_progress_callback=file_progress_callback, instrumentation=instrumentation)
+    return RtbReader(file_path, file_progress_callback=file_progress_callback, instrumentation=instrumentation)
@@ -0,0 +1,323 @@
+import os
+import logging
+from .rtb_reader import create_reader
+from .batch_decoder import BatchDecoder, EnsembleBatch, DEFAULT_BATCH_SIZE, file_shape
+from .netcdf_writer import NetcdfWriter, read_resume_state
+from .batch_writer import BatchWriter, create_writer
+from .output_formats import is_netcdf_only
+from .time_average import TimeAverager
+from .export_profile import ExportProfile
+from .memory_budget import MemoryBudget
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from .job_control import JobControl, JobCancelled, NULL_JOB_CONTROL
+from .progress import ProgressReporter
+from .analyze_stats import AnalyzeStats
+from .analyze_cache import head_hash
+
+
+def default_output_path(file_path: str) -> str:
+    """
+    Get the netCDF file path for the RTB file.  The netCDF file
+    is in the same folder as the RTB file with the .nc extension.
+    :param file_path: RTB file path.
+    :type file_path: str
+    :return: netCDF file path.
+    :rtype: str
+    """
+    return os.path.splitext(file_path)[0] + ".nc"
+
+
+def find_resume_state(file_path: str, output_path: str = None) -> dict:
+    """
+    Find the resume state of the netCDF file exported from the RTB file.
+    The state is only given if the netCDF file was exported from the start
+    of the same RTB file, and the RTB file has not been made smaller.
+    :param file_path: RTB file path.
+    :type file_path: str
+    :param output_path: netCDF file path.  If None, the RTB file path with the .nc extension.
+    :type output_path: str
+    :return: Resume state from read_resume_state() or None if the file can not be appended to.
+    :rtype: dict
+    """
+    if not output_path:
+        output_path = default_output_path(file_path)
+
+    state = read_resume_state(output_path)
+    if state is None:
+        return None
+
+    if state["ResumeOffset"] > os.path.getsize(file_path):
+        logging.debug(file_path + " is smaller than the resume offset of " + output_path)
+        return None
+    if state["SourceHash"] != head_hash(file_path, state["ResumeOffset"]):
+        logging.debug(output_path + " was not exported from " + file_path)
+        return None
+
+    return state
+
+
+class StreamExporter:
+    """
+    Export the RTB file to netCDF in a single pass.  The ensembles are decoded
+    in batches and each batch is written to the netCDF file.  The analyze results
+    are collected at the same time, so the file does not need to be analyzed first.
+
+    The same decoded batches can be written to more than one output format,
+    such as netCDF and Zarr, so each format is produced from a single read of
+    the RTB file.  Only the netCDF file can be appended to.
+
+    For a quick look at a large file, only the byte ranges of selected records
+    can be read, such as every Nth record found with the ensemble index, so the
+    records not selected are not read or decoded.  The ensembles can also be
+    averaged into fixed time intervals.  These files are not appended to.
+
+    A 4 beam ensemble followed by a vertical beam ensemble is merged into a
+    5 beam ensemble.
+
+    When the whole file is exported, the byte offset after the last ensemble is
+    stored in the netCDF file.  In append mode, only the ensembles after that
+    offset are read and they are added to the end of the existing netCDF file.
+    If the netCDF file can not be appended to, the whole file is exported.
+
+    A file still being recorded may end between a 4 beam ensemble and its
+    vertical beam.  So a 4 beam ensemble at the end of paired ensembles is not
+    exported and the stored offset is the start of that ensemble.  The next
+    append reads it again with its vertical beam.
+
+    If the profile has a memory budget, the reader, decoder and writer are
+    sized to keep the resident memory within the budget for any file size.
+
+    The job control is checked before each batch is written.  If the job is
+    cancelled, the partial netCDF file is removed.  When appending, the
+    batches already read are written and the file is closed with the resume
+    offset after them, so the next append continues where it stopped.
+    """
+
+    def __init__(self, file_path: str, output_path: str = None,
+                 file_progress_callback=None, ensemble_progress_callback=None,
+                 start_offset: int = 0, end_offset: int = None, use_mmap: bool = True,
+                 batch_size: int = DEFAULT_BATCH_SIZE, profile: ExportProfile = None, append: bool = False,
+                 instrumentation: Instrumentation = NULL_INSTRUMENTATION, job_control: JobControl = NULL_JOB_CONTROL,
+                 formats: list = None, record_ranges: list = None, decimate: int = 1,
+                 average_interval: float = None):
+        """
+        Initialize the exporter.
+        :param file_path: RTB file path to export.
+        :type file_path: str
+        :param output_path: netCDF file path.  If None, the RTB file path with the .nc extension.
+        :type output_path: str
+        :param file_progress_callback: Called with the bytes read for each chunk, the total size and file name.
+        :type file_progress_callback: function(bytes_read, total_size, file_name)
+        :param ensemble_progress_callback: Called with the number of ensembles exported so far.  The calls are rate limited.
+        :type ensemble_progress_callback: function(ens_exported)
+        :param start_offset: Byte offset in the file of the first ensemble to export.
+        :type start_offset: int
+        :param end_offset: Byte offset in the file to stop exporting.  If None, export to the end of the file.
+        :type end_offset: int
+        :param use_mmap: Read the file using a memory mapped file.
+        :type use_mmap: bool
+        :param batch_size: Number of ensembles to decode and write at a time.
+        :type batch_size: int
+        :param profile: Chunk shape, compression and write buffer of the netCDF file.  If None, the default profile.
+        :type profile: ExportProfile
+        :param append: Append the ensembles added to the file since the last export to the netCDF file.
+        :type append: bool
+        :param instrumentation: Records the time of each stage and the counters.
+        :type instrumentation: Instrumentation
+        :param job_control: Cancel or pause the export.
+        :type job_control: JobControl
+        :param formats: Output formats in OUTPUT_FORMATS.  The other formats use the netCDF file path with
+                        their extension.  If None, only netCDF.
+        :type formats: list
+        :param record_ranges: Start and end byte offset of each record to read.  If given, only these records
+                              are read and the start and end offset are not used.
+        :type record_ranges: list
+        :param decimate: Every decimate record was selected in the record ranges.  Stored in the analyze results.
+        :type decimate: int
+        :param average_interval: Average the ensembles into intervals of this many seconds.  None to not average.
+        :type average_interval: float
+        """
+        self.file_path = file_path
+        self.output_path = output_path if output_path else default_output_path(file_path)
+        self.file_progress_callback = file_progress_callback
+        self.progress = ProgressReporter(ensemble_progress_callback)
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.use_mmap = use_mmap
+        self.batch_size = batch_size
+        self.profile = profile
+        self.append = append
+        self.instrumentation = instrumentation
+        self.job_control = job_control
+        self.formats = formats
+        self.record_ranges = record_ranges
+        self.decimate = decimate
+        self.average_interval = average_interval
+        self.stats = AnalyzeStats()
+
+        # Number of ensembles written, which are the intervals when averaging
+        self.written_count = 0
+
+        # Byte offset after the last record written
+        self.last_end_offset = None
+
+    def export(self) -> dict:
+        """
+        Export the file.  If the export fails, the partial output files are removed.
+        When appending, the existing netCDF file is kept.
+        :return: Analyze results of the file.
+        :rtype: dict
+        """
+        logging.debug("Starting Single Pass Export netCDF: " + self.file_path)
+        memory_budget = MemoryBudget.from_profile(self.profile)
+        reader = create_reader(self.file_path, self.file_progress_callback, self.use_mmap, memory_budget,
+                               self.instrumentation)
+
+        # Continue from the last export of the file
+        resume = None
+        if self.append and is_netcdf_only(self.formats) and not self._is_selection() and \
+                self.start_offset == 0 and self.end_offset is None:
+            resume = find_resume_state(self.file_path, self.output_path)
+
+        if resume is not None:
+            logging.debug("Appending to " + self.output_path + " from byte " + str(resume["ResumeOffset"]))
+            self.start_offset = resume["ResumeOffset"]
+            self.stats.resume(resume["Result"])
+            writer = NetcdfWriter(self.output_path, self.profile, append=True, memory_budget=memory_budget,
+                                  instrumentation=self.instrumentation)
+            decoder = BatchDecoder(self.batch_size, resume["NumBins"], resume["NumBeams"], memory_budget,
+                                   self.instrumentation)
+        else:
+            # The number of bins and beams of the whole file, not of the first record
+            num_bins, num_beams = file_shape(self.file_path)
+            writer = create_writer(self.output_path, self.formats, self.profile, memory_budget, self.instrumentation)
+            decoder = BatchDecoder(self.batch_size, num_bins, num_beams, memory_budget, self.instrumentation)
+
+        averager = TimeAverager(self.average_interval) if self.average_interval else None
+
+        try:
+            for batch in self._batches(reader, decoder, self._is_resumable(resume)):
+                self.job_control.check()
+                decoded_count = batch.count
+                if averager is not None:
+                    # Only the completed intervals are written
+                    batch = averager.add(batch)
+                if batch is not None:
+                    self._write(writer, batch)
+
+                if self.progress.enabled:
+                    self.progress.add(decoded_count)
+
+            # The next append starts at the 4 beam ensemble held without its vertical beam
+            if decoder.held_offset is not None:
+                self.last_end_offset = decoder.held_offset
+
+            if averager is not None:
+                batch = averager.finish()
+                if batch is not None:
+                    self._write(writer, batch)
+            self.progress.finish()
+        except JobCancelled:
+            if resume is None:
+                writer.abort()
+                writer.remove()
+            else:
+                # Keep the ensembles appended so far
+                self._close(writer, resume)
+            logging.debug("Single Pass Export netCDF Cancelled: " + self.file_path)
+            raise
+        except Exception:
+            writer.abort()
+            if resume is None:
+                writer.remove()
+            raise
+
+        result = self._close(writer, resume)
+
+        logging.debug("Single Pass Export netCDF Complete: " + self.file_path +
+                      " Bad Checksums: " + str(reader.bad_checksums) + " Bad Bytes: " + str(reader.bad_bytes))
+        return result
+
+    def _close(self, writer: BatchWriter, resume: dict) -> dict:
+        """
+        Close the output files with the analyze results and the resume offset.
+        :param writer: Writer of the output formats.
+        :type writer: BatchWriter
+        :param resume: Resume state of the file appended to.  None if a new file was created.
+        :type resume: dict
+        :return: Analyze results of the file.
+        :rtype: dict
+        """
+        result = self.stats.result(self.file_path)
+        if self.decimate > 1:
+            result["Decimate"] = self.decimate
+        if self.average_interval:
+            result["AverageInterval"] = self.average_interval
+            result["IntervalCount"] = self.written_count
+
+        # Only a file exported from the start can be appended to later
+        resume_offset = None
+        source_hash = None
+        if self.last_end_offset is not None and self._is_resumable(resume):
+            resume_offset = self.last_end_offset
+            source_hash = head_hash(self.file_path, resume_offset)
+        writer.close(result, resume_offset, source_hash)
+        return result
+
+    def _write(self, writer: BatchWriter, batch: EnsembleBatch):
+        """
+        Write the batch and add it to the analyze results.
+        :param writer: Writer of the output formats.
+        :type writer: BatchWriter
+        :param batch: Batch of decoded ensembles.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        writer.write_batch(batch)
+        self.last_end_offset = int(batch.end_offsets[batch.count - 1])
+        self.written_count += batch.count
+
+        # Count the ensembles averaged into the batch.  Only the first two and last
+        # valid times are needed for the analyze results.
+        record_count, pair_count = batch.source_counts()
+        self.stats.add_batch(record_count, pair_count, *batch.time_summary())
+
+    def _is_resumable(self, resume: dict) -> bool:
+        """
+        Check if the export reads to the end of the file from the start of the file
+        or from the resume offset, so the file can be appended to later.
+        :param resume: Resume state of the file appended to.  None if a new file is created.
+        :type resume: dict
+        :return: TRUE if the resume offset is stored.
+        :rtype: bool
+        """
+        return self.end_offset is None and not self._is_selection() and (self.start_offset == 0 or resume is not None)
+
+    def _is_selection(self) -> bool:
+        """
+        Check if only some of the records are read or the ensembles are averaged.
+        The file can not be appended to.
+        :return: TRUE if the records are selected or averaged.
+        :rtype: bool
+        """
+        return self.record_ranges is not None or bool(self.average_interval)
+
+    def _batches(self, reader, decoder: BatchDecoder, hold_unpaired: bool):
+        """
+        Read and decode the ensembles.  If the record ranges are given, only the
+        records in the ranges are read.
+        :param reader: Reader of the RTB file.
+        :type reader: RtbReader
+        :param decoder: Decoder of the ensembles.
+        :type decoder: BatchDecoder
+        :param hold_unpaired: Do not export a 4 beam ensemble at the end of paired ensembles.
+        :type hold_unpaired: bool
+        :return: Decoded batches.
+        :rtype: EnsembleBatch
+        """
+        if self.record_ranges is None:
+            return decoder.batches(reader.ensembles(self.start_offset, self.end_offset), hold_unpaired)
+
+        return decoder.record_batches(ens_record for ensembles in reader.records(self.record_ranges)
+                                      for ens_record in decoder.paired_records(ensembles))
@@ -0,0 +1,239 @@
+import numpy as np
+from .rtb_decoder import ANCILLARY_FIELDS, BAD_VELOCITY
+from .batch_decoder import EnsembleBatch, US_PER_SECOND
+from .batch_writer import VELOCITY_VARIABLES
+
+# Ancillary values in degrees that wrap at 360, averaged as angles
+ANGLE_FIELDS = ["heading", "roll"]
+ANGLE_COLUMNS = [ANCILLARY_FIELDS.index(field) for field in ANGLE_FIELDS]
+
+# Columns of each interval, as opposed to the sums and counts
+INTERVAL_COLUMNS = ("key", "ens_num", "is_pair", "offsets", "end_offsets", "record_counts", "pair_counts")
+
+
+class TimeAverager:
+    """
+    Average the decoded ensembles into fixed time intervals.  The intervals
+    start at multiples of the interval since 1970, so the files of a deployment
+    use the same intervals.  Each interval is given the time of its center.
+
+    The bin and beam values and the ancillary values of the ensembles in an
+    interval are averaged, ignoring bad velocities and missing values.  If no
+    ensemble in the interval has a good value, the velocity is the bad velocity
+    and the other values are NaN.  The averaged values are floats.  The heading
+    and roll are averaged as angles from the sums of their sines and cosines,
+    so 359 and 1 degrees average to 0 degrees.  The heading is wrapped to
+    [0, 360) and the roll to (-180, 180], so the roll keeps its sign.
+
+    Each interval keeps the number of records and paired records averaged
+    into it, so the analyze results count the ensembles of the file.
+
+    The ensembles must be in time order.  An interval can span many batches,
+    so the last interval of each batch is held until the next batch.
+    Ensembles without a valid time are not averaged.
+    """
+
+    def __init__(self, interval: float):
+        """
+        Initialize the averager.
+        :param interval: Length of each interval in seconds.
+        :type interval: float
+        """
+        if interval <= 0:
+            raise ValueError("The average interval must be more than 0 seconds")
+        self.interval = interval
+        self.interval_us = max(1, int(round(interval * US_PER_SECOND)))
+
+        # Sums of the interval not complete yet
+        self.pending = None
+
+        # Batch the averaged intervals are copied from, to get the number of bins and beams
+        self.template = None
+
+    def add(self, batch: EnsembleBatch) -> EnsembleBatch:
+        """
+        Add the ensembles of the batch to the intervals.
+        :param batch: Batch of decoded ensembles.
+        :type batch: EnsembleBatch
+        :return: Batch of the intervals completed.  None if no interval was completed.
+        :rtype: EnsembleBatch
+        """
+        count = batch.count
+        datetimes = batch.datetimes[:count]
+        rows = np.flatnonzero(~np.isnat(datetimes))
+        if len(rows) == 0:
+            return None
+        if self.template is None:
+            self.template = batch
+
+        # Interval of each ensemble and the first ensemble of each interval
+        keys = datetimes[rows].astype(np.int64) // self.interval_us
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        ends = np.concatenate((starts[1:], [len(rows)])) - 1
+
+        intervals = {
+            "key": keys[starts],
+            "ens_num": batch.ens_num[rows[starts]],
+            "is_pair": np.logical_or.reduceat(batch.is_pair[rows], starts),
+            "offsets": batch.offsets[rows[starts]],
+            "end_offsets": batch.end_offsets[rows[ends]],
+            "record_counts": ends - starts + 1,
+            "pair_counts": np.add.reduceat(batch.is_pair[rows].astype(np.int64), starts),
+            "sums": {},
+            "counts": {},
+        }
+        for var_name, values in batch.bin_beam.items():
+            self._sum(intervals, var_name, values[rows], starts)
+        self._sum(intervals, "ancillary", batch.ancillary[rows], starts)
+
+        # Sum the sines and cosines of the angles
+        angles = np.radians(batch.ancillary[rows][:, ANGLE_COLUMNS].astype(np.float64))
+        self._sum(intervals, "angle_sin", np.sin(angles), starts)
+        self._sum(intervals, "angle_cos", np.cos(angles), starts)
+
+        # Add the interval held from the last batch
+        if self.pending is not None:
+            if self.pending["key"][0] == intervals["key"][0]:
+                self._merge(self.pending, intervals)
+            else:
+                intervals = self._concatenate(self.pending, intervals)
+
+        # The last interval may continue in the next batch
+        self.pending = self._slice(intervals, slice(-1, None))
+        if len(intervals["key"]) == 1:
+            return None
+        return self._create_batch(self._slice(intervals, slice(None, -1)))
+
+    def finish(self) -> EnsembleBatch:
+        """
+        Complete the last interval.
+        :return: Batch of the last interval.  None if there is no interval.
+        :rtype: EnsembleBatch
+        """
+        if self.pending is None:
+            return None
+        intervals = self.pending
+        self.pending = None
+        return self._create_batch(intervals)
+
+    @staticmethod
+    def _sum(intervals: dict, var_name: str, values: np.ndarray, starts: np.ndarray):
+        """
+        Add the sum and count of the good values in each interval.
+        :param intervals: Intervals of the batch.
+        :type intervals: dict
+        :param var_name: Variable name.
+        :type var_name: str
+        :param values: Values of the ensembles with a valid time.
+        :type values: np.ndarray
+        :param starts: First ensemble of each interval.
+        :type starts: np.ndarray
+        :return:
+        :rtype:
+        """
+        values = values.astype(np.float64)
+        good = ~np.isnan(values)
+        if var_name in VELOCITY_VARIABLES:
+            # Bad velocities are not averaged
+            good &= values != np.float32(BAD_VELOCITY)
+        intervals["sums"][var_name] = np.add.reduceat(np.where(good, values, 0.0), starts, axis=0)
+        intervals["counts"][var_name] = np.add.reduceat(good.astype(np.int64), starts, axis=0)
+
+    @staticmethod
+    def _merge(first: dict, intervals: dict):
+        """
+        Add the interval held from the last batch into the first interval of the batch.
+        :param first: Interval held from the last batch.
+        :type first: dict
+        :param intervals: Intervals of the batch.
+        :type intervals: dict
+        :return:
+        :rtype:
+        """
+        intervals["ens_num"][0] = first["ens_num"][0]
+        intervals["offsets"][0] = first["offsets"][0]
+        intervals["is_pair"][0] |= first["is_pair"][0]
+        intervals["record_counts"][0] += first["record_counts"][0]
+        intervals["pair_counts"][0] += first["pair_counts"][0]
+        for var_name in intervals["sums"]:
+            intervals["sums"][var_name][0] += first["sums"][var_name][0]
+            intervals["counts"][var_name][0] += first["counts"][var_name][0]
+
+    @staticmethod
+    def _concatenate(first: dict, intervals: dict) -> dict:
+        """
+        Put the intervals together.
+        :param first: Intervals before the batch.
+        :type first: dict
+        :param intervals: Intervals of the batch.
+        :type intervals: dict
+        :return: All the intervals.
+        :rtype: dict
+        """
+        result = {name: np.concatenate((first[name], intervals[name])) for name in INTERVAL_COLUMNS}
+        for total in ("sums", "counts"):
+            result[total] = {var_name: np.concatenate((first[total][var_name], values))
+                             for var_name, values in intervals[total].items()}
+        return result
+
+    @staticmethod
+    def _slice(intervals: dict, selection: slice) -> dict:
+        """
+        Copy some of the intervals.
+        :param intervals: Intervals.
+        :type intervals: dict
+        :param selection: Intervals to copy.
+        :type selection: slice
+        :return: Intervals selected.
+        :rtype: dict
+        """
+        result = {name: intervals[name][selection].copy() for name in INTERVAL_COLUMNS}
+        for total in ("sums", "counts"):
+            result[total] = {var_name: values[selection].copy() for var_name, values in intervals[total].items()}
+        return result
+
+    def _create_batch(self, intervals: dict) -> EnsembleBatch:
+        """
+        Create the batch of the average of each interval.
+        :param intervals: Completed intervals.
+        :type intervals: dict
+        :return: Batch with an ensemble for each interval.
+        :rtype: EnsembleBatch
+        """
+        template = self.template
+        batch = EnsembleBatch()
+        batch.count = len(intervals["key"])
+        batch.num_bins = template.num_bins
+        batch.num_beams = template.num_beams
+        batch.serial_number = template.serial_number
+        batch.subsystem_code = template.subsystem_code
+        batch.subsystem_config = template.subsystem_config
+
+        # The time of each interval is its center
+        batch.datetimes = (intervals["key"] * self.interval_us + self.interval_us // 2).astype("datetime64[us]")
+        batch.ens_num = intervals["ens_num"]
+        batch.is_pair = intervals["is_pair"]
+        batch.offsets = intervals["offsets"]
+        batch.end_offsets = intervals["end_offsets"]
+        batch.record_counts = intervals["record_counts"]
+        batch.pair_counts = intervals["pair_counts"]
+
+        for var_name, sums in intervals["sums"].items():
+            if var_name in ("angle_sin", "angle_cos"):
+                continue
+            counts = intervals["counts"][var_name]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                average = (sums / counts).astype(np.float32)
+            missing = BAD_VELOCITY if var_name in VELOCITY_VARIABLES else np.nan
+            average[counts == 0] = missing
+            if var_name == "ancillary":
+                batch.ancillary = average[:, :len(ANCILLARY_FIELDS)]
+            else:
+                batch.bin_beam[var_name] = average
+
+        # Average of the angles from the sines and cosines.  Only the heading is wrapped to [0, 360).
+        angles = np.degrees(np.arctan2(intervals["sums"]["angle_sin"], intervals["sums"]["angle_cos"]))
+        angles[:, ANGLE_FIELDS.index("heading")] %= 360
+        angles[intervals["counts"]["angle_sin"] == 0] = np.nan
+        batch.ancillary[:, ANGLE_COLUMNS] = angles.astype(np.float32)
+        return batch
@@ -0,0 +1,643 @@
+import os
+import sys
+import json
+import time
+import errno
+import struct
+import select
+import logging
+import datetime
+import threading
+import ctypes
+import ctypes.util
+from concurrent.futures import ProcessPoolExecutor
+from . import file_export
+from .export_pool import export_file_summary, default_worker_count
+
+
+# Time in seconds a file must not change before it is exported
+DEFAULT_SETTLE_TIME = 2.0
+
+# Longest time in seconds to wait for a file to stop changing.  A file that is
+# still being recorded is exported at least this often, appending the new ensembles.
+DEFAULT_MAX_DELAY = 60.0
+
+# Time in seconds between scans of the directories when polling
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Time in seconds between writes of the status file
+DEFAULT_STATUS_INTERVAL = 5.0
+
+# Longest time in seconds to wait for file events before checking the queue
+WAIT_TIMEOUT = 0.5
+
+# Longest time in seconds to wait for file events while exports are running
+RUNNING_WAIT_TIMEOUT = 0.1
+
+# Version of the status file
+STATUS_VERSION = 1
+
+# inotify event flags, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# Events watched in each directory
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# inotify event: watch descriptor, mask, cookie, name length
+INOTIFY_EVENT_STRUCT = struct.Struct("iIII")
+
+# Size of the buffer to read the inotify events
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+def is_rtb_file(file_path: str) -> bool:
+    """
+    Check if the file has an RTB file extension.
+    :param file_path: File path.
+    :type file_path: str
+    :return: TRUE if the file is an RTB file.
+    :rtype: bool
+    """
+    return os.path.splitext(file_path)[1].lower() in file_export.RTB_FILE_EXTENSIONS
+
+
+class InotifySource:
+    """
+    Get the files changed in the directories using Linux inotify.  The
+    kernel sends an event for each write, so changes are seen at once
+    without reading the directories.  A file closed after writing is
+    reported as closed, so it can be exported without waiting.
+    """
+
+    name = "inotify"
+
+    def __init__(self, directories: list, recursive: bool = False):
+        """
+        Start watching the directories.
+        :param directories: Directories to watch.
+        :type directories: list
+        :param recursive: Also watch all the sub directories.
+        :type recursive: bool
+        """
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_init1: " + os.strerror(err))
+
+        self.directories = directories
+        self.recursive = recursive
+
+        # Directory of each watch descriptor
+        self.watches = {}
+
+        try:
+            for directory in directories:
+                self._add_watch(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, directory: str):
+        """
+        Watch the directory and, if recursive, all the sub directories.
+        :param directory: Directory to watch.
+        :type directory: str
+        :return:
+        :rtype:
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_add_watch: " + os.strerror(err), directory)
+        self.watches[wd] = directory
+
+        if self.recursive:
+            for entry in os.scandir(directory):
+                if entry.is_dir(follow_symlinks=False):
+                    self._add_watch(entry.path)
+
+    def wait(self, timeout: float) -> list:
+        """
+        Wait for files to change.
+        :param timeout: Longest time in seconds to wait.
+        :type timeout: float
+        :return: List of (file path, closed) for each change.  Closed is TRUE if the file was closed after writing.
+        :rtype: list
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        changes = []
+        pos = 0
+        while pos + INOTIFY_EVENT_STRUCT.size <= len(data):
+            wd, mask, cookie, name_len = INOTIFY_EVENT_STRUCT.unpack_from(data, pos)
+            pos += INOTIFY_EVENT_STRUCT.size
+            name = os.fsdecode(data[pos:pos + name_len].rstrip(b"\0"))
+            pos += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so check all the files
+                logging.warning("inotify queue overflow, scanning all the directories")
+                changes.extend((file_path, False) for file_path in file_export.find_files(self.directories,
+                                                                                          self.recursive))
+                continue
+
+            if mask & IN_IGNORED:
+                # The directory was removed
+                self.watches.pop(wd, None)
+                continue
+
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+
+            if mask & IN_ISDIR:
+                # Watch a new sub directory and check any files moved in with it
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._add_watch(path)
+                    except OSError as ex:
+                        logging.warning("Could not watch " + path + ": " + str(ex))
+                    changes.extend((file_path, False) for file_path in file_export.find_files([path], True))
+                continue
+
+            changes.append((path, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+
+        return changes
+
+    def close(self):
+        """
+        Stop watching the directories.
+        :return:
+        :rtype:
+        """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingSource:
+    """
+    Get the files changed in the directories by scanning the directories
+    and comparing the size and modified time of each file.  This is used
+    when inotify is not available, such as on Windows, macOS or a network
+    drive.
+    """
+
+    name = "polling"
+
+    def __init__(self, directories: list, recursive: bool = False, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        """
+        Scan the directories to get the current state of the files.
+        :param directories: Directories to watch.
+        :type directories: list
+        :param recursive: Also watch all the sub directories.
+        :type recursive: bool
+        :param poll_interval: Time in seconds between scans.
+        :type poll_interval: float
+        """
+        self.directories = directories
+        self.recursive = recursive
+        self.poll_interval = poll_interval
+        self.next_poll = time.monotonic() + poll_interval
+
+        # Size and modified time of each file
+        self.file_stats = {}
+        self._scan()
+
+    def _scan(self) -> list:
+        """
+        Scan the directories for files that are new or changed.
+        :return: List of file paths that are new or changed since the last scan.
+        :rtype: list
+        """
+        changed = []
+        file_stats = {}
+        for file_path in file_export.find_files(self.directories, self.recursive):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            file_stats[file_path] = (stat.st_size, stat.st_mtime_ns)
+            if self.file_stats.get(file_path) != file_stats[file_path]:
+                changed.append(file_path)
+
+        self.file_stats = file_stats
+        return changed
+
+    def wait(self, timeout: float) -> list:
+        """
+        Wait for the next scan of the directories.
+        :param timeout: Longest time in seconds to wait.
+        :type timeout: float
+        :return: List of (file path, closed) for each change.  Closed is always FALSE.
+        :rtype: list
+        """
+        delay = self.next_poll - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        if delay > 0:
+            time.sleep(delay)
+
+        self.next_poll = time.monotonic() + self.poll_interval
+        return [(file_path, False) for file_path in self._scan()]
+
+    def close(self):
+        """
+        Stop watching the directories.
+        :return:
+        :rtype:
+        """
+        self.file_stats = {}
+
+
+def create_source(directories: list, recursive: bool = False, use_inotify: bool = True,
+                  poll_interval: float = DEFAULT_POLL_INTERVAL):
+    """
+    Create the source of the file changes.  inotify is used if it is available,
+    otherwise the directories are polled.
+    :param directories: Directories to watch.
+    :type directories: list
+    :param recursive: Also watch all the sub directories.
+    :type recursive: bool
+    :param use_inotify: Use inotify if it is available.
+    :type use_inotify: bool
+    :param poll_interval: Time in seconds between scans when polling.
+    :type poll_interval: float
+    :return: Source of the file changes.
+    :rtype: InotifySource or PollingSource
+    """
+    if use_inotify:
+        try:
+            return InotifySource(directories, recursive)
+        except OSError as ex:
+            logging.warning("inotify not available, polling the directories: " + str(ex))
+    return PollingSource(directories, recursive, poll_interval)
+
+
+def _timestamp(value: float = None) -> str:
+    """
+    Format a time for the status file.
+    :param value: Time since the epoch.  If None, the current time.
+    :type value: float
+    :return: ISO 8601 date and time.
+    :rtype: str
+    """
+    if value is None:
+        value = time.time()
+    return datetime.datetime.fromtimestamp(value).isoformat(timespec="seconds")
+
+
+class FolderWatcher:
+    """
+    Watch directories for new or grown RTB files and export them to netCDF.
+
+    A file is exported once it has not changed for the settle time, or at once
+    when it is closed after writing.  A file that keeps changing, such as a
+    recording, is exported at least every max delay.  The files are exported
+    incrementally, so only the ensembles added since the last export are read
+    and appended to the netCDF file.  A file that changes while it is exported
+    is exported again when the export completes.
+
+    The number of files exported at the same time is limited by the number of
+    workers.  The state of the watcher and the files is written to a JSON status
+    file that can be read by monitoring tools.
+    """
+
+    def __init__(self, directories: list, recursive: bool = False, workers: int = None,
+                 settle_time: float = DEFAULT_SETTLE_TIME, max_delay: float = DEFAULT_MAX_DELAY,
+                 use_inotify: bool = True, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 status_path: str = None, status_interval: float = DEFAULT_STATUS_INTERVAL,
+                 export_options: dict = None):
+        """
+        Initialize the watcher.
+        :param directories: Directories to watch.
+        :type directories: list
+        :param recursive: Also watch all the sub directories.
+        :type recursive: bool
+        :param workers: Number of files to export at the same time.  If None, the number of CPU cores.
+        :type workers: int
+        :param settle_time: Time in seconds a file must not change before it is exported.
+        :type settle_time: float
+        :param max_delay: Longest time in seconds to wait for a file to stop changing.
+        :type max_delay: float
+        :param use_inotify: Use inotify if it is available, otherwise poll the directories.
+        :type use_inotify: bool
+        :param poll_interval: Time in seconds between scans when polling.
+        :type poll_interval: float
+        :param status_path: File path to write the JSON status.  If None, no status file is written.
+        :type status_path: str
+        :param status_interval: Time in seconds between writes of the status file.
+        :type status_interval: float
+        :param export_options: Options passed to file_export.export_file(), such as profile.
+        :type export_options: dict
+        """
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.recursive = recursive
+        self.workers = workers if workers and workers > 0 else default_worker_count()
+        self.settle_time = settle_time
+        self.max_delay = max_delay
+        self.use_inotify = use_inotify
+        self.poll_interval = poll_interval
+        self.status_path = status_path
+        self.status_interval = status_interval
+
+        # The files are always appended to
+        self.export_options = dict(export_options) if export_options else {}
+        self.export_options["incremental"] = True
+
+        self.stop_event = threading.Event()
+        self.source = None
+        self.started = None
+
+        # Files waiting to be exported: path -> [first change, last change, closed]
+        self.pending = {}
+
+        # Files being exported: future -> (path, time queued)
+        self.running = {}
+
+        # State of each file for the status file
+        self.files = {}
+
+        # Counters for the status file
+        self.exported = 0
+        self.failed = 0
+        self.last_latency = None
+        self.total_latency = 0.0
+        self.max_latency = None
+        self.last_status_time = 0.0
+
+    def stop(self):
+        """
+        Stop watching.  The exports running are completed before run() returns.
+        This can be called from another thread or a signal handler.
+        :return:
+        :rtype:
+        """
+        self.stop_event.set()
+
+    def run(self):
+        """
+        Watch the directories and export the files until stop() is called.
+        :return:
+        :rtype:
+        """
+        self.started = time.time()
+        self.source = create_source(self.directories, self.recursive, self.use_inotify, self.poll_interval)
+        logging.info("Watching " + ", ".join(self.directories) + " using " + self.source.name)
+
+        # Export the files that changed while not watching
+        for file_path in file_export.find_files(self.directories, self.recursive):
+            if self._needs_export(file_path):
+                self._file_changed(file_path, True)
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                while not self.stop_event.is_set():
+                    for file_path, closed in self.source.wait(self._wait_timeout()):
+                        if is_rtb_file(file_path):
+                            self._file_changed(os.path.abspath(file_path), closed)
+
+                    self._collect_complete()
+                    self._submit_ready(executor)
+                    self._write_status()
+
+                # Let the running exports complete
+                logging.info("Stopping, waiting for " + str(len(self.running)) + " exports")
+                executor.shutdown(wait=True)
+                self._collect_complete()
+        finally:
+            self.source.close()
+            self._write_status(force=True, stopped=True)
+
+    @staticmethod
+    def _needs_export(file_path: str) -> bool:
+        """
+        Check if the file has changed since the netCDF file was written.
+        :param file_path: RTB file path.
+        :type file_path: str
+        :return: TRUE if the netCDF file does not exist or is older than the RTB file.
+        :rtype: bool
+        """
+        output_path = os.path.splitext(file_path)[0] + ".nc"
+        try:
+            return os.path.getmtime(output_path) < os.path.getmtime(file_path)
+        except OSError:
+            return True
+
+    def _file_changed(self, file_path: str, closed: bool):
+        """
+        Add the change of the file to the files waiting to be exported.
+        :param file_path: RTB file path.
+        :type file_path: str
+        :param closed: TRUE if the file was closed after writing.
+        :type closed: bool
+        :return:
+        :rtype:
+        """
+        now = time.monotonic()
+        pending = self.pending.get(file_path)
+        if pending is None:
+            self.pending[file_path] = [now, now, closed]
+            if not any(running_path == file_path for running_path, _ in self.running.values()):
+                self._set_file_status(file_path, "queued")
+        else:
+            pending[1] = now
+            pending[2] = closed
+
+    def _is_ready(self, file_path: str, now: float) -> bool:
+        """
+        Check if the file is ready to export.
+        :param file_path: RTB file path.
+        :type file_path: str
+        :param now: Current monotonic time.
+        :type now: float
+        :return: TRUE if the file is not being written or has waited the max delay.
+        :rtype: bool
+        """
+        first_change, last_change, closed = self.pending[file_path]
+        return closed or now - last_change >= self.settle_time or now - first_change >= self.max_delay
+
+    def _wait_timeout(self) -> float:
+        """
+        Get the time to wait for file events before the next pending file is ready
+        or a running export may be complete.
+        :return: Time in seconds.
+        :rtype: float
+        """
+        if self.running:
+            timeout = RUNNING_WAIT_TIMEOUT
+            if len(self.running) >= self.workers:
+                # No file can be started until an export is complete
+                return timeout
+        else:
+            timeout = WAIT_TIMEOUT
+
+        now = time.monotonic()
+        running_paths = {file_path for file_path, _ in self.running.values()}
+        for file_path, (first_change, last_change, closed) in self.pending.items():
+            if file_path in running_paths:
+                continue
+            if closed:
+                return 0.0
+            ready_time = min(last_change + self.settle_time, first_change + self.max_delay)
+            timeout = min(timeout, max(0.0, ready_time - now))
+        return timeout
+
+    def _submit_ready(self, executor: ProcessPoolExecutor):
+        """
+        Start exporting the files that are ready, oldest first, up to the number of workers.
+        :param executor: Process pool to export the files.
+        :type executor: ProcessPoolExecutor
+        :return:
+        :rtype:
+        """
+        now = time.monotonic()
+        running_paths = {file_path for file_path, _ in self.running.values()}
+        ready = [file_path for file_path in self.pending
+                 if file_path not in running_paths and self._is_ready(file_path, now)]
+        ready.sort(key=lambda file_path: self.pending[file_path][0])
+
+        for file_path in ready[:max(0, self.workers - len(self.running))]:
+            first_change = self.pending.pop(file_path)[0]
+            if not os.path.isfile(file_path):
+                self.files.pop(file_path, None)
+                continue
+
+            # The latency is measured from when the change was seen
+            queued_time = time.time() - (now - first_change)
+            future = executor.submit(export_file_summary, {"FilePath": file_path}, None, self.export_options)
+            self.running[future] = (file_path, queued_time)
+            self._set_file_status(file_path, "running")
+
+    def _collect_complete(self):
+        """
+        Get the results of the exports that are complete.
+        :return:
+        :rtype:
+        """
+        for future in [future for future in self.running if future.done()]:
+            file_path, queued_time = self.running.pop(future)
+            try:
+                summary = future.result()
+            except Exception as ex:
+                summary = {"FilePath": file_path, "Status": "failed", "Error": str(ex)}
+
+            latency = time.time() - queued_time
+            file_status = self._set_file_status(file_path, summary["Status"])
+            file_status["Error"] = summary.get("Error")
+            file_status["LastExport"] = _timestamp()
+            file_status["ExportSeconds"] = summary.get("ExportSeconds")
+            file_status["LatencySeconds"] = latency
+
+            if summary["Status"] == "ok":
+                self.exported += 1
+                self.last_latency = latency
+                self.total_latency += latency
+                self.max_latency = latency if self.max_latency is None else max(self.max_latency, latency)
+                result = summary.get("Result") or {}
+                file_status["EnsCount"] = result.get("EnsCount", 0)
+                logging.info("Exported " + file_path + " " + str(file_status["EnsCount"]) + " ensembles in " +
+                             "{:.1f}".format(latency) + " s")
+            else:
+                self.failed += 1
+                logging.error("Error exporting " + file_path + ": " + str(summary.get("Error")))
+
+            # Changed again while exporting
+            if file_path in self.pending:
+                file_status["Status"] = "queued"
+
+            self._write_status(force=True)
+
+    def _set_file_status(self, file_path: str, status: str) -> dict:
+        """
+        Set the status of the file for the status file.
+        :param file_path: RTB file path.
+        :type file_path: str
+        :param status: queued, running, ok or failed.
+        :type status: str
+        :return: Status of the file.
+        :rtype: dict
+        """
+        file_status = self.files.setdefault(file_path, {"Status": None, "LastExport": None, "EnsCount": None,
+                                                        "ExportSeconds": None, "LatencySeconds": None,
+                                                        "Error": None})
+        file_status["Status"] = status
+        return file_status
+
+    def status(self, stopped: bool = False) -> dict:
+        """
+        Get the status of the watcher and the files.
+        :param stopped: TRUE if the watcher has stopped.
+        :type stopped: bool
+        :return: Status.
+        :rtype: dict
+        """
+        return {
+            "Version": STATUS_VERSION,
+            "Pid": os.getpid(),
+            "State": "stopped" if stopped else "watching",
+            "Backend": self.source.name if self.source else None,
+            "Directories": self.directories,
+            "Started": _timestamp(self.started) if self.started else None,
+            "Updated": _timestamp(),
+            "Workers": self.workers,
+            "Queued": len(self.pending),
+            "Running": len(self.running),
+            "Exported": self.exported,
+            "Failed": self.failed,
+            "LastLatencySeconds": self.last_latency,
+            "MeanLatencySeconds": self.total_latency / self.exported if self.exported else None,
+            "MaxLatencySeconds": self.max_latency,
+            "Files": self.files,
+        }
+
+    def _write_status(self, force: bool = False, stopped: bool = False):
+        """
+        Write the status file.  The file is replaced in a single step,
+        so a reader never sees a partial file.
+        :param force: Write the file even if the status interval has not passed.
+        :type force: bool
+        :param stopped: TRUE if the watcher has stopped.
+        :type stopped: bool
+        :return:
+        :rtype:
+        """
+        if not self.status_path:
+            return
+
+        now = time.monotonic()
+        if not force and now - self.last_status_time < self.status_interval:
+            return
+        self.last_status_time = now
+
+        try:
+            temp_path = self.status_path + ".tmp"
+            with open(temp_path, "w") as status_file:
+                json.dump(self.status(stopped), status_file, indent=2, default=str)
+            os.replace(temp_path, self.status_path)
+        except OSError as ex:
+            logging.warning("Could not write the status file " + self.status_path + ": " + str(ex))
@@ -0,0 +1,203 @@
+import os
+import shutil
+import numpy as np
+import zarr
+import numcodecs
+from .rtb_decoder import ANCILLARY_FIELDS, BAD_VELOCITY
+from .batch_decoder import EnsembleBatch
+from .batch_writer import BatchWriter, VARIABLE_ATTRS, VELOCITY_VARIABLES, TIME_UNITS_PREFIX, TIME_UNITS_FORMAT, \
+    has_ancillary, analyze_attrs
+from .export_profile import ExportProfile
+from .memory_budget import MemoryBudget
+from .instrumentation import Instrumentation, NULL_INSTRUMENTATION, STAGE_WRITE
+
+
+# Zarr format written.  Format 2 stores can be read by zarr 2 and 3, xarray and Dask.
+ZARR_FORMAT = 2
+
+# Attribute xarray uses to name the dimensions of a Zarr format 2 array
+DIMENSIONS_ATTR = "_ARRAY_DIMENSIONS"
+
+
+class ZarrWriter(BatchWriter):
+    """
+    Write the decoded ensembles to a Zarr directory store.  The variables,
+    attributes, chunk shape and compression are the same as the netCDF file,
+    and each array names its dimensions, so xarray.open_zarr() gives the same
+    dataset as opening the netCDF file.
+
+    Each chunk is a separate file, so the store can be read in parallel by
+    Dask.  The arrays grow along the time dimension as the write buffer is
+    written, and the metadata is consolidated when the store is closed.
+    """
+
+    def __init__(self, file_path: str, profile: ExportProfile = None, memory_budget: MemoryBudget = None,
+                 instrumentation: Instrumentation = NULL_INSTRUMENTATION):
+        """
+        Initialize the writer.
+        :param file_path: Directory of the Zarr store to create.
+        :type file_path: str
+        :param profile: Chunk shape, compression and write buffer settings.  If None, the default profile.
+        :type profile: ExportProfile
+        :param memory_budget: Memory budget of the export.  If None, the memory is not limited.
+        :type memory_budget: MemoryBudget
+        :param instrumentation: Records the write time, the records written and the buffer writes.
+        :type instrumentation: Instrumentation
+        """
+        super().__init__(file_path, profile, memory_budget, instrumentation)
+        self.group = None
+
+        # Variable name and the array written for each ensemble
+        self.arrays = {}
+
+    def _start(self, batch: EnsembleBatch):
+        """
+        Create the Zarr store using the first batch to set the dimensions and arrays.
+        :param batch: First batch.
+        :type batch: EnsembleBatch
+        :return:
+        :rtype:
+        """
+        self.group = zarr.open_group(self.file_path, mode="w", zarr_format=ZARR_FORMAT)
+
+        # Use the first ensemble time as the time reference
+        first_datetime = self._set_time_ref(batch)
+
+        self.group.attrs.update({
+            "Conventions": "CF-1.6",
+            "history": "Created by Rowe Technologies Inc. ExportR",
+            "serial_number": batch.serial_number,
+            "subsystem_code": batch.subsystem_code,
+            "subsystem_config": batch.subsystem_config,
+        })
+
+        # Coordinates
+        time_chunks = self.profile.variable_options()["chunksizes"]
+        self.arrays["time"] = self._create_array("time", np.float64, ("time",), time_chunks, {
+            "units": TIME_UNITS_PREFIX + first_datetime.strftime(TIME_UNITS_FORMAT),
+            "calendar": "standard",
+            "standard_name": "time",
+        }, fill_value=np.nan)
+        self.arrays["ens_num"] = self._create_array("ens_num", np.int32, ("time",), time_chunks,
+                                                    {"long_name": "Ensemble Number"})
+
+        beam_array = self._create_array("beam", np.int32, ("beam",), None, {}, size=batch.num_beams)
+        beam_array[:] = np.arange(1, batch.num_beams + 1)
+
+        ancillary = has_ancillary(batch)
+        if ancillary:
+            bin_array = self._create_array("bin_range", np.float32, ("bin",), None,
+                                           {"long_name": "Range to the Bin", "units": "m"}, size=batch.num_bins)
+            bin_array[:] = batch.ancillary[0, 0] + np.arange(batch.num_bins) * batch.ancillary[0, 1]
+
+        # Bin and beam data
+        bin_beam_chunks = self.profile.variable_options(batch.num_bins, batch.num_beams)["chunksizes"]
+        for var_name, values in batch.bin_beam.items():
+            attrs = dict(VARIABLE_ATTRS.get(var_name, {}))
+            if var_name in VELOCITY_VARIABLES:
+                attrs["missing_value"] = BAD_VELOCITY
+            self.arrays[var_name] = self._create_array(var_name, values.dtype, ("time", "bin", "beam"),
+                                                       bin_beam_chunks, attrs,
+                                                       shape=(0, batch.num_bins, batch.num_beams))
+
+        # Ancillary data
+        if ancillary:
+            for field in ANCILLARY_FIELDS:
+                self.arrays[field] = self._create_array(field, np.float32, ("time",), time_chunks,
+                                                        VARIABLE_ATTRS.get(field, {}))
+
+        self._create_buffer(batch, ancillary)
+
+    def _create_array(self, name: str, dtype, dimensions: tuple, chunks: list, attrs: dict,
+                      size: int = 0, shape: tuple = None, fill_value=None):
+        """
+        Create an array with the compression of the export profile.
+        :param name: Variable name.
+        :type name: str
+        :param dtype: Value type.
+        :type dtype: np.dtype
+        :param dimensions: Dimension names.
+        :type dimensions: tuple
+        :param chunks: Chunk shape.  If None, the array is a single chunk.
+        :type chunks: list
+        :param attrs: Variable attributes.
+        :type attrs: dict
+        :param size: Length of a 1 dimensional array.
+        :type size: int
+        :param shape: Shape of the array.  If None, a 1 dimensional array of the size.
+        :type shape: tuple
+        :param fill_value: Value of the missing values.
+        :return: Zarr array.
+        :rtype: zarr.Array
+        """
+        if shape is None:
+            shape = (size,)
+        if chunks is None:
+            chunks = shape
+
+        dtype = np.dtype(dtype)
+        compressors = None
+        filters = None
+        if self.profile.complevel > 0:
+            compressors = numcodecs.Zlib(level=self.profile.complevel)
+            if self.profile.shuffle:
+                filters = [numcodecs.Shuffle(elementsize=dtype.itemsize)]
+
+        array = self.group.create_array(name, shape=shape, chunks=tuple(chunks), dtype=dtype,
+                                        compressors=compressors, filters=filters, fill_value=fill_value)
+        attrs = dict(attrs)
+        attrs[DIMENSIONS_ATTR] = list(dimensions)
+        array.attrs.update(attrs)
+        return array
+
+    def _write_buffer(self, start: int, end: int, columns: dict):
+        """
+        Grow each array along the time dimension and write the ensembles.
+        :param start: Index of the first ensemble in the store.
+        :type start: int
+        :param end: Index after the last ensemble.
+        :type end: int
+        :param columns: Variable name and the values of the ensembles.
+        :type columns: dict
+        :return:
+        :rtype:
+        """
+        for var_name, values in columns.items():
+            array = self.arrays[var_name]
+            array.resize((end,) + array.shape[1:])
+            array[start:end] = values
+
+    def close(self, analyze_result: dict = None, resume_offset: int = None, source_hash: str = None):
+        """
+        Write the buffer, add the analyze results to the attributes and consolidate the metadata.
+        A Zarr store can not be appended to, so the resume offset is not used.
+        :param analyze_result: Analyze results to store in the attributes.
+        :type analyze_result: dict
+        :param resume_offset: Not used.
+        :type resume_offset: int
+        :param source_hash: Not used.
+        :type source_hash: str
+        :return:
+        :rtype:
+        """
+        if self.group is None:
+            return
+
+        with self.instrumentation.stage(STAGE_WRITE):
+            self.flush()
+
+            if analyze_result:
+                self.group.attrs.update(analyze_attrs(analyze_result))
+            zarr.consolidate_metadata(self.file_path)
+
+        self.group = None
+        self.arrays = {}
+
+    def remove(self):
+        """
+        Remove the Zarr store directory.
+        :return:
+        :rtype:
+        """
+        if os.path.isdir(self.file_path):
+            shutil.rmtree(self.file_path)
@@ -18,14 +18,23 @@ a = Analysis(['mainwindow.py'],
 pyz = PYZ(a.pure, a.zipped_data,
              cipher=block_cipher)
 
+# Build a folder instead of a single file.  A single file EXE extracts all the
+# libraries (Qt, numpy, netCDF4, pandas, scipy) to a temp folder every time it starts.
 exe = EXE(pyz,
           a.scripts,
-          a.binaries,
-          a.zipfiles,
-          a.datas,
+          [],
+          exclude_binaries=True,
           name='ExportR',
           debug=False,
           strip=False,
           upx=True,
           console=False,
-          icon='rti.ico')
\ No newline at end of file
+          icon='rti.ico')
+
+coll = COLLECT(exe,
+               a.binaries,
+               a.zipfiles,
+               a.datas,
+               strip=False,
+               upx=True,
+               name='ExportR')
\ No newline at end of file
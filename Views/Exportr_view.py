@@ -54,6 +54,7 @@ class Ui_ExporterView(object):
         self.horizontalLayout_3.addWidget(self.scanFilesProgressBar)
         self.verticalLayout.addLayout(self.horizontalLayout_3)
         self.filesListWidget = QtWidgets.QListWidget(self.centralwidget)
+        self.filesListWidget.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.filesListWidget.setObjectName("filesListWidget")
         self.verticalLayout.addWidget(self.filesListWidget)
         self.groupBox = QtWidgets.QGroupBox(self.centralwidget)
@@ -64,13 +65,90 @@ class Ui_ExporterView(object):
         self.netcdfCheckBox.setChecked(True)
         self.netcdfCheckBox.setObjectName("netcdfCheckBox")
         self.horizontalLayout_5.addWidget(self.netcdfCheckBox)
+        self.appendCheckBox = QtWidgets.QCheckBox(self.groupBox)
+        self.appendCheckBox.setObjectName("appendCheckBox")
+        self.horizontalLayout_5.addWidget(self.appendCheckBox)
+        self.combineCheckBox = QtWidgets.QCheckBox(self.groupBox)
+        self.combineCheckBox.setObjectName("combineCheckBox")
+        self.horizontalLayout_5.addWidget(self.combineCheckBox)
+        self.groupsCheckBox = QtWidgets.QCheckBox(self.groupBox)
+        self.groupsCheckBox.setObjectName("groupsCheckBox")
+        self.horizontalLayout_5.addWidget(self.groupsCheckBox)
+        self.zarrCheckBox = QtWidgets.QCheckBox(self.groupBox)
+        self.zarrCheckBox.setObjectName("zarrCheckBox")
+        self.horizontalLayout_5.addWidget(self.zarrCheckBox)
+        self.parquetCheckBox = QtWidgets.QCheckBox(self.groupBox)
+        self.parquetCheckBox.setObjectName("parquetCheckBox")
+        self.horizontalLayout_5.addWidget(self.parquetCheckBox)
         self.verticalLayout.addWidget(self.groupBox)
+        self.horizontalLayout_6 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_6.setObjectName("horizontalLayout_6")
+        self.label_3 = QtWidgets.QLabel(self.centralwidget)
+        self.label_3.setObjectName("label_3")
+        self.horizontalLayout_6.addWidget(self.label_3)
+        self.workersSpinBox = QtWidgets.QSpinBox(self.centralwidget)
+        self.workersSpinBox.setMinimum(1)
+        self.workersSpinBox.setObjectName("workersSpinBox")
+        self.horizontalLayout_6.addWidget(self.workersSpinBox)
+        self.splitCheckBox = QtWidgets.QCheckBox(self.centralwidget)
+        self.splitCheckBox.setObjectName("splitCheckBox")
+        self.horizontalLayout_6.addWidget(self.splitCheckBox)
+        self.timingCheckBox = QtWidgets.QCheckBox(self.centralwidget)
+        self.timingCheckBox.setObjectName("timingCheckBox")
+        self.horizontalLayout_6.addWidget(self.timingCheckBox)
+        self.verticalLayout.addLayout(self.horizontalLayout_6)
+        self.horizontalLayout_8 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_8.setObjectName("horizontalLayout_8")
+        self.label_5 = QtWidgets.QLabel(self.centralwidget)
+        self.label_5.setObjectName("label_5")
+        self.horizontalLayout_8.addWidget(self.label_5)
+        self.decimateSpinBox = QtWidgets.QSpinBox(self.centralwidget)
+        self.decimateSpinBox.setMinimum(1)
+        self.decimateSpinBox.setMaximum(1000000)
+        self.decimateSpinBox.setObjectName("decimateSpinBox")
+        self.horizontalLayout_8.addWidget(self.decimateSpinBox)
+        self.label_6 = QtWidgets.QLabel(self.centralwidget)
+        self.label_6.setObjectName("label_6")
+        self.horizontalLayout_8.addWidget(self.label_6)
+        self.averageSpinBox = QtWidgets.QDoubleSpinBox(self.centralwidget)
+        self.averageSpinBox.setDecimals(1)
+        self.averageSpinBox.setMaximum(86400.0)
+        self.averageSpinBox.setObjectName("averageSpinBox")
+        self.horizontalLayout_8.addWidget(self.averageSpinBox)
+        self.timeWindowCheckBox = QtWidgets.QCheckBox(self.centralwidget)
+        self.timeWindowCheckBox.setObjectName("timeWindowCheckBox")
+        self.horizontalLayout_8.addWidget(self.timeWindowCheckBox)
+        self.startDateTimeEdit = QtWidgets.QDateTimeEdit(self.centralwidget)
+        self.startDateTimeEdit.setObjectName("startDateTimeEdit")
+        self.horizontalLayout_8.addWidget(self.startDateTimeEdit)
+        self.endDateTimeEdit = QtWidgets.QDateTimeEdit(self.centralwidget)
+        self.endDateTimeEdit.setObjectName("endDateTimeEdit")
+        self.horizontalLayout_8.addWidget(self.endDateTimeEdit)
+        self.verticalLayout.addLayout(self.horizontalLayout_8)
         self.exportButton = QtWidgets.QPushButton(self.centralwidget)
         font = QtGui.QFont()
         font.setPointSize(20)
         self.exportButton.setFont(font)
         self.exportButton.setObjectName("exportButton")
         self.verticalLayout.addWidget(self.exportButton)
+        self.horizontalLayout_7 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_7.setObjectName("horizontalLayout_7")
+        self.label_4 = QtWidgets.QLabel(self.centralwidget)
+        self.label_4.setObjectName("label_4")
+        self.horizontalLayout_7.addWidget(self.label_4)
+        self.priorityComboBox = QtWidgets.QComboBox(self.centralwidget)
+        self.priorityComboBox.setObjectName("priorityComboBox")
+        self.priorityComboBox.addItem("")
+        self.priorityComboBox.addItem("")
+        self.priorityComboBox.addItem("")
+        self.horizontalLayout_7.addWidget(self.priorityComboBox)
+        self.pauseButton = QtWidgets.QPushButton(self.centralwidget)
+        self.pauseButton.setObjectName("pauseButton")
+        self.horizontalLayout_7.addWidget(self.pauseButton)
+        self.cancelButton = QtWidgets.QPushButton(self.centralwidget)
+        self.cancelButton.setObjectName("cancelButton")
+        self.horizontalLayout_7.addWidget(self.cancelButton)
+        self.verticalLayout.addLayout(self.horizontalLayout_7)
         self.horizontalLayout.addLayout(self.verticalLayout)
         self.verticalLayout_4.addLayout(self.horizontalLayout)
         self.gridLayout = QtWidgets.QGridLayout()
@@ -104,7 +182,42 @@ class Ui_ExporterView(object):
         self.label_2.setText(_translate("ExporterView", "Scanning Progress    "))
         self.groupBox.setTitle(_translate("ExporterView", "Export Formats"))
         self.netcdfCheckBox.setText(_translate("ExporterView", "netCDF"))
+        self.appendCheckBox.setToolTip(_translate("ExporterView", "Only read the ensembles added since the file was last exported and append them to the netCDF file"))
+        self.appendCheckBox.setText(_translate("ExporterView", "Append New Ensembles"))
+        self.combineCheckBox.setToolTip(_translate("ExporterView", "Export all the files in time order into a single netCDF file, overlapping ensembles are only written once"))
+        self.combineCheckBox.setText(_translate("ExporterView", "Combine Files"))
+        self.groupsCheckBox.setToolTip(_translate("ExporterView", "Write each subsystem configuration to its own netCDF group, such as the two subsystems of a 7 beam or 8 beam system"))
+        self.groupsCheckBox.setText(_translate("ExporterView", "Subsystem Groups"))
+        self.zarrCheckBox.setToolTip(_translate("ExporterView", "Write a Zarr store with the same variables, chunks and compression as the netCDF file, for xarray and Dask"))
+        self.zarrCheckBox.setText(_translate("ExporterView", "Zarr"))
+        self.parquetCheckBox.setToolTip(_translate("ExporterView", "Write a Parquet file with a row for each ensemble and bin, for pandas and Dask"))
+        self.parquetCheckBox.setText(_translate("ExporterView", "Parquet"))
+        self.label_3.setText(_translate("ExporterView", "Export Workers"))
+        self.splitCheckBox.setToolTip(_translate("ExporterView", "Export one file at a time, splitting each file across the workers"))
+        self.splitCheckBox.setText(_translate("ExporterView", "Split Files"))
+        self.timingCheckBox.setToolTip(_translate("ExporterView", "Record the time of each stage of the analyze and export and write it to ~/.exportr/instrumentation.json"))
+        self.timingCheckBox.setText(_translate("ExporterView", "Timing Stats"))
+        self.label_5.setText(_translate("ExporterView", "Export Every"))
+        self.decimateSpinBox.setToolTip(_translate("ExporterView", "Only export every Nth ensemble for a quick look, the ensembles skipped are not read"))
+        self.decimateSpinBox.setSuffix(_translate("ExporterView", " ens"))
+        self.label_6.setText(_translate("ExporterView", "Average"))
+        self.averageSpinBox.setToolTip(_translate("ExporterView", "Average the ensembles into intervals of this many seconds for a quick look"))
+        self.averageSpinBox.setSpecialValueText(_translate("ExporterView", "Off"))
+        self.averageSpinBox.setSuffix(_translate("ExporterView", " s"))
+        self.timeWindowCheckBox.setToolTip(_translate("ExporterView", "Only export the ensembles from the start time to the end time, the ensembles outside are not read"))
+        self.timeWindowCheckBox.setText(_translate("ExporterView", "Time Window"))
+        self.startDateTimeEdit.setDisplayFormat(_translate("ExporterView", "yyyy-MM-dd HH:mm:ss"))
+        self.endDateTimeEdit.setDisplayFormat(_translate("ExporterView", "yyyy-MM-dd HH:mm:ss"))
         self.exportButton.setText(_translate("ExporterView", "Begin Export"))
+        self.label_4.setText(_translate("ExporterView", "Priority"))
+        self.priorityComboBox.setToolTip(_translate("ExporterView", "Priority of the files exported next, or of the selected files waiting to export"))
+        self.priorityComboBox.setItemText(0, _translate("ExporterView", "Low"))
+        self.priorityComboBox.setItemText(1, _translate("ExporterView", "Normal"))
+        self.priorityComboBox.setItemText(2, _translate("ExporterView", "High"))
+        self.pauseButton.setToolTip(_translate("ExporterView", "Pause or resume the export of the selected files, or of all the files if none are selected"))
+        self.pauseButton.setText(_translate("ExporterView", "Pause"))
+        self.cancelButton.setToolTip(_translate("ExporterView", "Cancel the export of the selected files, or of all the files if none are selected"))
+        self.cancelButton.setText(_translate("ExporterView", "Cancel"))
         self.darkCheckBox.setText(_translate("ExporterView", "Dark Theme"))
 
 
@@ -1,13 +1,22 @@
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
-import qdarkstyle
 import logging
 import threading
 import os
 from . import Exportr_view
-from rti_python.Writer.rti_netcdf import RtiNetcdf
-from rti_python.Ensemble.Ensemble import Ensemble
+from Export.export_pool import default_worker_count
+from Export.analyze_pool import AnalyzePool
+from Export.job_queue import JobQueue, PRIORITY_NORMAL, JOB_QUEUED, JOB_PAUSED, JOB_CANCELLED, JOB_FAILED, \
+    JOB_FINAL_STATES
+from Export.analyze_cache import AnalyzeCache
+from Export.instrumentation import DEFAULT_INSTRUMENTATION_PATH, write_results
+from Export.output_formats import FORMAT_NETCDF, FORMAT_ZARR, FORMAT_PARQUET, check_format, is_netcdf_only
+
+
+# Steps of the progress bar showing the bytes analyzed of all the files.
+# The total size of the files does not fit in the progress bar.
+ANALYZE_PROGRESS_STEPS = 1000
 
 
 class ExportrVM(Exportr_view.Ui_ExporterView, QWidget):
@@ -16,12 +25,11 @@ class ExportrVM(Exportr_view.Ui_ExporterView, QWidget):
     """
 
     # Create signals to use in the VM
-    sig_update_file_progress = pyqtSignal(int)
-    sig_update_file_size = pyqtSignal(int)
-    sig_set_analyze_file_result = pyqtSignal(object)
-    sig_analyze_complete = pyqtSignal()
-    sig_ensemble_progress = pyqtSignal(int)
-    sig_export_complete = pyqtSignal()
+    sig_analyze_file_progress = pyqtSignal(int, int, object)
+    sig_set_analyze_file_result = pyqtSignal(int, int, object)
+    sig_analyze_complete = pyqtSignal(int)
+    sig_ensemble_progress = pyqtSignal(int, int)
+    sig_export_job_state = pyqtSignal(int)
 
     def __init__(self, parent):
         Exportr_view.Ui_ExporterView.__init__(self)
@@ -36,11 +44,24 @@ class ExportrVM(Exportr_view.Ui_ExporterView, QWidget):
         self.selectFilesButton.clicked.connect(self.select_files)
         self.darkCheckBox.clicked.connect(self.change_theme)
         self.exportButton.clicked.connect(self.export_files)
+        self.cancelButton.clicked.connect(self.cancel_jobs)
+        self.pauseButton.clicked.connect(self.pause_jobs)
+        self.priorityComboBox.setCurrentIndex(PRIORITY_NORMAL)
+        self.priorityComboBox.currentIndexChanged.connect(self.change_priority)
+        self.filesListWidget.itemSelectionChanged.connect(self.update_job_buttons)
 
         # Init progress bars
         self.fileAnalyzeProgressBar.setValue(0)
         self.scanFilesProgressBar.setValue(0)
-        self.file_bytes_read = 0
+
+        # Queue of the export jobs, created when the first file is exported
+        self.job_queue = None
+
+        # Export jobs since the progress bars were reset, the last state of each job
+        # and the ensembles exported in each job
+        self.export_jobs = {}
+        self.job_states = {}
+        self.export_file_progress = {}
 
         # Create the object to process the files and convert to netCDF
         #self.net_cdf = RtiNetcdf()
@@ -49,17 +70,49 @@ class ExportrVM(Exportr_view.Ui_ExporterView, QWidget):
         # Store all the analyze results
         self.analzye_results = []
 
-        # Keep track of the next index
-        self.export_file_index = 0
-        self.analyze_file_index = 0
+        # Keep the analyze results between runs so unchanged files are not analyzed again
+        try:
+            self.analyze_cache = AnalyzeCache()
+        except Exception as ex:
+            logging.error("Error opening the analyze cache: " + str(ex))
+            self.analyze_cache = None
+
+        # Pool analyzing the selected files.  Each time files are selected a new run is
+        # started, the signals of the runs before are ignored.
+        self.analyze_pool = None
+        self.analyze_run = 0
+
+        # Size and bytes analyzed of each selected file and the number of files analyzed
+        self.analyze_file_sizes = []
+        self.analyze_bytes_read = []
+        self.analyze_file_count = 0
+
+        # Number of processes to export the files
+        self.workersSpinBox.setMinimum(1)
+        self.workersSpinBox.setMaximum(default_worker_count())
+        self.workersSpinBox.setValue(default_worker_count())
+
+        # The time window is set from the files analyzed
+        self.startDateTimeEdit.setEnabled(False)
+        self.endDateTimeEdit.setEnabled(False)
+        self.timeWindowCheckBox.toggled.connect(self.startDateTimeEdit.setEnabled)
+        self.timeWindowCheckBox.toggled.connect(self.endDateTimeEdit.setEnabled)
+
+        # Files that failed to export or were cancelled
+        self.export_failed_files = []
+        self.export_cancelled_files = []
+
+        # Analyze and export instrumentation of each file when Timing Stats is checked
+        self.instrumentation_results = {}
 
         # Setup Signal connections
-        self.sig_update_file_progress.connect(self.file_progress_sig_handler)
-        self.sig_update_file_size.connect(self.file_size_sig_handler)
+        self.sig_analyze_file_progress.connect(self.analyze_file_progress_sig_handler)
         self.sig_set_analyze_file_result.connect(self.analyze_result_sig_handler)
         self.sig_analyze_complete.connect(self.analyze_complete_sig_handler)
         self.sig_ensemble_progress.connect(self.export_ensemble_progress_sig_handler)
-        self.sig_export_complete.connect(self.export_file_complete_sig_handler)
+        self.sig_export_job_state.connect(self.export_job_state_sig_handler)
+
+        self.update_job_buttons()
 
     def select_files(self):
         """
@@ -88,294 +141,614 @@ class ExportrVM(Exportr_view.Ui_ExporterView, QWidget):
         ensemble and the start and stop date and time.  It will also
         get the delta time between ensembles.
 
+        The files are analyzed at the same time in a pool of processes, the number
+        of processes is set with the workers spin box.  Each file is shown in the
+        list with its progress and the results are shown as each file is complete.
+
         All the results are stored to a list.  The index of the results
         will be the same index as the list of file names.
         :return:
         :rtype:
         """
+        # Stop analyzing the files selected before
+        if self.analyze_pool is not None:
+            self.analyze_pool.cancel()
+        self.analyze_run += 1
+
         # Reset the analyze file results
-        self.analzye_results.clear()
+        # Until a file is analyzed, its result only has the file path
+        self.analzye_results = [{"FilePath": file_path} for file_path in self.selected_files]
         self.filesListWidget.clear()
-
-        # Update the progress bar
+        self.instrumentation_results = {}
+
+        self.analyze_file_sizes = []
+        for file_path in self.selected_files:
+            try:
+                self.analyze_file_sizes.append(os.path.getsize(file_path))
+            except OSError:
+                self.analyze_file_sizes.append(0)
+        self.analyze_bytes_read = [0] * len(self.selected_files)
+        self.analyze_file_count = 0
+
+        # Show each file in the list in the order selected
+        for file_path in self.selected_files:
+            desc = os.path.basename(file_path)
+            item = QListWidgetItem(desc + " [Waiting]")
+            item.setData(Qt.UserRole, desc)
+            self.filesListWidget.addItem(item)
+
+        # Update the progress bars
         self.scanFilesProgressBar.setValue(0)
         self.scanFilesProgressBar.setMaximum(len(self.selected_files))
+        self.fileAnalyzeProgressBar.setValue(0)
+        self.fileAnalyzeProgressBar.setMaximum(ANALYZE_PROGRESS_STEPS)
+        self.fileScanLabel.setText("Analyzing " + str(len(self.selected_files)) + " files")
+
+        if len(self.selected_files) == 0:
+            return
 
-        # Reset the index
-        self.analyze_file_index = 0
+        analyze_options = {"incremental": self.appendCheckBox.isChecked(),
+                           "instrument": self.timingCheckBox.isChecked()}
+        if self.analyze_cache is not None:
+            analyze_options["cache_path"] = self.analyze_cache.cache_path
+        self.analyze_pool = AnalyzePool(self.workersSpinBox.value(), analyze_options)
 
-        # Start the analyzing
-        # This will start the thread
-        # When this thread is complete, the signal will be emitted
-        # A and new thread will be created and started
-        # This is to prevent all the threads starting at once
-        if len(self.selected_files) > 0:
-            self.analyze_file(self.selected_files[0])
+        # Create a thread to wait on the pool, the signals are emitted as the files are analyzed
+        logging.debug("----------------------------------------------")
+        logging.debug("Start Analyze Thread")
+        analyze_thread = threading.Thread(target=self.analyze_files_thread,
+                                          args=(self.analyze_run, self.analyze_pool, list(self.selected_files)),
+                                          daemon=True)
+        analyze_thread.start()
 
-    def analyze_file(self, file_path: str):
+    def analyze_files_thread(self, run: int, analyze_pool: AnalyzePool, file_paths: list):
         """
-        Create a thread to analyze the file.
-        :param file_path: File path to analyze.
-        :type file_path: string
+        Thread to analyze the files in the pool.  This will emit the
+        progress and the result of each file to the signals.  It will
+        then emit a complete signal when all the files are analyzed.
+        :param run: Analyze run of the files.
+        :type run: int
+        :param analyze_pool: Pool to analyze the files.
+        :type analyze_pool: AnalyzePool
+        :param file_paths: Files to analyze.
+        :type file_paths: list
         :return:
         :rtype:
         """
-        # Set the file currently working on
-        self.fileScanLabel.setText(file_path)
+        def file_progress_callback(file_index, bytes_read):
+            self.sig_analyze_file_progress.emit(run, file_index, bytes_read)
 
-        # Reset the progress bar
-        self.fileAnalyzeProgressBar.setValue(0)
-        self.file_bytes_read = 0
+        def file_complete_callback(file_index, summary):
+            self.sig_set_analyze_file_result.emit(run, file_index, summary)
 
-        # Create a thread worker to do analyze the file
-        logging.debug("----------------------------------------------")
-        logging.debug("Start Analyze Thread")
-        analyze_thread = threading.Thread(target=self.analyze_file_thread, args=(file_path, ))
-        analyze_thread.start()
-        logging.debug("Analyze Thread Complete")
+        analyze_pool.analyze(file_paths, file_progress_callback, file_complete_callback)
+
+        # Emit that the thread is complete
+        self.sig_analyze_complete.emit(run)
+
+    @pyqtSlot(int)
+    def analyze_complete_sig_handler(self, run: int):
+        """
+        All the files of the analyze run are analyzed.
+        :param run: Analyze run of the files.
+        :type run: int
+        :return:
+        :rtype:
+        """
+        if run != self.analyze_run:
+            return
+        self.analyze_pool = None
+
+        # Analyzing is complete, so make sure the progress bars are at the end
+        if not self.export_running():
+            self.scanFilesProgressBar.setValue(len(self.selected_files))
+            self.fileAnalyzeProgressBar.setValue(self.fileAnalyzeProgressBar.maximum())
+        self.fileScanLabel.setText("Analyzed " + str(len(self.selected_files)) + " files")
+        self.write_instrumentation()
+
+        # Start the time window at the first and last ensemble of the files
+        first_times = [file_result["FirstEnsDateTime"] for file_result in self.analzye_results
+                       if file_result.get("FirstEnsDateTime")]
+        last_times = [file_result["LastEnsDateTime"] for file_result in self.analzye_results
+                      if file_result.get("LastEnsDateTime")]
+        if first_times and last_times:
+            self.startDateTimeEdit.setDateTime(QDateTime(min(first_times)))
+            self.endDateTimeEdit.setDateTime(QDateTime(max(last_times)))
+
+        logging.debug("Completed Analyze Thread")
         logging.debug("----------------------------------------------")
 
-    def analyze_file_thread(self, file_path):
+    @pyqtSlot(int, int, object)
+    def analyze_result_sig_handler(self, run: int, file_index: int, summary: dict):
         """
-        Thread to process analyze a file.  This will then
-        emit the results to the signal.  It will then emit a
-        complete signal to start the next file or complete.
-        :param file_path: File path to analyze.
-        :type file_path: str
+        Receive the results from analyzing a file.  The files are complete in any
+        order, the results are shown at the index of the file.
+        :param run: Analyze run of the file.
+        :type run: int
+        :param file_index: Index of the file in the selected files.
+        :type file_index: int
+        :param summary: Summary of the analyze.  The results are in Result.
+        :type summary: dict
         :return:
         :rtype:
         """
-        net_cdf = RtiNetcdf()
-        net_cdf.file_progress_event += self.file_progress_event_handler
-        result = net_cdf.analyze_file(file_path)
+        if run != self.analyze_run:
+            return
+
+        result = summary.get("Result")
+        if summary["Status"] == "ok" and result is not None:
+            desc = result['CompleteFileDesc']
+            if 'NewEnsCount' in result:
+                desc += " - " + str(result['NewEnsCount']) + " new ensembles"
+        else:
+            # The file is not exported without the analyze results
+            result = {"FilePath": summary["FilePath"]}
+            desc = os.path.basename(summary["FilePath"]) + " - Analyze failed: " + str(summary.get("Error"))
+
+        # Keep the description to show the export state after it
+        item = self.filesListWidget.item(file_index)
+        if item is not None:
+            item.setText(desc)
+            item.setData(Qt.UserRole, desc)
+
+        # Add the results to the list
+        self.analzye_results[file_index] = result
 
-        # Emit the result
-        self.sig_set_analyze_file_result.emit(result)
+        if "Instrumentation" in summary:
+            self.add_instrumentation(summary["FilePath"], "AnalyzeInstrumentation", summary["Instrumentation"])
 
-        # Emit that thread is complete to start next file or complete
-        self.sig_analyze_complete.emit()
+        # Update the progress bars
+        self.analyze_bytes_read[file_index] = self.analyze_file_sizes[file_index]
+        self.analyze_file_count += 1
+        self.show_analyze_progress()
 
-    def file_progress_event_handler(self, sender, bytes_read: int, total_size: int, file_name: str):
+        logging.debug("Got Results of Analyze File " + summary["FilePath"])
+
+    @pyqtSlot(int, int, object)
+    def analyze_file_progress_sig_handler(self, run: int, file_index: int, bytes_read: int):
         """
-        Receive the event. Then pass the event to signals so the GUI can be updated.
-        :param sender: NOT USED
-        :type sender:
-        :param bytes_read: Bytes read from the file.
+        Show the bytes read of a file being analyzed next to the file and in the progress of all the files.
+        :param run: Analyze run of the file.
+        :type run: int
+        :param file_index: Index of the file in the selected files.
+        :type file_index: int
+        :param bytes_read: Bytes read from the file so far.
         :type bytes_read: int
-        :param total_size: Total size of the file in bytes.
-        :type total_size: int
-        :param file_name: File name in progress.
-        :type file_name: str
         :return:
         :rtype:
         """
-        self.sig_update_file_size.emit(total_size)
-        self.sig_update_file_progress.emit(bytes_read)
+        if run != self.analyze_run or "EnsCount" in self.analzye_results[file_index]:
+            return
+        self.analyze_bytes_read[file_index] = bytes_read
+
+        item = self.filesListWidget.item(file_index)
+        if item is not None:
+            percent = 100 * bytes_read // max(self.analyze_file_sizes[file_index], 1)
+            item.setText(item.data(Qt.UserRole) + " [Analyzing " + str(min(percent, 100)) + "%]")
+
+        self.show_analyze_progress()
 
-    @pyqtSlot()
-    def analyze_complete_sig_handler(self):
+    def show_analyze_progress(self):
         """
-        Once a thread has completed, this handler will be called.
-        Then start the next file thread.  This is to prevent running
-        all the threads at one time.
+        Show the number of files analyzed and the bytes analyzed of all the files.
+        The progress bars show the export progress while files are exported.
         :return:
         :rtype:
         """
-        # Move to the next file
-        self.analyze_file_index += 1
+        if self.export_running():
+            return
 
-        # Verify we can move to the next file
-        if self.analyze_file_index < len(self.selected_files):
-            self.analyze_file(self.selected_files[self.analyze_file_index])
-        else:
-            # Analyzing is complete, so make sure the progress bar is at the end
-            self.scanFilesProgressBar.setValue(len(self.selected_files))
+        self.scanFilesProgressBar.setValue(self.analyze_file_count)
+        total_size = sum(self.analyze_file_sizes)
+        if total_size > 0:
+            self.fileAnalyzeProgressBar.setValue(ANALYZE_PROGRESS_STEPS * sum(self.analyze_bytes_read) // total_size)
 
-        logging.debug("Completed Analyze File Thread")
+    def export_files(self):
+        """
+        Export the files to netCDF.  Each file is added to the job queue as an export job.
+        The job queue will export multiple files at the same time, each file in its
+        own process.  The number of processes is set with the workers spin box.
+        If Split Files is checked, each file is split across the processes instead.
+        If Append New Ensembles is checked, only the new ensembles are exported.
+        If Combine Files is checked, all the files are exported into a single netCDF file.
+        If Subsystem Groups is checked, each subsystem is written to its own netCDF group.
+        The groups are not appended to or split, and are not used to combine files.
+        If Zarr or Parquet is checked, each checked format is written from a single read
+        of the file.  These formats are not appended to, split, combined or grouped.
+        For a quick look, only every Nth ensemble is exported, the ensembles are averaged
+        into intervals or only the ensembles in the time window are exported.  A quick
+        look always creates a new file, is not split, and is not combined or grouped.
+
+        The jobs are added with the selected priority.  More files can be exported
+        while the jobs are running, they are added to the progress bars.
+        :return:
+        :rtype:
+        """
+        # Get the output formats checked
+        formats = [output_format for output_format, check_box in ((FORMAT_NETCDF, self.netcdfCheckBox),
+                                                                  (FORMAT_ZARR, self.zarrCheckBox),
+                                                                  (FORMAT_PARQUET, self.parquetCheckBox))
+                   if check_box.isChecked()]
+        if len(formats) == 0:
+            return
+
+        # Check the packages of the formats are installed
+        try:
+            for output_format in formats:
+                check_format(output_format)
+        except ValueError as ex:
+            QMessageBox.warning(self.parent, "Export Formats", str(ex), QMessageBox.Ok)
+            return
+
+        netcdf_only = is_netcdf_only(formats)
+        if not netcdf_only and (self.combineCheckBox.isChecked() or self.groupsCheckBox.isChecked()):
+            QMessageBox.warning(self.parent, "Export Formats",
+                                "Combine Files and Subsystem Groups only write netCDF.  "
+                                "Uncheck Zarr and Parquet to use them.", QMessageBox.Ok)
+            return
+
+        # Quick look at some of the ensembles
+        decimate = self.decimateSpinBox.value()
+        average_interval = self.averageSpinBox.value()
+        time_window = self.timeWindowCheckBox.isChecked()
+        quick_look = decimate > 1 or average_interval > 0 or time_window
+        if quick_look and (self.combineCheckBox.isChecked() or self.groupsCheckBox.isChecked()):
+            QMessageBox.warning(self.parent, "Quick Look",
+                                "Combine Files and Subsystem Groups export all the ensembles.  "
+                                "Set Export Every to 1, Average to Off and uncheck Time Window to use them.",
+                                QMessageBox.Ok)
+            return
+        if time_window and self.startDateTimeEdit.dateTime() > self.endDateTimeEdit.dateTime():
+            QMessageBox.warning(self.parent, "Quick Look", "The time window starts after it ends.", QMessageBox.Ok)
+            return
+
+        # Get all the files with data to export.  Only the netCDF file is appended to.
+        append = netcdf_only and not quick_look
+        export_results = [file_result for file_result in self.analzye_results
+                          if "EnsCount" in file_result and file_result["EnsCount"] > 0 and
+                          (not append or file_result.get("NewEnsCount", 1) > 0)]
+
+        if len(export_results) == 0:
+            return
+
+        # Get the file to combine all the files into
+        combine_path = None
+        if self.combineCheckBox.isChecked():
+            options = QFileDialog.Options()
+            options |= QFileDialog.DontUseNativeDialog
+            combine_path, _ = QFileDialog.getSaveFileName(self.parent,
+                                                          "Combine Files",
+                                                          "",
+                                                          "netCDF Files (*.nc);;All Files (*)",
+                                                          options=options)
+            if not combine_path:
+                return
+
+            # All the ensembles are read again
+            export_results = [file_result for file_result in self.analzye_results
+                              if "EnsCount" in file_result and file_result["EnsCount"] > 0]
+
+        # The number of workers can only be changed when no job is running
+        workers = self.workersSpinBox.value()
+        if self.job_queue is None or (self.job_queue.workers != workers and not self.job_queue.active()):
+            if self.job_queue is not None:
+                self.job_queue.shutdown()
+            self.job_queue = JobQueue(workers, self.job_state_handler, self.job_progress_handler)
+
+        # Start a new run if the last one is complete
+        # The file progress bar will show the ensembles exported for all the jobs
+        if not self.export_running():
+            self.export_jobs = {}
+            self.job_states = {}
+            self.export_file_progress = {}
+            self.export_failed_files = []
+            self.export_cancelled_files = []
+            self.scanFilesProgressBar.setValue(0)
+            self.scanFilesProgressBar.setMaximum(0)
+            self.fileAnalyzeProgressBar.setValue(0)
+            self.fileAnalyzeProgressBar.setMaximum(0)
+
+        export_options = {"incremental": self.appendCheckBox.isChecked()}
+        if not netcdf_only:
+            # Only the netCDF file can be appended to or split
+            export_options["formats"] = formats
+            export_options["incremental"] = False
+        elif self.groupsCheckBox.isChecked():
+            export_options["groups"] = True
+            export_options["incremental"] = False
+        elif self.splitCheckBox.isChecked() and not quick_look:
+            export_options["split_workers"] = workers
+        if quick_look:
+            # A quick look always creates a new file
+            export_options["incremental"] = False
+            if decimate > 1:
+                export_options["decimate"] = decimate
+            if average_interval > 0:
+                export_options["average_interval"] = average_interval
+            if time_window:
+                export_options["time_range"] = [self.startDateTimeEdit.dateTime().toPyDateTime(),
+                                                self.endDateTimeEdit.dateTime().toPyDateTime()]
+        if self.timingCheckBox.isChecked():
+            export_options["instrument"] = True
+        priority = self.priorityComboBox.currentIndex()
+
+        # Add the jobs to the queue
         logging.debug("----------------------------------------------")
+        logging.debug("Queue Export Files netCDF Jobs")
+        if combine_path:
+            jobs = [self.job_queue.submit_aggregate(export_results, combine_path,
+                                                    {"instrument": self.timingCheckBox.isChecked()}, priority)]
+        else:
+            jobs = [self.job_queue.submit(file_result, export_options, priority) for file_result in export_results]
+
+        for job in jobs:
+            self.export_jobs[job.job_id] = job
+            self.export_job_state_sig_handler(job.job_id)
+        self.scanFilesProgressBar.setMaximum(len(self.export_jobs))
+        self.fileAnalyzeProgressBar.setMaximum(sum(job.total_ensembles for job in self.export_jobs.values()))
+        self.fileScanLabel.setText("Exporting " + str(len(self.export_jobs)) + " jobs")
+        self.update_job_buttons()
 
-    @pyqtSlot(object)
-    def analyze_result_sig_handler(self, result):
+    def export_running(self) -> bool:
         """
-        Receive the results from analyzing the file.
-        :param result: Dictionary containing the results.
-        :type result: dictionary
+        Check if any export job of the current run is not complete.
+        :return: TRUE if a job is queued, running or paused.
+        :rtype: bool
+        """
+        return any(self.job_states.get(job_id) not in JOB_FINAL_STATES for job_id in self.export_jobs)
+
+    def job_state_handler(self, job):
+        """
+        Emit that the state of the job changed.  The job queue calls this from
+        its own thread or from the thread cancelling or pausing the job.
+        :param job: Export job that changed.
+        :type job: ExportJob
         :return:
         :rtype:
         """
-        index = self.filesListWidget.count()
-        self.filesListWidget.insertItem(index, result['CompleteFileDesc'])
+        self.sig_export_job_state.emit(job.job_id)
 
-        # Add the results to the list
-        self.analzye_results.append(result)
-
-        # Update the progress bar
-        self.fileAnalyzeProgressBar.setValue(self.fileAnalyzeProgressBar.maximum())
-        self.scanFilesProgressBar.setValue(index + 1)
+    def job_progress_handler(self, job):
+        """
+        Emit the number of ensembles exported in the job.
+        The job queue limits how often this is called.
+        :param job: Export job exporting.
+        :type job: ExportJob
+        :return:
+        :rtype:
+        """
+        self.sig_ensemble_progress.emit(job.job_id, job.ens_exported)
 
-        logging.debug("Got Results of Analyze File")
-        logging.debug("----------------------------------------------")
+    @pyqtSlot(int, int)
+    def export_ensemble_progress_sig_handler(self, job_id: int, ens_exported: int):
+        """
+        Set the progress the ensembles being processed in the progressbar.
+        :param job_id: ID of the export job.
+        :type job_id: int
+        :param ens_exported: Number of ensembles exported in the job so far.
+        :type ens_exported: int
+        :return:
+        :rtype:
+        """
+        if job_id not in self.export_jobs or self.job_states.get(job_id) in JOB_FINAL_STATES:
+            return
+        self.export_file_progress[job_id] = ens_exported
+        self.fileAnalyzeProgressBar.setValue(sum(self.export_file_progress.values()))
 
     @pyqtSlot(int)
-    def file_progress_sig_handler(self, bytes_read: int):
+    def export_job_state_sig_handler(self, job_id: int):
         """
-        Handler to Keep track of the bytes read for the current file.
-        :param bytes_read: Bytes read from the file.
-        :type bytes_read: int
+        Show the state of the job next to its files and update the
+        progress as each job is complete.  The signals can arrive after
+        the job has changed again, so the current state of the job is used.
+        :param job_id: ID of the export job.
+        :type job_id: int
         :return:
         :rtype:
         """
-        # Increment the bytes read
-        self.file_bytes_read += bytes_read
+        job = self.export_jobs.get(job_id)
+        if job is None or self.job_states.get(job_id) in JOB_FINAL_STATES:
+            return
+        state = job.state
+        self.job_states[job.job_id] = state
+
+        # The priority of a queued job can still be changed
+        state_text = state.capitalize()
+        if state == JOB_QUEUED:
+            state_text += ", " + self.priorityComboBox.itemText(job.priority)
+        for file_path in job.file_paths:
+            self.set_file_state(file_path, state_text)
+        self.update_job_buttons()
+
+        if state not in JOB_FINAL_STATES:
+            return
+
+        # The job is done, so all its ensembles are counted
+        self.export_file_progress[job.job_id] = job.total_ensembles
+        self.fileAnalyzeProgressBar.setValue(sum(self.export_file_progress.values()))
+        self.scanFilesProgressBar.setValue(self.scanFilesProgressBar.value() + 1)
 
-        # Update the progress bar
-        self.fileAnalyzeProgressBar.setValue(self.file_bytes_read)
+        summary = job.summary or {}
+        if state == JOB_CANCELLED:
+            self.export_cancelled_files.extend(job.file_paths)
+        elif state == JOB_FAILED:
+            self.export_failed_files.extend(job.file_paths)
 
-        logging.debug("Analyzing File Progress: " + str(self.file_bytes_read))
+        # Files that could not be combined with the other files are also reported
+        for file_summary in summary.get("Files", []):
+            if file_summary["Status"] == "skipped":
+                self.export_failed_files.append(file_summary["FilePath"])
 
-    @pyqtSlot(int)
-    def file_size_sig_handler(self, file_size: int):
+        # The instrumentation of the combined file is given for the netCDF file
+        if "Instrumentation" in summary:
+            self.add_instrumentation(summary["FilePath"], "ExportInstrumentation", summary["Instrumentation"])
+
+        logging.debug("Export Job " + state + ": " + job.name)
+
+        if not self.export_running():
+            self.export_complete()
+
+    def set_file_state(self, file_path: str, state_text: str):
         """
-        Handler to set the file size to monitor the file progress.
-        :param file_size: Total bytes in the file.
-        :type file_size: int
+        Show the export state of the file in the list of files.
+        :param file_path: File path of the file.
+        :type file_path: str
+        :param state_text: State of the export job to show.
+        :type state_text: str
         :return:
         :rtype:
         """
-        # Verify the maximum has been set for the progress bar
-        if self.fileAnalyzeProgressBar.maximum() != file_size:
-            self.fileAnalyzeProgressBar.setMaximum(file_size)
+        for row, file_result in enumerate(self.analzye_results):
+            if file_result.get("FilePath") == file_path:
+                item = self.filesListWidget.item(row)
+                if item is not None:
+                    item.setText(item.data(Qt.UserRole) + " [" + state_text + "]")
+
+    def selected_jobs(self) -> list:
+        """
+        Get the export jobs that are not complete for the selected files.
+        If no file is selected, all the jobs that are not complete are given.
+        :return: Export jobs.
+        :rtype: list
+        """
+        jobs = [job for job in self.export_jobs.values() if self.job_states.get(job.job_id) not in JOB_FINAL_STATES]
 
-        logging.debug("Set File Size: " + str(file_size))
+        rows = [index.row() for index in self.filesListWidget.selectedIndexes()]
+        if not rows:
+            return jobs
 
-    def export_files(self):
+        file_paths = set(self.analzye_results[row].get("FilePath") for row in rows if row < len(self.analzye_results))
+        return [job for job in jobs if file_paths.intersection(job.file_paths)]
+
+    def cancel_jobs(self):
+        """
+        Cancel the export of the selected files, or of all the files if none are selected.
+        The partial netCDF files are removed.
+        :return:
+        :rtype:
         """
-        Export the files to netCDF.  This will start the thread for the first file.
-        When that thread is complete, it passes a signal which starts the next thread.
+        for job in self.selected_jobs():
+            self.job_queue.cancel(job.job_id)
 
-        Also reset all the progess bars.
+    def pause_jobs(self):
+        """
+        Pause the export of the selected files, or of all the files if none are selected.
+        If all the jobs are paused, resume them.
         :return:
         :rtype:
         """
-        # Clear the progress bars
-        self.scanFilesProgressBar.setValue(0)
-        self.scanFilesProgressBar.setMaximum(len(self.analzye_results))
-
-        # Reset the index to start the export process
-        self.export_file_index = 0
-
-        # Export the file
-        # This will start the loop
-        # When one thread is complete, a new one will be started
-        if len(self.analzye_results) > 0:
-            self.export_file(self.analzye_results[0])
-
-    def export_file(self, file_result: dict):
-        # Determine the file had data
-        if "EnsCount" in file_result and file_result["EnsCount"] > 0:
-            # Check netCDF is checked
-            if self.netcdfCheckBox.isChecked():
-                # Set the progress bar max and reset the progress bar
-                self.fileAnalyzeProgressBar.setValue(0)
-                self.fileAnalyzeProgressBar.setMaximum(file_result["EnsCount"])
-
-                # Set the file name
-                if "CompleteFileDesc" in file_result:
-                    self.fileScanLabel.setText(file_result["CompleteFileDesc"])
-                elif "FilePath" in file_result:
-                    self.fileScanLabel.setText(file_result["FilePath"])
-
-                # Create a thread worker to do analyze the file
-                #export_worker = ExportNetCdfFileWorker.ExportNetCdfFileWorker(file_result)
-                #export_worker.signals.ensemble_progress.connect(self.export_ensemble_progress_handler)
-                #export_worker.finished.connect(self.export_file_complete_handler)
-                #export_worker.start()
-                logging.debug("----------------------------------------------")
-                logging.debug("Export File netCDF Thread")
-                export_thread = threading.Thread(target=self.export_file_thread, args=(file_result,))
-                export_thread.start()
-                logging.debug("Export File netCDF Thread Complete")
-                logging.debug("----------------------------------------------")
-
-    def export_file_thread(self, file_result: dict):
-        # Export the file
-        logging.debug("Starting Export netCDF: " + file_result["FilePath"])
-        net_cdf = RtiNetcdf()
-        net_cdf.ensemble_progress_event += self.ensemble_progress_handler
-
-        # File Path
-        file_path = file_result["FilePath"]
-
-        # Ensure a value is given for the number of ensembles
-        total_ensembles = file_result['EnsPairCount']
-        if total_ensembles <= 0:
-            total_ensembles = file_result['EnsCount']
-
-        logging.debug("Exporting " + str(total_ensembles) + " to netCDF")
-
-        # Start and stop ensemble
-        ens_to_process = [0, total_ensembles]
-
-        # Time between ensembles
-        ens_delta = file_result['EnsembleDeltaTime']
-
-        # Start exporting the data
-        net_cdf.export(file_path, ens_to_process, ens_delta)
-
-        # Emit that thread is complete to start next file or complete
-        self.sig_export_complete.emit()
-
-        logging.debug("Exporting netCDF Complete: " + file_result["FilePath"])
-
-    def ensemble_progress_handler(self, sender, ens: Ensemble):
-        """
-        Emit that a ensemble was received.
-        :param sender: NOT USED
-        :type sender:
-        :param ens: Ensemble received.
-        :type ens: Ensemble
+        jobs = self.selected_jobs()
+        if any(self.job_states.get(job.job_id) != JOB_PAUSED for job in jobs):
+            for job in jobs:
+                self.job_queue.pause(job.job_id)
+        else:
+            for job in jobs:
+                self.job_queue.resume(job.job_id)
+
+    def change_priority(self, priority: int):
+        """
+        Change the priority of the selected files waiting to export.
+        The priority of the files exported next is always the selected priority.
+        :param priority: PRIORITY_LOW, PRIORITY_NORMAL or PRIORITY_HIGH.
+        :type priority: int
+        :return:
+        :rtype:
+        """
+        if self.job_queue is None or not self.filesListWidget.selectedIndexes():
+            return
+        for job in self.selected_jobs():
+            self.job_queue.set_priority(job.job_id, priority)
+
+    def update_job_buttons(self):
+        """
+        Enable the cancel and pause buttons if there are jobs to change.
+        Show Resume if all the jobs are paused.
         :return:
         :rtype:
         """
-        if ens.IsEnsembleData:
-            self.sig_ensemble_progress.emit(ens.EnsembleData.EnsembleNumber)
+        jobs = self.selected_jobs()
+        self.cancelButton.setEnabled(len(jobs) > 0)
+        self.pauseButton.setEnabled(len(jobs) > 0)
+        if jobs and all(self.job_states.get(job.job_id) == JOB_PAUSED for job in jobs):
+            self.pauseButton.setText("Resume")
         else:
-            # Just emit that an ensemble was received if no ensemble is known
-            self.sig_ensemble_progress.emit(0)
+            self.pauseButton.setText("Pause")
 
-    @pyqtSlot()
-    def export_file_complete_sig_handler(self):
+    def stop_exports(self):
+        """
+        Stop analyzing the files, cancel all the export jobs and stop the
+        worker processes.  This is used when the application is closed.
+        :return:
+        :rtype:
+        """
+        if self.analyze_pool is not None:
+            self.analyze_pool.cancel()
+            self.analyze_pool = None
+        if self.job_queue is not None:
+            self.job_queue.shutdown()
+            self.job_queue = None
+
+    def export_complete(self):
         """
-        As one thread completes, we will start another thread.
-        This will prevent all the threads for each file running at the same time.
+        All the export jobs have completed, failed or been cancelled.
         :return:
         :rtype:
         """
-        # Increment the index
-        self.export_file_index += 1
+        self.scanFilesProgressBar.setValue(self.scanFilesProgressBar.maximum())
+        self.fileAnalyzeProgressBar.setValue(self.fileAnalyzeProgressBar.maximum())
 
-        # Move the state
-        self.scanFilesProgressBar.setValue(self.scanFilesProgressBar.value() + 1)
+        logging.debug("Export File netCDF Jobs Complete")
+        logging.debug("----------------------------------------------")
 
-        # Check if we have exported all the files
-        if self.export_file_index >= len(self.analzye_results):
-            # Show a dialog box that everything is exported and complete
-            QMessageBox.question(self.parent, "Export Complete", "All files have been exported.", QMessageBox.Ok)
+        # Write the timing of the analyze and export
+        message = ""
+        if self.write_instrumentation():
+            message = "\n\nTiming stats written to " + DEFAULT_INSTRUMENTATION_PATH
+
+        if self.export_cancelled_files:
+            message = "\n\nCancelled exporting the files:\n" + "\n".join(self.export_cancelled_files) + message
+
+        # Show a dialog box that everything is exported and complete
+        if self.export_failed_files:
+            QMessageBox.question(self.parent, "Export Complete",
+                                 "Failed to export the files:\n" + "\n".join(self.export_failed_files) + message,
+                                 QMessageBox.Ok)
+        elif self.export_cancelled_files:
+            QMessageBox.question(self.parent, "Export Complete", message.strip(), QMessageBox.Ok)
         else:
-            # Export the next file
-            self.export_file(self.analzye_results[self.export_file_index])
+            QMessageBox.question(self.parent, "Export Complete", "All files have been exported." + message,
+                                 QMessageBox.Ok)
 
-    @pyqtSlot(int)
-    def export_ensemble_progress_sig_handler(self, ens_num: int):
+    def add_instrumentation(self, file_path: str, stage: str, result: dict):
         """
-        Set the progress the ensembles being processed in the progressbar.
-        :param ens_num: Ensemble number.
-        :type ens_num: int
+        Store the instrumentation of the analyze or export of a file.
+        :param file_path: File path analyzed or exported.
+        :type file_path: str
+        :param stage: AnalyzeInstrumentation or ExportInstrumentation.
+        :type stage: str
+        :param result: Result from Instrumentation.result().
+        :type result: dict
         :return:
         :rtype:
         """
-        logging.debug(str(ens_num))
-        self.fileAnalyzeProgressBar.setValue(self.fileAnalyzeProgressBar.value() + 1)
+        self.instrumentation_results.setdefault(file_path, {"FilePath": file_path})[stage] = result
+
+    def write_instrumentation(self) -> bool:
+        """
+        Write the instrumentation of all the files to the JSON file.
+        :return: True if the instrumentation was written.
+        :rtype: bool
+        """
+        if not self.instrumentation_results:
+            return False
+
+        try:
+            write_results(list(self.instrumentation_results.values()))
+            logging.info("Timing stats written to " + DEFAULT_INSTRUMENTATION_PATH)
+            return True
+        except OSError as ex:
+            logging.error("Error writing the timing stats: " + str(ex))
+            return False
 
     def change_theme(self):
         """
@@ -388,6 +761,8 @@ class ExportrVM(Exportr_view.Ui_ExporterView, QWidget):
             raise RuntimeError("No Qt Application found.")
 
         if self.darkCheckBox.isChecked():
+            # Only imported when the dark theme is used
+            import qdarkstyle
             app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
         else:
             app.setStyleSheet("")
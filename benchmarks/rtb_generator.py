@@ -0,0 +1,232 @@
+import argparse
+import binascii
+import datetime
+import struct
+import numpy as np
+
+
+# Ensemble header start
+ENSEMBLE_HEADER = b'\x80' * 16
+
+# Data set value types
+VALUE_TYPE_FLOAT = 10
+VALUE_TYPE_INT = 20
+
+# Data set header: value type, number of elements, element multiplier, imaginary, name length
+DATASET_HEADER_STRUCT = struct.Struct("<iiiii")
+
+# Serial number written to every ensemble
+SERIAL_NUMBER = b"01300000000000000000000000000001"
+
+# Subsystem codes of the 4 beam and vertical beam ensembles
+SUBSYSTEM_CODE_4_BEAM = b'2'
+SUBSYSTEM_CODE_VERTICAL = b'3'
+
+# Subsystem code and configuration of the second subsystem of a 7 beam or 8 beam system
+SUBSYSTEM_CODE_SECOND = b'6'
+SUBSYSTEM_CONFIG_SECOND = 2
+
+# Time between ensembles in seconds
+ENSEMBLE_INTERVAL = 1.0
+
+
+def dataset(name: str, value_type: int, num_elements: int, element_multiplier: int, data: bytes) -> bytes:
+    """
+    Create a data set with the header and name.
+    :param name: Data set name, E000001.
+    :type name: str
+    :param value_type: Value type of the data.
+    :type value_type: int
+    :param num_elements: Number of elements (bins).
+    :type num_elements: int
+    :param element_multiplier: Element multiplier (beams).
+    :type element_multiplier: int
+    :param data: Data set values.
+    :type data: bytes
+    :return: Data set bytes.
+    :rtype: bytes
+    """
+    return DATASET_HEADER_STRUCT.pack(value_type, num_elements, element_multiplier, 0, 8) + \
+        name.encode("ascii").ljust(8, b'\0') + data
+
+
+class SyntheticRtbGenerator:
+    """
+    Create RTB files with synthetic ensembles.  The files are deterministic,
+    the same settings and seed always give the same file, so the benchmark
+    results can be compared between runs.
+
+    Each ensemble has the beam, instrument and earth velocity, amplitude,
+    correlation, good beam, good earth, ensemble and ancillary data sets.
+    A 5 beam file has a vertical beam ensemble after each 4 beam ensemble.
+    A 7 beam or 8 beam file has an ensemble of a second subsystem with 3 or 4
+    beams after each 4 beam ensemble.
+    Corruption is added as junk bytes between ensembles and ensembles with
+    a bad checksum.
+    """
+
+    def __init__(self, bins: int = 30, five_beam: bool = False, corruption_rate: float = 0.0, seed: int = 1,
+                 second_beams: int = 0):
+        """
+        Initialize the generator.
+        :param bins: Number of bins in each ensemble.
+        :type bins: int
+        :param five_beam: Add a vertical beam ensemble after each 4 beam ensemble.
+        :type five_beam: bool
+        :param corruption_rate: Fraction of the ensembles followed by junk bytes or with a bad checksum.
+        :type corruption_rate: float
+        :param seed: Random seed.
+        :type seed: int
+        :param second_beams: Number of beams of the second subsystem, 3 for a 7 beam or 4 for an 8 beam system.  0 for none.
+        :type second_beams: int
+        """
+        self.bins = bins
+        self.five_beam = five_beam
+        self.corruption_rate = corruption_rate
+        self.seed = seed
+        self.second_beams = second_beams
+
+    def ensemble(self, rng: np.random.Generator, ens_num: int, ens_datetime: datetime.datetime,
+                 num_beams: int, subsystem_code: bytes, subsystem_config: int) -> bytes:
+        """
+        Create an ensemble.
+        :param rng: Random number generator.
+        :type rng: np.random.Generator
+        :param ens_num: Ensemble number.
+        :type ens_num: int
+        :param ens_datetime: Ensemble date and time.
+        :type ens_datetime: datetime.datetime
+        :param num_beams: Number of beams.
+        :type num_beams: int
+        :param subsystem_code: Subsystem code character.
+        :type subsystem_code: bytes
+        :param subsystem_config: Subsystem configuration index.
+        :type subsystem_config: int
+        :return: Complete ensemble with the header and checksum.
+        :rtype: bytes
+        """
+        bins = self.bins
+        values = bins * num_beams
+
+        ens_data = struct.pack("<13i", ens_num, bins, num_beams, 1, 1, 0,
+                               ens_datetime.year, ens_datetime.month, ens_datetime.day,
+                               ens_datetime.hour, ens_datetime.minute, ens_datetime.second,
+                               ens_datetime.microsecond // 10000)
+        ens_data += SERIAL_NUMBER + bytes([1, 2, 3]) + subsystem_code + bytes([0, 0, 0, subsystem_config])
+
+        ancillary = struct.pack("<13f", 1.0, 0.5, 0.0, 1.0,
+                                rng.uniform(0, 360), rng.uniform(-5, 5), rng.uniform(-5, 5),
+                                15.0, 20.0, 35.0, 0.0, 1.0, 1500.0)
+
+        # Velocities decrease with depth, amplitude and correlation drop off with range
+        velocity = rng.normal(0.0, 0.3, (3, values)).astype("<f4")
+        amplitude = (80.0 - np.linspace(0, 50, values) + rng.normal(0, 1, values)).astype("<f4")
+        correlation = np.clip(rng.normal(0.9, 0.05, values), 0, 1).astype("<f4")
+        good_pings = np.full(values, 10, dtype="<i4")
+
+        payload = dataset("E000008", VALUE_TYPE_INT, 23, 1, ens_data)
+        payload += dataset("E000009", VALUE_TYPE_FLOAT, 13, 1, ancillary)
+        payload += dataset("E000001", VALUE_TYPE_FLOAT, bins, num_beams, velocity[0].tobytes())
+        payload += dataset("E000002", VALUE_TYPE_FLOAT, bins, num_beams, velocity[1].tobytes())
+        payload += dataset("E000003", VALUE_TYPE_FLOAT, bins, num_beams, velocity[2].tobytes())
+        payload += dataset("E000004", VALUE_TYPE_FLOAT, bins, num_beams, amplitude.tobytes())
+        payload += dataset("E000005", VALUE_TYPE_FLOAT, bins, num_beams, correlation.tobytes())
+        payload += dataset("E000006", VALUE_TYPE_INT, bins, num_beams, good_pings.tobytes())
+        payload += dataset("E000007", VALUE_TYPE_INT, bins, num_beams, good_pings.tobytes())
+
+        header = ENSEMBLE_HEADER + struct.pack("<IIII", ens_num, ens_num ^ 0xFFFFFFFF,
+                                               len(payload), len(payload) ^ 0xFFFFFFFF)
+        return header + payload + struct.pack("<I", binascii.crc_hqx(payload, 0))
+
+    def generate(self, file_path: str, ensembles: int) -> dict:
+        """
+        Create the RTB file.
+        :param file_path: File path to create.
+        :type file_path: str
+        :param ensembles: Number of 4 beam ensembles.  A 5 beam file also has the same number of vertical beam
+                          ensembles, and a 7 beam or 8 beam file the same number of second subsystem ensembles.
+        :type ensembles: int
+        :return: Number of ensembles, records and corrupted ensembles written and the file size.
+        :rtype: dict
+        """
+        rng = np.random.default_rng(self.seed)
+        ens_datetime = datetime.datetime(2020, 1, 1)
+        corrupted = 0
+        ens_count = 0
+        file_size = 0
+
+        with open(file_path, "wb") as file:
+            for ens_index in range(ensembles):
+                ens_num = ens_index + 1
+                records = [self.ensemble(rng, ens_num, ens_datetime, 4, SUBSYSTEM_CODE_4_BEAM, 0)]
+                if self.five_beam:
+                    records.append(self.ensemble(rng, ens_num, ens_datetime, 1, SUBSYSTEM_CODE_VERTICAL, 1))
+                if self.second_beams:
+                    records.append(self.ensemble(rng, ens_num, ens_datetime, self.second_beams,
+                                                 SUBSYSTEM_CODE_SECOND, SUBSYSTEM_CONFIG_SECOND))
+
+                if self.corruption_rate > 0 and rng.random() < self.corruption_rate:
+                    corrupted += 1
+                    if rng.random() < 0.5:
+                        # Junk bytes with a partial header between the ensembles
+                        records.append(ENSEMBLE_HEADER[:8] + rng.bytes(int(rng.integers(1, 64))))
+                    else:
+                        # Flip a byte in the payload so the checksum fails
+                        ens = bytearray(records[0])
+                        pos = int(rng.integers(32, len(ens) - 4))
+                        ens[pos] ^= 0xFF
+                        records[0] = bytes(ens)
+
+                for record in records:
+                    file.write(record)
+                    file_size += len(record)
+                ens_count += 1 + (1 if self.five_beam else 0) + (1 if self.second_beams else 0)
+                ens_datetime += datetime.timedelta(seconds=ENSEMBLE_INTERVAL)
+
+        return {"EnsCount": ens_count, "Records": ensembles, "Corrupted": corrupted, "FileSize": file_size}
+
+    def ensembles_for_size(self, size_mb: float) -> int:
+        """
+        Get the number of 4 beam ensembles needed for the file size.
+        :param size_mb: File size in megabytes.
+        :type size_mb: float
+        :return: Number of 4 beam ensembles.
+        :rtype: int
+        """
+        rng = np.random.default_rng(self.seed)
+        record_size = len(self.ensemble(rng, 1, datetime.datetime(2020, 1, 1), 4, SUBSYSTEM_CODE_4_BEAM, 0))
+        if self.five_beam:
+            record_size += len(self.ensemble(rng, 1, datetime.datetime(2020, 1, 1), 1, SUBSYSTEM_CODE_VERTICAL, 1))
+        if self.second_beams:
+            record_size += len(self.ensemble(rng, 1, datetime.datetime(2020, 1, 1), self.second_beams,
+                                             SUBSYSTEM_CODE_SECOND, SUBSYSTEM_CONFIG_SECOND))
+        return max(1, int(size_mb * 1e6 / record_size))
+
+
+def main(argv=None):
+    """
+    Create a synthetic RTB file from the command line.
+    :param argv: Command line arguments.  If None, sys.argv is used.
+    :type argv: list
+    :return:
+    :rtype:
+    """
+    parser = argparse.ArgumentParser(description="Create a synthetic RTB file.")
+    parser.add_argument("file_path", help="RTB file to create.")
+    parser.add_argument("--size-mb", type=float, default=10.0, help="Approximate file size in megabytes.")
+    parser.add_argument("--bins", type=int, default=30, help="Number of bins.")
+    parser.add_argument("--five-beam", action="store_true", help="Add a vertical beam ensemble after each 4 beam ensemble.")
+    parser.add_argument("--second-beams", type=int, choices=[0, 3, 4], default=0,
+                        help="Add an ensemble of a second subsystem with this many beams after each 4 beam ensemble.  "
+                             "3 gives a 7 beam and 4 an 8 beam system.")
+    parser.add_argument("--corruption", type=float, default=0.0, help="Fraction of the ensembles corrupted.")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed.")
+    args = parser.parse_args(argv)
+
+    generator = SyntheticRtbGenerator(args.bins, args.five_beam, args.corruption, args.seed, args.second_beams)
+    info = generator.generate(args.file_path, generator.ensembles_for_size(args.size_mb))
+    print(args.file_path + ": " + str(info))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+import os
+import sys
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import resource
+from .rtb_generator import SyntheticRtbGenerator
+
+
+# Root of the repository, the benchmarks are run from here
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Version of the results file
+RESULTS_VERSION = 1
+
+# Files created for the benchmarks and the generator settings
+DATASETS = {
+    "4beam": {"five_beam": False, "corruption_rate": 0.0},
+    "5beam": {"five_beam": True, "corruption_rate": 0.0},
+    "4beam_corrupt": {"five_beam": False, "corruption_rate": 0.01},
+}
+
+# Benchmark cases
+#   analyze      file_export.analyze_file() without the cache
+#   export       file_export.export_file() using RtiNetcdf.export (the file is analyzed first, not timed)
+#   single_pass  file_export.export_file() analyzing and exporting in a single pass
+#   bounded      single_pass with the BOUNDED_MEMORY_BUDGET memory budget
+CASES = ("analyze", "export", "single_pass", "bounded")
+
+# Memory budget of the bounded case in megabytes
+BOUNDED_MEMORY_BUDGET = 128
+
+# Cases and dataset run at each size to show the peak memory as the file grows
+SCALING_CASES = ("single_pass", "bounded")
+SCALING_DATASET = "4beam"
+
+# Default allowed change from the baseline before it is a regression
+DEFAULT_TOLERANCE = 0.15
+
+
+def peak_rss_mb() -> float:
+    """
+    Get the peak resident memory of this process.
+    :return: Peak resident memory in megabytes.
+    :rtype: float
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux gives kilobytes, macOS gives bytes
+    if sys.platform == "darwin":
+        return max_rss / 1e6
+    return max_rss * 1024 / 1e6
+
+
+def run_case(case: str, file_path: str) -> dict:
+    """
+    Run the benchmark case on the file.  This is run in a child process,
+    so the peak memory is only for this case.
+    :param case: Benchmark case in CASES.
+    :type case: str
+    :param file_path: RTB file path.
+    :type file_path: str
+    :return: Time in seconds, number of ensembles and peak memory.
+    :rtype: dict
+    """
+    from Export import file_export
+    from Export.export_profile import get_profile, DEFAULT_PROFILE_NAME
+
+    if case == "analyze":
+        start_time = time.perf_counter()
+        result = file_export.analyze_file(file_path)
+        seconds = time.perf_counter() - start_time
+    elif case == "export":
+        file_result = file_export.analyze_file(file_path)
+        start_time = time.perf_counter()
+        file_export.export_file(file_result)
+        seconds = time.perf_counter() - start_time
+        result = file_result
+    elif case == "single_pass":
+        start_time = time.perf_counter()
+        result = file_export.export_file({"FilePath": file_path}, single_pass=True)
+        seconds = time.perf_counter() - start_time
+    elif case == "bounded":
+        profile = get_profile(DEFAULT_PROFILE_NAME).with_memory_budget(BOUNDED_MEMORY_BUDGET)
+        start_time = time.perf_counter()
+        result = file_export.export_file({"FilePath": file_path}, profile=profile)
+        seconds = time.perf_counter() - start_time
+    else:
+        raise ValueError("Unknown benchmark case " + case)
+
+    return {"Seconds": seconds, "EnsCount": result.get("EnsCount", 0), "PeakRssMB": peak_rss_mb()}
+
+
+def run_child(case: str, file_path: str) -> dict:
+    """
+    Run the benchmark case in a new process.
+    :param case: Benchmark case in CASES.
+    :type case: str
+    :param file_path: RTB file path.
+    :type file_path: str
+    :return: Results from the child process.
+    :rtype: dict
+    """
+    process = subprocess.run([sys.executable, "-m", "benchmarks.run_benchmarks", "--child", case, file_path],
+                             cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "Exit code " +
+                           str(process.returncode))
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def create_dataset(work_dir: str, name: str, size_mb: float, bins: int, seed: int) -> str:
+    """
+    Create the synthetic RTB file for the dataset.  The file is reused
+    if it was already created with the same settings.
+    :param work_dir: Folder to store the files.
+    :type work_dir: str
+    :param name: Dataset name in DATASETS.
+    :type name: str
+    :param size_mb: File size in megabytes.
+    :type size_mb: float
+    :param bins: Number of bins.
+    :type bins: int
+    :param seed: Random seed.
+    :type seed: int
+    :return: RTB file path.
+    :rtype: str
+    """
+    file_path = os.path.join(work_dir, name + "_" + str(size_mb) + "mb_" + str(bins) + "bins_seed" + str(seed) + ".ens")
+    if not os.path.exists(file_path):
+        generator = SyntheticRtbGenerator(bins=bins, seed=seed, **DATASETS[name])
+        generator.generate(file_path + ".tmp", generator.ensembles_for_size(size_mb))
+        os.replace(file_path + ".tmp", file_path)
+    return file_path
+
+
+def remove_outputs(file_path: str):
+    """
+    Remove the files created by analyzing and exporting, so each run starts the same.
+    :param file_path: RTB file path.
+    :type file_path: str
+    :return:
+    :rtype:
+    """
+    for output_path in (file_path + ".ensidx", os.path.splitext(file_path)[0] + ".nc"):
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+
+def run_benchmarks(datasets: list, cases: list, size_mb: float, bins: int, repeat: int, work_dir: str,
+                   seed: int = 1) -> dict:
+    """
+    Run all the benchmark cases on all the datasets.  Each case is run
+    repeat times and the fastest time and highest memory are kept.
+    :param datasets: Dataset names in DATASETS.
+    :type datasets: list
+    :param cases: Benchmark cases in CASES.
+    :type cases: list
+    :param size_mb: File size in megabytes.
+    :type size_mb: float
+    :param bins: Number of bins.
+    :type bins: int
+    :param repeat: Number of times to run each case.
+    :type repeat: int
+    :param work_dir: Folder to store the files.
+    :type work_dir: str
+    :param seed: Random seed.
+    :type seed: int
+    :return: Benchmark results.
+    :rtype: dict
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    results = {}
+
+    for name in datasets:
+        file_path = create_dataset(work_dir, name, size_mb, bins, seed)
+        file_mb = os.path.getsize(file_path) / 1e6
+
+        for case in cases:
+            key = name + "/" + case
+            runs = []
+            try:
+                for run in range(repeat):
+                    remove_outputs(file_path)
+                    runs.append(run_child(case, file_path))
+            except RuntimeError as ex:
+                results[key] = {"Error": str(ex)}
+                print(key.ljust(28) + "failed: " + str(ex), file=sys.stderr)
+                continue
+            finally:
+                remove_outputs(file_path)
+
+            seconds = min(run["Seconds"] for run in runs)
+            ens_count = runs[0]["EnsCount"]
+            results[key] = {
+                "Seconds": seconds,
+                "MBps": file_mb / seconds if seconds > 0 else 0.0,
+                "EnsPerSecond": ens_count / seconds if seconds > 0 else 0.0,
+                "EnsCount": ens_count,
+                "PeakRssMB": max(run["PeakRssMB"] for run in runs),
+            }
+            print(key.ljust(28) + format_result(results[key]), file=sys.stderr)
+
+    return {
+        "Version": RESULTS_VERSION,
+        "Platform": platform.platform(),
+        "Machine": platform.machine(),
+        "Python": platform.python_version(),
+        "CpuCount": os.cpu_count(),
+        "SizeMB": size_mb,
+        "Bins": bins,
+        "Seed": seed,
+        "Results": results,
+    }
+
+
+def run_scaling(sizes: list, bins: int, work_dir: str, seed: int = 1) -> dict:
+    """
+    Run the scaling cases on files of each size to show how the peak
+    memory changes with the file size.
+    :param sizes: File sizes in megabytes.
+    :type sizes: list
+    :param bins: Number of bins.
+    :type bins: int
+    :param work_dir: Folder to store the files.
+    :type work_dir: str
+    :param seed: Random seed.
+    :type seed: int
+    :return: Peak memory of each case at each size.
+    :rtype: dict
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    scaling = {case: [] for case in SCALING_CASES}
+
+    for size_mb in sorted(sizes):
+        file_path = create_dataset(work_dir, SCALING_DATASET, size_mb, bins, seed)
+        for case in SCALING_CASES:
+            try:
+                remove_outputs(file_path)
+                run = run_child(case, file_path)
+            finally:
+                remove_outputs(file_path)
+
+            scaling[case].append({"SizeMB": size_mb, "Seconds": run["Seconds"], "PeakRssMB": run["PeakRssMB"]})
+            print((case + " " + str(size_mb) + " MB").ljust(28) +
+                  "{:8.3f} s {:8.1f} MB peak RSS".format(run["Seconds"], run["PeakRssMB"]), file=sys.stderr)
+
+    # Growth of the peak memory from the smallest to the largest file
+    for case, runs in scaling.items():
+        growth = runs[-1]["PeakRssMB"] - runs[0]["PeakRssMB"]
+        print((case + " growth").ljust(28) + "{:8.1f} MB peak RSS".format(growth), file=sys.stderr)
+
+    return {
+        "Version": RESULTS_VERSION,
+        "Platform": platform.platform(),
+        "Python": platform.python_version(),
+        "Bins": bins,
+        "Seed": seed,
+        "MemoryBudgetMB": BOUNDED_MEMORY_BUDGET,
+        "Scaling": scaling,
+    }
+
+
+def format_result(result: dict) -> str:
+    """
+    Format the result of a benchmark case to display.
+    :param result: Result of the case.
+    :type result: dict
+    :return: Formatted result.
+    :rtype: str
+    """
+    return "{:8.3f} s {:8.1f} MB/s {:10.0f} ens/s {:8.1f} MB peak RSS".format(
+        result["Seconds"], result["MBps"], result["EnsPerSecond"], result["PeakRssMB"])
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """
+    Compare the results to the baseline.  A case is a regression if the
+    throughput is lower or the peak memory is higher than the baseline
+    by more than the tolerance.
+    :param results: Benchmark results.
+    :type results: dict
+    :param baseline: Baseline benchmark results.
+    :type baseline: dict
+    :param tolerance: Allowed fraction of change from the baseline.
+    :type tolerance: float
+    :return: List of regression descriptions.  Empty if no regressions.
+    :rtype: list
+    """
+    if baseline.get("SizeMB") != results.get("SizeMB") or baseline.get("Bins") != results.get("Bins"):
+        print("Warning: baseline was created with a different file size or bins", file=sys.stderr)
+
+    regressions = []
+    for key, result in results["Results"].items():
+        base = baseline.get("Results", {}).get(key)
+        if base is None or "Error" in base:
+            continue
+        if "Error" in result:
+            regressions.append(key + ": failed, " + result["Error"])
+            continue
+
+        if result["MBps"] < base["MBps"] * (1 - tolerance):
+            regressions.append(key + ": throughput {:.1f} MB/s, baseline {:.1f} MB/s".format(result["MBps"], base["MBps"]))
+        if result["PeakRssMB"] > base["PeakRssMB"] * (1 + tolerance):
+            regressions.append(key + ": peak RSS {:.1f} MB, baseline {:.1f} MB".format(result["PeakRssMB"], base["PeakRssMB"]))
+
+    return regressions
+
+
+def main(argv=None) -> int:
+    """
+    Run the benchmarks from the command line.
+    :param argv: Command line arguments.  If None, sys.argv is used.
+    :type argv: list
+    :return: Exit code.  1 if a regression is found.
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the analyze and export of synthetic RTB files.")
+    parser.add_argument("--datasets", nargs="+", choices=sorted(DATASETS), default=sorted(DATASETS),
+                        help="Synthetic files to benchmark.")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES), help="Benchmark cases to run.")
+    parser.add_argument("--size-mb", type=float, default=50.0, help="Size of each synthetic file in megabytes.")
+    parser.add_argument("--bins", type=int, default=30, help="Number of bins in each ensemble.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to run each case.  The fastest is kept.")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the synthetic files.")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "exportr_benchmarks"),
+                        help="Folder to store the synthetic files.")
+    parser.add_argument("--output", help="Write the results JSON to this file.")
+    parser.add_argument("--save-baseline", help="Save the results as the baseline JSON file.")
+    parser.add_argument("--compare", help="Compare the results to this baseline JSON file.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed fraction of change from the baseline.")
+    parser.add_argument("--scaling", type=float, nargs="+", metavar="SIZE_MB",
+                        help="Only run the single pass and bounded export of the " + SCALING_DATASET +
+                             " file at each size to show the peak memory as the file grows.")
+    parser.add_argument("--child", nargs=2, metavar=("CASE", "FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Run a single case in this process for the parent
+    if args.child:
+        print(json.dumps(run_case(args.child[0], args.child[1])))
+        return 0
+
+    if args.scaling:
+        results_json = json.dumps(run_scaling(args.scaling, args.bins, args.work_dir, args.seed), indent=2)
+        if args.output:
+            with open(args.output, "w") as output_file:
+                output_file.write(results_json)
+        else:
+            print(results_json)
+        return 0
+
+    results = run_benchmarks(args.datasets, args.cases, args.size_mb, args.bins, max(args.repeat, 1),
+                             args.work_dir, args.seed)
+    results_json = json.dumps(results, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(results_json)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            baseline_file.write(results_json)
+    if not args.output and not args.save_baseline:
+        print(results_json)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_results(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression, file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions compared to " + args.compare, file=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import os
+import sys
+import argparse
+import json
+import subprocess
+import time
+
+
+# Root of the repository, the modules are imported from here
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported when each program starts
+#   gui     The view model imported by mainwindow.py before the window is shown
+#   cli     exportr_cli.py before the files are analyzed
+#   watch   exportr_watch.py before the folders are watched
+#   export  The modules only imported when the analyze or export starts, to show the time moved there
+STARTUP_TARGETS = {
+    "gui": ["Views.Exportr_vm"],
+    "cli": ["exportr_cli"],
+    "watch": ["exportr_watch"],
+    "export": ["Export.rtb_analyze", "Export.stream_export", "Export.parallel_export", "Export.aggregate_export"],
+}
+
+# Modules that are slow to import and are only needed to analyze or export
+HEAVY_MODULES = ("numpy", "netCDF4", "cftime", "pandas", "scipy", "rti_python", "qdarkstyle")
+
+# Code run in the child process to import the modules of a target
+CHILD_CODE = """
+import sys, json, time, importlib
+start_time = time.perf_counter()
+for module in sys.argv[2:]:
+    importlib.import_module(module)
+seconds = time.perf_counter() - start_time
+heavy = [name for name in json.loads(sys.argv[1]) if name in sys.modules]
+print(json.dumps({"ImportSeconds": seconds, "HeavyModules": heavy}))
+"""
+
+
+def run_target(target: str) -> dict:
+    """
+    Import the modules of the target in a new Python process.
+    :param target: Target in STARTUP_TARGETS.
+    :type target: str
+    :return: Import time, process time and the heavy modules imported.
+    :rtype: dict
+    """
+    start_time = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", CHILD_CODE, json.dumps(HEAVY_MODULES)] + STARTUP_TARGETS[target],
+                             cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    process_seconds = time.perf_counter() - start_time
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        return {"Error": lines[-1] if lines else "Exit code " + str(process.returncode)}
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["ProcessSeconds"] = process_seconds
+    return result
+
+
+def run_startup(targets: list, repeat: int) -> dict:
+    """
+    Measure the startup time of each target.  The fastest run is kept,
+    so the operating system has the files of the modules cached.
+    :param targets: Targets in STARTUP_TARGETS.
+    :type targets: list
+    :param repeat: Number of times to run each target.
+    :type repeat: int
+    :return: Result of each target.
+    :rtype: dict
+    """
+    results = {}
+    for target in targets:
+        best = None
+        for _ in range(repeat):
+            result = run_target(target)
+            if "Error" in result:
+                best = result
+                break
+            if best is None or result["ImportSeconds"] < best["ImportSeconds"]:
+                best = result
+        results[target] = best
+
+        if "Error" in best:
+            print("{:8s} failed: {}".format(target, best["Error"]), file=sys.stderr)
+        else:
+            print("{:8s} {:8.3f} s import {:8.3f} s process  {}".format(
+                target, best["ImportSeconds"], best["ProcessSeconds"], " ".join(best["HeavyModules"]) or "-"),
+                file=sys.stderr)
+
+    return {"Python": sys.version.split()[0], "Results": results}
+
+
+def main(argv=None) -> int:
+    """
+    Measure the startup time from the command line.
+    :param argv: Command line arguments.  If None, sys.argv is used.
+    :type argv: list
+    :return: Exit code.
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(description="Measure the time to import the modules of the user interface "
+                                                 "and command line before any file is analyzed.")
+    parser.add_argument("--targets", nargs="+", choices=sorted(STARTUP_TARGETS), default=sorted(STARTUP_TARGETS),
+                        help="Programs to measure.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of times to run each target.  The fastest is kept.")
+    parser.add_argument("--output", help="Write the results JSON to this file.")
+    args = parser.parse_args(argv)
+
+    results_json = json.dumps(run_startup(args.targets, max(args.repeat, 1)), indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(results_json)
+    else:
+        print(results_json)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,430 @@
+import sys
+import argparse
+import json
+import logging
+import time
+import datetime
+from Export import file_export
+from Export.export_pool import ExportPool, default_worker_count
+from Export.analyze_cache import AnalyzeCache, DEFAULT_CACHE_PATH
+from Export.export_profile import ExportProfile, EXPORT_PROFILES, get_profile
+from Export.output_formats import OUTPUT_FORMATS, check_format, is_netcdf_only
+from Export.instrumentation import Instrumentation, NULL_INSTRUMENTATION, PROFILERS, DEFAULT_PROFILER, \
+    check_profiler, merge_results, profile_call, profile_dump_path
+
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_NO_FILES = 2
+
+
+def set_result_summary(summary: dict, result: dict):
+    """
+    Add the analyze results to the file summary.
+    :param summary: Summary of the file.
+    :type summary: dict
+    :param result: Analyze results of the file.
+    :type result: dict
+    :return:
+    :rtype:
+    """
+    summary["EnsCount"] = result.get("EnsCount", 0)
+    summary["EnsPairCount"] = result.get("EnsPairCount", 0)
+    summary["EnsembleDeltaTime"] = result.get("EnsembleDeltaTime")
+    summary["FirstEnsDateTime"] = result.get("FirstEnsDateTime")
+    summary["LastEnsDateTime"] = result.get("LastEnsDateTime")
+    if "IntervalCount" in result:
+        summary["IntervalCount"] = result["IntervalCount"]
+    if "NewEnsCount" in result:
+        summary["NewEnsCount"] = result["NewEnsCount"]
+    if "Groups" in result:
+        summary["Groups"] = {name: {"EnsCount": group_result["EnsCount"], "EnsPairCount": group_result["EnsPairCount"]}
+                             for name, group_result in result["Groups"].items()}
+
+
+def write_summary(summary: dict, summary_path: str = None):
+    """
+    Write the JSON summary to the file or stdout.
+    :param summary: Summary of all the files.
+    :type summary: dict
+    :param summary_path: File path to write the summary.  If None, the summary is written to stdout.
+    :type summary_path: str
+    :return:
+    :rtype:
+    """
+    summary_json = json.dumps(summary, indent=2, default=str)
+    if summary_path:
+        with open(summary_path, "w") as summary_file:
+            summary_file.write(summary_json)
+    else:
+        print(summary_json)
+
+
+def analyze_file(file_path: str, cache: AnalyzeCache = None, incremental: bool = False, instrument: bool = False,
+                 profile_dir: str = None, profiler: str = DEFAULT_PROFILER) -> tuple:
+    """
+    Analyze a single file.  Any error is caught and stored
+    in the summary so the remaining files can still be processed.
+    :param file_path: File path to analyze.
+    :type file_path: str
+    :param cache: Optional cache of the analyze results.
+    :type cache: AnalyzeCache
+    :param incremental: Only read the data added since the file was last exported.
+    :type incremental: bool
+    :param instrument: Give the time of each stage and the counters in AnalyzeInstrumentation.
+    :type instrument: bool
+    :param profile_dir: Folder to write the call profile of the analyze.  If None, no profile is written.
+    :type profile_dir: str
+    :param profiler: Profiler used to write the call profile.
+    :type profiler: str
+    :return: Summary of the file and the analyze results.
+    :rtype: dict, dict
+    """
+    summary = {"FilePath": file_path, "Status": "ok", "Error": None}
+    result = None
+    instrumentation = Instrumentation() if instrument else NULL_INSTRUMENTATION
+
+    def analyze():
+        return file_export.analyze_file(file_path, cache=cache, incremental=incremental,
+                                        instrumentation=instrumentation)
+
+    try:
+        # Analyze the file
+        start_time = time.perf_counter()
+        if profile_dir:
+            result = profile_call(analyze, profile_dump_path(profile_dir, file_path, "analyze"), profiler)
+        else:
+            result = analyze()
+        summary["AnalyzeSeconds"] = time.perf_counter() - start_time
+
+        set_result_summary(summary, result)
+
+        if result.get("EnsCount", 0) <= 0:
+            summary["Status"] = "empty"
+    except Exception as ex:
+        logging.exception("Error analyzing file " + file_path)
+        summary["Status"] = "failed"
+        summary["Error"] = str(ex)
+
+    if instrument:
+        summary["AnalyzeInstrumentation"] = instrumentation.result()
+
+    return summary, result
+
+
+def export_aggregate(export_results: list, export_summaries: list, output_path: str,
+                     profile: ExportProfile = None, instrument: bool = False, profile_dir: str = None,
+                     profiler: str = DEFAULT_PROFILER) -> dict:
+    """
+    Export all the files into a single netCDF file.  The status of each
+    file in the aggregated file is stored in the file summaries.
+    :param export_results: Analyze results of the files to export.
+    :type export_results: list
+    :param export_summaries: Summary of each file to export.
+    :type export_summaries: list
+    :param output_path: netCDF file path.
+    :type output_path: str
+    :param profile: Chunk shape, compression and write buffer of the netCDF file.
+    :type profile: ExportProfile
+    :param instrument: Give the time of each stage and the counters in ExportInstrumentation.
+    :type instrument: bool
+    :param profile_dir: Folder to write the call profile of the export.  If None, no profile is written.
+    :type profile_dir: str
+    :param profiler: Profiler used to write the call profile.
+    :type profiler: str
+    :return: Summary of the aggregated file.
+    :rtype: dict
+    """
+    aggregate_summary = {"FilePath": output_path, "Status": "ok", "Error": None}
+    instrumentation = Instrumentation() if instrument else NULL_INSTRUMENTATION
+
+    def export():
+        return file_export.export_aggregate(export_results, output_path, profile=profile,
+                                            instrumentation=instrumentation)
+
+    try:
+        start_time = time.perf_counter()
+        if profile_dir:
+            result = profile_call(export, profile_dump_path(profile_dir, output_path, "export"), profiler)
+        else:
+            result = export()
+        aggregate_summary["ExportSeconds"] = time.perf_counter() - start_time
+        set_result_summary(aggregate_summary, result)
+    except Exception as ex:
+        logging.exception("Error exporting the files to " + output_path)
+        aggregate_summary["Status"] = "failed"
+        aggregate_summary["Error"] = str(ex)
+        for summary in export_summaries:
+            summary["Status"] = "failed"
+            summary["Error"] = str(ex)
+        if instrument:
+            aggregate_summary["ExportInstrumentation"] = instrumentation.result()
+        return aggregate_summary
+
+    file_statuses = {file_summary["FilePath"]: file_summary for file_summary in result["Files"]}
+    for summary in export_summaries:
+        file_status = file_statuses[summary["FilePath"]]
+        summary["Status"] = file_status["Status"]
+        summary["Records"] = file_status["Records"]
+        summary["Dropped"] = file_status["Dropped"]
+        if file_status["Reason"]:
+            summary["Error"] = file_status["Reason"]
+
+    if instrument:
+        aggregate_summary["ExportInstrumentation"] = instrumentation.result()
+
+    return aggregate_summary
+
+
+def instrumentation_total(summaries: list) -> dict:
+    """
+    Add up the analyze and export instrumentation of all the files.
+    :param summaries: Summary of each file and the aggregated file.
+    :type summaries: list
+    :return: Total time of each stage and the counters.
+    :rtype: dict
+    """
+    results = []
+    for summary in summaries:
+        results.append(summary.get("AnalyzeInstrumentation"))
+        results.append(summary.get("ExportInstrumentation"))
+    return merge_results(results)
+
+
+def create_profile(args) -> ExportProfile:
+    """
+    Create the export profile from the command line arguments.  The named
+    profile is used with any chunk, compression or buffer options changed.
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :return: Export profile or None if no profile options are given.
+    :rtype: ExportProfile
+    """
+    if args.profile is None and args.complevel is None and args.chunks is None and args.write_buffer is None and \
+            args.memory_budget is None:
+        return None
+
+    profile = get_profile(args.profile if args.profile else "default")
+    time_chunk, bin_chunk, beam_chunk = profile.time_chunk, profile.bin_chunk, profile.beam_chunk
+    if args.chunks is not None:
+        # 0 uses all the bins or beams in a chunk
+        time_chunk = args.chunks[0]
+        bin_chunk = args.chunks[1] if args.chunks[1] > 0 else None
+        beam_chunk = args.chunks[2] if args.chunks[2] > 0 else None
+
+    return ExportProfile(time_chunk=time_chunk, bin_chunk=bin_chunk, beam_chunk=beam_chunk,
+                         complevel=args.complevel if args.complevel is not None else profile.complevel,
+                         shuffle=profile.shuffle,
+                         write_buffer=args.write_buffer if args.write_buffer is not None else profile.write_buffer,
+                         memory_budget=args.memory_budget)
+
+
+def main(argv=None) -> int:
+    """
+    Run the analyze and export without the QT user interface.
+    :param argv: Command line arguments.  If None, sys.argv is used.
+    :type argv: list
+    :return: Exit code.
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(description="Rowe Technologies Inc. - ExportR. "
+                                                 "Export RTB files to netCDF without the user interface.")
+    parser.add_argument("paths", nargs="+", help="Files, directories or glob patterns of RTB files.")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Search directories and globs recursively.")
+    parser.add_argument("--analyze-only", action="store_true", help="Only analyze the files, do not export.")
+    parser.add_argument("--single-pass", action="store_true",
+                        help="Analyze and export each file in a single read of the file.")
+    parser.add_argument("--ensembles", type=int, nargs=2, metavar=("START", "STOP"),
+                        help="Only export the ensembles from START up to STOP.")
+    parser.add_argument("--start-time", type=datetime.datetime.fromisoformat,
+                        help="Only export the ensembles at or after this time, YYYY-MM-DDTHH:MM:SS.")
+    parser.add_argument("--end-time", type=datetime.datetime.fromisoformat,
+                        help="Only export the ensembles at or before this time, YYYY-MM-DDTHH:MM:SS.")
+    parser.add_argument("--decimate", type=int, metavar="N",
+                        help="Only export every Nth ensemble for a quick look.  The ensemble index is used to "
+                             "read only these ensembles.  Uses the single pass export.")
+    parser.add_argument("--average", type=float, metavar="SECONDS",
+                        help="Average the ensembles into intervals of this many seconds for a quick look.  "
+                             "Uses the single pass export.")
+    parser.add_argument("--profile", choices=sorted(EXPORT_PROFILES),
+                        help="netCDF chunk shape and compression profile.  Uses the single pass export.")
+    parser.add_argument("--complevel", type=int, choices=range(10), metavar="0-9",
+                        help="zlib compression level.  0 to not compress.")
+    parser.add_argument("--chunks", type=int, nargs=3, metavar=("TIME", "BIN", "BEAM"),
+                        help="netCDF chunk shape.  Use 0 for BIN or BEAM to include all the bins or beams.")
+    parser.add_argument("--write-buffer", type=int,
+                        help="Number of ensembles to hold in memory before writing to the netCDF file.")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="Resident memory budget of each export process in megabytes.  The memory used does "
+                             "not grow with the file size.  Uses the single pass export.")
+    parser.add_argument("--append", action="store_true",
+                        help="Only read the ensembles added to each file since it was last exported "
+                             "and append them to the netCDF file.")
+    parser.add_argument("--groups", action="store_true",
+                        help="Write each subsystem configuration to its own netCDF group, such as the two "
+                             "subsystems of a 7 beam or 8 beam system.  Uses the single pass export.")
+    parser.add_argument("--formats", type=lambda value: value.split(","), metavar="FORMAT,...",
+                        help="Comma separated output formats to write from a single read of each file, from " +
+                             ", ".join(OUTPUT_FORMATS) + ".  Each format uses the netCDF file name with its "
+                             "extension.  Default is netcdf.")
+    parser.add_argument("--aggregate", metavar="OUTPUT",
+                        help="Export all the files in time order into this single netCDF file.  "
+                             "Overlapping ensembles are only written once.")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="File path of the analyze results cache.")
+    parser.add_argument("--no-cache", action="store_true", help="Analyze all the files, do not use the cache.")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of files to export at the same time.  Default is the number of CPU cores.")
+    parser.add_argument("--split", action="store_true",
+                        help="Export one file at a time, splitting each file across the workers.  "
+                             "Uses the single pass export.")
+    parser.add_argument("--instrument", action="store_true",
+                        help="Give the time of each stage of the analyze and export and the byte, ensemble and "
+                             "bad checksum counts in the summary.")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="Write the call profile of the analyze and export of each file to this folder.")
+    parser.add_argument("--profiler", choices=PROFILERS, default=DEFAULT_PROFILER,
+                        help="Profiler used for --profile-dir.  cprofile writes .prof files, pyinstrument "
+                             "writes .html files.")
+    parser.add_argument("--summary", help="Write the JSON summary to this file instead of stdout.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Display debug logging.")
+    args = parser.parse_args(argv)
+
+    try:
+        profile = create_profile(args)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    if args.aggregate and (args.ensembles or args.start_time or args.end_time or args.append or args.split):
+        parser.error("--aggregate can not be used with --ensembles, --start-time, --end-time, --append or --split")
+    if args.groups and (args.aggregate or args.append or args.split):
+        parser.error("--groups can not be used with --aggregate, --append or --split")
+    if args.formats:
+        # Remove any repeated formats
+        args.formats = list(dict.fromkeys(args.formats))
+        for output_format in args.formats:
+            try:
+                check_format(output_format)
+            except ValueError as ex:
+                parser.error(str(ex))
+        if not is_netcdf_only(args.formats) and (args.aggregate or args.append or args.split or args.groups):
+            parser.error("--formats other than netcdf can not be used with --aggregate, --append, --split "
+                         "or --groups")
+    if args.decimate is not None and args.decimate < 1:
+        parser.error("--decimate must be 1 or more")
+    if args.average is not None and args.average <= 0:
+        parser.error("--average must be more than 0 seconds")
+    if (args.decimate or args.average) and (args.aggregate or args.append or args.split or args.groups):
+        parser.error("--decimate and --average can not be used with --aggregate, --append, --split or --groups")
+    if args.memory_budget is not None and args.split:
+        parser.error("--memory-budget can not be used with --split")
+    if args.profile_dir:
+        try:
+            check_profiler(args.profiler)
+        except ValueError as ex:
+            parser.error(str(ex))
+
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',
+                        level=logging.DEBUG if args.verbose else logging.WARNING,
+                        stream=sys.stderr)
+
+    # Find all the files to process
+    files = file_export.find_files(args.paths, recursive=args.recursive)
+    if not files:
+        logging.error("No RTB files found")
+        return EXIT_NO_FILES
+
+    file_summaries = []
+    export_results = []
+    export_summaries = []
+    # The profile, split, groups, formats other than netCDF and the quick look are only used by the single pass export
+    single_pass = args.single_pass or args.split or args.groups or not is_netcdf_only(args.formats) or \
+        (args.decimate or 1) > 1 or args.average is not None or profile is not None
+
+    if single_pass and not args.analyze_only and not args.aggregate:
+        # The files are analyzed while they are exported
+        for file_path in files:
+            summary = {"FilePath": file_path, "Status": "ok", "Error": None}
+            file_summaries.append(summary)
+            export_results.append({"FilePath": file_path})
+            export_summaries.append(summary)
+    else:
+        # Analyze all the files
+        cache = None if args.no_cache else AnalyzeCache(args.cache)
+        for file_path in files:
+            summary, result = analyze_file(file_path, cache, args.append, args.instrument, args.profile_dir,
+                                           args.profiler)
+            file_summaries.append(summary)
+
+            if args.analyze_only:
+                if summary["Status"] == "ok":
+                    summary["Status"] = "analyzed"
+            elif summary["Status"] == "ok":
+                export_results.append(result)
+                export_summaries.append(summary)
+
+    # Export all the files with data into a single file
+    if args.aggregate and not args.analyze_only:
+        aggregate_summary = export_aggregate(export_results, export_summaries, args.aggregate, profile,
+                                             args.instrument, args.profile_dir, args.profiler)
+        failed = sum(1 for summary in file_summaries if summary["Status"] == "failed")
+        summary = {"Total": len(file_summaries), "Failed": failed, "Aggregate": aggregate_summary,
+                   "Files": file_summaries}
+        if args.instrument:
+            summary["Instrumentation"] = instrumentation_total(file_summaries + [aggregate_summary])
+        write_summary(summary, args.summary)
+        return EXIT_FAILED if failed > 0 else EXIT_OK
+
+    # Export all the files with data
+    export_options = {"single_pass": single_pass, "profile": profile}
+    if args.ensembles:
+        export_options["ens_range"] = args.ensembles
+    if args.start_time or args.end_time:
+        export_options["time_range"] = [args.start_time, args.end_time]
+    if args.append:
+        export_options["incremental"] = True
+    if args.groups:
+        export_options["groups"] = True
+    if not is_netcdf_only(args.formats):
+        export_options["formats"] = args.formats
+    if args.decimate and args.decimate > 1:
+        export_options["decimate"] = args.decimate
+    if args.average:
+        export_options["average_interval"] = args.average
+    if args.split:
+        export_options["split_workers"] = args.workers if args.workers else default_worker_count()
+    if args.instrument:
+        export_options["instrument"] = True
+    if args.profile_dir:
+        export_options["profile_dir"] = args.profile_dir
+        export_options["profiler"] = args.profiler
+
+    export_pool = ExportPool(args.workers, export_options)
+    for summary, export_summary in zip(export_summaries, export_pool.export(export_results)):
+        summary["Status"] = export_summary["Status"]
+        summary["Error"] = export_summary["Error"]
+        summary["ExportSeconds"] = export_summary.get("ExportSeconds")
+        if "Instrumentation" in export_summary:
+            summary["ExportInstrumentation"] = export_summary["Instrumentation"]
+
+        # Single pass, append and range exports give the analyze results of the ensembles exported
+        result = export_summary.get("Result")
+        if result and (single_pass or args.append or "ens_range" in export_options or "time_range" in export_options):
+            set_result_summary(summary, result)
+            if result.get("EnsCount", 0) <= 0:
+                summary["Status"] = "empty"
+
+    failed = sum(1 for summary in file_summaries if summary["Status"] == "failed")
+    summary = {"Total": len(file_summaries), "Failed": failed, "Files": file_summaries}
+    if args.instrument:
+        summary["Instrumentation"] = instrumentation_total(file_summaries)
+
+    write_summary(summary, args.summary)
+
+    if failed > 0:
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import os
+import sys
+import signal
+import argparse
+import logging
+from Export.watcher import FolderWatcher, DEFAULT_SETTLE_TIME, DEFAULT_MAX_DELAY, DEFAULT_POLL_INTERVAL, \
+    DEFAULT_STATUS_INTERVAL
+from Export.export_profile import EXPORT_PROFILES, DEFAULT_PROFILE_NAME, get_profile
+
+
+# Exit codes
+EXIT_OK = 0
+EXIT_NO_DIRECTORY = 2
+
+
+def main(argv=None) -> int:
+    """
+    Watch directories and export the RTB files to netCDF as they are written.
+    This runs until it is stopped with Ctrl-C or SIGTERM.
+    :param argv: Command line arguments.  If None, sys.argv is used.
+    :type argv: list
+    :return: Exit code.
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(description="Rowe Technologies Inc. - ExportR. "
+                                                 "Watch directories and export new or grown RTB files to netCDF.")
+    parser.add_argument("directories", nargs="+", help="Directories to watch.")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Also watch all the sub directories.")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of files to export at the same time.  Default is the number of CPU cores.")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_TIME,
+                        help="Seconds a file must not change before it is exported.")
+    parser.add_argument("--max-delay", type=float, default=DEFAULT_MAX_DELAY,
+                        help="Longest seconds to wait for a file that keeps changing before exporting it.")
+    parser.add_argument("--poll", action="store_true", help="Poll the directories instead of using inotify.")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Seconds between scans of the directories when polling.")
+    parser.add_argument("--status", help="Write the JSON status and metrics to this file.")
+    parser.add_argument("--status-interval", type=float, default=DEFAULT_STATUS_INTERVAL,
+                        help="Seconds between writes of the status file.")
+    parser.add_argument("--profile", choices=sorted(EXPORT_PROFILES),
+                        help="netCDF chunk shape and compression profile of new netCDF files.")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="Resident memory budget of each export process in megabytes.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Display debug logging.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',
+                        level=logging.DEBUG if args.verbose else logging.INFO,
+                        stream=sys.stderr)
+
+    missing = [directory for directory in args.directories if not os.path.isdir(directory)]
+    if missing:
+        logging.error("Directories not found: " + ", ".join(missing))
+        return EXIT_NO_DIRECTORY
+
+    if args.memory_budget is not None and args.memory_budget <= 0:
+        parser.error("--memory-budget must be more than 0 MB")
+
+    export_options = {}
+    if args.profile:
+        export_options["profile"] = get_profile(args.profile)
+    if args.memory_budget:
+        profile = get_profile(args.profile if args.profile else DEFAULT_PROFILE_NAME)
+        export_options["profile"] = profile.with_memory_budget(args.memory_budget)
+
+    watcher = FolderWatcher(args.directories,
+                            recursive=args.recursive,
+                            workers=args.workers,
+                            settle_time=args.settle,
+                            max_delay=args.max_delay,
+                            use_inotify=not args.poll,
+                            poll_interval=args.poll_interval,
+                            status_path=args.status,
+                            status_interval=args.status_interval,
+                            export_options=export_options)
+
+    # Stop cleanly when the service is stopped or Ctrl-C is pressed
+    def stop_handler(signum, frame):
+        watcher.stop()
+    signal.signal(signal.SIGTERM, stop_handler)
+    signal.signal(signal.SIGINT, stop_handler)
+
+    watcher.run()
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import sys
 import traceback
+import multiprocessing
 from PyQt5 import QtGui, QtWidgets
 from Views.Exportr_vm import ExportrVM
 import logging
@@ -44,6 +45,9 @@ class MainWindow(QtWidgets.QMainWindow):
             "Are you sure you want to quit?", QtWidgets.QMessageBox.Close | QtWidgets.QMessageBox.Cancel)
 
         if reply == QtWidgets.QMessageBox.Close:
+            # Cancel the exports so the partial files are removed
+            if hasattr(self, "predictor"):
+                self.predictor.stop_exports()
             event.accept()
         else:
             event.ignore()
@@ -58,6 +62,8 @@ def exception_hook(exctype, value, traceback):
 
 
 if __name__ == '__main__':
+    # Needed for the export worker processes in the frozen application
+    multiprocessing.freeze_support()
     sys.excepthook = exception_hook
     app = QtWidgets.QApplication(sys.argv)
     app.setStyle("Mac")
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from benchmarks.rtb_generator import SyntheticRtbGenerator
+from Export.rtb_reader import create_reader
+
+
+# File attributes that must match between two exports of the same ensembles
+COMPARED_ATTRS = ("ens_count", "ens_pair_count", "resume_offset", "resume_record_count")
+
+
+@pytest.fixture
+def rtb_file(tmp_path):
+    """
+    Create synthetic RTB files in the test folder.
+    :return: Function(name, ensembles, **settings) that creates the file and gives its path.
+             The settings are passed to SyntheticRtbGenerator.
+    :rtype: function
+    """
+    def create(name: str, ensembles: int, **settings) -> str:
+        file_path = str(tmp_path / name)
+        SyntheticRtbGenerator(**settings).generate(file_path, ensembles)
+        return file_path
+    return create
+
+
+@pytest.fixture
+def drop_ensembles(tmp_path):
+    """
+    Copy a file without some of its ensembles, such as a download that starts
+    mid pair or a file with a corrupt ensemble.
+    :return: Function(file_path, name, ens_indexes) that creates the copy and gives its path.
+    :rtype: function
+    """
+    def create(file_path: str, name: str, ens_indexes: list) -> str:
+        copy_path = str(tmp_path / name)
+        with open(file_path, "rb") as file, open(copy_path, "wb") as copy:
+            data = file.read()
+            offsets = [offset for offset, ens_bytes in create_reader(file_path).ensembles()] + [len(data)]
+            for ens_index in range(len(offsets) - 1):
+                if ens_index not in ens_indexes:
+                    copy.write(data[offsets[ens_index]:offsets[ens_index + 1]])
+        return copy_path
+    return create
+
+
+@pytest.fixture
+def assert_same_netcdf():
+    """
+    Check two netCDF files have the same variables, values and counts.
+    :return: Function(path, expected_path).
+    :rtype: function
+    """
+    netCDF4 = pytest.importorskip("netCDF4")
+
+    def compare(path: str, expected_path: str):
+        with netCDF4.Dataset(path) as dataset, netCDF4.Dataset(expected_path) as expected:
+            assert set(dataset.variables) == set(expected.variables)
+            for var_name in expected.variables:
+                values = dataset.variables[var_name][:]
+                expected_values = expected.variables[var_name][:]
+                assert values.shape == expected_values.shape, var_name
+                assert np.array_equal(np.ma.getmaskarray(values), np.ma.getmaskarray(expected_values)), var_name
+                assert np.array_equal(np.ma.filled(values, 0), np.ma.filled(expected_values, 0),
+                                      equal_nan=True), var_name
+            for name in COMPARED_ATTRS:
+                assert getattr(dataset, name, None) == getattr(expected, name, None), name
+    return compare
+
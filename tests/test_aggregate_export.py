@@ -0,0 +1,22 @@
+import pytest
+from Export import file_export
+from Export.aggregate_export import AggregateExporter, FILE_STATUS_EXPORTED
+
+netCDF4 = pytest.importorskip("netCDF4")
+
+
+def test_aggregate_file_starting_on_vertical_beam(rtb_file, drop_ensembles, tmp_path):
+    full_path = rtb_file("full.ens", 100, five_beam=True)
+
+    # The first file starts with the vertical beam of the first pair
+    first_path = drop_ensembles(full_path, "first.ens", [0] + list(range(100, 200)))
+    second_path = drop_ensembles(full_path, "second.ens", list(range(100)))
+    file_results = [file_export.analyze_file(file_path) for file_path in (first_path, second_path)]
+
+    result = AggregateExporter(file_results, str(tmp_path / "all.nc")).export()
+    assert [summary["Status"] for summary in result["Files"]] == [FILE_STATUS_EXPORTED] * 2
+    assert result["EnsCount"] == 199
+    assert result["EnsPairCount"] == 99
+    with netCDF4.Dataset(str(tmp_path / "all.nc")) as dataset:
+        assert len(dataset.dimensions["beam"]) == 5
+        assert len(dataset.dimensions["time"]) == 100
@@ -0,0 +1,38 @@
+import pytest
+from Export import batch_decoder, file_export
+from Export.batch_decoder import BatchDecoder, file_shape
+from Export.rtb_reader import create_reader
+
+
+def test_shape_of_file_starting_on_vertical_beam(rtb_file, drop_ensembles):
+    file_path = drop_ensembles(rtb_file("full.ens", 50, five_beam=True), "cut.ens", [0])
+    batch = next(BatchDecoder().batches(create_reader(file_path).ensembles()))
+    assert batch.num_beams == 5
+    assert file_shape(file_path)[1] == 5
+
+
+def test_shape_of_file_missing_vertical_beam(rtb_file, drop_ensembles):
+    file_path = drop_ensembles(rtb_file("full.ens", 50, five_beam=True), "missing.ens", [1])
+    batch = next(BatchDecoder().batches(create_reader(file_path).ensembles()))
+    assert batch.num_beams == 5
+    assert file_shape(file_path)[1] == 5
+
+
+def test_shape_of_4_beam_file(rtb_file):
+    assert file_shape(rtb_file("four.ens", 20))[1] == 4
+
+
+def test_record_larger_than_batch_raises(rtb_file):
+    file_path = rtb_file("full.ens", 10, five_beam=True)
+    with pytest.raises(ValueError, match="5 beams"):
+        list(BatchDecoder(num_beams=4).batches(create_reader(file_path).ensembles()))
+
+
+def test_shape_of_file_uses_index(rtb_file, drop_ensembles, monkeypatch):
+    monkeypatch.setattr(batch_decoder, "SHAPE_RECORDS", 1)
+    file_path = drop_ensembles(rtb_file("full.ens", 50, five_beam=True), "cut.ens", [0])
+    assert file_shape(file_path)[1] == 1
+
+    # The index has the beams of every record in the file
+    file_export.analyze_file(file_path)
+    assert file_shape(file_path)[1] == 5
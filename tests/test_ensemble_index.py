@@ -0,0 +1,33 @@
+from Export.ensemble_index import EnsembleIndex
+
+
+def create_index(num_beams: list) -> EnsembleIndex:
+    """
+    Create an index of ensembles of 100 bytes with the number of beams.
+    """
+    index = EnsembleIndex()
+    for ens_index, beams in enumerate(num_beams):
+        index.append(ens_index * 100, 100, ens_index + 1, None, beams)
+    return index
+
+
+def test_record_starts_pair_vertical_beam():
+    index = create_index([4, 1, 4, 4, 1, 1, 3, 1, 4])
+    assert list(index.record_starts()) == [0, 2, 3, 5, 6, 7, 8]
+
+
+def test_record_starts_empty():
+    assert len(create_index([]).record_starts()) == 0
+
+
+def test_record_ranges_and_offsets():
+    index = create_index([4, 1, 4, 1, 4, 1, 4])
+    assert index.record_offsets(1, 3) == (200, 600)
+    assert index.record_ranges(0, 4, 2) == [(0, 200), (400, 600)]
+    assert index.record_ranges(3, 10) == [(600, 700)]
+
+
+def test_max_record_beams():
+    assert create_index([1, 4, 1, 4, 4]).max_record_beams() == 5
+    assert create_index([1, 4, 4]).max_record_beams() == 4
+    assert create_index([]).max_record_beams() == 0
@@ -0,0 +1,39 @@
+import queue
+
+from Export.job_queue import JobQueue, ExportJob, PRIORITY_NORMAL, PRIORITY_HIGH, JOB_COMPLETED
+
+
+def create_queue(**callbacks) -> JobQueue:
+    """
+    Create a job queue with two jobs waiting.  The dispatcher is not started.
+    """
+    job_queue = JobQueue(workers=1, **callbacks)
+    for job_id in (1, 2):
+        job_queue.jobs[job_id] = ExportJob(job_id, [{"FilePath": str(job_id) + ".ens"}], {}, PRIORITY_NORMAL, job_id)
+    job_queue.progress_queue = queue.Queue()
+    return job_queue
+
+
+def test_set_priority_notifies_state():
+    notified = []
+    job_queue = create_queue(job_state_callback=notified.append)
+
+    assert job_queue.set_priority(2, PRIORITY_HIGH)
+    assert [(job.job_id, job.priority) for job in notified] == [(2, PRIORITY_HIGH)]
+
+    # A complete job can not be changed
+    job_queue.jobs[1].state = JOB_COMPLETED
+    assert not job_queue.set_priority(1, PRIORITY_HIGH)
+    assert len(notified) == 1
+
+
+def test_dispatch_progress_keeps_latest():
+    notified = []
+    job_queue = create_queue(job_progress_callback=lambda job: notified.append((job.job_id, job.ens_exported)))
+    job_queue.jobs[2].state = JOB_COMPLETED
+    for job_id, ens_exported in [(1, 10), (2, 5), (1, 30), (1, 20)]:
+        job_queue.progress_queue.put((job_id, ens_exported))
+
+    job_queue._dispatch_progress()
+    assert notified == [(1, 30)]
+    assert job_queue.jobs[1].ens_exported == 30
@@ -0,0 +1,94 @@
+import os
+import pytest
+from Export import file_export, parallel_export
+from Export.parallel_export import ParallelExporter, find_record_start, split_file
+from Export.rtb_decoder import decode_ensemble_header
+from Export.rtb_reader import create_reader
+from Export.stream_export import StreamExporter
+
+netCDF4 = pytest.importorskip("netCDF4")
+
+
+# Generator settings of each file compared
+FILES = {
+    "4beam": {"five_beam": False},
+    "5beam": {"five_beam": True},
+    "4beam_corrupt": {"five_beam": False, "corruption_rate": 0.05},
+    "5beam_corrupt": {"five_beam": True, "corruption_rate": 0.05},
+}
+
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch):
+    """
+    Split the small test files into parts.
+    """
+    monkeypatch.setattr(parallel_export, "MIN_PART_SIZE", 64 * 1024)
+
+
+def ensemble_beams(file_path: str) -> dict:
+    """
+    Get the number of beams of each ensemble by its byte offset.
+    """
+    return {offset: decode_ensemble_header(ens_bytes).num_beams
+            for offset, ens_bytes in create_reader(file_path).ensembles()}
+
+
+@pytest.mark.parametrize("name", sorted(FILES))
+@pytest.mark.parametrize("use_index", [False, True])
+def test_split_same_as_single_pass(rtb_file, assert_same_netcdf, tmp_path, name, use_index):
+    file_path = rtb_file(name + ".ens", 200, **FILES[name])
+    if use_index:
+        file_export.analyze_file(file_path)
+    StreamExporter(file_path, str(tmp_path / "single.nc")).export()
+
+    result = ParallelExporter(file_path, str(tmp_path / "split.nc"), workers=4).export()
+    assert len(split_file(file_path, 4)) == 4
+    assert result["EnsCount"] > 0
+    assert_same_netcdf(str(tmp_path / "split.nc"), str(tmp_path / "single.nc"))
+
+
+@pytest.mark.parametrize("dropped", [[0], [1]])
+def test_split_file_missing_ensemble_same_as_single_pass(rtb_file, drop_ensembles, assert_same_netcdf, tmp_path,
+                                                         dropped):
+    # The file starts with a vertical beam or the first vertical beam is missing
+    file_path = drop_ensembles(rtb_file("5beam.ens", 200, five_beam=True), "dropped.ens", dropped)
+    StreamExporter(file_path, str(tmp_path / "single.nc")).export()
+
+    ParallelExporter(file_path, str(tmp_path / "split.nc"), workers=4).export()
+    assert_same_netcdf(str(tmp_path / "split.nc"), str(tmp_path / "single.nc"))
+    with netCDF4.Dataset(str(tmp_path / "split.nc")) as dataset:
+        assert len(dataset.dimensions["beam"]) == 5
+
+
+@pytest.mark.parametrize("parts", [2, 3, 5, 7, 11])
+def test_split_starts_at_record(rtb_file, parts):
+    file_path = rtb_file("5beam.ens", 200, five_beam=True)
+    beams = ensemble_beams(file_path)
+
+    # Each split starts at a 4 beam ensemble, never at its vertical beam
+    for start, end in split_file(file_path, parts)[1:]:
+        assert beams[start] == 4
+
+
+def test_find_record_start_skips_vertical_beam(rtb_file):
+    file_path = rtb_file("5beam.ens", 20, five_beam=True)
+    offsets = sorted(ensemble_beams(file_path))
+
+    # A split at the vertical beam or inside the 4 beam ensemble moves to the next record
+    assert find_record_start(file_path, offsets[1]) == offsets[2]
+    assert find_record_start(file_path, offsets[2] + 10) == offsets[4]
+    assert find_record_start(file_path, offsets[2]) == offsets[2]
+
+
+def test_merge_drops_duplicate_records(rtb_file, assert_same_netcdf, tmp_path, monkeypatch):
+    file_path = rtb_file("5beam.ens", 200, five_beam=True)
+    StreamExporter(file_path, str(tmp_path / "single.nc")).export()
+    offsets = sorted(ensemble_beams(file_path))
+
+    # The second part also reads the last 20 records of the first part
+    ranges = [(0, offsets[200]), (offsets[160], offsets[300]), (offsets[300], os.path.getsize(file_path))]
+    monkeypatch.setattr(parallel_export, "split_file", lambda path, parts: ranges)
+
+    ParallelExporter(file_path, str(tmp_path / "split.nc"), workers=3).export()
+    assert_same_netcdf(str(tmp_path / "split.nc"), str(tmp_path / "single.nc"))
@@ -0,0 +1,60 @@
+import os
+import shutil
+import itertools
+import numpy as np
+import pytest
+from Export import file_export
+from Export.rtb_decoder import BAD_VELOCITY
+from Export.stream_export import StreamExporter
+
+netCDF4 = pytest.importorskip("netCDF4")
+pytest.importorskip("rti_python.Writer.rti_netcdf")
+
+
+def read_values(file_path: str) -> dict:
+    """
+    Read every variable of the netCDF file as floats without masking.
+    Bad velocities are NaN, so the exports can mark them either way.
+    """
+    values = {}
+    with netCDF4.Dataset(file_path) as dataset:
+        dataset.set_auto_mask(False)
+        for var_name, var in dataset.variables.items():
+            if var.dtype.kind not in "fiu":
+                continue
+            var_values = np.asarray(var[:], dtype=np.float64)
+            var_values[var_values == np.float64(np.float32(BAD_VELOCITY))] = np.nan
+            values[var_name] = var_values
+    return values
+
+
+def has_same_values(expected: np.ndarray, variables: dict) -> bool:
+    """
+    Check if any variable has the expected values, in any order of its dimensions.
+    """
+    for values in variables.values():
+        if values.size != expected.size:
+            continue
+        for axes in itertools.permutations(range(values.ndim)):
+            transposed = values.transpose(axes)
+            if transposed.shape == expected.shape and \
+                    np.allclose(transposed, expected, rtol=1e-6, atol=0.0, equal_nan=True):
+                return True
+    return False
+
+
+def test_same_values_as_rti_netcdf(rtb_file, tmp_path):
+    file_path = rtb_file("four.ens", 50)
+    file_result = file_export.analyze_file(file_path)
+
+    # rti_python writes the netCDF file next to the RTB file
+    file_export.export_file(file_result)
+    rti_path = str(tmp_path / "rti.nc")
+    shutil.move(os.path.splitext(file_path)[0] + ".nc", rti_path)
+
+    StreamExporter(file_path, str(tmp_path / "new.nc")).export()
+
+    new_values = read_values(str(tmp_path / "new.nc"))
+    rti_values = read_values(rti_path)
+    for var_name in ["ens_num"] + [var_name for var_name, values in new_values.items() if values.ndim == 3]:
+        assert has_same_values(new_values[var_name], rti_values), var_name
@@ -0,0 +1,99 @@
+import shutil
+import numpy as np
+import pytest
+from Export import file_export
+from Export.rtb_reader import create_reader
+from Export.stream_export import StreamExporter
+
+netCDF4 = pytest.importorskip("netCDF4")
+
+
+def ensemble_offsets(file_path: str) -> list:
+    """
+    Get the byte offset of each ensemble in the file.
+    """
+    return [offset for offset, ens_bytes in create_reader(file_path).ensembles()]
+
+
+def copy_start(file_path: str, copy_path: str, size: int):
+    """
+    Copy the start of the file, as if the file is still being recorded.
+    """
+    with open(file_path, "rb") as file, open(copy_path, "wb") as copy:
+        copy.write(file.read(size))
+
+
+def test_append_after_cut_between_pair(rtb_file, assert_same_netcdf, tmp_path):
+    full_path = rtb_file("full.ens", 400, five_beam=True)
+    full_result = StreamExporter(full_path, str(tmp_path / "full.nc")).export()
+
+    # Cut the file after the 4 beam ensemble of record 150, before its vertical beam
+    file_path = str(tmp_path / "live.ens")
+    offsets = ensemble_offsets(full_path)
+    copy_start(full_path, file_path, offsets[301])
+    result = StreamExporter(file_path).export()
+    assert result["EnsCount"] == 300
+    assert result["EnsPairCount"] == 150
+
+    # The rest of the file is recorded
+    shutil.copyfile(full_path, file_path)
+    analyze_result = file_export.analyze_file(file_path, incremental=True)
+    assert analyze_result["ResumeOffset"] == offsets[300]
+    assert analyze_result["EnsPairCount"] == full_result["EnsPairCount"]
+    assert analyze_result["NewEnsPairCount"] == 250
+
+    result = StreamExporter(file_path, append=True).export()
+    assert result["EnsCount"] == full_result["EnsCount"]
+    assert result["EnsPairCount"] == full_result["EnsPairCount"]
+    assert_same_netcdf(str(tmp_path / "live.nc"), str(tmp_path / "full.nc"))
+
+
+def test_4_beam_file_exports_last_ensemble(rtb_file, tmp_path):
+    file_path = rtb_file("four.ens", 50)
+    result = StreamExporter(file_path).export()
+    assert result["EnsCount"] == 50
+
+
+def read_variables(file_path: str) -> dict:
+    """
+    Read the bin and beam variables of the netCDF file.
+    """
+    with netCDF4.Dataset(file_path) as dataset:
+        return {var_name: np.ma.filled(var[:].astype(np.float64), np.nan)
+                for var_name, var in dataset.variables.items() if var.dimensions == ("time", "bin", "beam")}
+
+
+def test_file_starting_on_vertical_beam(rtb_file, drop_ensembles, tmp_path):
+    full_path = rtb_file("full.ens", 50, five_beam=True)
+    StreamExporter(full_path, str(tmp_path / "full.nc")).export()
+
+    # The file starts with the vertical beam of the first pair
+    file_path = drop_ensembles(full_path, "cut.ens", [0])
+    result = StreamExporter(file_path, str(tmp_path / "cut.nc")).export()
+    assert result["EnsCount"] == 99
+    assert result["EnsPairCount"] == 49
+
+    full = read_variables(str(tmp_path / "full.nc"))
+    cut = read_variables(str(tmp_path / "cut.nc"))
+    assert full
+    for var_name, values in full.items():
+        assert cut[var_name].shape == (50, values.shape[1], 5)
+        assert np.array_equal(cut[var_name][1:], values[1:], equal_nan=True), var_name
+
+
+def test_file_missing_vertical_beam(rtb_file, drop_ensembles, tmp_path):
+    full_path = rtb_file("full.ens", 50, five_beam=True)
+    StreamExporter(full_path, str(tmp_path / "full.nc")).export()
+
+    # The vertical beam of the first pair is corrupt
+    file_path = drop_ensembles(full_path, "missing.ens", [1])
+    result = StreamExporter(file_path, str(tmp_path / "missing.nc")).export()
+    assert result["EnsCount"] == 99
+    assert result["EnsPairCount"] == 49
+
+    full = read_variables(str(tmp_path / "full.nc"))
+    missing = read_variables(str(tmp_path / "missing.nc"))
+    for var_name, values in full.items():
+        assert missing[var_name].shape == values.shape
+        assert np.array_equal(missing[var_name][1:], values[1:], equal_nan=True), var_name
+        assert np.array_equal(missing[var_name][0, :, :4], values[0, :, :4], equal_nan=True), var_name
@@ -0,0 +1,100 @@
+import numpy as np
+from Export.batch_decoder import EnsembleBatch
+from Export.rtb_decoder import ANCILLARY_FIELDS
+from Export.stream_export import StreamExporter
+from Export.time_average import TimeAverager
+
+HEADING = ANCILLARY_FIELDS.index("heading")
+ROLL = ANCILLARY_FIELDS.index("roll")
+PITCH = ANCILLARY_FIELDS.index("pitch")
+
+
+def create_batch(seconds: list, headings: list, is_pair: list = None) -> EnsembleBatch:
+    """
+    Create a batch of ensembles at the times with the headings.  The roll is
+    the heading and the pitch is 1 degree.
+    """
+    batch = EnsembleBatch()
+    batch.count = len(seconds)
+    batch.num_bins = 1
+    batch.num_beams = 4
+    batch.datetimes = (np.array(seconds, dtype=np.int64) * 1000000).astype("datetime64[us]")
+    batch.ens_num = np.arange(batch.count, dtype=np.int32)
+    batch.is_pair = np.array(is_pair if is_pair else [False] * batch.count)
+    batch.offsets = np.arange(batch.count, dtype=np.int64) * 100
+    batch.end_offsets = batch.offsets + 100
+    batch.ancillary = np.full((batch.count, len(ANCILLARY_FIELDS)), 1.0, dtype=np.float32)
+    batch.ancillary[:, HEADING] = headings
+    batch.ancillary[:, ROLL] = headings
+    return batch
+
+
+def angle_difference(angle: float, expected: float) -> float:
+    """
+    Get the difference of the angles in degrees, so 359.9999 is close to 0.
+    """
+    return abs((angle - expected + 180.0) % 360.0 - 180.0)
+
+
+def test_angles_averaged_across_north():
+    averager = TimeAverager(10)
+    first = averager.add(create_batch([0, 1, 2, 10, 11], [359.0, 1.0, np.nan, 350.0, 20.0]))
+    last = averager.add(create_batch([12, 20], [np.nan, 90.0]))
+
+    assert first.count == 1
+    assert angle_difference(first.ancillary[0, HEADING], 0.0) < 1e-4
+    assert angle_difference(last.ancillary[0, HEADING], 5.0) < 1e-4
+    assert angle_difference(last.ancillary[0, ROLL], 5.0) < 1e-4
+    assert last.ancillary[0, PITCH] == 1.0
+
+    final = averager.finish()
+    assert angle_difference(final.ancillary[0, HEADING], 90.0) < 1e-4
+
+
+def test_negative_roll_keeps_sign():
+    averager = TimeAverager(10)
+    batch = create_batch([0, 1, 2], [10.0, 20.0, 30.0])
+    batch.ancillary[:, ROLL] = [-2.0, -4.0, -3.0]
+    averager.add(batch)
+    batch = averager.finish()
+
+    assert np.isclose(batch.ancillary[0, ROLL], -3.0, atol=1e-4)
+    assert np.isclose(batch.ancillary[0, HEADING], 20.0, atol=1e-4)
+
+
+def test_heading_wrapped_to_360():
+    averager = TimeAverager(10)
+    averager.add(create_batch([0, 1], [350.0, 354.0]))
+    batch = averager.finish()
+
+    assert np.isclose(batch.ancillary[0, HEADING], 352.0, atol=1e-4)
+    assert np.isclose(batch.ancillary[0, ROLL], -8.0, atol=1e-4)
+
+
+def test_interval_with_no_angles_is_nan():
+    averager = TimeAverager(10)
+    averager.add(create_batch([0, 1], [np.nan, np.nan]))
+    batch = averager.finish()
+    assert np.isnan(batch.ancillary[0, HEADING])
+    assert batch.ancillary[0, PITCH] == 1.0
+
+
+def test_record_counts_across_batches():
+    averager = TimeAverager(10)
+    first = averager.add(create_batch([0, 1, 10, 11], [0.0] * 4, [True, False, True, True]))
+    last = averager.add(create_batch([12, 20, 21], [0.0] * 3, [False, True, False]))
+    final = averager.finish()
+
+    assert first.source_counts() == (2, 1)
+    assert last.source_counts() == (3, 2)
+    assert final.source_counts() == (2, 1)
+
+
+def test_average_export_counts_ensembles(rtb_file, tmp_path):
+    file_path = rtb_file("average.ens", 400, five_beam=True)
+    full_result = StreamExporter(file_path, str(tmp_path / "full.nc")).export()
+    result = StreamExporter(file_path, str(tmp_path / "average.nc"), average_interval=60).export()
+
+    assert result["EnsCount"] == full_result["EnsCount"]
+    assert result["EnsPairCount"] == full_result["EnsPairCount"]
+    assert 0 < result["IntervalCount"] < full_result["EnsCount"] - full_result["EnsPairCount"]
@@ -0,0 +1,57 @@
+import os
+import time
+import threading
+from Export.rtb_reader import create_reader
+from Export.stream_export import StreamExporter
+from Export.watcher import FolderWatcher
+
+
+# Longest time in seconds to wait for the watcher to export a file
+EXPORT_TIMEOUT = 60.0
+
+
+def wait_exported(watcher: FolderWatcher, exports: int):
+    """
+    Wait for the watcher to complete the number of exports with no file waiting.
+    """
+    deadline = time.monotonic() + EXPORT_TIMEOUT
+    while watcher.exported + watcher.failed < exports or watcher.pending or watcher.running:
+        assert time.monotonic() < deadline, "The watcher did not export the file"
+        time.sleep(0.05)
+    assert watcher.failed == 0
+
+
+def test_growing_5_beam_file(rtb_file, assert_same_netcdf, tmp_path):
+    full_path = rtb_file("full.ens", 300, five_beam=True)
+    StreamExporter(full_path, str(tmp_path / "full.nc")).export()
+    offsets = [offset for offset, ens_bytes in create_reader(full_path).ensembles()]
+    with open(full_path, "rb") as file:
+        data = file.read()
+
+    # The recording has started before watching
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    file_path = str(watch_dir / "live.ens")
+    with open(file_path, "wb") as file:
+        file.write(data[:offsets[101]])
+
+    # The file keeps changing, so it is exported each max delay
+    watcher = FolderWatcher([str(watch_dir)], workers=1, settle_time=30.0, max_delay=0.2, use_inotify=False,
+                            poll_interval=0.05)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        wait_exported(watcher, 1)
+
+        # Each cut is after a 4 beam ensemble and before its vertical beam, except the end of the file
+        written = offsets[101]
+        for exports, cut in enumerate((offsets[351], offsets[352], offsets[481], len(data)), 2):
+            with open(file_path, "ab") as file:
+                file.write(data[written:cut])
+            written = cut
+            wait_exported(watcher, exports)
+    finally:
+        watcher.stop()
+        thread.join()
+
+    assert_same_netcdf(os.path.splitext(file_path)[0] + ".nc", str(tmp_path / "full.nc"))